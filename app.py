@@ -19,14 +19,64 @@ Optional:
   MODEL_PATH          - Path to fine-tuned model adapter
   BASE_MODEL          - Base model name (default: mistralai/Mistral-7B-Instruct-v0.2)
   LOAD_IN_8BIT        - Load model in 8-bit mode (1/true/yes)
+  SUPABASE_SERVICE_ROLE_KEY - Server-side Supabase access (quota, usage, cost tracking); one pooled client per process
+  SUPABASE_TIMEOUT_SECONDS / SUPABASE_POOL_MAX_CONNECTIONS - that client's request timeout and pool size
+  QUOTA_CACHE_TTL_SECONDS - Reuse check_user_quota results for this long (default 30; 0 = call Supabase every time)
+  QUOTA_CACHE_MARGIN  - Always ask Supabase when this few evaluations (or fewer) remain (default 3)
+  COST_FLUSH_SECONDS / COST_FLUSH_BATCH - cost_tracking rows are batch-inserted this often / at this many rows (5 / 50)
+  COST_SPILL_FILE     - Where unwritable cost rows wait for replay (default .cost_spill.jsonl next to app.py); rows
+                        Postgres rejects (and unreadable spill lines) are kept in <COST_SPILL_FILE>.rejected
+  DIAGNOSTICS_SECRET  - Shared secret for GET /diagnostics (X-Diagnostics-Secret header); unset = route disabled
+  WHISPER_MODEL       - Whisper size for /api/evaluate_with_file (default base); warmed at startup if installed
+  QWEN_API_URL        - Qwen2.5-VL service for /qwen-api/* (Modal, RunPod or ISAAC)
+  QWEN_BACKENDS       - JSON list of Qwen backends ({url, name, provider, weight, cost_per_second, max_concurrency,
+                        model}); replaces QWEN_API_URL when set, with failover on 502/503/504, timeouts and connect
+                        errors. Backends with the same "model" (default: their URL) share cached results
+  QWEN_ROUTING        - least_outstanding (default; in-flight / weight) or cheapest (lowest cost_per_second first)
+  QWEN_BACKEND_QUEUE_SECONDS - How long a request waits when every backend is at max_concurrency (default 300)
+  QWEN_WARM           - Let POST /qwen-api/warm wake the Qwen backends ahead of an evaluation (default 1)
+  QWEN_WARM_INTERVAL_SECONDS / QWEN_WARM_MAX_SECONDS / QWEN_WARM_POLL_SECONDS - warm each backend at most every
+                        120s, polling its /health every 5s for up to 180s
+  QWEN_POOL_MAX_CONNECTIONS / QWEN_POOL_MAX_KEEPALIVE / QWEN_POOL_KEEPALIVE_SECONDS - shared upstream pool limits
+  QWEN_TIMEOUT_<ROUTE> - Per-route upstream timeout in seconds (e.g. QWEN_TIMEOUT_EVALUATE_VIDEO=600)
+  QWEN_CIRCUIT_FAILURES / QWEN_CIRCUIT_OPEN_SECONDS / QWEN_CIRCUIT_MAX_OPEN_SECONDS / QWEN_CIRCUIT_PROBE_SECONDS -
+                        circuit breaker: open after 5 straight failures for 30s (doubling, max 300s), probe every 5s
+  QWEN_STREAM_UPLOADS - Stream uploaded videos upstream in QWEN_UPLOAD_CHUNK_KB chunks (default 1; 0 = buffer in RAM)
+  QWEN_RESULT_CACHE   - Serve repeat evaluations (same video bytes + rubric + backend model) from disk (default 1;
+                        0 = off). storage_url videos are keyed on the object's ETag/Last-Modified (HEAD request)
+  QWEN_RESULT_CACHE_DIR / QWEN_RESULT_CACHE_MB / QWEN_RESULT_CACHE_ENTRIES - cache location and LRU limits
+  QWEN_RESULT_CACHE_VERSION - Bump after changing the Qwen model or prompt to invalidate cached results
+  QWEN_JOBS_DIR       - SQLite job store + queued uploads for /qwen-api/jobs/* (default ./.qwen_jobs)
+  QWEN_JOB_WORKERS    - Concurrent evaluations forwarded to Qwen by the job queue (default 4)
+  QWEN_JOB_RETENTION_HOURS - How long finished jobs stay pollable (default 24); older ones are purged every
+                        QWEN_JOB_PURGE_SECONDS (default 3600)
+  QWEN_JOB_CIRCUIT_WAIT_SECONDS - How long a queued job waits for an open circuit before failing (default 900)
+  STATIC_BROTLI_QUALITY - Brotli level for the precompressed HTML pages (default 11; gzip variants are always built)
+  STATIC_HASHED_ASSETS - Rewrite assets/<name> in HTML to content-hashed, immutable URLs (default 1)
+  STATIC_INLINE_CONFIG - Inline the generated config.js into HTML pages instead of a blocking request (default 1)
+  STATIC_INDEX_POLL_SECONDS - How often servable files are checked for changes (default 30; SIGHUP reloads at once)
 
 Local development: Create a .env file with SUPABASE_URL and SUPABASE_ANON_KEY, then run ./run_local.sh
 """
 
+import asyncio
+import gzip
+import hashlib
+import hmac
 import json
+import mimetypes
 import os
+import re
+import shutil
+import signal
+import sqlite3
+import sys
+import threading
 import time
-from datetime import datetime, timedelta
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
 
 # Load .env for local development (optional)
@@ -67,7 +117,7 @@ if not os.environ.get("RENDER_LLM_EXPORT_SECRET"):
 
 from fastapi import FastAPI, File, Form, UploadFile, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, FileResponse, JSONResponse
+from fastapi.responses import Response, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.routing import APIRouter
 import httpx
@@ -78,6 +128,9 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 import base64
 
+# Content-hash result cache for /qwen-api/evaluate_video (stdlib only)
+from llm_training.result_cache import DiskLRUCache, canonical_json, sha256_file
+
 # Import the evaluation API app (model loaded on startup if MODEL_PATH exists)
 try:
     from llm_training import serve_model
@@ -90,6 +143,12 @@ except ImportError as e:
         @staticmethod
         def load_model_and_tokenizer(*args, **kwargs):
             pass
+        @staticmethod
+        def warm_whisper():
+            pass
+        @staticmethod
+        def whisper_stats():
+            return {"available": False}
     serve_model = DummyServeModel()
 
 # Initialize Sentry for error monitoring (optional, requires SENTRY_DSN env var)
@@ -176,8 +235,734 @@ app.add_middleware(
 
 # ----- Qwen proxy router: registered first so /qwen-api/* is never shadowed by StaticFiles mount at / -----
 def _qwen_base():
-    base = _get_env("QWEN_API_URL", "").strip().rstrip("/")
-    return base if base else None
+    """URL of the first configured Qwen backend (QWEN_BACKENDS or QWEN_API_URL), or None when none is set."""
+    backends = _qwen_backends()
+    return backends[0].url if backends else None
+
+
+def _env_int(key: str, default: int) -> int:
+    """Integer env var; falls back to default when unset or invalid."""
+    try:
+        return int(_get_env(key, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_float(key: str, default: float) -> float:
+    """Float env var; falls back to default when unset or invalid."""
+    try:
+        return float(_get_env(key, str(default)))
+    except ValueError:
+        return default
+
+
+# ----- Shared upstream HTTP client: one keep-alive pool for all /qwen-api/* traffic (no TCP+TLS handshake per request) -----
+# Per-route read timeouts in seconds. Override with QWEN_TIMEOUT_<ROUTE>, e.g. QWEN_TIMEOUT_EVALUATE_VIDEO=900
+_QWEN_ROUTE_TIMEOUTS = {
+    "health": 10.0,
+    "evaluate_video": 600.0,  # Match Modal timeout (600s) to avoid premature timeouts
+    "analyze_video": 120.0,
+    "extract_rubric": 300.0,
+}
+
+_qwen_http_client = None
+_qwen_pool_stats = {"requests": 0, "errors": 0, "in_flight": 0, "peak_in_flight": 0, "clients_created": 0, "http2": False}
+
+
+def _qwen_timeout(route: str) -> httpx.Timeout:
+    """Timeout for one upstream route; connect timeout is capped separately (QWEN_CONNECT_TIMEOUT, default 10s)."""
+    seconds = _env_float(f"QWEN_TIMEOUT_{route.upper()}", _QWEN_ROUTE_TIMEOUTS.get(route, 60.0))
+    return httpx.Timeout(seconds, connect=min(seconds, _env_float("QWEN_CONNECT_TIMEOUT", 10.0)))
+
+
+def _qwen_http() -> httpx.AsyncClient:
+    """
+    Return the process-wide AsyncClient for Qwen upstream calls (created on startup, or lazily on first use).
+    Pool size: QWEN_POOL_MAX_CONNECTIONS (default 100), QWEN_POOL_MAX_KEEPALIVE (default 20),
+    QWEN_POOL_KEEPALIVE_SECONDS (default 120). HTTP/2 is used when QWEN_HTTP2 is on (default) and h2 is installed.
+    """
+    global _qwen_http_client
+    if _qwen_http_client is None or _qwen_http_client.is_closed:
+        http2 = _get_env("QWEN_HTTP2", "1").lower() in ("1", "true", "yes")
+        if http2:
+            try:
+                import h2  # noqa: F401  (httpx needs it for HTTP/2)
+            except ImportError:
+                http2 = False
+        limits = httpx.Limits(
+            max_connections=_env_int("QWEN_POOL_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=_env_int("QWEN_POOL_MAX_KEEPALIVE", 20),
+            keepalive_expiry=_env_float("QWEN_POOL_KEEPALIVE_SECONDS", 120.0),
+        )
+        _qwen_http_client = httpx.AsyncClient(http2=http2, limits=limits, timeout=_qwen_timeout("default"))
+        _qwen_pool_stats["clients_created"] += 1
+        _qwen_pool_stats["http2"] = http2
+        _qwen_pool_stats["max_connections"] = limits.max_connections
+        _qwen_pool_stats["max_keepalive_connections"] = limits.max_keepalive_connections
+    return _qwen_http_client
+
+
+async def _qwen_send(method: str, route: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send one request to the Qwen service through the shared pool, using the route's timeout. Raises
+    _QwenCircuitOpen without contacting the backend while its circuit is open.
+    """
+    circuit = _qwen_circuit(url.rsplit("/", 1)[0])
+    trial = circuit.acquire()
+    client = _qwen_http()
+    kwargs.setdefault("timeout", _qwen_timeout(route))
+    _qwen_pool_stats["requests"] += 1
+    _qwen_pool_stats["in_flight"] += 1
+    _qwen_pool_stats["peak_in_flight"] = max(_qwen_pool_stats["peak_in_flight"], _qwen_pool_stats["in_flight"])
+    ok, error = None, None
+    try:
+        response = await client.request(method, url, **kwargs)
+        ok = response.status_code not in _CIRCUIT_FAILURE_STATUSES
+        error = None if ok else f"{route}: HTTP {response.status_code}"
+        return response
+    except httpx.RequestError as e:
+        _qwen_pool_stats["errors"] += 1
+        ok, error = False, f"{route}: {type(e).__name__}"
+        raise
+    finally:
+        _qwen_pool_stats["in_flight"] -= 1
+        circuit.release(trial, ok, error)
+
+
+def _qwen_pool_snapshot() -> dict:
+    """
+    Pool utilization for /diagnostics: request counters plus open/idle connections from the transport pool, or just
+    the in-flight count (marked estimated) when the pool can't be read.
+    """
+    snapshot = dict(_qwen_pool_stats)
+    snapshot["timeouts"] = {route: _qwen_timeout(route).read for route in _QWEN_ROUTE_TIMEOUTS}
+    client = _qwen_http_client
+    if client is None or client.is_closed:
+        snapshot["connections"] = {"open": 0, "idle": 0, "active": 0}
+        return snapshot
+    try:
+        # httpcore's pool is not part of httpx's public API; report what it exposes and skip if it changes
+        connections = list(client._transport._pool.connections)
+        idle = sum(1 for c in connections if c.is_idle())
+        snapshot["connections"] = {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+    except Exception:
+        # No pool to inspect (httpx internals moved, or a custom transport): requests in flight each hold a connection
+        snapshot["connections"] = {"open": None, "idle": None, "active": _qwen_pool_stats["in_flight"], "estimated": True}
+    return snapshot
+
+
+# ----- Circuit breaker: stop sending requests to a Qwen backend that keeps failing, probe /health until it recovers -----
+# A backend's circuit opens after QWEN_CIRCUIT_FAILURES consecutive connect errors, timeouts or 502/503/504s.
+# While open, requests fail fast with 503 + Retry-After. Once QWEN_CIRCUIT_OPEN_SECONDS have passed it is
+# half-open: exactly one request (or background /health probe) is let through; success closes the circuit,
+# failure re-opens it for twice as long (capped at QWEN_CIRCUIT_MAX_OPEN_SECONDS).
+_CIRCUIT_FAILURE_STATUSES = (502, 503, 504)
+_qwen_circuits = {}  # base URL -> _QwenCircuit
+_qwen_circuit_probe = None  # (loop, task) for the background /health prober
+
+
+class _QwenCircuitOpen(Exception):
+    """
+    Raised instead of contacting a backend whose circuit is open. _qwen_route also raises it with circuit=None
+    when every backend is at its max concurrency for longer than QWEN_BACKEND_QUEUE_SECONDS.
+    """
+
+    def __init__(self, circuit, retry_after: float, detail: str = None):
+        self.circuit = circuit
+        self.retry_after = max(1, int(retry_after + 0.999))
+        self.detail = detail or f"Qwen service is unavailable after repeated failures; retry in {self.retry_after}s."
+        super().__init__(f"Qwen circuit for {circuit.base} is {circuit.state}; retry in {retry_after:.0f}s" if circuit else self.detail)
+
+
+class _QwenCircuit:
+    """Closed/open/half-open state for one upstream base URL (event-loop only, so no locking)."""
+
+    def __init__(self, base: str):
+        self.base = base
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened = 0  # consecutive times opened without recovering, for the backoff
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.last_error = None
+        self.transitions = {}
+        self.history = deque(maxlen=20)
+        self.rejected = 0
+        self.probes = 0
+
+    def _transition(self, state: str):
+        key = f"{self.state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        self.history.append({"at": round(time.time(), 3), "transition": key, "error": self.last_error})
+        print(f"[QWEN_CIRCUIT] {self.base}: {key}" + (f" ({self.last_error})" if state == "open" else ""))
+        self.state = state
+
+    def retry_after(self) -> float:
+        """Seconds until a request could be let through (0 when one would be allowed now)."""
+        now = time.time()
+        if self.state == "open" and now < self.open_until:
+            return self.open_until - now
+        if self.state == "half_open" and self.trial_in_flight:
+            return _env_float("QWEN_CIRCUIT_PROBE_SECONDS", 5)
+        return 0
+
+    def acquire(self) -> bool:
+        """Admit one request or raise _QwenCircuitOpen; True means it is the half-open trial."""
+        wait = self.retry_after()
+        if wait:
+            self.rejected += 1
+            raise _QwenCircuitOpen(self, wait)
+        if self.state == "open":
+            self._transition("half_open")
+        if self.state == "half_open":
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def release(self, trial: bool, ok, error: str = None):
+        """Record the outcome; ok=None (cancelled, or failed before reaching the backend) changes nothing."""
+        if trial:
+            self.trial_in_flight = False
+        if ok is None:
+            return
+        if ok:
+            self.consecutive_failures = 0
+            if self.state != "closed" and (trial or self.state == "open"):
+                self.opened = 0
+                self._transition("closed")
+            return
+        self.consecutive_failures += 1
+        self.last_error = error
+        if self.state == "half_open" or (
+            self.state == "closed" and self.consecutive_failures >= _env_int("QWEN_CIRCUIT_FAILURES", 5)
+        ):
+            self.opened += 1
+            base_seconds = _env_float("QWEN_CIRCUIT_OPEN_SECONDS", 30)
+            self.open_until = time.time() + min(base_seconds * 2 ** (self.opened - 1), _env_float("QWEN_CIRCUIT_MAX_OPEN_SECONDS", 300))
+            self._transition("open")
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_after_seconds": round(self.retry_after(), 1),
+            "rejected": self.rejected,
+            "probes": self.probes,
+            "last_error": self.last_error,
+            "transitions": dict(self.transitions),
+            "recent": list(self.history),
+        }
+
+
+def _qwen_circuit(base: str) -> _QwenCircuit:
+    circuit = _qwen_circuits.get(base)
+    if circuit is None:
+        circuit = _qwen_circuits[base] = _QwenCircuit(base)
+    return circuit
+
+
+def _qwen_circuit_denial():
+    """503 + Retry-After if every backend's circuit would reject a request right now (no half-open slot is taken)."""
+    circuits = [_qwen_circuit(b.url) for b in _qwen_backends()]
+    waits = [c.retry_after() for c in circuits]
+    if not circuits or not all(waits):
+        return None
+    circuit = circuits[waits.index(min(waits))]
+    circuit.rejected += 1
+    return _qwen_circuit_response(_QwenCircuitOpen(circuit, min(waits)))
+
+
+def _qwen_circuit_response(exc: _QwenCircuitOpen) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={
+            "detail": exc.detail,
+            "circuit": exc.circuit.state if exc.circuit else None,
+            "last_error": exc.circuit.last_error if exc.circuit else None,
+        },
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+async def _qwen_circuit_probe_loop():
+    """Every QWEN_CIRCUIT_PROBE_SECONDS, send the half-open /health probe for circuits whose open period is over.
+    Closed circuits are never probed, so an idle Modal deployment is not kept warm by this loop."""
+    while True:
+        await asyncio.sleep(_env_float("QWEN_CIRCUIT_PROBE_SECONDS", 5))
+        for base, circuit in list(_qwen_circuits.items()):
+            if circuit.state == "closed" or circuit.retry_after():
+                continue
+            circuit.probes += 1
+            try:
+                await _qwen_send("GET", "health", f"{base}/health")
+            except (httpx.RequestError, _QwenCircuitOpen):
+                pass
+            except Exception as e:
+                print(f"[QWEN_CIRCUIT] Probe of {base} failed: {e}")
+
+
+def _start_qwen_circuit_probe():
+    global _qwen_circuit_probe
+    loop = asyncio.get_running_loop()
+    if _qwen_circuit_probe is not None and _qwen_circuit_probe[0] is loop:
+        return
+    _qwen_circuit_probe = (loop, loop.create_task(_qwen_circuit_probe_loop()))
+
+
+def _qwen_circuit_snapshot() -> dict:
+    """Circuits keyed by backend name: the upstream URLs are private endpoints."""
+    names = {b.url: b.name for b in _qwen_backends()}
+    return {
+        names.get(base, f"unconfigured-{i + 1}"): circuit.snapshot()
+        for i, (base, circuit) in enumerate(_qwen_circuits.items())
+    }
+
+
+# ----- Qwen backends: weighted pool of Modal / RunPod / ISAAC endpoints, each with its own price, concurrency and circuit -----
+# QWEN_BACKENDS is a JSON list, e.g.
+#   [{"name": "runpod-a100", "url": "https://abc-8000.proxy.runpod.net", "cost_per_second": 0.000165, "max_concurrency": 2},
+#    {"name": "modal", "url": "https://me--qwen-serve.modal.run", "weight": 2}]
+# url is required. provider (cost_tracking.provider) defaults to "modal" for modal.run URLs and "runpod" otherwise,
+# cost_per_second to that provider's GPU price, weight to 1 and max_concurrency to 0 (unlimited). Without
+# QWEN_BACKENDS, QWEN_API_URL is a single backend. QWEN_ROUTING picks among backends whose circuit is closed and
+# that have a free slot: least_outstanding (default; in-flight requests / weight) or cheapest (lowest
+# cost_per_second, then least outstanding). Connect errors, timeouts and 502/503/504 fail over to the next backend.
+_QWEN_COST_PER_SECOND = {"modal": 0.00125, "runpod": 0.000165}  # A100: Modal ~$0.0011-0.0014/s, RunPod ~$0.00011-0.00022/s
+_qwen_backend_pool = (None, [])  # (config it was built from, [_QwenBackend])
+
+
+class _QwenBackend:
+    """One upstream Qwen service and its routing/cost counters."""
+
+    def __init__(self, name: str, url: str, provider: str, cost_per_second: float, weight: float = 1.0, max_concurrency: int = 0,
+                 model: str = ""):
+        self.name = name
+        self.url = url
+        self.model = model or url  # what the result cache keys on; backends sharing it share results
+        self.provider = provider
+        self.cost_per_second = cost_per_second
+        self.weight = weight if weight > 0 else 1.0
+        self.max_concurrency = max(0, max_concurrency)
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.failovers = 0
+        self.busy_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float, ok: bool):
+        self.requests += 1
+        self.errors += 0 if ok else 1
+        self.busy_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def has_capacity(self) -> bool:
+        return not self.max_concurrency or self.in_flight < self.max_concurrency
+
+    def snapshot(self) -> dict:
+        return {
+            "provider": self.provider,
+            "weight": self.weight,
+            "cost_per_second": self.cost_per_second,
+            "max_concurrency": self.max_concurrency or None,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.errors / self.requests, 3) if self.requests else None,
+            "failovers": self.failovers,
+            "avg_latency_seconds": round(self.busy_seconds / self.requests, 2) if self.requests else None,
+            "max_latency_seconds": round(self.max_seconds, 2),
+            "estimated_spend_usd": round(self.busy_seconds * self.cost_per_second, 4),
+            "circuit": _qwen_circuits[self.url].state if self.url in _qwen_circuits else "closed",
+        }
+
+
+def _provider_for_url(url: str) -> str:
+    return "modal" if "modal" in url.lower() else "runpod"
+
+
+def _qwen_backends() -> list:
+    """The configured backends (rebuilt, with fresh counters, only when QWEN_BACKENDS / QWEN_API_URL change)."""
+    global _qwen_backend_pool
+    raw = _get_env("QWEN_BACKENDS", "").strip()
+    config = raw or _get_env("QWEN_API_URL", "").strip()
+    if _qwen_backend_pool[0] == config:
+        return _qwen_backend_pool[1]
+    entries = []
+    if raw:
+        try:
+            entries = json.loads(raw)
+            if not isinstance(entries, list):
+                raise ValueError("expected a JSON list")
+        except ValueError as e:
+            print(f"[QWEN_BACKENDS] Ignoring invalid QWEN_BACKENDS ({e}); using QWEN_API_URL")
+            entries = []
+    if not entries and _get_env("QWEN_API_URL", "").strip():
+        entries = [{"url": _get_env("QWEN_API_URL")}]
+    backends = []
+    for entry in entries:
+        url = str(entry.get("url") or "").strip().rstrip("/")
+        if not url:
+            continue
+        provider = entry.get("provider") or _provider_for_url(url)
+        try:
+            backends.append(_QwenBackend(
+                name=entry.get("name") or f"{provider}-{len(backends) + 1}",
+                url=url,
+                provider=provider,
+                cost_per_second=float(entry.get("cost_per_second", _QWEN_COST_PER_SECOND.get(provider, _QWEN_COST_PER_SECOND["runpod"]))),
+                weight=float(entry.get("weight", 1)),
+                max_concurrency=int(entry.get("max_concurrency", 0)),
+                model=str(entry.get("model") or ""),
+            ))
+        except (TypeError, ValueError) as e:
+            print(f"[QWEN_BACKENDS] Skipping backend {url}: {e}")
+    if len(backends) > 1:
+        print("[QWEN_BACKENDS] " + ", ".join(f"{b.name} ({b.provider}, ${b.cost_per_second}/s)" for b in backends))
+    _qwen_backend_pool = (config, backends)
+    return backends
+
+
+def _pick_qwen_backend(candidates: list):
+    policy = _get_env("QWEN_ROUTING", "least_outstanding").strip().lower()
+    if policy == "cheapest":
+        return min(candidates, key=lambda b: (b.cost_per_second, b.in_flight / b.weight))
+    return min(candidates, key=lambda b: ((b.in_flight + 1) / b.weight, b.cost_per_second))
+
+
+async def _qwen_route(method: str, route: str, **kwargs):
+    """
+    Send one request to the best available backend and fail over to the others on connect errors, timeouts and
+    502/503/504. Returns (backend, response); the last backend's error or response is surfaced when all fail.
+    Raises _QwenCircuitOpen when every circuit is open, or when no backend frees a slot within
+    QWEN_BACKEND_QUEUE_SECONDS (default 300).
+    """
+    backends = _qwen_backends()
+    tried = []
+    last = None  # (backend, response) of the last 502/503/504
+    last_error = None  # RequestError of the last backend that could not be reached
+    queue_deadline = time.time() + _env_float("QWEN_BACKEND_QUEUE_SECONDS", 300)
+    while True:
+        waits = {b: _qwen_circuit(b.url).retry_after() for b in backends if b not in tried}
+        available = [b for b, wait in waits.items() if not wait]
+        if not available:
+            if last is not None:
+                return last
+            if last_error is not None:
+                raise last_error
+            if waits:
+                backend = min(waits, key=waits.get)
+                circuit = _qwen_circuit(backend.url)
+                circuit.rejected += 1
+                raise _QwenCircuitOpen(circuit, waits[backend])
+            raise httpx.ConnectError("No Qwen backend configured (set QWEN_API_URL or QWEN_BACKENDS)")
+        ready = [b for b in available if b.has_capacity()]
+        if not ready:
+            if time.time() >= queue_deadline:
+                raise _QwenCircuitOpen(None, 30, "All Qwen backends are at their max concurrency; retry shortly.")
+            await asyncio.sleep(0.1)
+            continue
+        backend = _pick_qwen_backend(ready)
+        failover = len(available) > 1
+        backend.in_flight += 1
+        started = time.time()
+        try:
+            response = await _qwen_send(method, route, f"{backend.url}/{route}", **kwargs)
+        except _QwenCircuitOpen:
+            tried.append(backend)  # lost the half-open slot to another request; nothing was sent
+            continue
+        except httpx.RequestError as e:
+            backend.record(time.time() - started, ok=False)
+            tried.append(backend)
+            last_error, last = e, None
+            if failover:
+                backend.failovers += 1
+                print(f"[QWEN_BACKENDS] {route} failed on {backend.name} ({type(e).__name__}); failing over")
+            continue
+        finally:
+            backend.in_flight -= 1
+        ok = response.status_code not in _CIRCUIT_FAILURE_STATUSES
+        backend.record(time.time() - started, ok)
+        if ok:
+            return backend, response
+        tried.append(backend)
+        last, last_error = (backend, response), None
+        if failover:
+            backend.failovers += 1
+            print(f"[QWEN_BACKENDS] {route} got {response.status_code} from {backend.name}; failing over")
+
+
+def _qwen_backends_snapshot() -> dict:
+    return {
+        "routing": _get_env("QWEN_ROUTING", "least_outstanding").strip().lower(),
+        "backends": {b.name: b.snapshot() for b in _qwen_backends()},
+    }
+
+
+# ----- Pre-warm: opening the evaluate page or starting a bulk upload wakes scaled-to-zero Qwen containers -----
+# POST /qwen-api/warm polls each backend's /health in the background until the model reports "ok", so the
+# container cold start (Modal: image pull + weight load) overlaps with the instructor choosing a rubric and files.
+# Each backend is warmed at most once per QWEN_WARM_INTERVAL_SECONDS; QWEN_WARM=0 turns the hook into a no-op.
+_qwen_warmups = {}  # backend url -> {"task": asyncio.Task, "started": ts}
+_qwen_warm_stats = {"requested": 0, "started": 0, "skipped": 0, "cold_starts": 0, "failures": 0, "recent": deque(maxlen=20)}
+
+
+async def _warm_qwen_backend(backend: _QwenBackend, reason: str):
+    """Poll backend's /health until the model is loaded (or QWEN_WARM_MAX_SECONDS); log how long that took."""
+    started = time.time()
+    deadline = started + _env_float("QWEN_WARM_MAX_SECONDS", 180)
+    polls = 0
+    status = None
+    while time.time() < deadline:
+        polls += 1
+        try:
+            r = await _qwen_send("GET", "health", f"{backend.url}/health")
+            status = (r.json() or {}).get("status") if r.status_code == 200 else f"HTTP {r.status_code}"
+        except (httpx.RequestError, _QwenCircuitOpen, ValueError, AttributeError) as e:
+            status = type(e).__name__
+        if status == "ok":
+            break
+        await asyncio.sleep(_env_float("QWEN_WARM_POLL_SECONDS", 5))
+    elapsed = time.time() - started
+    # A warm container answers the first poll in well under a second; anything else was a scale-from-zero
+    cold = polls > 1 or elapsed > _env_float("QWEN_WARM_COLD_SECONDS", 5)
+    if status == "ok":
+        _qwen_warm_stats["cold_starts"] += 1 if cold else 0
+        print(f"[QWEN_WARM] {backend.name} ready after {elapsed:.1f}s ({'cold start' if cold else 'already warm'}; {reason})")
+    else:
+        _qwen_warm_stats["failures"] += 1
+        print(f"[QWEN_WARM] {backend.name} not ready after {elapsed:.1f}s (last status: {status}; {reason})")
+    _qwen_warm_stats["recent"].append({
+        "backend": backend.name,
+        "reason": reason,
+        "ready": status == "ok",
+        "cold_start": cold,
+        "seconds": round(elapsed, 1),
+        "at": started,
+    })
+
+
+def _warm_qwen_backends(reason: str) -> dict:
+    """Start a background warm-up for every backend not warmed recently; returns {"warming": [...], "skipped": [...]}."""
+    _qwen_warm_stats["requested"] += 1
+    warming, skipped = [], []
+    if _get_env("QWEN_WARM", "1").lower() in ("0", "false", "no"):
+        return {"warming": warming, "skipped": [b.name for b in _qwen_backends()]}
+    interval = _env_float("QWEN_WARM_INTERVAL_SECONDS", 120)
+    now = time.time()
+    for backend in _qwen_backends():
+        previous = _qwen_warmups.get(backend.url)
+        if previous is not None and (not previous["task"].done() or now - previous["started"] < interval):
+            skipped.append(backend.name)
+            continue
+        task = asyncio.get_running_loop().create_task(_warm_qwen_backend(backend, reason))
+        _qwen_warmups[backend.url] = {"task": task, "started": now}
+        warming.append(backend.name)
+    _qwen_warm_stats["started"] += len(warming)
+    _qwen_warm_stats["skipped"] += len(skipped)
+    return {"warming": warming, "skipped": skipped}
+
+
+def _qwen_warm_snapshot() -> dict:
+    s = _qwen_warm_stats
+    return {
+        "requested": s["requested"],
+        "started": s["started"],
+        "skipped": s["skipped"],
+        "cold_starts": s["cold_starts"],
+        "failures": s["failures"],
+        "in_progress": sorted(b.name for b in _qwen_backends() if b.url in _qwen_warmups and not _qwen_warmups[b.url]["task"].done()),
+        "recent": list(s["recent"]),
+    }
+
+
+# ----- Streaming uploads: forward the spooled multipart file upstream chunk by chunk instead of read()-ing it -----
+# Starlette spools each uploaded file to disk past 1 MB, so with QWEN_STREAM_UPLOADS on (default) a request only
+# holds one chunk (QWEN_UPLOAD_CHUNK_KB, default 256) of the video in memory while it is sent to Modal/RunPod.
+_upload_stats = {"uploads": 0, "in_flight": 0, "bytes": 0, "max_peak_rss_delta_mb": 0.0, "recent": deque(maxlen=20)}
+
+
+def _current_rss_bytes() -> int:
+    """Resident set size of this process (Linux /proc; falls back to peak RSS from getrusage)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _MeteredUpload:
+    """
+    Read-only file wrapper handed to httpx: caps each read at the chunk size, counts bytes sent and samples RSS
+    per chunk so the peak memory of this upload can be reported. No fileno(), so a SpooledTemporaryFile still
+    in memory is never forced to roll over just to measure its length (httpx uses seek/tell instead).
+    """
+
+    def __init__(self, fileobj, route: str, chunk_bytes: int):
+        self._f = fileobj
+        self.route = route
+        self.chunk_bytes = max(4096, chunk_bytes)
+        self.bytes_sent = 0
+        self.started = time.time()
+        self.rss_start = _current_rss_bytes()
+        self.rss_peak = self.rss_start
+        self.finished = False
+        _upload_stats["in_flight"] += 1
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0 or size > self.chunk_bytes:
+            size = self.chunk_bytes
+        chunk = self._f.read(size)
+        if chunk:
+            self.bytes_sent += len(chunk)
+            self.rss_peak = max(self.rss_peak, _current_rss_bytes())
+        return chunk
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._f.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._f.tell()
+
+    def sha256(self) -> str:
+        """Digest of the whole upload, read from the underlying file so it isn't counted as bytes sent."""
+        return sha256_file(self._f)
+
+    def size(self) -> int:
+        offset = self._f.tell()
+        length = self._f.seek(0, os.SEEK_END)
+        self._f.seek(offset)
+        return length
+
+    def finish(self, status_code=None) -> dict:
+        """Record this upload in /diagnostics stats and log its peak RSS. Safe to call more than once."""
+        if self.finished:
+            return {}
+        self.finished = True
+        _upload_stats["in_flight"] -= 1
+        _upload_stats["uploads"] += 1
+        _upload_stats["bytes"] += self.bytes_sent
+        delta_mb = (self.rss_peak - self.rss_start) / (1024 * 1024)
+        _upload_stats["max_peak_rss_delta_mb"] = round(max(_upload_stats["max_peak_rss_delta_mb"], delta_mb), 2)
+        record = {
+            "route": self.route,
+            "mb": round(self.bytes_sent / (1024 * 1024), 2),
+            "seconds": round(time.time() - self.started, 2),
+            "peak_rss_mb": round(self.rss_peak / (1024 * 1024), 1),
+            "peak_rss_delta_mb": round(delta_mb, 2),
+            "status": status_code,
+        }
+        _upload_stats["recent"].append(record)
+        print(f"[UPLOAD] {self.route}: {record['mb']} MB streamed in {record['seconds']}s, peak RSS {record['peak_rss_mb']} MB (+{record['peak_rss_delta_mb']} MB)")
+        return record
+
+
+async def _upload_part_for_httpx(part, route: str, default_name: str):
+    """
+    Build the httpx files entry for an uploaded form file. Returns (files_entry, size_bytes, meter).
+    meter is a _MeteredUpload in streaming mode (call meter.finish() when the upstream call returns) or None
+    when QWEN_STREAM_UPLOADS=0, in which case the whole file is read into memory as before.
+    """
+    filename = getattr(part, "filename", None) or default_name
+    content_type = getattr(part, "content_type", None) or "application/octet-stream"
+    fileobj = getattr(part, "file", None)
+    streaming = _get_env("QWEN_STREAM_UPLOADS", "1").lower() in ("1", "true", "yes")
+    if not streaming or fileobj is None:
+        body = await part.read()
+        return (filename, body, content_type), len(body), None
+    meter = _MeteredUpload(fileobj, route, _env_int("QWEN_UPLOAD_CHUNK_KB", 256) * 1024)
+    return (filename, meter, content_type), meter.size(), meter
+
+
+def _upload_stats_snapshot() -> dict:
+    snapshot = dict(_upload_stats)
+    snapshot["recent"] = list(_upload_stats["recent"])
+    snapshot["streaming"] = _get_env("QWEN_STREAM_UPLOADS", "1").lower() in ("1", "true", "yes")
+    snapshot["current_rss_mb"] = round(_current_rss_bytes() / (1024 * 1024), 1)
+    return snapshot
+
+
+# ----- Evaluation result cache: same video content + same rubric + same model/prompt version -> stored result, no GPU -----
+_qwen_result_cache = None
+
+
+def _qwen_results():
+    """The shared DiskLRUCache, or None when QWEN_RESULT_CACHE=0."""
+    global _qwen_result_cache
+    if _get_env("QWEN_RESULT_CACHE", "1").lower() not in ("1", "true", "yes"):
+        return None
+    if _qwen_result_cache is None:
+        _qwen_result_cache = DiskLRUCache(
+            _get_env("QWEN_RESULT_CACHE_DIR") or str(_this_dir / ".qwen_cache"),
+            max_bytes=_env_int("QWEN_RESULT_CACHE_MB", 256) * 1024 * 1024,
+            max_entries=_env_int("QWEN_RESULT_CACHE_ENTRIES", 5000),
+        )
+    return _qwen_result_cache
+
+
+_storage_http_client = None
+
+
+def _storage_http() -> httpx.AsyncClient:
+    """Small client for storage HEADs, kept apart from the Qwen pool (and its stats); 10s timeout."""
+    global _storage_http_client
+    if _storage_http_client is None or _storage_http_client.is_closed:
+        _storage_http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0), limits=httpx.Limits(max_connections=10, max_keepalive_connections=2)
+        )
+    return _storage_http_client
+
+
+async def _storage_object_version(storage_url: str):
+    """
+    The storage object's current version (ETag, Last-Modified, size) from a HEAD request, or None when the server
+    reports neither ETag nor Last-Modified. Uploads overwrite the same storage path (upsert), so the URL alone
+    doesn't identify the video.
+    """
+    r = await _storage_http().head(storage_url, follow_redirects=True)
+    if r.status_code != 200:
+        return None
+    etag, modified = r.headers.get("etag"), r.headers.get("last-modified")
+    if not etag and not modified:
+        return None
+    return f"etag={etag or ''};modified={modified or ''};length={r.headers.get('content-length', '')}"
+
+
+async def _evaluation_video_identity(files, data: dict):
+    """
+    SHA-256 of the video bytes; for a storage_url (which the proxy never downloads), the URL plus the object's
+    version. None when a storage_url's version can't be told, so that request isn't cached.
+    """
+    if files:
+        body = files["file"][1]
+        return hashlib.sha256(body).hexdigest() if isinstance(body, bytes) else await asyncio.to_thread(body.sha256)
+    version = await _storage_object_version(data["storage_url"])
+    return f"url:{data['storage_url']}#{version}" if version else None
+
+
+def _evaluation_cache_key(video: str, data: dict, model: str) -> str:
+    """
+    Key for a video identity, the canonical rubric JSON and the model/prompt version: QWEN_RESULT_CACHE_VERSION plus
+    the model of the backend that answers (a result is only stored under the backend that produced it).
+    """
+    version = f"{_get_env('QWEN_RESULT_CACHE_VERSION', '1')}@{model}"
+    return DiskLRUCache.make_key(video, canonical_json(data.get("rubric") or ""), version)
+
+
+def _cacheable_evaluation(content: bytes) -> bool:
+    """Only cache real evaluations: a parse-failure fallback (empty sections) should be retried, not replayed."""
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return False
+    return isinstance(body, dict) and bool(body.get("sections"))
+
+
+def _result_cache_snapshot() -> dict:
+    cache = _qwen_results()
+    return cache.stats() if cache is not None else {"enabled": False}
 
 
 qwen_router = APIRouter(prefix="/qwen-api", tags=["qwen"])
@@ -189,9 +974,10 @@ async def qwen_proxy_health():
     if not base:
         return Response(status_code=503, content=json.dumps({"status": "error", "detail": "QWEN_API_URL not set on Render"}))
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            r = await client.get(f"{base}/health")
-            return Response(content=r.content, status_code=r.status_code, media_type="application/json")
+        _backend, r = await _qwen_route("GET", "health")
+        return Response(content=r.content, status_code=r.status_code, media_type="application/json")
+    except _QwenCircuitOpen as e:
+        return _qwen_circuit_response(e)
     except httpx.TimeoutException:
         return Response(
             status_code=503,
@@ -215,48 +1001,52 @@ async def qwen_proxy_evaluate_video(request: Request, file: UploadFile = File(..
     base = _qwen_base()
     if not base:
         return Response(status_code=503, content="QWEN_API_URL not set")
+    meter = None
     try:
-        body = await file.read()
-        files = {"file": (file.filename or "video", body, file.content_type or "application/octet-stream")}
+        file_entry, _size, meter = await _upload_part_for_httpx(file, "evaluate_video", "video")
+        files = {"file": file_entry}
         data = {"rubric": rubric}
         # Match Modal timeout (600s) to avoid premature timeouts
-        async with httpx.AsyncClient(timeout=600.0) as client:
-            r = await client.post(f"{base}/evaluate_video", files=files, data=data)
-            # Handle 503 responses with better error messages
-            if r.status_code == 503:
-                error_detail = "Service Unavailable"
+        _backend, r = await _qwen_route("POST", "evaluate_video", files=files, data=data)
+        if meter:
+            meter.finish(r.status_code)
+        # Handle 503 responses with better error messages
+        if r.status_code == 503:
+            error_detail = "Service Unavailable"
+            try:
+                error_json = r.json()
+                error_detail = error_json.get("detail", "Service Unavailable") if isinstance(error_json, dict) else str(error_json)
+            except:
+                # If JSON parsing fails, try to get text
                 try:
-                    error_json = r.json()
-                    error_detail = error_json.get("detail", "Service Unavailable") if isinstance(error_json, dict) else str(error_json)
+                    error_text = r.text[:500]  # First 500 chars
+                    if error_text:
+                        error_detail = error_text
                 except:
-                    # If JSON parsing fails, try to get text
-                    try:
-                        error_text = r.text[:500]  # First 500 chars
-                        if error_text:
-                            error_detail = error_text
-                    except:
-                        pass
-                
-                # Log the actual error from Modal for debugging
-                print(f"[ERROR] Modal returned 503: {error_detail}")
-                print(f"[ERROR] Response headers: {dict(r.headers)}")
-                print(f"[ERROR] This may indicate: cold start, service unavailable, or Modal infrastructure issue.")
-                print(f"[ERROR] Check Modal logs at https://modal.com/apps for detailed error information.")
-                
-                if "model not loaded" in error_detail.lower():
-                    return Response(
-                        status_code=503,
-                        content=json.dumps({"detail": "Qwen model is still loading (cold start). Please wait 30-90 seconds and try again."}),
-                        media_type="application/json"
-                    )
-                else:
-                    # Return the actual error detail from Modal
-                    return Response(
-                        status_code=503,
-                        content=json.dumps({"detail": f"Modal service unavailable: {error_detail}"}),
-                        media_type="application/json"
-                    )
-            return Response(content=r.content, status_code=r.status_code, media_type="application/json")
+                    pass
+            
+            # Log the actual error from Modal for debugging
+            print(f"[ERROR] Modal returned 503: {error_detail}")
+            print(f"[ERROR] Response headers: {dict(r.headers)}")
+            print(f"[ERROR] This may indicate: cold start, service unavailable, or Modal infrastructure issue.")
+            print(f"[ERROR] Check Modal logs at https://modal.com/apps for detailed error information.")
+            
+            if "model not loaded" in error_detail.lower():
+                return Response(
+                    status_code=503,
+                    content=json.dumps({"detail": "Qwen model is still loading (cold start). Please wait 30-90 seconds and try again."}),
+                    media_type="application/json"
+                )
+            else:
+                # Return the actual error detail from Modal
+                return Response(
+                    status_code=503,
+                    content=json.dumps({"detail": f"Modal service unavailable: {error_detail}"}),
+                    media_type="application/json"
+                )
+        return Response(content=r.content, status_code=r.status_code, media_type="application/json")
+    except _QwenCircuitOpen as e:
+        return _qwen_circuit_response(e)
     except httpx.TimeoutException:
         return Response(
             status_code=503,
@@ -269,6 +1059,9 @@ async def qwen_proxy_evaluate_video(request: Request, file: UploadFile = File(..
         )
     except Exception as e:
         return Response(status_code=503, content=json.dumps({"detail": f"Qwen proxy error: {e!s}"}))
+    finally:
+        if meter:
+            meter.finish()
 
 
 @qwen_router.post("/analyze_video")
@@ -276,14 +1069,20 @@ async def qwen_proxy_analyze_video(file: UploadFile = File(...)):
     base = _qwen_base()
     if not base:
         return Response(status_code=503, content="QWEN_API_URL not set")
+    meter = None
     try:
-        body = await file.read()
-        files = {"file": (file.filename or "video", body, file.content_type or "application/octet-stream")}
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            r = await client.post(f"{base}/analyze_video", files=files)
-            return Response(content=r.content, status_code=r.status_code, media_type="application/json")
+        file_entry, _size, meter = await _upload_part_for_httpx(file, "analyze_video", "video")
+        _backend, r = await _qwen_route("POST", "analyze_video", files={"file": file_entry})
+        if meter:
+            meter.finish(r.status_code)
+        return Response(content=r.content, status_code=r.status_code, media_type="application/json")
+    except _QwenCircuitOpen as e:
+        return _qwen_circuit_response(e)
     except Exception as e:
         return Response(status_code=503, content=f"Qwen proxy error: {e!s}")
+    finally:
+        if meter:
+            meter.finish()
 
 
 @qwen_router.post("/extract_rubric")
@@ -291,19 +1090,692 @@ async def qwen_proxy_extract_rubric(file: UploadFile = File(...)):
     base = _qwen_base()
     if not base:
         return Response(status_code=503, content="QWEN_API_URL not set")
+    meter = None
     try:
-        body = await file.read()
-        files = {"file": (file.filename or "rubric", body, file.content_type or "application/octet-stream")}
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            r = await client.post(f"{base}/extract_rubric", files=files)
-            return Response(content=r.content, status_code=r.status_code, media_type="application/json")
+        file_entry, _size, meter = await _upload_part_for_httpx(file, "extract_rubric", "rubric")
+        _backend, r = await _qwen_route("POST", "extract_rubric", files={"file": file_entry})
+        if meter:
+            meter.finish(r.status_code)
+        return Response(content=r.content, status_code=r.status_code, media_type="application/json")
+    except _QwenCircuitOpen as e:
+        return _qwen_circuit_response(e)
     except Exception as e:
         return Response(status_code=503, content=f"Qwen proxy error: {e!s}")
+    finally:
+        if meter:
+            meter.finish()
+
+
+@qwen_router.post("/warm")
+async def qwen_warm(reason: str = "manual"):
+    """Fire-and-forget warm-up of the Qwen backends (called when the evaluate page opens or a bulk upload starts)."""
+    if not _qwen_base():
+        return Response(status_code=503, content="QWEN_API_URL not set")
+    return JSONResponse(status_code=202, content=_warm_qwen_backends(reason[:40]))
 
 
 app.include_router(qwen_router)
 
 
+async def _quota_denial(user_id, institution_id=None):
+    """Return a 402 response if the user has no evaluations left, else None (anonymous callers are not checked)."""
+    if not user_id:
+        return None
+    quota_check = await _cached_user_quota(user_id, institution_id or _cached_institution(user_id))
+    if quota_check.get("bypass", False) or quota_check.get("has_quota", False):
+        return None
+    return _quota_exhausted(quota_check)
+
+
+def _quota_exhausted(quota_check: dict, queued: int = 0):
+    """The 402 response for a user with no evaluations left (queued: evaluations already reserved by queued jobs)."""
+    remaining = quota_check.get("remaining_quota", 0)
+    buffer_remaining = quota_check.get("buffer_remaining", 0)
+    error_msg = f"Quota exhausted. You have {remaining} evaluations remaining in your monthly quota"
+    if buffer_remaining > 0:
+        error_msg += f" and {buffer_remaining} in the shared buffer pool"
+    if queued:
+        error_msg += f", all reserved by {queued} queued evaluation(s). Wait for them to finish."
+    elif buffer_remaining > 0:
+        error_msg += "."
+    else:
+        error_msg += ". Please upgrade your plan or purchase additional evaluations."
+    return JSONResponse(
+        status_code=402,
+        content={"detail": error_msg, "quota_info": quota_check}
+    )
+
+
+async def _forward_evaluate_video(base, files, data, storage_url, file_size_mb, user_id, institution_id, start_time, meter=None):
+    """Send one evaluate_video request upstream, log its cost, and map upstream errors to client-facing responses.
+
+    Shared by the synchronous /qwen-api/evaluate_video proxy and the background job workers. Repeat evaluations
+    are answered from the result cache without calling Qwen and are logged as zero GPU-seconds.
+    """
+    cache = _qwen_results()
+    video = cached = None
+    if cache is not None:
+        try:
+            video = await _evaluation_video_identity(files, data)
+            # Any backend may answer, so a result from any configured backend's model counts
+            for model in dict.fromkeys(b.model for b in _qwen_backends()) if video else ():
+                cached = await asyncio.to_thread(cache.get, _evaluation_cache_key(video, data, model))
+                if cached is not None:
+                    break
+        except Exception as e:
+            print(f"[RESULT_CACHE] Lookup failed, evaluating normally: {e}")
+            video, cached = None, None
+        if cached is not None:
+            elapsed_time = time.time() - start_time
+            provider = _provider_for_url(base)
+            print(f"[COST_TRACKING] Evaluation served from cache - Duration: {elapsed_time:.3f}s, GPU seconds: 0, Provider: {provider}")
+            await _log_cost_to_database(
+                user_id=user_id,
+                institution_id=institution_id,
+                evaluation_id=None,
+                provider=provider,
+                model_name="qwen",
+                file_size_mb=file_size_mb,
+                processing_time_seconds=elapsed_time,
+                cache_hit=True,
+            )
+            await _record_usage(user_id, institution_id, 0, provider)
+            return Response(content=cached, status_code=200, media_type="application/json", headers={"X-Qwen-Cache": "hit"})
+
+    # Log evaluation start for cost tracking
+    if not storage_url:
+        print(f"[COST_TRACKING] Evaluation started - File size: {file_size_mb:.2f} MB, Timestamp: {time.time()}")
+    else:
+        print(f"[COST_TRACKING] Evaluation started - Using storage URL: {storage_url}, Timestamp: {time.time()}")
+
+    # Shared pool; evaluate_video route timeout matches Modal's 600s. _qwen_route picks the backend and fails over.
+    try:
+        if files:
+            # Traditional file upload
+            backend, r = await _qwen_route("POST", "evaluate_video", files=files, data=data, follow_redirects=True)
+        else:
+            # Storage URL: sent as form fields, matching qwen_serve's Form(...) parameters
+            backend, r = await _qwen_route("POST", "evaluate_video", data=data, follow_redirects=True)
+    except httpx.TimeoutException as e:
+        elapsed_time = time.time() - start_time
+        error_msg = f"Qwen service timeout after {elapsed_time:.1f}s. The evaluation may be taking too long or the service may be unavailable."
+        print(f"[COST_TRACKING] Evaluation failed - Timeout: {elapsed_time:.2f}s")
+        print(f"[ERROR] {error_msg}")
+        return JSONResponse(status_code=504, content={"detail": error_msg})
+    except httpx.RequestError as e:
+        elapsed_time = time.time() - start_time
+        error_msg = f"Failed to connect to Qwen service: {str(e)}. Check QWEN_API_URL and ensure the Modal service is running."
+        print(f"[COST_TRACKING] Evaluation failed - Connection error: {elapsed_time:.2f}s")
+        print(f"[ERROR] {error_msg}")
+        return JSONResponse(status_code=503, content={"detail": error_msg})
+
+    if meter:
+        meter.finish(r.status_code)
+    # Calculate and log cost metrics
+    elapsed_time = time.time() - start_time
+    # Priced at the backend that answered (QWEN_BACKENDS cost_per_second; Modal/RunPod A100 averages by default)
+    estimated_cost = elapsed_time * backend.cost_per_second
+    provider = backend.provider
+
+    print(f"[COST_TRACKING] Evaluation completed - Duration: {elapsed_time:.2f}s, Estimated cost: ${estimated_cost:.4f}, Provider: {provider}, Backend: {backend.name}, Status: {r.status_code}")
+
+    # Log cost to database and increment usage if evaluation was successful
+    if r.status_code == 200:
+        # Note: evaluation_id will be None here since it's created in frontend after save
+        # Frontend can update cost_tracking record later with evaluation_id if needed
+        await _log_cost_to_database(
+            user_id=user_id,
+            institution_id=institution_id,
+            evaluation_id=None,  # Will be set when evaluation is saved in frontend
+            gpu_seconds=elapsed_time,
+            estimated_cost=estimated_cost,
+            provider=provider,
+            model_name="qwen",
+            file_size_mb=file_size_mb,
+            processing_time_seconds=elapsed_time
+        )
+        # Increment usage quota (cached quota is decremented now, Supabase is updated in the background)
+        await _record_usage(user_id, institution_id, estimated_cost, provider)
+        if video and _cacheable_evaluation(r.content):
+            try:
+                await asyncio.to_thread(cache.put, _evaluation_cache_key(video, data, backend.model), r.content)
+            except OSError as e:
+                print(f"[RESULT_CACHE] Could not store result: {e}")
+
+    if 300 <= r.status_code < 400:
+        return JSONResponse(status_code=502, content={"detail": "Qwen service returned redirect (3xx). Check QWEN_API_URL—use https, no trailing slash. Ensure the Qwen tunnel/URL is correct."})
+
+    # If 503 error, check if it's a model loading issue
+    if r.status_code == 503:
+        error_detail = "Service Unavailable"
+        try:
+            error_json = r.json()
+            if isinstance(error_json, dict) and "detail" in error_json:
+                error_detail = error_json["detail"]
+            elif isinstance(error_json, dict) and "error" in error_json:
+                error_detail = error_json["error"]
+        except:
+            try:
+                error_text = r.text[:500]
+                if error_text:
+                    error_detail = error_text
+            except:
+                pass
+
+        # Check if it's a model loading issue
+        if "model not loaded" in error_detail.lower() or "model_not_loaded" in error_detail.lower():
+            print(f"[ERROR] Qwen model not loaded. Service may be cold starting. Wait 30-90 seconds and retry.")
+            return JSONResponse(
+                status_code=503, 
+                content={"detail": "Qwen model is still loading (cold start). Please wait 30-90 seconds and try again. The service is starting up."}
+            )
+
+        print(f"[ERROR] Qwen service returned 503: {error_detail}")
+        return JSONResponse(
+            status_code=503, 
+            content={"detail": f"Qwen service temporarily unavailable: {error_detail}. The service may be starting up or experiencing issues. Please try again in a few moments."}
+        )
+
+    # If 500 error, try to extract more details from response
+    if r.status_code == 500:
+        error_detail = "Internal Server Error"
+        try:
+            error_json = r.json()
+            if isinstance(error_json, dict) and "detail" in error_json:
+                error_detail = error_json["detail"]
+            elif isinstance(error_json, dict) and "error" in error_json:
+                error_detail = error_json["error"]
+        except:
+            # If JSON parsing fails, try to get text
+            try:
+                error_text = r.text[:500]  # First 500 chars
+                if error_text:
+                    error_detail = error_text
+            except:
+                pass
+
+        print(f"[ERROR] Qwen service returned 500: {error_detail}")
+        print(f"[ERROR] This may indicate: OOM (Out of Memory) error, model loading issue, or video processing failure.")
+        print(f"[ERROR] Check Modal logs at https://modal.com/apps for detailed error information.")
+
+        # Log to Sentry
+        try:
+            import sentry_sdk
+            sentry_sdk.capture_message(
+                f"Qwen evaluation failed: {error_detail}",
+                level="error",
+                contexts={
+                    "evaluation": {
+                        "file_size_mb": file_size_mb,
+                        "elapsed_time": elapsed_time,
+                        "status_code": 500
+                    }
+                }
+            )
+        except Exception:
+            pass
+
+        # Provide more helpful error message
+        if "OOM" in error_detail or "out of memory" in error_detail.lower() or "CUDA" in error_detail:
+            error_detail = f"Out of Memory error: {error_detail}. T4 GPU may not have enough memory for this video. Consider using a smaller video or switching to A100 GPU."
+        elif "model" in error_detail.lower() and ("not loaded" in error_detail.lower() or "load" in error_detail.lower()):
+            error_detail = f"Model loading error: {error_detail}. The Qwen model may not have loaded correctly on Modal. Check Modal deployment logs."
+
+        return JSONResponse(status_code=500, content={"detail": f"Qwen evaluation failed: {error_detail}"})
+
+    headers = {"X-Qwen-Cache": "miss"} if video else None
+    return Response(content=r.content, status_code=r.status_code, media_type="application/json", headers=headers)
+
+
+
+# ----- Evaluation job queue: submit returns a job id at once, a bounded worker pool forwards jobs to QWEN_API_URL -----
+# Browsers poll GET /qwen-api/jobs/{id} or subscribe to /qwen-api/jobs/{id}/events (SSE) instead of holding one
+# request open for up to 600s. Jobs live in SQLite so a restart requeues whatever was queued or running.
+# Each job reserves one evaluation of its user's quota from submit until it finishes, so queued jobs can't add up to
+# more than the quota; the quota is checked again just before a job is sent to Qwen.
+_QWEN_JOB_TERMINAL = ("succeeded", "failed")
+_qwen_jobs = None  # _QwenJobStore, opened on first use
+_qwen_job_queue = None  # asyncio.Queue of job ids, bound to the loop the workers run on
+_qwen_job_loop = None
+_qwen_job_workers = []
+_qwen_job_janitor_task = None  # asyncio.Task purging old finished jobs
+_qwen_job_stats = {
+    "submitted": 0, "succeeded": 0, "failed": 0, "requeued_on_start": 0, "purged": 0, "quota_denied": 0,
+    "max_wait_seconds": 0.0,
+}
+
+
+def _qwen_jobs_dir() -> Path:
+    return Path(_get_env("QWEN_JOBS_DIR") or str(_this_dir / ".qwen_jobs"))
+
+
+class _QwenJobStore:
+    """SQLite job table (WAL mode, one shared connection behind a lock; every statement is a single-row read/write)."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS qwen_jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    progress TEXT,
+                    user_id TEXT,
+                    institution_id TEXT,
+                    rubric TEXT NOT NULL,
+                    storage_url TEXT,
+                    file_path TEXT,
+                    filename TEXT,
+                    content_type TEXT,
+                    file_size_mb REAL,
+                    status_code INTEGER,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    quota_reserved INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(qwen_jobs)")}
+            if "quota_reserved" not in columns:  # store created before quota reservations
+                self._conn.execute("ALTER TABLE qwen_jobs ADD COLUMN quota_reserved INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS qwen_jobs_status_created ON qwen_jobs (status, created_at)")
+
+    def create(self, reserve=None, **fields):
+        """
+        Insert a queued job. reserve=(column, value, limit) also reserves one evaluation of quota for it, unless the
+        unfinished jobs already holding a reservation for that user_id/institution_id number limit or more: then
+        nothing is inserted and None is returned. Counting and inserting happen under one lock.
+        """
+        fields.setdefault("status", "queued")
+        fields.setdefault("progress", "queued")
+        fields.setdefault("created_at", time.time())
+        with self._lock:
+            if reserve is not None:
+                column, value, limit = reserve
+                if self._reserved(column, value) >= limit:
+                    return None
+                fields["quota_reserved"] = 1
+            columns = ", ".join(fields)
+            placeholders = ", ".join("?" for _ in fields)
+            self._conn.execute(f"INSERT INTO qwen_jobs ({columns}) VALUES ({placeholders})", tuple(fields.values()))
+        return self.get(fields["id"])
+
+    def _reserved(self, column: str, value) -> int:
+        assert column in ("user_id", "institution_id")
+        return self._conn.execute(
+            f"SELECT COUNT(*) FROM qwen_jobs WHERE quota_reserved = 1 AND status IN ('queued', 'running') AND {column} = ?",
+            (value,),
+        ).fetchone()[0]
+
+    def reserved(self, column: str, value) -> int:
+        """Unfinished jobs holding a quota reservation for that user_id / institution_id."""
+        with self._lock:
+            return self._reserved(column, value)
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM qwen_jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def update(self, job_id: str, **fields):
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE qwen_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim(self, job_id: str) -> bool:
+        """Move a queued job to running; False if another worker already took it (or it no longer exists)."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE qwen_jobs SET status = 'running', progress = 'starting', started_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            )
+            return cur.rowcount == 1
+
+    def position(self, job: dict) -> int:
+        """1-based position among queued jobs (oldest first)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM qwen_jobs WHERE status = 'queued' AND created_at < ?", (job["created_at"],)
+            ).fetchone()
+        return row[0] + 1
+
+    def recover(self) -> list:
+        """Requeue jobs a previous process left running and return every queued job id, oldest first."""
+        with self._lock:
+            self._conn.execute("UPDATE qwen_jobs SET status = 'queued', progress = 'requeued after restart' WHERE status = 'running'")
+            rows = self._conn.execute("SELECT id FROM qwen_jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+        return [r[0] for r in rows]
+
+    def purge(self, older_than: float) -> int:
+        """Delete finished jobs (and any upload they still reference) that ended before older_than."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, file_path FROM qwen_jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?", (older_than,)
+            ).fetchall()
+            self._conn.execute("DELETE FROM qwen_jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?", (older_than,))
+        for _, file_path in rows:
+            if file_path:
+                Path(file_path).unlink(missing_ok=True)
+        return len(rows)
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM qwen_jobs GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+async def _qwen_job_quota(user_id, institution_id):
+    """
+    (reserve, quota_check) for a job submission. reserve is the create() argument that holds one evaluation of the
+    caller's quota until the job finishes: (column, value, headroom) for the user, or for the institution when its
+    department shares one quota. None for anonymous callers and users who bypass quotas.
+    """
+    if not user_id:
+        return None, None
+    quota_check = await _cached_user_quota(user_id, institution_id)
+    if quota_check.get("bypass", False):
+        return None, quota_check
+    if quota_check.get("quota_type") == "department" and institution_id:
+        column, value = "institution_id", institution_id
+    else:
+        column, value = "user_id", user_id
+    headroom = _quota_headroom(quota_check) if quota_check.get("has_quota", False) else 0
+    return (column, value, headroom), quota_check
+
+
+def _qwen_job_store() -> _QwenJobStore:
+    global _qwen_jobs
+    if _qwen_jobs is None:
+        _qwen_jobs = _QwenJobStore(_qwen_jobs_dir() / "jobs.sqlite3")
+    return _qwen_jobs
+
+
+def _start_qwen_job_workers():
+    """Start QWEN_JOB_WORKERS workers on the running loop and requeue jobs left over from a previous process."""
+    global _qwen_job_queue, _qwen_job_loop, _qwen_job_janitor_task
+    loop = asyncio.get_running_loop()
+    if _qwen_job_queue is not None and _qwen_job_loop is loop:
+        return
+    _qwen_job_queue = asyncio.Queue()
+    _qwen_job_loop = loop
+    store = _qwen_job_store()
+    pending = store.recover()
+    for job_id in pending:
+        _qwen_job_queue.put_nowait(job_id)
+    _qwen_job_stats["requeued_on_start"] += len(pending)
+    workers = max(1, _env_int("QWEN_JOB_WORKERS", 4))
+    _qwen_job_workers[:] = [loop.create_task(_qwen_job_worker(_qwen_job_queue)) for _ in range(workers)]
+    _qwen_job_janitor_task = loop.create_task(_qwen_job_janitor())
+    print(f"[JOBS] {workers} workers started, store={store.path}, {len(pending)} job(s) requeued")
+
+
+async def _stop_qwen_job_workers():
+    """Cancel the workers and the janitor; a job cut off mid-flight stays 'running' in SQLite and is requeued on next start."""
+    global _qwen_job_queue, _qwen_job_loop, _qwen_job_janitor_task
+    tasks = _qwen_job_workers + ([_qwen_job_janitor_task] if _qwen_job_janitor_task else [])
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    _qwen_job_workers.clear()
+    _qwen_job_janitor_task = None
+    _qwen_job_queue = None
+    _qwen_job_loop = None
+
+
+async def _qwen_job_janitor():
+    """Purge jobs finished more than QWEN_JOB_RETENTION_HOURS ago now and every QWEN_JOB_PURGE_SECONDS after."""
+    while True:
+        try:
+            older_than = time.time() - _env_float("QWEN_JOB_RETENTION_HOURS", 24) * 3600
+            purged = await asyncio.to_thread(_qwen_job_store().purge, older_than)
+            _qwen_job_stats["purged"] += purged
+            if purged:
+                print(f"[JOBS] Purged {purged} finished job(s)")
+        except Exception as e:
+            print(f"[JOBS] Purge failed: {e}")
+        await asyncio.sleep(max(1.0, _env_float("QWEN_JOB_PURGE_SECONDS", 3600)))
+
+
+async def _qwen_job_worker(queue: asyncio.Queue):
+    while True:
+        job_id = await queue.get()
+        try:
+            await _run_qwen_job(job_id)
+        except Exception as e:
+            print(f"[JOBS] Job {job_id} crashed: {e}")
+            await asyncio.to_thread(_finish_qwen_job, job_id, 500, json.dumps({"detail": f"Qwen job error: {e!s}"}))
+        finally:
+            queue.task_done()
+
+
+async def _run_qwen_job(job_id: str):
+    # Store calls go through worker threads: they share a lock with SSE polls and the janitor's purge
+    store = _qwen_job_store()
+    if not await asyncio.to_thread(store.claim, job_id):
+        return
+    job = await asyncio.to_thread(store.get, job_id)
+    wait = job["started_at"] - job["created_at"]
+    _qwen_job_stats["max_wait_seconds"] = round(max(_qwen_job_stats["max_wait_seconds"], wait), 2)
+    # The quota may have been spent since submit (other jobs, other tabs, other processes): check it again
+    denial = await _quota_denial(job["user_id"], job["institution_id"])
+    if denial is not None:
+        _qwen_job_stats["quota_denied"] += 1
+        await asyncio.to_thread(_finish_qwen_job, job_id, 402, bytes(denial.body).decode("utf-8"))
+        return
+    base = _qwen_base()
+    if not base:
+        await asyncio.to_thread(_finish_qwen_job, job_id, 503, json.dumps({"detail": "QWEN_API_URL not set"}))
+        return
+    data = {"rubric": job["rubric"]}
+    files = None
+    fh = None
+    meter = None
+    try:
+        if job["storage_url"]:
+            data["storage_url"] = job["storage_url"]
+        else:
+            fh = open(job["file_path"], "rb")
+            meter = _MeteredUpload(fh, "evaluate_video", _env_int("QWEN_UPLOAD_CHUNK_KB", 256) * 1024)
+            files = {"file": (job["filename"], meter, job["content_type"])}
+        # An open circuit parks the job (up to QWEN_JOB_CIRCUIT_WAIT_SECONDS) instead of failing it
+        deadline = time.time() + _env_float("QWEN_JOB_CIRCUIT_WAIT_SECONDS", 900)
+        while True:
+            await asyncio.to_thread(store.update, job_id, progress="evaluating")
+            try:
+                response = await _forward_evaluate_video(
+                    base, files, data, job["storage_url"], job["file_size_mb"] or 0,
+                    job["user_id"], job["institution_id"], time.time(), meter=meter,
+                )
+                break
+            except _QwenCircuitOpen as e:
+                if time.time() + e.retry_after > deadline:
+                    response = _qwen_circuit_response(e)
+                    break
+                await asyncio.to_thread(store.update, job_id, progress="waiting for Qwen")
+                await asyncio.sleep(e.retry_after)
+    finally:
+        if meter:
+            meter.finish()
+        if fh:
+            fh.close()
+    await asyncio.to_thread(_finish_qwen_job, job_id, response.status_code, bytes(response.body).decode("utf-8", errors="replace"))
+
+
+def _finish_qwen_job(job_id: str, status_code: int, body: str):
+    """Record the upstream outcome, drop the queued upload and update counters."""
+    store = _qwen_job_store()
+    job = store.get(job_id)
+    if job is None:
+        return
+    status = "succeeded" if status_code == 200 else "failed"
+    error = None
+    if status == "failed":
+        try:
+            error = json.loads(body).get("detail") or body[:500]
+        except Exception:
+            error = body[:500]
+    store.update(
+        job_id, status=status, progress="done", status_code=status_code,
+        result=body if status == "succeeded" else None, error=error, finished_at=time.time(), file_path=None,
+    )
+    if job["file_path"]:
+        Path(job["file_path"]).unlink(missing_ok=True)
+    _qwen_job_stats[status] += 1
+    print(f"[JOBS] Job {job_id} {status} (status {status_code}) after {time.time() - job['created_at']:.1f}s")
+
+
+def _qwen_job_view(job: dict) -> dict:
+    """Client-facing job status: result is the parsed evaluation JSON once the job has succeeded."""
+    view = {k: job[k] for k in ("id", "status", "progress", "status_code", "created_at", "started_at", "finished_at")}
+    if job["status"] == "queued":
+        view["queue_position"] = _qwen_job_store().position(job)
+    if job["status"] == "succeeded":
+        try:
+            view["result"] = json.loads(job["result"])
+        except (TypeError, ValueError):
+            view["result"] = job["result"]
+    if job["status"] == "failed":
+        view["error"] = job["error"]
+    return view
+
+
+def _qwen_job_for_request(request: Request, job_id: str):
+    """The job if it exists and belongs to the caller (jobs submitted anonymously are readable by id alone)."""
+    job = _qwen_job_store().get(job_id)
+    if job is None:
+        return None
+    user_id, _ = _get_user_info_from_token(request)
+    if job["user_id"] and job["user_id"] != user_id:
+        return None
+    return job
+
+
+def _qwen_job_stats_snapshot() -> dict:
+    snapshot = dict(_qwen_job_stats)
+    snapshot["workers"] = len(_qwen_job_workers)
+    snapshot["queue_depth"] = _qwen_job_queue.qsize() if _qwen_job_queue is not None else 0
+    # Don't open (create) the SQLite store just to report on it
+    snapshot["by_status"] = _qwen_jobs.counts() if _qwen_jobs is not None else {}
+    return snapshot
+
+
+@app.post("/qwen-api/jobs/evaluate_video")
+@limiter.limit("200/hour")
+async def qwen_jobs_submit_evaluate_video(request: Request):
+    """Queue a Qwen evaluation (same form fields as /qwen-api/evaluate_video) and return its job id with 202."""
+    if not _qwen_base():
+        return Response(status_code=503, content="QWEN_API_URL not set")
+    _set_sentry_user_context(request)
+    user_id, institution_id = _get_user_info_from_token(request)
+    institution_id = institution_id or (_cached_institution(user_id) if user_id else None)
+    reserve, quota_check = await _qwen_job_quota(user_id, institution_id)
+    if reserve is not None:
+        queued = await asyncio.to_thread(_qwen_job_store().reserved, reserve[0], reserve[1])
+        if queued >= reserve[2]:
+            return _quota_exhausted(quota_check, queued)
+
+    form = await request.form()
+    rubric_part = form.get("rubric")
+    storage_url = form.get("storage_url")
+    file_part = form.get("file")
+    if rubric_part is None:
+        return JSONResponse(status_code=400, content={"detail": "Missing rubric"})
+    if isinstance(rubric_part, str):
+        rubric_str = rubric_part
+    else:
+        rubric_str = (await rubric_part.read()).decode("utf-8", errors="replace")
+
+    job_id = uuid.uuid4().hex
+    fields = {"id": job_id, "user_id": user_id, "institution_id": institution_id, "rubric": rubric_str}
+    if storage_url:
+        fields["storage_url"] = storage_url
+    elif file_part and hasattr(file_part, "read"):
+        # Move the spooled upload to the job dir so it survives this request (and a restart) until a worker sends it
+        uploads_dir = _qwen_jobs_dir() / "uploads"
+        uploads_dir.mkdir(parents=True, exist_ok=True)
+        dest = uploads_dir / job_id
+
+        def _save():
+            file_part.file.seek(0)
+            with open(dest, "wb") as out:
+                shutil.copyfileobj(file_part.file, out, 1024 * 1024)
+
+        await asyncio.to_thread(_save)
+        fields.update(
+            file_path=str(dest),
+            filename=file_part.filename or "video",
+            content_type=file_part.content_type or "application/octet-stream",
+            file_size_mb=dest.stat().st_size / (1024 * 1024),
+        )
+    else:
+        return JSONResponse(status_code=400, content={"detail": "Missing file or storage_url"})
+
+    job = await asyncio.to_thread(_qwen_job_store().create, reserve=reserve, **fields)
+    if job is None:  # concurrent submissions took the last of the quota meanwhile
+        if fields.get("file_path"):
+            Path(fields["file_path"]).unlink(missing_ok=True)
+        return _quota_exhausted(quota_check, await asyncio.to_thread(_qwen_job_store().reserved, reserve[0], reserve[1]))
+    _start_qwen_job_workers()
+    _qwen_job_queue.put_nowait(job_id)
+    _qwen_job_stats["submitted"] += 1
+    source = "storage_url" if storage_url else f"{fields['file_size_mb']:.2f} MB upload"
+    print(f"[JOBS] Job {job_id} queued ({source})")
+    view = await asyncio.to_thread(_qwen_job_view, job)
+    return JSONResponse(status_code=202, content=view, headers={"Location": f"/qwen-api/jobs/{job_id}"})
+
+
+@app.get("/qwen-api/jobs/{job_id}")
+def qwen_jobs_status(job_id: str, request: Request):
+    """Poll a job: status, progress, queue position while queued, and the evaluation result once finished."""
+    job = _qwen_job_for_request(request, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"detail": "Job not found"})
+    return _qwen_job_view(job)
+
+
+@app.get("/qwen-api/jobs/{job_id}/events")
+async def qwen_jobs_events(job_id: str, request: Request):
+    """Server-Sent Events: one message per status/progress change, ending with the finished job."""
+    if await asyncio.to_thread(_qwen_job_for_request, request, job_id) is None:
+        return JSONResponse(status_code=404, content={"detail": "Job not found"})
+    poll_seconds = max(0.1, _env_float("QWEN_JOB_POLL_SECONDS", 1.0))
+
+    async def stream():
+        last = None
+        last_sent = time.time()
+        while True:
+            job = await asyncio.to_thread(_qwen_job_store().get, job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'detail': 'Job not found'})}\n\n"
+                return
+            view = await asyncio.to_thread(_qwen_job_view, job)
+            if view != last:
+                yield f"data: {json.dumps(view)}\n\n"
+                last = view
+                last_sent = time.time()
+            elif time.time() - last_sent >= 15:
+                # Comment line keeps proxies/tunnels from closing an idle stream
+                yield ": keep-alive\n\n"
+                last_sent = time.time()
+            if job["status"] in _QWEN_JOB_TERMINAL or await request.is_disconnected():
+                return
+            await asyncio.sleep(poll_seconds)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.middleware("http")
 async def log_llm_export_requests(request, call_next):
     # Handle /qwen-api in middleware so nothing downstream (router/StaticFiles) can return 405
@@ -315,6 +1787,11 @@ async def log_llm_export_requests(request, call_next):
             base = _qwen_base()
             if not base:
                 return Response(status_code=503, content="QWEN_API_URL not set")
+            # Fail fast while every backend's circuit is open, before reading the upload
+            denial = _qwen_circuit_denial()
+            if denial is not None:
+                return denial
+            meter = None
             try:
                 form = await request.form()
                 file_part = form.get("file")
@@ -326,26 +1803,13 @@ async def log_llm_export_requests(request, call_next):
                     
                     # Check user quota before proceeding
                     user_id, institution_id = _get_user_info_from_token(request)
-                    if user_id:
-                        quota_check = await _check_user_quota(user_id)
-                        if not quota_check.get("bypass", False) and not quota_check.get("has_quota", False):
-                            # No quota available
-                            remaining = quota_check.get("remaining_quota", 0)
-                            buffer_remaining = quota_check.get("buffer_remaining", 0)
-                            error_msg = f"Quota exhausted. You have {remaining} evaluations remaining in your monthly quota"
-                            if buffer_remaining > 0:
-                                error_msg += f" and {buffer_remaining} in the shared buffer pool."
-                            else:
-                                error_msg += ". Please upgrade your plan or purchase additional evaluations."
-                            return JSONResponse(
-                                status_code=402,
-                                content={"detail": error_msg, "quota_info": quota_check}
-                            )
+                    denial = await _quota_denial(user_id, institution_id)
+                    if denial is not None:
+                        return denial
                     
                     # Rate limiting is now handled by the @limiter.limit() decorator on the endpoint
                     # No need to check here in middleware
                     
-                    import time
                     start_time = time.time()
                     evaluation_start = time.time()
                     
@@ -369,168 +1833,26 @@ async def log_llm_export_requests(request, call_next):
                         files = None
                         file_size_mb = 0  # Unknown when using URL
                     elif file_part and hasattr(file_part, "read"):
-                        # Traditional file upload (fallback)
-                        body = await file_part.read()
-                        files = {"file": (getattr(file_part, "filename", None) or "video", body, getattr(file_part, "content_type", None) or "application/octet-stream")}
+                        # Traditional file upload (fallback); streamed from the spooled upload, not held in memory
+                        file_entry, file_size, meter = await _upload_part_for_httpx(file_part, "evaluate_video", "video")
+                        files = {"file": file_entry}
                         data = {"rubric": rubric_str}
-                        file_size_mb = len(body) / (1024 * 1024)
+                        file_size_mb = file_size / (1024 * 1024)
                     else:
                         return JSONResponse(status_code=400, content={"detail": "Missing file or storage_url"})
                     
-                    # Log evaluation start for cost tracking
-                    if not storage_url:
-                        print(f"[COST_TRACKING] Evaluation started - File size: {file_size_mb:.2f} MB, Timestamp: {time.time()}")
-                    else:
-                        print(f"[COST_TRACKING] Evaluation started - Using storage URL: {storage_url}, Timestamp: {time.time()}")
-                    
-                    # Match Modal timeout (600s) to avoid premature timeouts
-                    async with httpx.AsyncClient(timeout=600.0, follow_redirects=True) as client:
-                        try:
-                            if files:
-                                # Traditional file upload
-                                r = await client.post(f"{base}/evaluate_video", files=files, data=data)
-                            else:
-                                # Storage URL (Qwen API needs to support this)
-                                r = await client.post(f"{base}/evaluate_video", json=data, headers={"Content-Type": "application/json"})
-                        except httpx.TimeoutException as e:
-                            elapsed_time = time.time() - start_time
-                            error_msg = f"Qwen service timeout after {elapsed_time:.1f}s. The evaluation may be taking too long or the service may be unavailable."
-                            print(f"[COST_TRACKING] Evaluation failed - Timeout: {elapsed_time:.2f}s")
-                            print(f"[ERROR] {error_msg}")
-                            return JSONResponse(status_code=504, content={"detail": error_msg})
-                        except httpx.RequestError as e:
-                            elapsed_time = time.time() - start_time
-                            error_msg = f"Failed to connect to Qwen service: {str(e)}. Check QWEN_API_URL and ensure the Modal service is running."
-                            print(f"[COST_TRACKING] Evaluation failed - Connection error: {elapsed_time:.2f}s")
-                            print(f"[ERROR] {error_msg}")
-                            return JSONResponse(status_code=503, content={"detail": error_msg})
-                    
-                    # Calculate and log cost metrics
-                    elapsed_time = time.time() - start_time
-                    # RunPod A100 GPU cost: ~$0.00011-0.00022/second (using average of $0.000165)
-                    # Modal A100 GPU cost: ~$0.0011-0.0014/second (using average of $0.00125)
-                    # Check provider from QWEN_API_URL to determine cost
-                    base = _qwen_base()
-                    if base and "modal" in base.lower():
-                        estimated_cost = elapsed_time * 0.00125  # Modal pricing
-                        provider = "modal"
-                    else:
-                        estimated_cost = elapsed_time * 0.000165  # RunPod pricing
-                        provider = "runpod"
-                    
-                    print(f"[COST_TRACKING] Evaluation completed - Duration: {elapsed_time:.2f}s, Estimated cost: ${estimated_cost:.4f}, Provider: {provider}, Status: {r.status_code}")
-                    
-                    # Log cost to database and increment usage if evaluation was successful
-                    if r.status_code == 200:
-                        user_id, institution_id = _get_user_info_from_token(request)
-                        # Note: evaluation_id will be None here since it's created in frontend after save
-                        # Frontend can update cost_tracking record later with evaluation_id if needed
-                        await _log_cost_to_database(
-                            user_id=user_id,
-                            institution_id=institution_id,
-                            evaluation_id=None,  # Will be set when evaluation is saved in frontend
-                            gpu_seconds=elapsed_time,
-                            estimated_cost=estimated_cost,
-                            provider=provider,
-                            model_name="qwen",
-                            file_size_mb=file_size_mb,
-                            processing_time_seconds=elapsed_time
-                        )
-                        # Increment usage quota
-                        if user_id:
-                            await _increment_usage(user_id, None, estimated_cost, provider)
-                    
-                    if 300 <= r.status_code < 400:
-                        return JSONResponse(status_code=502, content={"detail": "Qwen service returned redirect (3xx). Check QWEN_API_URL—use https, no trailing slash. Ensure the Qwen tunnel/URL is correct."})
-                    
-                    # If 503 error, check if it's a model loading issue
-                    if r.status_code == 503:
-                        error_detail = "Service Unavailable"
-                        try:
-                            error_json = r.json()
-                            if isinstance(error_json, dict) and "detail" in error_json:
-                                error_detail = error_json["detail"]
-                            elif isinstance(error_json, dict) and "error" in error_json:
-                                error_detail = error_json["error"]
-                        except:
-                            try:
-                                error_text = r.text[:500]
-                                if error_text:
-                                    error_detail = error_text
-                            except:
-                                pass
-                        
-                        # Check if it's a model loading issue
-                        if "model not loaded" in error_detail.lower() or "model_not_loaded" in error_detail.lower():
-                            print(f"[ERROR] Qwen model not loaded. Service may be cold starting. Wait 30-90 seconds and retry.")
-                            return JSONResponse(
-                                status_code=503, 
-                                content={"detail": "Qwen model is still loading (cold start). Please wait 30-90 seconds and try again. The service is starting up."}
-                            )
-                        
-                        print(f"[ERROR] Qwen service returned 503: {error_detail}")
-                        return JSONResponse(
-                            status_code=503, 
-                            content={"detail": f"Qwen service temporarily unavailable: {error_detail}. The service may be starting up or experiencing issues. Please try again in a few moments."}
-                        )
-                    
-                    # If 500 error, try to extract more details from response
-                    if r.status_code == 500:
-                        error_detail = "Internal Server Error"
-                        try:
-                            error_json = r.json()
-                            if isinstance(error_json, dict) and "detail" in error_json:
-                                error_detail = error_json["detail"]
-                            elif isinstance(error_json, dict) and "error" in error_json:
-                                error_detail = error_json["error"]
-                        except:
-                            # If JSON parsing fails, try to get text
-                            try:
-                                error_text = r.text[:500]  # First 500 chars
-                                if error_text:
-                                    error_detail = error_text
-                            except:
-                                pass
-                        
-                        print(f"[ERROR] Qwen service returned 500: {error_detail}")
-                        print(f"[ERROR] This may indicate: OOM (Out of Memory) error, model loading issue, or video processing failure.")
-                        print(f"[ERROR] Check Modal logs at https://modal.com/apps for detailed error information.")
-                        
-                        # Log to Sentry
-                        try:
-                            import sentry_sdk
-                            sentry_sdk.capture_message(
-                                f"Qwen evaluation failed: {error_detail}",
-                                level="error",
-                                contexts={
-                                    "evaluation": {
-                                        "file_size_mb": file_size_mb,
-                                        "elapsed_time": elapsed_time,
-                                        "status_code": 500
-                                    }
-                                }
-                            )
-                        except Exception:
-                            pass
-                        
-                        # Provide more helpful error message
-                        if "OOM" in error_detail or "out of memory" in error_detail.lower() or "CUDA" in error_detail:
-                            error_detail = f"Out of Memory error: {error_detail}. T4 GPU may not have enough memory for this video. Consider using a smaller video or switching to A100 GPU."
-                        elif "model" in error_detail.lower() and ("not loaded" in error_detail.lower() or "load" in error_detail.lower()):
-                            error_detail = f"Model loading error: {error_detail}. The Qwen model may not have loaded correctly on Modal. Check Modal deployment logs."
-                        
-                        return JSONResponse(status_code=500, content={"detail": f"Qwen evaluation failed: {error_detail}"})
-                    
-                    return Response(content=r.content, status_code=r.status_code, media_type="application/json")
+                    return await _forward_evaluate_video(
+                        base, files, data, storage_url, file_size_mb, user_id, institution_id, start_time, meter=meter
+                    )
                 if path == "/qwen-api/analyze_video" and file_part and hasattr(file_part, "read"):
                     start_time = time.time()
-                    body = await file_part.read()
-                    files = {"file": (getattr(file_part, "filename", None) or "video", body, getattr(file_part, "content_type", None) or "application/octet-stream")}
-                    async with httpx.AsyncClient(timeout=120.0) as client:
-                        r = await client.post(f"{base}/analyze_video", files=files)
+                    file_entry, file_size, meter = await _upload_part_for_httpx(file_part, "analyze_video", "video")
+                    backend, r = await _qwen_route("POST", "analyze_video", files={"file": file_entry})
+                    if meter:
+                        meter.finish(r.status_code)
                     elapsed_time = time.time() - start_time
-                    estimated_cost = elapsed_time * 0.000222
-                    print(f"[COST_TRACKING] Video analysis - Duration: {elapsed_time:.2f}s, Estimated cost: ${estimated_cost:.4f}, Status: {r.status_code}")
+                    estimated_cost = elapsed_time * backend.cost_per_second
+                    print(f"[COST_TRACKING] Video analysis - Duration: {elapsed_time:.2f}s, Estimated cost: ${estimated_cost:.4f}, Backend: {backend.name}, Status: {r.status_code}")
                     
                     # Log cost to database if successful
                     if r.status_code == 200:
@@ -540,22 +1862,22 @@ async def log_llm_export_requests(request, call_next):
                             institution_id=institution_id,
                             gpu_seconds=elapsed_time,
                             estimated_cost=estimated_cost,
-                            provider="modal",
+                            provider=backend.provider,
                             model_name="qwen",
-                            file_size_mb=len(body) / (1024 * 1024) if body else None,
+                            file_size_mb=file_size / (1024 * 1024) if file_size else None,
                             processing_time_seconds=elapsed_time
                         )
                     
                     return Response(content=r.content, status_code=r.status_code, media_type="application/json")
                 if path == "/qwen-api/extract_rubric" and file_part and hasattr(file_part, "read"):
                     start_time = time.time()
-                    body = await file_part.read()
-                    files = {"file": (getattr(file_part, "filename", None) or "rubric", body, getattr(file_part, "content_type", None) or "application/octet-stream")}
-                    async with httpx.AsyncClient(timeout=300.0) as client:
-                        r = await client.post(f"{base}/extract_rubric", files=files)
+                    file_entry, file_size, meter = await _upload_part_for_httpx(file_part, "extract_rubric", "rubric")
+                    backend, r = await _qwen_route("POST", "extract_rubric", files={"file": file_entry})
+                    if meter:
+                        meter.finish(r.status_code)
                     elapsed_time = time.time() - start_time
-                    estimated_cost = elapsed_time * 0.000222
-                    print(f"[COST_TRACKING] Rubric extraction - Duration: {elapsed_time:.2f}s, Estimated cost: ${estimated_cost:.4f}, Status: {r.status_code}")
+                    estimated_cost = elapsed_time * backend.cost_per_second
+                    print(f"[COST_TRACKING] Rubric extraction - Duration: {elapsed_time:.2f}s, Estimated cost: ${estimated_cost:.4f}, Backend: {backend.name}, Status: {r.status_code}")
                     
                     # Log cost to database if successful
                     if r.status_code == 200:
@@ -565,23 +1887,29 @@ async def log_llm_export_requests(request, call_next):
                             institution_id=institution_id,
                             gpu_seconds=elapsed_time,
                             estimated_cost=estimated_cost,
-                            provider="modal",
+                            provider=backend.provider,
                             model_name="qwen",
-                            file_size_mb=len(body) / (1024 * 1024) if body else None,
+                            file_size_mb=file_size / (1024 * 1024) if file_size else None,
                             processing_time_seconds=elapsed_time
                         )
                     
                     return Response(content=r.content, status_code=r.status_code, media_type="application/json")
+            except _QwenCircuitOpen as e:
+                return _qwen_circuit_response(e)
             except Exception as e:
                 return JSONResponse(status_code=503, content={"detail": f"Qwen proxy error: {e!s}"}, media_type="application/json")
+            finally:
+                if meter:
+                    meter.finish()
         if request.method == "GET" and path == "/qwen-api/health":
             base = _qwen_base()
             if not base:
                 return Response(status_code=503, content="QWEN_API_URL not set")
             try:
-                async with httpx.AsyncClient(timeout=10.0) as client:
-                    r = await client.get(f"{base}/health")
+                _backend, r = await _qwen_route("GET", "health")
                 return Response(content=r.content, status_code=r.status_code, media_type="application/json")
+            except _QwenCircuitOpen as e:
+                return _qwen_circuit_response(e)
             except Exception as e:
                 return Response(status_code=503, content=f"Qwen proxy error: {e!s}")
     # Handle notify-signup-request in middleware so it's never shadowed by the /api mount
@@ -667,6 +1995,87 @@ def _get_user_info_from_token(request: Request):
     return user_id, institution_id
 
 
+# ----- Supabase service-role client: one pooled client per process, calls run off the event loop and are timed per RPC -----
+_supabase_client = None
+_supabase_client_key = None
+_supabase_client_lock = threading.Lock()
+_SUPABASE_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+_supabase_latency = {}  # label -> {"count", "errors", "total_ms", "max_ms", "buckets"}
+
+
+def _supabase_admin():
+    """
+    Shared service-role Supabase client (sync supabase-py over one keep-alive httpx pool), or None when
+    SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY are not set. Raises ImportError if supabase isn't installed.
+    Rebuilt only if the URL or key changes.
+    """
+    global _supabase_client, _supabase_client_key
+    supabase_url = _get_env("SUPABASE_URL")
+    supabase_service_key = _get_env("SUPABASE_SERVICE_ROLE_KEY")
+    if not supabase_url or not supabase_service_key:
+        return None
+    if _supabase_client is not None and _supabase_client_key == (supabase_url, supabase_service_key):
+        return _supabase_client
+    from supabase import ClientOptions, create_client
+    with _supabase_client_lock:
+        if _supabase_client is None or _supabase_client_key != (supabase_url, supabase_service_key):
+            timeout = _env_float("SUPABASE_TIMEOUT_SECONDS", 10)
+            options = ClientOptions(
+                postgrest_client_timeout=timeout,
+                # Service-role key: no user session to persist or refresh
+                auto_refresh_token=False,
+                persist_session=False,
+                httpx_client=httpx.Client(
+                    timeout=timeout,
+                    limits=httpx.Limits(max_connections=_env_int("SUPABASE_POOL_MAX_CONNECTIONS", 20), max_keepalive_connections=10),
+                ),
+            )
+            _supabase_client = create_client(supabase_url, supabase_service_key, options=options)
+            _supabase_client_key = (supabase_url, supabase_service_key)
+    return _supabase_client
+
+
+def _supabase_timed(label: str, fn):
+    """Run fn(client) (a blocking supabase-py query) in the calling thread and record its latency under label."""
+    client = _supabase_admin()
+    stats = _supabase_latency.setdefault(
+        label, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "buckets": [0] * (len(_SUPABASE_BUCKETS_MS) + 1)}
+    )
+    t0 = time.perf_counter()
+    try:
+        return fn(client)
+    except Exception:
+        stats["errors"] += 1
+        raise
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        stats["count"] += 1
+        stats["total_ms"] += ms
+        stats["max_ms"] = max(stats["max_ms"], ms)
+        bucket = next((i for i, le in enumerate(_SUPABASE_BUCKETS_MS) if ms <= le), len(_SUPABASE_BUCKETS_MS))
+        stats["buckets"][bucket] += 1
+
+
+async def _supabase_call(label: str, fn):
+    """Run fn(client) in a worker thread so the event loop never blocks on Supabase; latency is recorded under label."""
+    return await asyncio.to_thread(_supabase_timed, label, fn)
+
+
+def _supabase_latency_snapshot() -> dict:
+    """Per-call latency histograms: bucket upper bounds in ms ("+Inf" catches the rest)."""
+    snapshot = {}
+    for label, s in _supabase_latency.items():
+        bounds = [str(b) for b in _SUPABASE_BUCKETS_MS] + ["+Inf"]
+        snapshot[label] = {
+            "count": s["count"],
+            "errors": s["errors"],
+            "avg_ms": round(s["total_ms"] / s["count"], 1) if s["count"] else None,
+            "max_ms": round(s["max_ms"], 1),
+            "histogram_ms": dict(zip(bounds, s["buckets"])),
+        }
+    return snapshot
+
+
 # Helper to check user quota before evaluation
 async def _check_user_quota(user_id: str) -> dict:
     """Check if user has available quota. Returns dict with has_quota, quota_type, remaining_quota, etc."""
@@ -681,11 +2090,8 @@ async def _check_user_quota(user_id: str) -> dict:
             print("[QUOTA_CHECK] Cannot check quota: SUPABASE_SERVICE_ROLE_KEY not set")
             return {"has_quota": True, "bypass": True}  # Bypass if not configured
         
-        from supabase import create_client
-        supabase_client = create_client(supabase_url, supabase_service_key)
-        
         # Call the check_user_quota function
-        result = supabase_client.rpc("check_user_quota", {"p_user_id": user_id}).execute()
+        result = await _supabase_call("rpc:check_user_quota", lambda sb: sb.rpc("check_user_quota", {"p_user_id": user_id}).execute())
         
         if result.data and len(result.data) > 0:
             quota_info = result.data[0]
@@ -721,16 +2127,13 @@ async def _increment_usage(user_id: str, evaluation_id: str = None, cost: float
             print("[USAGE_TRACKING] Cannot increment usage: SUPABASE_SERVICE_ROLE_KEY not set")
             return
         
-        from supabase import create_client
-        supabase_client = create_client(supabase_url, supabase_service_key)
-        
         # Call the increment_usage function
-        result = supabase_client.rpc("increment_usage", {
+        result = await _supabase_call("rpc:increment_usage", lambda sb: sb.rpc("increment_usage", {
             "p_user_id": user_id,
             "p_evaluation_id": evaluation_id,
             "p_cost": cost,
             "p_provider": provider
-        }).execute()
+        }).execute())
         
         if result.data:
             print(f"[USAGE_TRACKING] Usage incremented for user {user_id}")
@@ -743,6 +2146,343 @@ async def _increment_usage(user_id: str, evaluation_id: str = None, cost: float
         print(f"[USAGE_TRACKING] Failed to increment usage: {e}")
 
 
+# ----- Quota cache: short-TTL check_user_quota results, decremented locally and reconciled in the background -----
+_quota_cache = {}  # cache key -> {"info": quota dict, "fetched_at": epoch seconds}
+_quota_cache_alias = {}  # user_id -> cache key (department users share their institution's entry)
+_quota_background = set()  # strong refs so pending reconcile tasks aren't garbage collected
+_quota_cache_stats = {"hits": 0, "misses": 0, "boundary_checks": 0, "optimistic_decrements": 0, "reconciles": 0}
+
+
+def _quota_cache_key(user_id: str, institution_id, quota_info: dict) -> str:
+    """Department quotas are one pool per institution; everything else is per user."""
+    if quota_info.get("quota_type") == "department" and institution_id:
+        return f"institution:{institution_id}"
+    return f"user:{user_id}"
+
+
+def _quota_headroom(quota_info: dict) -> int:
+    remaining = quota_info.get("remaining_quota") or 0
+    if quota_info.get("can_use_buffer"):
+        remaining += quota_info.get("buffer_remaining") or 0
+    return remaining
+
+
+def _store_quota(user_id: str, institution_id, quota_info: dict):
+    # Bypass/error results are never cached: a transient Supabase failure must not stick for the TTL
+    if quota_info.get("bypass") or "error" in quota_info:
+        return
+    key = _quota_cache_key(user_id, institution_id, quota_info)
+    _quota_cache[key] = {"info": dict(quota_info), "fetched_at": time.time()}
+    _quota_cache_alias[user_id] = key
+
+
+async def _cached_user_quota(user_id: str, institution_id: str = None) -> dict:
+    """
+    check_user_quota with a short-TTL in-process cache (QUOTA_CACHE_TTL_SECONDS, default 30; 0 disables).
+    Within QUOTA_CACHE_MARGIN evaluations of the limit the authoritative RPC is always called, so a stale
+    entry can only over-admit when other processes spend more than the margin inside one TTL window.
+    """
+    ttl = _env_float("QUOTA_CACHE_TTL_SECONDS", 30)
+    if not user_id or ttl <= 0:
+        return await _check_user_quota(user_id)
+    entry = _quota_cache.get(_quota_cache_alias.get(user_id))
+    if entry is not None and time.time() - entry["fetched_at"] < ttl:
+        if _quota_headroom(entry["info"]) > _env_int("QUOTA_CACHE_MARGIN", 3):
+            _quota_cache_stats["hits"] += 1
+            return dict(entry["info"])
+        _quota_cache_stats["boundary_checks"] += 1
+    else:
+        _quota_cache_stats["misses"] += 1
+    quota_info = await _check_user_quota(user_id)
+    _store_quota(user_id, institution_id, quota_info)
+    return quota_info
+
+
+def _spawn_quota_task(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    _quota_background.add(task)
+    task.add_done_callback(_quota_background.discard)
+
+
+async def _reconcile_usage(user_id: str, institution_id, cost: float, provider: str):
+    """Record the evaluation with increment_usage, then refresh the cached quota from Supabase."""
+    await _increment_usage(user_id, None, cost, provider)
+    _quota_cache_stats["reconciles"] += 1
+    _store_quota(user_id, institution_id, await _check_user_quota(user_id))
+
+
+async def _record_usage(user_id: str, institution_id, cost: float, provider: str):
+    """
+    Count one successful evaluation against the user's quota. The cached entry is decremented right away
+    (monthly quota first, then the shared buffer, mirroring increment_usage) and the Supabase writes run
+    in the background so they stay off the response path. QUOTA_CACHE_TTL_SECONDS=0 restores the inline call.
+    """
+    if not user_id:
+        return
+    if _env_float("QUOTA_CACHE_TTL_SECONDS", 30) <= 0:
+        await _increment_usage(user_id, None, cost, provider)
+        return
+    entry = _quota_cache.get(_quota_cache_alias.get(user_id))
+    if entry is not None:
+        info = entry["info"]
+        if (info.get("remaining_quota") or 0) > 0:
+            info["remaining_quota"] -= 1
+        elif info.get("can_use_buffer") and (info.get("buffer_remaining") or 0) > 0:
+            info["buffer_remaining"] -= 1
+        info["has_quota"] = _quota_headroom(info) > 0
+        _quota_cache_stats["optimistic_decrements"] += 1
+    _spawn_quota_task(_reconcile_usage(user_id, institution_id, cost, provider))
+
+
+def _quota_cache_snapshot() -> dict:
+    lookups = _quota_cache_stats["hits"] + _quota_cache_stats["misses"] + _quota_cache_stats["boundary_checks"]
+    return {
+        **_quota_cache_stats,
+        "entries": len(_quota_cache),
+        "pending_reconciles": len(_quota_background),
+        "hit_rate": round(_quota_cache_stats["hits"] / lookups, 3) if lookups else None,
+        "ttl_seconds": _env_float("QUOTA_CACHE_TTL_SECONDS", 30),
+        "margin": _env_int("QUOTA_CACHE_MARGIN", 3),
+    }
+
+
+# ----- Cost tracking: handlers enqueue rows; one background thread writes them to cost_tracking in batches -----
+_cost_writer = None
+_institution_ids = {}  # user_id -> (institution_id or None, looked up at); also used to key department quotas
+
+
+def _cost_spill_path() -> Path:
+    return Path(_get_env("COST_SPILL_FILE") or str(_this_dir / ".cost_spill.jsonl"))
+
+
+_COST_TRANSIENT_CODES = ("PGRST0", "08", "53", "57")  # PostgREST connection, connection, resources, timeouts
+
+
+def _cost_insert_transient(e) -> bool:
+    """
+    True when a cost_tracking insert failed because Supabase couldn't take it right now (unreachable, overloaded,
+    timed out), so the rows are spilled and retried. Otherwise the rows themselves were rejected (constraint or type
+    errors, a value that can't be serialized) and retrying them would fail the same way.
+    """
+    if isinstance(e, (OSError, httpx.RequestError)):
+        return True
+    if not hasattr(e, "code"):
+        return False
+    code = str(e.code or "")
+    if len(code) == 3 and code.isdigit():  # HTTP status of a non-JSON error response (gateway errors)
+        return int(code) >= 500 or code in ("408", "429")
+    return not code or code.startswith(_COST_TRANSIENT_CODES)
+
+
+def _institution_known(user_id) -> bool:
+    hit = _institution_ids.get(user_id)
+    return hit is not None and time.time() - hit[1] < _env_float("INSTITUTION_CACHE_SECONDS", 3600)
+
+
+def _cached_institution(user_id):
+    """institution_id from an earlier user_profiles lookup, if still fresh. Never queries Supabase."""
+    return _institution_ids[user_id][0] if _institution_known(user_id) else None
+
+
+class _CostWriter:
+    """
+    Buffers cost_tracking rows in memory and writes them as multi-row inserts from one daemon thread, every
+    COST_FLUSH_SECONDS or as soon as COST_FLUSH_BATCH rows are waiting. Rows that cannot be written are appended
+    to a JSON-lines spill file and replayed once Supabase accepts inserts again (at most once a minute after a
+    failure). When Postgres rejects a batch, its rows are inserted one at a time and the ones it still rejects go
+    to a dead-letter file, so one bad row neither sinks its batch nor blocks the spill forever.
+    """
+
+    def __init__(self, spill_path: Path, flush_seconds: float, batch_size: int):
+        self.spill_path = spill_path
+        self.flush_seconds = flush_seconds
+        self.batch_size = max(1, batch_size)
+        self._pending = []
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._retry_spill_at = 0.0
+        self.rejected_path = spill_path.with_name(spill_path.name + ".rejected")
+        self.stats = {
+            "enqueued": 0, "written": 0, "batches": 0, "failures": 0,
+            "spilled": 0, "replayed": 0, "rejected": 0, "institution_lookups": 0,
+        }
+        self._thread = threading.Thread(target=self._run, name="cost-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, record: dict):
+        with self._cond:
+            self._pending.append(record)
+            self.stats["enqueued"] += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def close(self, timeout: float = 30):
+        """Write whatever is still buffered (spilling it if Supabase is down) and stop the thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_seconds)
+                batch, self._pending = self._pending[: self.batch_size], self._pending[self.batch_size:]
+                stopping = self._stopping and not self._pending
+            if batch:
+                self._write(batch)
+            elif time.time() >= self._retry_spill_at:
+                self._replay()
+            if stopping:
+                return
+
+    def _insert(self, rows):
+        def insert(sb):
+            if sb is None:
+                raise ConnectionError("Supabase client unavailable")
+            return sb.table("cost_tracking").insert(rows, returning="minimal").execute()
+        _supabase_timed("insert:cost_tracking", insert)
+
+    def _store(self, rows):
+        """
+        Insert rows; if Postgres rejects the multi-row insert, insert them one at a time and dead-letter the rows it
+        still rejects. Returns (rows written, rows left unwritten because Supabase couldn't be reached, that error).
+        """
+        try:
+            self._insert(rows)
+            return len(rows), [], None
+        except Exception as e:
+            if _cost_insert_transient(e):
+                return 0, rows, e
+            if len(rows) == 1:
+                self._reject(rows, e)
+                return 0, [], None
+        written = 0
+        for i, row in enumerate(rows):
+            try:
+                self._insert([row])
+                written += 1
+            except Exception as e:
+                if _cost_insert_transient(e):
+                    return written, rows[i:], e
+                self._reject([row], e)
+        return written, [], None
+
+    def _write(self, batch):
+        try:
+            self._resolve_institutions(batch)
+        except Exception as e:
+            print(f"[COST_TRACKING] Could not resolve institutions, writing rows without them: {e}")
+        written, unwritten, error = self._store(batch)
+        if unwritten:
+            self.stats["failures"] += 1
+            self._retry_spill_at = time.time() + 60
+            print(f"[COST_TRACKING] Insert of {len(unwritten)} rows failed, spilling to {self.spill_path}: {error}")
+            self._spill(unwritten)
+            return
+        self.stats["written"] += written
+        self.stats["batches"] += 1
+        print(f"[COST_TRACKING] Logged {written} rows to database")
+        if time.time() >= self._retry_spill_at:
+            self._replay()
+
+    def _resolve_institutions(self, batch):
+        """Fill in institution_id with one user_profiles query per batch for users not already cached."""
+        lookup = sorted({r["instructor_id"] for r in batch if r["instructor_id"] and not r["institution_id"]
+                         and not _institution_known(r["instructor_id"])})
+        if lookup:
+            try:
+                profiles = _supabase_timed(
+                    "select:user_profiles",
+                    lambda sb: sb.table("user_profiles").select("id,institution_id").in_("id", lookup).execute(),
+                )
+                now = time.time()
+                for user_id in lookup:
+                    _institution_ids[user_id] = (None, now)
+                for row in profiles.data or []:
+                    _institution_ids[row["id"]] = (row.get("institution_id"), now)
+                self.stats["institution_lookups"] += 1
+            except Exception:
+                pass
+        for r in batch:
+            if r["instructor_id"] and not r["institution_id"]:
+                r["institution_id"] = _cached_institution(r["instructor_id"])
+
+    def _reject(self, records, error):
+        """Keep rows Postgres rejected (or spill lines that can't be parsed) in the dead-letter file for inspection."""
+        print(f"[COST_TRACKING] {len(records)} rows rejected, moved to {self.rejected_path}: {error}")
+        try:
+            with open(self.rejected_path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps({"row": r, "error": str(error)[:500]}) + "\n" for r in records))
+            self.stats["rejected"] += len(records)
+        except OSError as e:
+            print(f"[COST_TRACKING] Could not keep {len(records)} rejected rows, they are lost: {e}")
+
+    def _spill(self, rows):
+        try:
+            self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(row) + "\n" for row in rows))
+                f.flush()
+                os.fsync(f.fileno())
+            self.stats["spilled"] += len(rows)
+        except OSError as e:
+            print(f"[COST_TRACKING] Could not spill {len(rows)} rows, they are lost: {e}")
+
+    def _replay(self):
+        """Re-insert spilled rows. A .replaying file left by a crash mid-replay is picked up first."""
+        replaying = self.spill_path.with_name(self.spill_path.name + ".replaying")
+        if not replaying.exists():
+            try:
+                os.replace(self.spill_path, replaying)
+            except OSError:
+                return
+        try:
+            lines = replaying.read_text(encoding="utf-8").splitlines()
+        except OSError as e:
+            print(f"[COST_TRACKING] Could not read spill file {replaying}: {e}")
+            return
+        rows = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as e:  # e.g. a line cut short by a crash while spilling
+                self._reject([line], e)
+        for i in range(0, len(rows), self.batch_size):
+            written, unwritten, error = self._store(rows[i:i + self.batch_size])
+            self.stats["replayed"] += written
+            if unwritten:
+                self._retry_spill_at = time.time() + 60
+                left = unwritten + rows[i + self.batch_size:]
+                print(f"[COST_TRACKING] Replay failed, {len(left)} rows stay spilled: {error}")
+                self._spill(left)
+                break
+        replaying.unlink(missing_ok=True)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            pending = len(self._pending)
+        try:
+            spill_bytes = self.spill_path.stat().st_size
+        except OSError:
+            spill_bytes = 0
+        return {**self.stats, "pending": pending, "spill_bytes": spill_bytes, "spill_file": str(self.spill_path)}
+
+
+def _cost_events() -> _CostWriter:
+    global _cost_writer
+    if _cost_writer is None:
+        _cost_writer = _CostWriter(
+            _cost_spill_path(),
+            flush_seconds=_env_float("COST_FLUSH_SECONDS", 5),
+            batch_size=_env_int("COST_FLUSH_BATCH", 50),
+        )
+    return _cost_writer
+
+
 # Helper to log cost to database
 async def _log_cost_to_database(
     user_id: str = None,
@@ -753,53 +2493,33 @@ async def _log_cost_to_database(
     provider: str = "modal",
     model_name: str = None,
     file_size_mb: float = None,
-    processing_time_seconds: float = None
+    processing_time_seconds: float = None,
+    cache_hit: bool = False
 ):
-    """Log evaluation cost to cost_tracking table."""
-    try:
-        supabase_url = _get_env("SUPABASE_URL")
-        supabase_service_key = _get_env("SUPABASE_SERVICE_ROLE_KEY")
-        
-        if not supabase_url or not supabase_service_key:
-            print("[COST_TRACKING] Cannot log to database: SUPABASE_SERVICE_ROLE_KEY not set")
-            return
-        
-        from supabase import create_client
-        supabase_client = create_client(supabase_url, supabase_service_key)
-        
-        # If we have user_id but not institution_id, try to get it from user_profiles
-        if user_id and not institution_id:
-            try:
-                profile = supabase_client.table("user_profiles").select("institution_id").eq("id", user_id).limit(1).execute()
-                if profile.data and len(profile.data) > 0:
-                    institution_id = profile.data[0].get("institution_id")
-            except Exception:
-                pass
-        
-        # Insert cost record
-        cost_record = {
-            "instructor_id": user_id,
-            "institution_id": institution_id,
-            "evaluation_id": evaluation_id,
-            "gpu_seconds": float(gpu_seconds),
-            "estimated_cost": float(estimated_cost),
-            "provider": provider,
-            "model_name": model_name,
-            "file_size_mb": float(file_size_mb) if file_size_mb else None,
-            "processing_time_seconds": float(processing_time_seconds) if processing_time_seconds else None
-        }
-        
-        # Remove None values
-        cost_record = {k: v for k, v in cost_record.items() if v is not None}
-        
-        result = supabase_client.table("cost_tracking").insert(cost_record).execute()
-        print(f"[COST_TRACKING] Logged to database: {estimated_cost:.4f} USD")
-        
-    except ImportError:
-        print("[COST_TRACKING] Cannot log to database: supabase package not installed")
-    except Exception as e:
-        print(f"[COST_TRACKING] Failed to log to database: {e}")
-        # Don't fail the request if cost logging fails
+    """
+    Queue one cost_tracking row for the background writer; nothing is written on the request path.
+    Cache hits are recorded as zero GPU-seconds and zero cost.
+    """
+    if cache_hit:
+        gpu_seconds = 0
+        estimated_cost = 0
+    if not _get_env("SUPABASE_URL") or not _get_env("SUPABASE_SERVICE_ROLE_KEY"):
+        print("[COST_TRACKING] Cannot log to database: SUPABASE_SERVICE_ROLE_KEY not set")
+        return
+    # Every row carries the same columns so a batch is one multi-row insert; created_at is set here because
+    # rows reach Postgres seconds (or, after a spill, hours) after the evaluation finished
+    _cost_events().enqueue({
+        "instructor_id": user_id,
+        "institution_id": institution_id or _cached_institution(user_id),
+        "evaluation_id": evaluation_id,
+        "gpu_seconds": float(gpu_seconds),
+        "estimated_cost": float(estimated_cost),
+        "provider": provider,
+        "model_name": model_name,
+        "file_size_mb": float(file_size_mb) if file_size_mb else None,
+        "processing_time_seconds": float(processing_time_seconds) if processing_time_seconds else None,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    })
 
 
 def _slack_webhook_url() -> str:
@@ -848,26 +2568,14 @@ async def _handle_notify_signup_request(request: Request):
 
 
 @app.get("/config.js")
-def get_config_js():
+def get_config_js(request: Request):
     """
     Return JavaScript that sets Supabase credentials from environment variables.
-    This must be loaded before the main app script runs.
+    This must be loaded before the main app script runs. The script is generated once and revalidated by ETag;
+    pages served by this app normally have it inlined (STATIC_INLINE_CONFIG), so this is for other pages and
+    local setups.
     """
-    supabase_url = _get_env("SUPABASE_URL")
-    supabase_anon_key = _get_env("SUPABASE_ANON_KEY")
-    qwen_api_url = _get_env("QWEN_API_URL")
-    
-    # Generate JavaScript that sets window variables
-    js_content = f"""// Auto-generated config from environment variables
-window.SUPABASE_URL = {repr(supabase_url)};
-window.SUPABASE_ANON_KEY = {repr(supabase_anon_key)};
-window.QWEN_API_URL = {repr(qwen_api_url)};  // Used when on localhost; on production, app uses same-origin /qwen-api
-"""
-    return Response(
-        content=js_content,
-        media_type="application/javascript",
-        headers={"Cache-Control": "no-store, no-cache, must-revalidate", "Pragma": "no-cache"},
-    )
+    return _static_entry_response(request, _config_js())
 
 
 @app.get("/config-check")
@@ -906,13 +2614,49 @@ def health_check():
     }
 
 
+@app.get("/diagnostics")
+def diagnostics(request: Request):
+    """
+    Runtime stats for capacity planning: Qwen upstream pool, uploads, result cache, Whisper, Supabase latency, job
+    queue. They include per-backend spend and cost-tracking state, so the caller must send DIAGNOSTICS_SECRET in
+    the X-Diagnostics-Secret header; without DIAGNOSTICS_SECRET set the route is off. Backends appear by name only.
+    """
+    secret = _get_env("DIAGNOSTICS_SECRET", "").strip()
+    if not secret:
+        return JSONResponse(status_code=503, content={"detail": "DIAGNOSTICS_SECRET not set"})
+    supplied = (request.headers.get("X-Diagnostics-Secret") or "").strip()
+    if not hmac.compare_digest(supplied.encode("utf-8"), secret.encode("utf-8")):
+        return JSONResponse(status_code=401, content={"detail": "Invalid or missing X-Diagnostics-Secret"})
+    return {
+        "qwen_pool": _qwen_pool_snapshot(),
+        "uploads": _upload_stats_snapshot(),
+        "result_cache": _result_cache_snapshot(),
+        "whisper": serve_model.whisper_stats(),
+        "supabase": _supabase_latency_snapshot(),
+        "quota_cache": _quota_cache_snapshot(),
+        "static": _static_snapshot(),
+        "qwen_circuit": _qwen_circuit_snapshot(),
+        "qwen_backends": _qwen_backends_snapshot(),
+        "qwen_warm": _qwen_warm_snapshot(),
+        "cost_tracking": _cost_writer.snapshot() if _cost_writer is not None else None,
+        "jobs": _qwen_job_stats_snapshot(),
+    }
+
+
 @app.on_event("startup")
 def startup():
     """Load the Fine-tuned model if MODEL_PATH is set and exists."""
     try:
+        # Open the shared Qwen upstream pool now so the first evaluation doesn't pay for client setup
+        _qwen_http()
         url = _get_env("SUPABASE_URL")
         key = _get_env("SUPABASE_ANON_KEY")
         print(f"Supabase config: SUPABASE_URL set={bool(url)}, SUPABASE_ANON_KEY set={bool(key)} (len={len(key)})")
+        # Build the shared service-role client now (quota checks, cost tracking, subscriptions reuse it)
+        try:
+            print(f"Supabase service-role client ready: {_supabase_admin() is not None}")
+        except ImportError:
+            print("Supabase service-role client unavailable: supabase package not installed")
         
         # Verify critical files exist
         print(f"Working directory: {_this_dir}")
@@ -932,12 +2676,63 @@ def startup():
                 print(f"Model load failed: {e}")
         else:
             print("MODEL_PATH not set or path missing; /api/evaluate* will return 503 until model is available.")
+        # Load Whisper for /api/evaluate_with_file in the background so startup isn't held up
+        threading.Thread(target=serve_model.warm_whisper, name="whisper-warmup", daemon=True).start()
+        # Full-quality brotli for the HTML pages takes a few seconds; requests before then get a quick build
+        threading.Thread(target=_warm_static_files, name="static-warmup", daemon=True).start()
     except Exception as e:
         print(f"Startup error: {e}")
         import traceback
         traceback.print_exc()
 
 
+@app.on_event("startup")
+async def start_qwen_jobs():
+    """Start the evaluation job workers (requeues jobs a previous process left queued or running) and the circuit prober."""
+    try:
+        _start_qwen_job_workers()
+    except Exception as e:
+        print(f"[JOBS] Could not start job queue: {e}")
+    _start_qwen_circuit_probe()
+
+
+@app.on_event("startup")
+async def start_static_index():
+    """Reload changed static files on SIGHUP and every STATIC_INDEX_POLL_SECONDS (default 30; 0 = SIGHUP only)."""
+    global _static_poller
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGHUP,
+            lambda: threading.Thread(target=_refresh_static_index, args=("SIGHUP",), name="static-refresh", daemon=True).start(),
+        )
+    except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+        pass  # No SIGHUP on Windows; signal handlers need the main thread (not the case under TestClient)
+    if _static_poller is None:
+        _static_poller = threading.Thread(target=_poll_static_index, name="static-poll", daemon=True)
+        _static_poller.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop the job workers, finish pending usage writes, and close the shared Qwen upstream pool."""
+    global _qwen_http_client, _storage_http_client
+    await _stop_qwen_job_workers()
+    if _qwen_circuit_probe is not None:
+        _qwen_circuit_probe[1].cancel()
+    for warmup in _qwen_warmups.values():
+        warmup["task"].cancel()
+    if _quota_background:
+        await asyncio.wait(list(_quota_background), timeout=10)
+    if _cost_writer is not None:
+        await asyncio.to_thread(_cost_writer.close)
+    if _qwen_http_client is not None:
+        await _qwen_http_client.aclose()
+        _qwen_http_client = None
+    if _storage_http_client is not None:
+        await _storage_http_client.aclose()
+        _storage_http_client = None
+
+
 # Notify signup (root path so it's never shadowed by /api mount)
 @app.get("/notify-signup-request")
 async def notify_signup_get():
@@ -1041,8 +2836,7 @@ async def generate_upload_url(request: Request):
             )
         
         try:
-            from supabase import create_client
-            supabase_client = create_client(supabase_url, supabase_service_key)
+            _supabase_admin()  # shared client; raises ImportError if supabase-py is missing
             
             bucket_name = "evaluation-media"
             expires_in = 900  # 15 minutes in seconds
@@ -1116,9 +2910,6 @@ async def create_subscription(request: Request):
         if not supabase_url or not supabase_service_key:
             return JSONResponse(status_code=503, content={"detail": "Supabase configuration missing"})
         
-        from supabase import create_client
-        supabase_client = create_client(supabase_url, supabase_service_key)
-        
         # Create subscription
         subscription_data = {
             "user_id": user_id,
@@ -1131,7 +2922,7 @@ async def create_subscription(request: Request):
             "billing_period": "monthly"
         }
         
-        subscription_result = supabase_client.table("subscriptions").insert(subscription_data).execute()
+        subscription_result = await _supabase_call("insert:subscriptions", lambda sb: sb.table("subscriptions").insert(subscription_data).execute())
         
         if not subscription_result.data:
             return JSONResponse(status_code=500, content={"detail": "Failed to create subscription"})
@@ -1151,19 +2942,22 @@ async def create_subscription(request: Request):
         }
         
         # Check if quota already exists
-        existing_quota = supabase_client.table("usage_quotas").select("*")
-        if contract_type == 'department' and institution_id:
-            existing_quota = existing_quota.eq("institution_id", institution_id).eq("account_type", tier)
-        else:
-            existing_quota = existing_quota.eq("user_id", user_id)
-        existing_quota = existing_quota.execute()
+        def _existing_quota(sb):
+            query = sb.table("usage_quotas").select("*")
+            if contract_type == 'department' and institution_id:
+                query = query.eq("institution_id", institution_id).eq("account_type", tier)
+            else:
+                query = query.eq("user_id", user_id)
+            return query.execute()
+        existing_quota = await _supabase_call("select:usage_quotas", _existing_quota)
         
         if existing_quota.data and len(existing_quota.data) > 0:
             # Update existing quota
-            quota_result = supabase_client.table("usage_quotas").update(quota_data).eq("id", existing_quota.data[0]['id']).execute()
+            quota_id = existing_quota.data[0]['id']
+            quota_result = await _supabase_call("update:usage_quotas", lambda sb: sb.table("usage_quotas").update(quota_data).eq("id", quota_id).execute())
         else:
             # Create new quota
-            quota_result = supabase_client.table("usage_quotas").insert(quota_data).execute()
+            quota_result = await _supabase_call("insert:usage_quotas", lambda sb: sb.table("usage_quotas").insert(quota_data).execute())
         
         return JSONResponse(status_code=200, content={
             "subscription": subscription_result.data[0],
@@ -1197,11 +2991,11 @@ async def upgrade_subscription(request: Request):
         if not supabase_url or not supabase_service_key:
             return JSONResponse(status_code=503, content={"detail": "Supabase configuration missing"})
         
-        from supabase import create_client
-        supabase_client = create_client(supabase_url, supabase_service_key)
-        
         # Get current subscription
-        current_sub = supabase_client.table("subscriptions").select("*").eq("user_id", user_id).eq("status", "active").limit(1).execute()
+        current_sub = await _supabase_call(
+            "select:subscriptions",
+            lambda sb: sb.table("subscriptions").select("*").eq("user_id", user_id).eq("status", "active").limit(1).execute(),
+        )
         
         if not current_sub.data or len(current_sub.data) == 0:
             return JSONResponse(status_code=404, content={"detail": "No active subscription found"})
@@ -1235,14 +3029,17 @@ async def get_current_subscription(request: Request):
         if not supabase_url or not supabase_service_key:
             return JSONResponse(status_code=503, content={"detail": "Supabase configuration missing"})
         
-        from supabase import create_client
-        supabase_client = create_client(supabase_url, supabase_service_key)
-        
-        # Get subscription
-        subscription = supabase_client.table("subscriptions").select("*").eq("user_id", user_id).eq("status", "active").limit(1).execute()
-        
-        # Get quota
-        quota = supabase_client.table("usage_quotas").select("*").eq("user_id", user_id).eq("is_active", True).limit(1).execute()
+        # Get subscription and quota concurrently
+        subscription, quota = await asyncio.gather(
+            _supabase_call(
+                "select:subscriptions",
+                lambda sb: sb.table("subscriptions").select("*").eq("user_id", user_id).eq("status", "active").limit(1).execute(),
+            ),
+            _supabase_call(
+                "select:usage_quotas",
+                lambda sb: sb.table("usage_quotas").select("*").eq("user_id", user_id).eq("is_active", True).limit(1).execute(),
+            ),
+        )
         
         return JSONResponse(status_code=200, content={
             "subscription": subscription.data[0] if subscription.data and len(subscription.data) > 0 else None,
@@ -1427,8 +3224,299 @@ async def confirm_upload(request: Request):
         )
 
 
+# ----- Static pages: precompressed gzip/brotli variants, strong ETags and content-hashed /assets URLs -----
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_COMPRESSIBLE_TYPES = ("application/javascript", "application/json", "image/svg+xml")
+_ASSET_REF = re.compile(rb"(?<=[\"'(/])assets/([A-Za-z0-9_.\-]+)")
+_CONFIG_SCRIPT = re.compile(rb'<script src="/?config\.js"></script>')
+_config_js_entry = None  # ((SUPABASE_URL, SUPABASE_ANON_KEY, QWEN_API_URL), _StaticFile)
+_static_files = {}  # absolute path -> _StaticFile
+_static_index = None  # URL path -> Path for files the catch-all may serve (see _build_static_index)
+_static_index_stats = {"hits": 0, "misses": 0, "refreshes": 0, "built_at": None}
+_static_poller = None
+_static_lock = threading.Lock()
+_asset_names = None  # (name -> hashed name, hashed name -> name)
+_static_stats = {"responses": 0, "not_modified": 0, "bytes_sent": 0, "bytes_uncompressed": 0, "br": 0, "gzip": 0, "identity": 0}
+
+
+class _StaticFile:
+    """
+    One file held in memory with its precompressed variants. HTML has its /assets references content-hashed and
+    (STATIC_INLINE_CONFIG) the config.js script inlined. Generated content such as /config.js passes body and mtime
+    instead of being read from path.
+    """
+
+    def __init__(self, path: Path, brotli_quality: int, body: bytes = None, mtime: float = None):
+        self.config_etag = None
+        if body is None:
+            mtime = path.stat().st_mtime
+            body = path.read_bytes()
+            if path.suffix == ".html":
+                body = self._rewrite_html(body)
+        self.path = path
+        self.mtime = mtime
+        self.brotli_quality = brotli_quality
+        self.media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        if self.media_type.startswith("text/"):
+            self.media_type += "; charset=utf-8"
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.last_modified = formatdate(mtime, usegmt=True)
+        self.variants = {"identity": body}
+        compressible = self.media_type.startswith("text/") or self.media_type.startswith(_COMPRESSIBLE_TYPES)
+        if compressible and len(body) > 1024:
+            # Keep a variant only when it is actually smaller
+            gz = gzip.compress(body, 9, mtime=0)
+            if len(gz) < len(body):
+                self.variants["gzip"] = gz
+            if brotli is not None:
+                br = brotli.compress(body, quality=brotli_quality)
+                if len(br) < len(body):
+                    self.variants["br"] = br
+
+    def _rewrite_html(self, body: bytes) -> bytes:
+        if _get_env("STATIC_HASHED_ASSETS", "1").lower() in ("1", "true", "yes"):
+            hashed = _asset_name_map()[0]
+            body = _ASSET_REF.sub(lambda m: b"assets/" + hashed.get(m.group(1).decode(), m.group(1).decode()).encode(), body)
+        if _get_env("STATIC_INLINE_CONFIG", "1").lower() in ("1", "true", "yes") and _CONFIG_SCRIPT.search(body):
+            config = _config_js()
+            # "</" inside a string would end the inline script early
+            inline = b"<script>\n" + config.variants["identity"].replace(b"</", b"<\\/") + b"</script>"
+            body = _CONFIG_SCRIPT.sub(lambda m: inline, body, count=1)
+            self.config_etag = config.etag
+        return body
+
+
+def _asset_name_map():
+    """{name: "stem.<hash>.ext"} and its inverse for every file in assets/ (computed once per process)."""
+    global _asset_names
+    if _asset_names is None:
+        hashed = {}
+        assets_dir = _this_dir / "assets"
+        if assets_dir.is_dir():
+            for path in assets_dir.iterdir():
+                if path.is_file():
+                    digest = hashlib.sha256(path.read_bytes()).hexdigest()[:10]
+                    hashed[path.name] = f"{path.stem}.{digest}{path.suffix}"
+        _asset_names = (hashed, {v: k for k, v in hashed.items()})
+    return _asset_names
+
+
+def _static_file(path: Path, fast: bool = True):
+    """
+    The in-memory copy of path, or None if it isn't a file. Cached copies are returned without touching the
+    filesystem; _refresh_static_index drops them when the file changes, and pages with an inlined config.js are
+    rebuilt if the config changed. Request-path builds use brotli quality 5 (a few ms) and the startup warm-up
+    replaces them with STATIC_BROTLI_QUALITY (default 11).
+    """
+    cached = _static_files.get(str(path))
+    if cached is not None and (cached.config_etag is None or cached.config_etag == _config_js().etag):
+        return cached
+    if not path.is_file():
+        return None
+    quality = _env_int("STATIC_BROTLI_QUALITY", 11)
+    entry = _StaticFile(path, min(quality, 5) if fast else quality)
+    with _static_lock:
+        _static_files[str(path)] = entry
+    return entry
+
+
+def _build_static_index() -> dict:
+    """
+    URL path -> file for everything the SPA catch-all may serve: top-level HTML pages, assets/* and the
+    llm_training/*.md guides linked from the app (/config.js has its own route). Source, env and data files are
+    never servable.
+    """
+    index = {path.name: path for path in _this_dir.glob("*.html")}
+    for path in (_this_dir / "assets").glob("*"):
+        if path.is_file():
+            index[f"assets/{path.name}"] = path
+    for path in (_this_dir / "llm_training").glob("*.md"):
+        index[f"llm_training/{path.name}"] = path
+    return index
+
+
+def _static_index_map() -> dict:
+    global _static_index
+    if _static_index is None:
+        _static_index = _build_static_index()
+        _static_index_stats["built_at"] = time.time()
+    return _static_index
+
+
+def _refresh_static_index(reason: str = "manual"):
+    """
+    Re-scan servable files (on SIGHUP and every STATIC_INDEX_POLL_SECONDS) and drop cached copies whose mtime
+    changed or that disappeared. A changed asset changes its hashed URL, so the HTML pages are rebuilt too.
+    """
+    global _static_index, _asset_names
+    index = _build_static_index()
+    stale = []
+    for key, entry in list(_static_files.items()):
+        try:
+            if Path(key).stat().st_mtime != entry.mtime:
+                stale.append(key)
+        except OSError:
+            stale.append(key)
+    assets_changed = _asset_names is not None and set(_asset_names[0]) != {k[len("assets/"):] for k in index if k.startswith("assets/")}
+    assets_changed = assets_changed or any(Path(key).parent == _this_dir / "assets" for key in stale)
+    with _static_lock:
+        if assets_changed:
+            _asset_names = None
+            stale.extend(key for key in _static_files if key.endswith(".html"))
+        for key in set(stale):
+            _static_files.pop(key, None)
+        _static_index = index
+    _static_index_stats["refreshes"] += 1
+    _static_index_stats["built_at"] = time.time()
+    if stale:
+        print(f"[STATIC] {reason}: {len(set(stale))} changed files will be reloaded")
+        _warm_static_files()
+
+
+def _poll_static_index():
+    interval = _env_float("STATIC_INDEX_POLL_SECONDS", 30)
+    while interval > 0:
+        time.sleep(interval)
+        try:
+            _refresh_static_index("mtime poll")
+        except Exception as e:
+            print(f"[STATIC] Index refresh failed: {e}")
+
+
+def _config_js() -> _StaticFile:
+    """The generated /config.js, built once and rebuilt only if the environment values it exposes change."""
+    global _config_js_entry
+    values = (_get_env("SUPABASE_URL"), _get_env("SUPABASE_ANON_KEY"), _get_env("QWEN_API_URL"))
+    if _config_js_entry is None or _config_js_entry[0] != values:
+        supabase_url, supabase_anon_key, qwen_api_url = values
+        js_content = f"""// Auto-generated config from environment variables
+window.SUPABASE_URL = {repr(supabase_url)};
+window.SUPABASE_ANON_KEY = {repr(supabase_anon_key)};
+window.QWEN_API_URL = {repr(qwen_api_url)};  // Used when on localhost; on production, app uses same-origin /qwen-api
+"""
+        _config_js_entry = (values, _StaticFile(Path("config.js"), 5, body=js_content.encode("utf-8"), mtime=time.time()))
+    return _config_js_entry[1]
+
+
+def _warm_static_files():
+    """
+    Build /config.js and load every indexed file into memory, HTML at full brotli quality (index.html takes a few
+    seconds), so run it off the event loop.
+    """
+    t0 = time.time()
+    _config_js()
+    built = 0
+    quality = _env_int("STATIC_BROTLI_QUALITY", 11)
+    for path in list(_static_index_map().values()):
+        cached = _static_files.get(str(path))
+        if cached is not None and cached.brotli_quality >= quality:
+            continue
+        try:
+            entry = _StaticFile(path, quality)
+        except OSError as e:
+            print(f"[STATIC] Could not load {path.name}: {e}")
+            continue
+        with _static_lock:
+            _static_files[str(path)] = entry
+        built += 1
+    print(f"[STATIC] Loaded {built} files in {time.time() - t0:.1f}s (brotli {'on' if brotli else 'off: package not installed'})")
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def _not_modified(request: Request, entry: _StaticFile) -> bool:
+    """If-None-Match (any encoding of this content matches) takes precedence over If-Modified-Since."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {t.strip().removeprefix("W/").strip('"').split("-")[0] for t in if_none_match.split(",")}
+        return "*" in tags or entry.etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(entry.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _static_response(request: Request, path: Path, cache_control: str = "no-cache"):
+    """
+    Serve path from memory, picking br > gzip > identity from Accept-Encoding, with a strong ETag per encoding
+    and 304 on revalidation. HTML keeps "no-cache" (always revalidate, usually a 304); hashed assets are immutable.
+    Returns None if path is not a file so callers keep their own 404/500 responses.
+    """
+    entry = _static_file(path)
+    if entry is None:
+        return None
+    return _static_entry_response(request, entry, cache_control)
+
+
+def _static_entry_response(request: Request, entry: _StaticFile, cache_control: str = "no-cache") -> Response:
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    encoding = next((e for e in ("br", "gzip") if e in entry.variants and e in accepted), "identity")
+    etag = entry.etag if encoding == "identity" else f"{entry.etag}-{encoding}"
+    headers = {"ETag": f'"{etag}"', "Last-Modified": entry.last_modified, "Cache-Control": cache_control}
+    if len(entry.variants) > 1:
+        headers["Vary"] = "Accept-Encoding"
+    _static_stats["responses"] += 1
+    if _not_modified(request, entry):
+        _static_stats["not_modified"] += 1
+        _static_stats["bytes_uncompressed"] += len(entry.variants["identity"])
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    body = entry.variants[encoding]
+    _static_stats[encoding] += 1
+    _static_stats["bytes_sent"] += len(body)
+    _static_stats["bytes_uncompressed"] += len(entry.variants["identity"])
+    return Response(content=body, media_type=entry.media_type, headers=headers)
+
+
+def _static_snapshot() -> dict:
+    return {
+        **_static_stats,
+        "bytes_saved": _static_stats["bytes_uncompressed"] - _static_stats["bytes_sent"],
+        "files": len(_static_files),
+        "memory_bytes": sum(len(v) for entry in list(_static_files.values()) for v in entry.variants.values()),
+        "brotli": brotli is not None,
+        "index": {**_static_index_stats, "entries": len(_static_index or {})},
+    }
+
+
+@app.get("/assets/{name}")
+def serve_asset(name: str, request: Request):
+    """
+    Files under assets/. Content-hashed names (logo.<hash>.png, as rewritten into the HTML pages) are cached for
+    a year as immutable; plain names are served with revalidation so existing links keep working.
+    """
+    hashed, original = _asset_name_map()
+    if name in original:
+        response = _static_response(request, _this_dir / "assets" / original[name], "public, max-age=31536000, immutable")
+    else:
+        path = _static_index_map().get(f"assets/{name}")
+        response = _static_response(request, path) if path is not None else None
+    return response or Response(status_code=404)
+
+
 @app.get("/")
-def serve_root():
+def serve_root(request: Request):
     """Serve landing.html for new users finding SpeechGradebook via search."""
     path = _this_dir / "landing.html"
     if not path.exists():
@@ -1440,36 +3528,20 @@ def serve_root():
                 content=f"Error: Neither landing.html nor index.html found in {_this_dir}",
                 media_type="text/plain"
             )
-    return FileResponse(
-        path,
-        media_type="text/html",
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        },
-    )
+    return _static_response(request, path)
 
 
 @app.get("/login")
-def serve_login():
+def serve_login(request: Request):
     """Serve index.html (login page) for returning users."""
     path = _this_dir / "index.html"
     if not path.exists():
         return Response(status_code=404)
-    return FileResponse(
-        path,
-        media_type="text/html",
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        },
-    )
+    return _static_response(request, path)
 
 @app.get("/app")
 @app.get("/index.html")
-def serve_index():
+def serve_index(request: Request):
     """Serve index.html (app) for authenticated users."""
     path = _this_dir / "index.html"
     if not path.exists():
@@ -1478,125 +3550,69 @@ def serve_index():
             content=f"Error: index.html not found in {_this_dir}",
             media_type="text/plain"
         )
-    return FileResponse(
-        path,
-        media_type="text/html",
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        },
-    )
+    return _static_response(request, path)
 
 
 # Explicit routes for common SPA paths (these will be matched before the catch-all)
 @app.get("/dashboard")
-def serve_dashboard():
+def serve_dashboard(request: Request):
     """Serve index.html for dashboard route."""
     path = _this_dir / "index.html"
     if not path.exists():
         return Response(status_code=404)
-    return FileResponse(
-        path,
-        media_type="text/html",
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        },
-    )
+    return _static_response(request, path)
 
 @app.get("/evaluate")
 @app.get("/settings")
 @app.get("/help")
 @app.get("/analytics")
-def serve_spa_page():
+def serve_spa_page(request: Request):
     """Serve index.html for common SPA routes."""
     path = _this_dir / "index.html"
     if not path.exists():
         return Response(status_code=404)
-    return FileResponse(
-        path,
-        media_type="text/html",
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        },
-    )
+    return _static_response(request, path)
 
 
 @app.get("/landing")
 @app.get("/learn-more")
 @app.get("/landing.html")
-def serve_landing():
+def serve_landing(request: Request):
     """Serve landing.html for new users to learn about the product."""
     path = _this_dir / "landing.html"
     if not path.exists():
         return Response(status_code=404)
-    return FileResponse(
-        path,
-        media_type="text/html",
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        },
-    )
+    return _static_response(request, path)
 
 
 @app.get("/contact")
 @app.get("/contact.html")
-def serve_contact():
+def serve_contact(request: Request):
     """Serve contact.html for contact form."""
     path = _this_dir / "contact.html"
     if not path.exists():
         return Response(status_code=404)
-    return FileResponse(
-        path,
-        media_type="text/html",
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        },
-    )
+    return _static_response(request, path)
 
 
 @app.get("/accessibility")
 @app.get("/accessibility.html")
-def serve_accessibility():
+def serve_accessibility(request: Request):
     """Serve accessibility.html for accessibility statement."""
     path = _this_dir / "accessibility.html"
     if not path.exists():
         return Response(status_code=404)
-    return FileResponse(
-        path,
-        media_type="text/html",
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        },
-    )
+    return _static_response(request, path)
 
 
 @app.get("/help")
 @app.get("/help.html")
-def serve_help():
+def serve_help(request: Request):
     """Serve help.html for help center documentation."""
     path = _this_dir / "help.html"
     if not path.exists():
         return Response(status_code=404)
-    return FileResponse(
-        path,
-        media_type="text/html",
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        },
-    )
+    return _static_response(request, path)
 
 
 @app.post("/api/contact")
@@ -1722,10 +3738,10 @@ This message was sent from the SpeechGradebook contact form.
 # This allows paths like /courses/123 to serve index.html for client-side routing
 # Note: FastAPI will match explicit routes (like @app.get("/")) before this catch-all
 @app.get("/{full_path:path}")
-def serve_spa_routes(full_path: str):
+def serve_spa_routes(full_path: str, request: Request):
     """
     Serve index.html for all routes to support client-side routing.
-    First checks if the requested path is an actual file, if so serves it.
+    First checks if the requested path is a servable file (see _build_static_index), if so serves it.
     Otherwise serves index.html for SPA routing.
     """
     # Don't handle API routes
@@ -1741,21 +3757,15 @@ def serve_spa_routes(full_path: str):
         landing_path = _this_dir / "landing.html"
         if not landing_path.exists():
             return Response(status_code=404)
-        return FileResponse(
-            landing_path,
-            media_type="text/html",
-            headers={
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-                "Pragma": "no-cache",
-                "Expires": "0",
-            },
-        )
+        return _static_response(request, landing_path)
     
-    # Check if the requested path is an actual file that exists
-    file_path = _this_dir / normalized_path
-    if file_path.exists() and file_path.is_file():
-        # Serve the actual file
-        return FileResponse(file_path)
+    # Servable files are looked up in the in-memory index (no filesystem access per request); anything else on
+    # disk - app.py, .env*, the job store - is never served
+    file_path = _static_index_map().get(normalized_path)
+    if file_path is not None:
+        _static_index_stats["hits"] += 1
+        return _static_response(request, file_path) or Response(status_code=404)
+    _static_index_stats["misses"] += 1
     
     # Don't handle files with extensions (they should have been caught above)
     # But allow .html files to be served
@@ -1764,18 +3774,7 @@ def serve_spa_routes(full_path: str):
         return Response(status_code=404)
     
     # Serve index.html for all other routes (client-side routing)
-    index_path = _this_dir / "index.html"
-    if not index_path.exists():
-        return Response(status_code=404)
-    return FileResponse(
-        index_path,
-        media_type="text/html",
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        },
-    )
+    return _static_response(request, _this_dir / "index.html") or Response(status_code=404)
 
 
 # Static files (assets, etc.) - mounted after catch-all for specific paths
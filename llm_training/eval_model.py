@@ -17,6 +17,11 @@ import torch
 from peft import PeftModel
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
+try:
+    from llm_training import json_extract
+except ImportError:
+    import json_extract
+
 
 def parse_args():
     p = argparse.ArgumentParser(description="Evaluate fine-tuned Mistral 7B on holdout set")
@@ -41,29 +46,8 @@ def load_jsonl(path: str):
 
 
 def extract_json_from_assistant(text: str):
-    """Try to extract a JSON object from model output (after [/INST] or at end)."""
-    # Common pattern: model may output markdown or raw JSON
-    text = text.strip()
-    # Find last { ... } block
-    start = text.rfind("{")
-    if start == -1:
-        return None
-    depth = 0
-    end = -1
-    for i in range(start, len(text)):
-        if text[i] == "{":
-            depth += 1
-        elif text[i] == "}":
-            depth -= 1
-            if depth == 0:
-                end = i + 1
-                break
-    if end == -1:
-        return None
-    try:
-        return json.loads(text[start:end])
-    except json.JSONDecodeError:
-        return None
+    """Try to extract a JSON object from model output: the last top-level one, fenced or truncated (see json_extract)."""
+    return json_extract.last_object(text)
 
 
 def main():
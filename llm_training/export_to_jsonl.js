@@ -38,6 +38,11 @@ function formatRubricStructure(rubricStructure) {
   return lines.length ? lines.join('\n') : null;
 }
 
+/**
+ * User turn: rubric and structure, then "Transcript:" and the per-speech parts. serve_model.build_messages uses the
+ * same order (its inference-only reference examples and textbook excerpts go just before "Transcript:"), so the
+ * rubric-dependent text stays a shared prefix; keep the transcript after it here too.
+ */
 function buildUserPrompt(transcript, rubricName, markers, videoNotes, rubricStructure) {
   let user = `Rubric: ${rubricName}\n`;
   const structureText = formatRubricStructure(rubricStructure);
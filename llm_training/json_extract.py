@@ -0,0 +1,209 @@
+"""
+Tolerant extraction of JSON objects from model output, in a single pass over the text.
+
+Usage:
+  found = extract(text, keys=("sections",))
+  found.objects            # every top-level {...} in order, parsed; a truncated last one is repaired
+  found.values["sections"] # first object/array under that key at any depth, even when its enclosing object is broken
+  last_object(text)        # the last top-level object (serve_model / eval_model: the model's answer)
+
+Model output arrives fenced (```json ... ```), wrapped in prose, cut off at max_new_tokens, or with trailing commas,
+and its feedback strings contain braces and escaped quotes. One left-to-right scan tracks strings (jumping to the
+closing quote with str.find), the open-bracket stack and the last point where the text could be closed cleanly, and
+each candidate goes to json.loads once. Repairs: trailing commas are dropped; a truncated object keeps its open
+string value (closed with a quote) or is cut back to its last complete value, then its brackets are closed. Linear
+in the length of the text; rescanning from every "{" was quadratic on long truncated outputs.
+
+Stdlib only, shared by qwen_serve.py, serve_model.py and eval_model.py.
+"""
+
+import json
+import re
+
+_CLOSE = {"{": "}", "[": "]"}
+_DELIMITERS = frozenset(',:{}[]" \t\r\n')
+_PARTIAL_ESCAPE = re.compile(r"(\\+)(u[0-9a-fA-F]{0,3})?$")
+
+
+class _Span:
+    """A value's extent in the text; end is None when the text stopped inside it (cut + suffix repair it)."""
+
+    __slots__ = ("start", "depth", "end", "cut", "suffix")
+
+    def __init__(self, start: int, depth: int):
+        self.start = start
+        self.depth = depth  # brackets open outside this value
+        self.end = self.cut = self.suffix = None
+
+
+class Extracted:
+    """Result of extract(): parsed top-level objects and the watched keys' values."""
+
+    __slots__ = ("objects", "values")
+
+    def __init__(self, objects: list, values: dict):
+        self.objects = objects
+        self.values = values
+
+
+def _load(text: str, span: _Span, drops: list):
+    """json.loads the span without its dangling commas (plus the truncation repair); None if it still isn't JSON."""
+    end = span.end if span.end is not None else span.cut
+    pieces, pos = [], span.start
+    for i in drops:
+        if span.start <= i < end:
+            pieces.append(text[pos:i])
+            pos = i + 1
+    pieces.append(text[pos:end])
+    if span.end is None:
+        pieces.append(span.suffix)
+    try:
+        return json.loads("".join(pieces))
+    except ValueError:
+        return None
+
+
+def _string_end(text: str, start: int) -> int:
+    """Index of the quote closing the string opened at start, or -1 if the text ends first."""
+    j = start + 1
+    while True:
+        j = text.find('"', j)
+        if j == -1:
+            return -1
+        k = j - 1
+        while text[k] == "\\":
+            k -= 1
+        if (j - k) % 2:  # even number of backslashes before the quote: it's not escaped
+            return j
+        j += 1
+
+
+def _scan(text: str, keys=()):
+    """Walk text once; returns ([(span, drops)] for top-level objects, {key: (span, drops)})."""
+    objects, values = [], {}
+    stack = []  # [opener, state]; state: "key" / "colon" / "value" / "after" (objects), "value" / "after" (arrays)
+    closers = ""  # what would close the stack right now, innermost first
+    watched = []  # spans of watched values still open
+    drops = []  # dangling commas in the current top-level object
+    current = None
+    last_key = None
+    safe = safe_closers = None  # last index the text could be cut at and closed with safe_closers
+    prev = None  # last structural character
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if not stack:
+            if c == "{":
+                current, drops = _Span(i, 0), []
+                stack.append(["{", "key"])
+                closers = "}"
+                safe, safe_closers, prev = i + 1, closers, "{"
+            i += 1
+            continue
+        if c in " \t\r\n":
+            i += 1
+            continue
+        top = stack[-1]
+        if c == '"':
+            j = _string_end(text, i)
+            is_key = top[0] == "{" and top[1] == "key"
+            if j == -1:
+                if not is_key:
+                    # Keep the partial string: drop a half-written escape (\ or \u12) and close it
+                    cut = n
+                    m = _PARTIAL_ESCAPE.search(text, i + 1)
+                    if m and len(m.group(1)) % 2:
+                        cut = m.end(1) - 1
+                    safe, safe_closers = cut, '"' + closers
+                break
+            if is_key:
+                last_key = text[i + 1:j] if keys else None
+                top[1] = "colon"
+            else:
+                top[1] = "after"
+                safe, safe_closers = j + 1, closers
+            prev = '"'
+            i = j + 1
+            continue
+        if c in "{[":
+            if top[1] != "value":
+                # Not JSON after all (e.g. a "{" in prose before the real object): start over from this bracket
+                stack, current = [], None
+                watched = _abandon(watched, values)
+                continue
+            if top[0] == "{" and last_key in keys and last_key not in values:
+                span = _Span(i, len(stack))
+                values[last_key] = (span, drops)
+                watched.append((last_key, span))
+            stack.append([c, "key" if c == "{" else "value"])
+            closers = _CLOSE[c] + closers
+            safe, safe_closers, prev = i + 1, closers, c
+        elif c in "}]":
+            if top[0] != ("{" if c == "}" else "["):
+                stack, current = [], None
+                watched = _abandon(watched, values)
+                i += 1
+                continue
+            if prev == ",":
+                drops.append(comma)
+            stack.pop()
+            closers = closers[1:]
+            while watched and watched[-1][1].depth == len(stack):
+                watched.pop()[1].end = i + 1
+            if not stack:
+                current.end = i + 1
+                objects.append((current, drops))
+                current = None
+            else:
+                stack[-1][1] = "after"
+                safe, safe_closers = i + 1, closers
+            prev = c
+        elif c == ":":
+            top[1] = "value"
+            prev = c
+        elif c == ",":
+            top[1] = "key" if top[0] == "{" else "value"
+            comma, prev = i, c
+        else:
+            # A number / true / false / null (or stray text, which json.loads will reject)
+            j = i + 1
+            while j < n and text[j] not in _DELIMITERS:
+                j += 1
+            if j == n:
+                break  # may be cut mid-number: the last safe point is before it
+            top[1] = "after"
+            safe, safe_closers, prev = j, closers, "0"
+            i = j
+            continue
+        i += 1
+    if stack and current is not None:
+        for span in [current] + [span for _, span in watched]:
+            span.cut = safe
+            span.suffix = safe_closers[: len(safe_closers) - span.depth]  # only the brackets opened inside it
+        objects.append((current, drops))
+    return objects, values
+
+
+def _abandon(watched: list, values: dict) -> list:
+    """Forget watched values inside an object that turned out not to be JSON, so a later one can be used."""
+    for key, _ in watched:
+        values.pop(key, None)
+    return []
+
+
+def extract(text: str, keys=()) -> Extracted:
+    """Parse every top-level object in text (repairing a truncated last one) and the first value under each of keys."""
+    objects, values = _scan(text or "", tuple(keys))
+    parsed = [obj for obj in (_load(text, span, drops) for span, drops in objects) if isinstance(obj, dict)]
+    found = {}
+    for key, (span, drops) in values.items():
+        value = _load(text, span, drops)
+        if value is not None:
+            found[key] = value
+    return Extracted(parsed, found)
+
+
+def last_object(text: str):
+    """The last top-level JSON object in text (repaired if truncated), or None."""
+    objects = extract(text).objects
+    return objects[-1] if objects else None
@@ -0,0 +1,467 @@
+"""
+JSON-schema-constrained decoding for Qwen's structured outputs (evaluate_video scores, extract_rubric).
+
+Usage:
+  grammar = Grammar(schema)                               # compile once per schema (cheap; reuse it across requests)
+  processor = JSONLogitsProcessor(grammar, tokenizer)     # one per generate() call
+  model.generate(..., logits_processor=LogitsProcessorList([processor]))
+  processor.complete                                      # True once the top-level object closed
+
+A character-level pushdown automaton tracks where the text generated so far sits in the schema; before each step
+the processor masks every token whose text can't extend that prefix, so the model can only write JSON the schema
+accepts: no markdown fences, no prose before or after, no keys out of order. Once the object is complete only EOS
+is allowed, so generation ends there instead of running on to max_new_tokens.
+
+Supported schema subset (what the rubric schemas need):
+  object  - "properties" (all required, emitted in the given order) or free-form "additionalProperties" (keys are
+            strings, values the given schema)
+  array   - "items" and/or "prefixItems" (fixed leading items; prefixItems alone means exactly that many),
+            "minItems", "maxItems"
+  string  - "maxLength", or "enum" of strings
+  number  - "number"/"integer", "minimum" >= 0 forbids a sign; at most 8 characters
+  "const" - any JSON value, emitted verbatim
+Output is compact: no whitespace outside strings.
+
+Allowed-token sets are computed once per automaton state and kept on the Grammar, so a batch of evaluations that
+share a rubric (and so a schema) walks the vocabulary for each state only once.
+
+Unconstrained generations can still stop at the end of the JSON: JSONObjectEnd is a stopping criterion that ends
+each row as soon as its first top-level object closes (ObjectScanner counts braces outside strings, honouring
+escapes), instead of letting the model run on with prose the parsers throw away. EarlyStopLedger turns that into
+tokens and GPU seconds saved per request.
+"""
+
+import json
+import re
+import threading
+
+try:
+    from transformers import LogitsProcessor, StoppingCriteria
+except ImportError:  # the automaton itself (Grammar.accepts / advance) needs only the stdlib
+    LogitsProcessor = StoppingCriteria = object
+
+_NUMBER_PREFIX = re.compile(r"-?(?:(?:0|[1-9][0-9]*)(?:\.[0-9]*)?)?")
+_NUMBER = re.compile(r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?")
+_INTEGER_PREFIX = re.compile(r"-?(?:0|[1-9][0-9]*)?")
+_INTEGER = re.compile(r"-?(?:0|[1-9][0-9]*)")
+_DIGITS = re.compile(r"[1-9]")
+_MAX_NUMBER_CHARS = 8
+_ESCAPES = '"\\/bfnrt'
+_HEX = "0123456789abcdefABCDEF"
+_STRUCTURAL = '{}[],:"-.0123456789' + _ESCAPES + "u" + _HEX
+MAX_CACHED_STATES = 50000
+
+
+class Grammar:
+    """A compiled schema: nodes plus the per-state allowed-token cache shared by every processor using it."""
+
+    def __init__(self, schema: dict):
+        self.nodes = []
+        self.literal_chars = set(_STRUCTURAL)
+        self.root = self._compile(schema)
+        self._key_node = self._add(("str", 64))
+        self._allowed = {}  # (vocab id, state key) -> (token ids, plain-token length limit or None)
+        self._lock = threading.Lock()
+
+    # ----- Compilation: schema -> node tuples; frames refer to nodes by index so states stay small and hashable -----
+    def _add(self, node) -> int:
+        self.nodes.append(node)
+        return len(self.nodes) - 1
+
+    def _literal(self, options) -> int:
+        options = tuple(options)
+        for o in options:
+            self.literal_chars.update(o)
+        return self._add(("lit", options))
+
+    def _compile(self, schema) -> int:
+        if "const" in schema:
+            return self._literal([json.dumps(schema["const"], ensure_ascii=False, separators=(",", ":"))])
+        if "enum" in schema:
+            if not schema["enum"] or not all(isinstance(v, str) for v in schema["enum"]):
+                raise ValueError("enum must be a non-empty list of strings")
+            return self._literal(dict.fromkeys(json.dumps(v, ensure_ascii=False) for v in schema["enum"]))
+        kind = schema.get("type")
+        if kind == "object":
+            if "properties" in schema:
+                props = []
+                for i, (key, sub) in enumerate(schema["properties"].items()):
+                    prefix = ("," if i else "") + json.dumps(key, ensure_ascii=False) + ":"
+                    self.literal_chars.update(prefix)
+                    props.append((prefix, self._compile(sub)))
+                return self._add(("obj", tuple(props)))
+            return self._add(("dict", self._compile(schema.get("additionalProperties") or {"type": "string"})))
+        if kind == "array":
+            prefix = tuple(self._compile(s) for s in schema.get("prefixItems", ()))
+            items = self._compile(schema["items"]) if "items" in schema else None
+            low = max(schema.get("minItems", 0), len(prefix))
+            high = len(prefix) if items is None else schema.get("maxItems", float("inf"))
+            return self._add(("arr", prefix, items, low, high))
+        if kind == "string":
+            return self._add(("str", schema.get("maxLength", 10 ** 9)))
+        if kind in ("number", "integer"):
+            return self._add(("num", kind == "integer", schema.get("minimum", -1) >= 0))
+        raise ValueError(f"unsupported schema: {schema!r}")
+
+    # ----- The automaton: a state is a tuple of frames (a stack); () means the document is complete -----
+    @property
+    def initial(self) -> tuple:
+        return (("v", self.root),)
+
+    def advance(self, state, text: str):
+        """State after appending text, or None if text can't extend the document."""
+        for ch in text:
+            state = self._step(state, ch)
+            if state is None:
+                return None
+        return state
+
+    def accepts(self, text: str) -> bool:
+        """True when text is one complete document for this schema (the same check generate() is held to)."""
+        return self.advance(self.initial, text) == ()
+
+    def _step(self, stack, c):
+        while stack:
+            frame, rest = stack[-1], stack[:-1]
+            kind = frame[0]
+            if kind == "v":
+                node = self.nodes[frame[1]]
+                kind = node[0]
+                if kind == "lit":
+                    stack = rest + (("lit", node[1], 0),)
+                    continue
+                if kind == "obj":
+                    return rest + (("o", frame[1], -1),) if c == "{" else None
+                if kind == "dict":
+                    return rest + (("d", frame[1], 0),) if c == "{" else None
+                if kind == "arr":
+                    return rest + (("a", frame[1], 0),) if c == "[" else None
+                if kind == "str":
+                    return rest + (("s", node[1], 0),) if c == '"' else None
+                if c == "-" and node[2]:
+                    return None
+                return rest + (("n", frame[1], c),) if self._number_prefix(node, c) else None
+            if kind == "lit":
+                pos = frame[2]
+                alive = tuple(o for o in frame[1] if o[pos] == c)
+                if not alive:
+                    return None
+                # JSON-encoded options never prefix one another, so a finished option is the only one left
+                if any(len(o) == pos + 1 for o in alive):
+                    return rest
+                return rest + (("lit", alive, pos + 1),)
+            if kind == "s":
+                remaining, esc = frame[1], frame[2]
+                if esc == 0:
+                    if c == '"':
+                        return rest
+                    if ord(c) < 0x20 or remaining <= 0:
+                        return None
+                    return rest + (("s", remaining - 1, -1 if c == "\\" else 0),)
+                if esc == -1:
+                    if c == "u":
+                        return rest + (("s", remaining, 4),)
+                    return rest + (("s", remaining, 0),) if c in _ESCAPES else None
+                if c not in _HEX:
+                    return None
+                return rest + (("s", remaining, esc - 1 if esc > 1 else 0),)
+            if kind == "n":
+                node = self.nodes[frame[1]]
+                text = frame[2] + c
+                if len(text) <= _MAX_NUMBER_CHARS and self._number_prefix(node, text):
+                    return rest + (("n", frame[1], text),)
+                if not (_INTEGER if node[1] else _NUMBER).fullmatch(frame[2]):
+                    return None
+                stack = rest  # the number ended; c belongs to the enclosing value
+                continue
+            if kind == "o":
+                props = self.nodes[frame[1]][1]
+                i = frame[2] + 1
+                if i == len(props):
+                    return rest if c == "}" else None
+                prefix, child = props[i]
+                stack = rest + (("o", frame[1], i), ("v", child), ("lit", (prefix,), 0))
+                continue
+            if kind == "a":
+                _, prefix, items, low, high = self.nodes[frame[1]]
+                count = frame[2]
+                if c == "]":
+                    return rest if count >= low else None
+                if count >= high:
+                    return None
+                child = prefix[count] if count < len(prefix) else items
+                if count == 0:
+                    stack = rest + (("a", frame[1], 1), ("v", child))
+                    continue
+                return rest + (("a", frame[1], count + 1), ("v", child)) if c == "," else None
+            if kind == "d":
+                count = frame[2]
+                if c == "}":
+                    return rest
+                child = self.nodes[frame[1]][1]
+                expand = rest + (("d", frame[1], count + 1), ("v", child), ("lit", (":",), 0), ("v", self._key_node))
+                if count == 0:
+                    stack = expand
+                    continue
+                return expand if c == "," else None
+            return None
+        return None  # complete: nothing may follow the top-level value
+
+    @staticmethod
+    def _number_prefix(node, text: str) -> bool:
+        return bool((_INTEGER_PREFIX if node[1] else _NUMBER_PREFIX).fullmatch(text))
+
+    # ----- Token masks -----
+    def allowed(self, vocab, state):
+        """(token ids, plain limit) allowed after state: plain limit n admits every plain token of <= n characters."""
+        top = state[-1] if state else None
+        open_string = top is not None and top[0] == "s" and top[2] == 0
+        if open_string:
+            limit = min(top[1], vocab.max_len)
+            key = (id(vocab), state[:-1] + (("s", limit, 0),))
+        elif top is not None and top[0] == "n":
+            # Only the shape of a number matters (sign, leading zero, dot, length), not its digits
+            key = (id(vocab), state[:-1] + (("n", top[1], _DIGITS.sub("1", top[2])),))
+        else:
+            key = (id(vocab), state)
+        cached = self._allowed.get(key)
+        if cached is not None:
+            return cached
+        if not state:
+            entry = (list(vocab.eos_ids), None)
+        elif open_string:
+            # Plain tokens only add string characters; only tokens with a quote or backslash need walking
+            ids = [t for t in vocab.special if self.advance(state, vocab.texts[t]) is not None]
+            entry = (ids, limit)
+        else:
+            firsts = [c for c in self.literal_chars if self._step(state, c) is not None]
+            ids = [t for c in firsts for t in vocab.by_first.get(c, ()) if self.advance(state, vocab.texts[t]) is not None]
+            entry = (ids, None)
+        with self._lock:
+            if len(self._allowed) >= MAX_CACHED_STATES:
+                self._allowed.clear()
+            self._allowed[key] = entry
+        return entry
+
+
+class TokenVocab:
+    """Each token's text, grouped for mask building. Built once per tokenizer (see vocab_for)."""
+
+    def __init__(self, tokenizer):
+        size = len(tokenizer)
+        texts = tokenizer.batch_decode([[i] for i in range(size)], skip_special_tokens=False,
+                                       clean_up_tokenization_spaces=False)
+        excluded = set(getattr(tokenizer, "all_special_ids", None) or ())
+        eos = tokenizer.eos_token_id
+        self.eos_ids = tuple(sorted({eos} if isinstance(eos, int) else set(eos or ())))
+        excluded.update(self.eos_ids)
+        self.texts = texts
+        self.size = size
+        self.plain = []  # tokens that are only ordinary string characters
+        self.special = []  # tokens with a quote or backslash (the only ones that can leave or escape inside a string)
+        self.by_first = {}
+        for i, text in enumerate(texts):
+            # Partial UTF-8 sequences decode to U+FFFD alone and can't be checked character by character
+            if i in excluded or not text or "�" in text or any(ord(ch) < 0x20 for ch in text):
+                continue
+            self.by_first.setdefault(text[0], []).append(i)
+            if '"' in text or "\\" in text:
+                self.special.append(i)
+            else:
+                self.plain.append(i)
+        self.max_len = max((len(t) for group in self.by_first.values() for t in map(texts.__getitem__, group)), default=0)
+        self._tensors = {}
+
+    def plain_tensors(self, device):
+        """(bool mask of plain tokens, their lengths) on device, cached."""
+        cached = self._tensors.get(str(device))
+        if cached is None:
+            import torch
+            mask = torch.zeros(self.size, dtype=torch.bool)
+            lengths = torch.zeros(self.size, dtype=torch.int32)
+            mask[self.plain] = True
+            lengths[self.plain] = torch.tensor([len(self.texts[i]) for i in self.plain], dtype=torch.int32)
+            cached = self._tensors[str(device)] = (mask.to(device), lengths.to(device))
+        return cached
+
+
+_vocabs = {}
+_vocabs_lock = threading.Lock()
+
+
+def vocab_for(tokenizer) -> TokenVocab:
+    """The TokenVocab for tokenizer, decoding the vocabulary on first use only."""
+    with _vocabs_lock:
+        entry = _vocabs.get(id(tokenizer))
+        if entry is None or entry[0] is not tokenizer:
+            entry = _vocabs[id(tokenizer)] = (tokenizer, TokenVocab(tokenizer))
+        return entry[1]
+
+
+class JSONLogitsProcessor(LogitsProcessor):
+    """Masks scores so each generated row stays a valid prefix of grammar's schema (then forces EOS)."""
+
+    def __init__(self, grammar: Grammar, tokenizer):
+        self.grammar = grammar
+        self.vocab = vocab_for(tokenizer)
+        self.states = None
+        self.desynced = 0  # rows whose text left the grammar (e.g. a token decoded differently); left unconstrained
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.states) and all(s == () for s in self.states)
+
+    def __call__(self, input_ids, scores):
+        import torch
+        if self.states is None:
+            self.states = [self.grammar.initial] * input_ids.shape[0]
+        else:
+            for row, token in enumerate(input_ids[:, -1].tolist()):
+                state = self.states[row]
+                if state is None or state == ():
+                    continue
+                text = self.vocab.texts[token] if token < self.vocab.size else ""
+                self.states[row] = self.grammar.advance(state, text) if text else None
+                if self.states[row] is None:
+                    self.desynced += 1
+        for row, state in enumerate(self.states):
+            if state is None:
+                continue
+            ids, limit = self.grammar.allowed(self.vocab, state)
+            if not ids and limit is None:
+                continue
+            allowed = torch.zeros(scores.shape[-1], dtype=torch.bool, device=scores.device)
+            if limit is not None:
+                mask, lengths = self.vocab.plain_tensors(scores.device)
+                n = min(self.vocab.size, scores.shape[-1])
+                allowed[:n] = (mask & (lengths <= limit))[:n]
+            if ids:
+                allowed[torch.tensor(ids, device=scores.device)] = True
+            scores[row] = scores[row].masked_fill(~allowed, float("-inf"))
+        return scores
+
+
+# ----- Early stop: end generation when the first top-level JSON object closes -----
+class ObjectScanner:
+    """Incremental brace counter that skips strings (and escaped quotes in them); closed_at is set when depth returns to 0."""
+
+    __slots__ = ("depth", "in_string", "escape", "closed_at")
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.closed_at = None
+
+    def feed(self, text: str, position=None) -> bool:
+        """Scan more text; returns True (and records position) when the outermost object has just closed."""
+        if self.closed_at is not None:
+            return False
+        for ch in text:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == "{":
+                self.depth += 1
+            elif not self.depth:
+                continue  # prose or a fence before the object: its quotes and braces don't count
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "}":
+                self.depth -= 1
+                if not self.depth:
+                    self.closed_at = position
+                    return True
+        return False
+
+
+class JSONObjectEnd(StoppingCriteria):
+    """
+    Stops each row of generate() once its first top-level JSON object has closed. With enabled=False it only
+    watches, so the tokens generated after the close can be measured (see EarlyStopLedger).
+    """
+
+    def __init__(self, tokenizer, enabled: bool = True):
+        self.vocab = vocab_for(tokenizer)
+        self.enabled = enabled
+        self.scanners = None
+        self.steps = 0
+        self.first_step_at = self.last_step_at = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import time
+        import torch
+        now = time.perf_counter()
+        if self.scanners is None:
+            self.scanners = [ObjectScanner() for _ in range(input_ids.shape[0])]
+            self.first_step_at = now
+        self.last_step_at = now
+        self.steps += 1
+        done = []
+        for row, token in enumerate(input_ids[:, -1].tolist()):
+            scanner = self.scanners[row]
+            scanner.feed(self.vocab.texts[token] if token < self.vocab.size else "", self.steps)
+            done.append(self.enabled and scanner.closed_at is not None)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    @property
+    def seconds_per_step(self):
+        """Decode time per generated token (prefill excluded: timed from the first step to the last)."""
+        if self.steps < 2:
+            return None
+        return (self.last_step_at - self.first_step_at) / (self.steps - 1)
+
+    def closed_at(self, row: int = 0):
+        """Tokens generated up to and including the one that closed row's object (None if it never closed)."""
+        return self.scanners[row].closed_at if self.scanners else None
+
+
+class EarlyStopLedger:
+    """
+    Per-server totals for JSONObjectEnd. When stopping is off, the tokens each generation spent after its object
+    closed are recorded; when on, each stopped request is credited with the mean of those observations (or, before
+    there are any, the unused budget max_new_tokens - tokens as an upper bound) at the measured decode step time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "stopped": 0, "observed": 0, "tokens_after_close": 0, "tokens_saved": 0,
+                      "gpu_seconds_saved": 0.0}
+
+    def record(self, criterion: JSONObjectEnd, row: int, tokens: int, max_new_tokens: int, batch_size: int = 1) -> dict:
+        """Account one row of a finished generate(); returns that request's report."""
+        closed_at = criterion.closed_at(row)
+        step = criterion.seconds_per_step
+        report = {"early_stop": criterion.enabled, "closed_at_token": closed_at, "stopped": False}
+        with self._lock:
+            s = self.stats
+            s["requests"] += 1
+            if closed_at is None:
+                return report
+            if not criterion.enabled:
+                s["observed"] += 1
+                s["tokens_after_close"] += tokens - closed_at
+                report["tokens_after_close"] = tokens - closed_at
+                return report
+            budget = max(0, max_new_tokens - tokens)
+            if s["observed"]:
+                saved, basis = min(budget, round(s["tokens_after_close"] / s["observed"])), "observed"
+            else:
+                saved, basis = budget, "upper_bound"
+            # A batch keeps stepping for its other rows, so one row's share of a step is 1/batch_size
+            seconds = round(saved * step / batch_size, 2) if step is not None else None
+            s["stopped"] += 1
+            s["tokens_saved"] += saved
+            s["gpu_seconds_saved"] = round(s["gpu_seconds_saved"] + (seconds or 0.0), 2)
+        report.update(stopped=True, tokens_saved=saved, gpu_seconds_saved=seconds, estimate=basis)
+        return report
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            s = dict(self.stats)
+        s["avg_tokens_after_close"] = round(s["tokens_after_close"] / s["observed"], 1) if s["observed"] else None
+        return s
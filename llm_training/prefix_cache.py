@@ -0,0 +1,167 @@
+"""
+Reuse of the attention keys/values for a prompt prefix that many requests share (KV-cache prefix reuse).
+
+Usage:
+  prefixes = PrefixCache(max_mb=512)
+  timer = FirstTokenTimer()                                   # before anything is prefilled
+  n = common_length(tokenizer(shared_text)["input_ids"], ids) # the leading tokens every request has in common
+  past, mode = prefixes.get(key_for(ids[:n], model_name), lambda: prefill(model, ids[:n]))
+  model.generate(..., past_key_values=fork(past, batch_size), logits_processor=LogitsProcessorList([timer]))
+  prefixes.record_ttft(mode, timer.seconds)
+
+A class's evaluations share a long prompt prefix (system prompt, rubric, point values, reference examples) and only
+differ after it (the transcript, or the video). The prefix is run through the model once and its past-key-values are
+kept on the device in an LRU bounded by bytes; each generate() gets its own copy (generate appends to the cache it
+is given), expanded to the batch, so only the request's own tokens are prefilled. Every row must have the prefix at
+positions 0..n-1, so a batch is padded between the prefix and the rest (pad_after_prefix) instead of on the left;
+position ids come from the attention mask, so the padding in the middle is skipped like left padding is.
+
+Time to first token (from before the prefix lookup to the first logits) is recorded per mode: "reused" (hit),
+"prefilled" (miss: the prefix was computed for this request and kept) and "off" (reuse disabled or not possible),
+so /health shows what reuse is worth.
+"""
+
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from transformers import LogitsProcessor
+except ImportError:
+    LogitsProcessor = object
+
+
+def key_for(ids, model_name: str = "") -> str:
+    """Cache key for a prefix's token ids under a model."""
+    return hashlib.sha256(f"{model_name}\n{','.join(map(str, ids))}".encode("utf-8")).hexdigest()
+
+
+def common_length(a, b) -> int:
+    """Number of leading tokens a and b have in common (a prefix tokenized alone can end differently)."""
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def prefill(model, ids):
+    """Run ids (one prefix) through model and return its past-key-values."""
+    import torch
+    from transformers import DynamicCache
+    with torch.no_grad():
+        # An explicit DynamicCache: without one, 4.x models hand back legacy tuples
+        out = model(input_ids=torch.tensor([list(ids)], device=model.device), past_key_values=DynamicCache(), use_cache=True)
+    return out.past_key_values
+
+
+def fork(past, batch_size: int = 1):
+    """A copy of a cached prefix for one generate() over batch_size rows."""
+    past = copy.deepcopy(past)
+    if batch_size > 1:
+        past.batch_repeat_interleave(batch_size)
+    return past
+
+
+def cache_bytes(past) -> int:
+    """Device memory held by a past-key-values object (DynamicCache of any transformers version, or legacy tuples)."""
+    if hasattr(past, "layers"):  # transformers 5
+        tensors = [t for layer in past.layers for t in (getattr(layer, "keys", None), getattr(layer, "values", None))]
+    elif hasattr(past, "key_cache"):
+        tensors = list(past.key_cache) + list(past.value_cache)
+    else:
+        tensors = [t for layer in past for t in layer]
+    return sum(t.numel() * t.element_size() for t in tensors if hasattr(t, "numel"))
+
+
+def pad_after_prefix(rows: list, prefix_len: int, pad_id: int, device=None) -> dict:
+    """input_ids / attention_mask for rows sharing their first prefix_len tokens, padded just after the prefix."""
+    import torch
+    width = max(len(r) for r in rows)
+    ids, mask = [], []
+    for r in rows:
+        pad = width - len(r)
+        ids.append(list(r[:prefix_len]) + [pad_id] * pad + list(r[prefix_len:]))
+        mask.append([1] * prefix_len + [0] * pad + [1] * (len(r) - prefix_len))
+    return {
+        "input_ids": torch.tensor(ids, dtype=torch.long, device=device),
+        "attention_mask": torch.tensor(mask, dtype=torch.long, device=device),
+    }
+
+
+class FirstTokenTimer(LogitsProcessor):
+    """Logits processor that changes nothing and notes when generate() first produces scores (prefill done)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_at = None
+
+    def __call__(self, input_ids, scores):
+        if self.first_at is None:
+            if getattr(scores, "is_cuda", False):
+                import torch
+                torch.cuda.synchronize()
+            self.first_at = time.perf_counter()
+        return scores
+
+    @property
+    def seconds(self):
+        return self.first_at - self.started if self.first_at is not None else None
+
+
+class PrefixCache:
+    """
+    Past-key-values per prefix key, least recently used evicted first once they hold more than max_mb. Prefixes
+    shorter than min_tokens aren't worth a lookup. Entries are never modified; callers generate from fork() copies.
+    """
+
+    def __init__(self, max_mb: float = 512, min_tokens: int = 64):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.min_tokens = min_tokens
+        self._entries = OrderedDict()  # key -> (past, tokens, bytes); least recently used first
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0, "tokens_reused": 0, "prefill_seconds": 0.0}
+        self._ttft = {}  # mode -> [count, total seconds]
+
+    def get(self, key: str, build):
+        """(past, "reused") for a cached prefix, else (build(), "prefilled") after storing it if it fits."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["tokens_reused"] += entry[1]
+                return entry[0], "reused"
+        started = time.perf_counter()
+        past = build()
+        size = cache_bytes(past)
+        with self._lock:
+            self.stats["misses"] += 1
+            self.stats["prefill_seconds"] += time.perf_counter() - started
+            if size <= self.max_bytes and key not in self._entries:
+                self._entries[key] = (past, past.get_seq_length(), size)
+                self.stats["bytes"] += size
+                while self.stats["bytes"] > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.stats["bytes"] -= evicted[2]
+                    self.stats["evictions"] += 1
+        return past, "prefilled"
+
+    def record_ttft(self, mode: str, seconds):
+        if seconds is None:
+            return
+        with self._lock:
+            count_total = self._ttft.setdefault(mode, [0, 0.0])
+            count_total[0] += 1
+            count_total[1] += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            s = dict(self.stats)
+            ttft = {mode: {"requests": c, "avg_ms": round(total / c * 1000, 1)} for mode, (c, total) in self._ttft.items()}
+            entries = len(self._entries)
+        s["prefill_seconds"] = round(s["prefill_seconds"], 2)
+        return {"entries": entries, "max_mb": round(self.max_bytes / 1024 / 1024, 1), **s, "ttft": ttft}
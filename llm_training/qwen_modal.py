@@ -7,6 +7,17 @@ Usage (from repo root):
 
 After deploy, set QWEN_API_URL on Render to the Modal URL (e.g. https://annalynm--qwen-speechgradebook.modal.run).
 
+**Cold starts:**
+- Weights live on the "qwen-speechgradebook-weights" Volume (HF_HOME=/weights/hf) instead of being pulled from the
+  Hugging Face hub on every container start. Fill it once (and after changing MODEL_NAME):
+    modal run llm_training/qwen_modal.py::download_weights
+- Containers start from a memory snapshot taken after torch/transformers/qwen_serve are imported; the model is
+  loaded onto the GPU after restore. Deploy with QWEN_MODAL_GPU_SNAPSHOT=1 to snapshot the loaded model too
+  (Modal's GPU memory snapshots; experimental).
+- QWEN_MODAL_MIN_CONTAINERS=1 at deploy time keeps one container warm (billed while idle).
+- app.py's POST /qwen-api/warm wakes the service when the evaluate page opens or a bulk upload starts.
+- Container start -> model ready -> first evaluation is logged as [COLD_START] and reported by /health.
+
 **RECOMMENDED: RunPod Alternative (80% cost savings)**
 For cost-effective deployment, consider using RunPod instead:
 - RunPod A100: $0.39-0.79/hour vs Modal $4-5/hour
@@ -22,6 +33,7 @@ To enable: remove DISABLE_TEXTBOOK_RAG from .env() above, create secret, then de
 - Cost is automatically tracked in app.py based on QWEN_API_URL provider
 """
 
+import os
 from pathlib import Path
 
 import modal
@@ -29,9 +41,23 @@ import modal
 _this_dir = Path(__file__).resolve().parent
 _repo_root = _this_dir.parent
 
+MODEL_NAME = "Qwen/Qwen2.5-VL-7B-Instruct"
+_WEIGHTS_DIR = "/weights"
+weights = modal.Volume.from_name("qwen-speechgradebook-weights", create_if_missing=True)
+# Set at deploy time (modal deploy). Modal imports this module again inside the container, where only the image's
+# env exists, so the values are also baked into the image below: the container must see the same flags the class
+# was deployed with (otherwise a GPU-snapshot deploy would snapshot without the model loaded).
+_GPU_SNAPSHOT = os.environ.get("QWEN_MODAL_GPU_SNAPSHOT", "").strip().lower() in ("1", "true", "yes")
+_MIN_CONTAINERS = int(os.environ.get("QWEN_MODAL_MIN_CONTAINERS", "0"))
+_DEPLOY_ENV = {
+    "QWEN_MODAL_GPU_SNAPSHOT": "1" if _GPU_SNAPSHOT else "0",
+    "QWEN_MODAL_MIN_CONTAINERS": str(_MIN_CONTAINERS),
+}
+
 # Image: Python deps + your code (add_local_dir last per Modal best practice)
 image = (
     modal.Image.debian_slim(python_version="3.11")
+    .apt_install("ffmpeg")  # frame sampling (llm_training/video_frames.py)
     .pip_install(
         "torch>=2.0",
         "torchvision>=0.15",
@@ -54,6 +80,12 @@ image = (
         "PYTORCH_ALLOC_CONF": "expandable_segments:True",
         # Disable textbook RAG on Modal to avoid OOM (sentence-transformers + Qwen + video can exceed memory)
         "DISABLE_TEXTBOOK_RAG": "1",
+        # One generate() on the GPU at a time; with max_inputs=2 the second request uploads/downloads meanwhile
+        "QWEN_GPU_CONCURRENCY": "1",
+        # Hugging Face cache on the weights Volume (filled by download_weights)
+        "HF_HOME": f"{_WEIGHTS_DIR}/hf",
+        "HF_HUB_CACHE": f"{_WEIGHTS_DIR}/hf/hub",
+        **_DEPLOY_ENV,
     })
     .add_local_dir(_this_dir, remote_path="/app/llm_training")
 )
@@ -61,6 +93,17 @@ image = (
 app = modal.App("qwen-speechgradebook", image=image)
 
 
+@app.function(volumes={_WEIGHTS_DIR: weights}, secrets=[modal.Secret.from_name("hf-token")], timeout=1800)
+def download_weights():
+    """Download MODEL_NAME into the weights Volume so containers load it from local disk."""
+    import time
+    from huggingface_hub import snapshot_download
+    started = time.time()
+    path = snapshot_download(MODEL_NAME, token=os.environ.get("HF_TOKEN"))
+    weights.commit()
+    print(f"[Modal] {MODEL_NAME} saved to {path} in {time.time() - started:.0f}s")
+
+
 @app.cls(
     # Using A100 GPU for sufficient memory (40GB VRAM)
     # T4 (14GB VRAM) was causing OOM errors with larger videos
@@ -69,6 +112,10 @@ app = modal.App("qwen-speechgradebook", image=image)
     gpu="A100",  # Switched from T4 due to OOM errors - A100 has 40GB VRAM
     scaledown_window=600,  # Increased from 300s to 600s (10 min) to prevent scale-down during bulk uploads
     timeout=600,
+    min_containers=_MIN_CONTAINERS,
+    volumes={_WEIGHTS_DIR: weights},
+    enable_memory_snapshot=True,
+    experimental_options={"enable_gpu_snapshot": True} if _GPU_SNAPSHOT else None,
     secrets=[
         modal.Secret.from_name("hf-token"),  # HF_TOKEN for faster Hugging Face downloads
         # modal.Secret.from_name("supabase-db"),  # Uncomment to enable textbook RAG; create secret first
@@ -79,16 +126,41 @@ app = modal.App("qwen-speechgradebook", image=image)
 class QwenService:
     """Load Qwen2.5-VL on GPU and serve the FastAPI app."""
 
-    @modal.enter()
-    def load_model(self):
+    @modal.enter(snap=True)
+    def import_libraries(self):
+        """Runs once, before the memory snapshot: imports (and, with GPU snapshots, the model) are restored from it."""
         import sys
+        import time
+        started = time.time()
         sys.path.insert(0, "/app")
+        import torch  # noqa: F401 - heavy imports are what the CPU snapshot saves
+        import transformers  # noqa: F401
         from llm_training import qwen_serve
         self.qwen_serve = qwen_serve
+        # Kept in the snapshot: a container restored from it runs as a different task
+        self._snapshot_task_id = os.environ.get("MODAL_TASK_ID")
+        print(f"[Modal] Libraries imported in {time.time() - started:.1f}s (captured in memory snapshot)")
+        if _GPU_SNAPSHOT:
+            self._load()
+
+    @modal.enter(snap=False)
+    def load_model(self):
+        """
+        Runs on every container start: after a restore, or straight after import_libraries on the first boot (which
+        creates the snapshot in this same task, so it isn't counted as restored).
+        """
+        snapshot_task = getattr(self, "_snapshot_task_id", None)
+        restored = snapshot_task is not None and os.environ.get("MODAL_TASK_ID") != snapshot_task
+        self.qwen_serve.mark_container_start(restored_from_snapshot=restored)
+        if self.qwen_serve.model is None:
+            self._load()
+
+    def _load(self):
+        qwen_serve = self.qwen_serve
         # A100 has 40GB VRAM, so we can use 4-bit quantization for cost savings
         # or load in full precision. 4-bit is fine and saves memory.
         print("[Modal] Starting model load...")
-        qwen_serve._load_model("Qwen/Qwen2.5-VL-7B-Instruct", load_in_4bit=True)
+        qwen_serve._load_model(MODEL_NAME, load_in_4bit=True)
         # Ensure model is fully loaded by accessing it
         # This forces synchronization and ensures weights are loaded
         if qwen_serve.model is not None:
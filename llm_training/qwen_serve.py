@@ -4,8 +4,9 @@ Qwen2.5-VL-7B service for SpeechGradebook video analysis and rubric extraction.
 
 Endpoints:
   GET  /health              -> { "status": "ok", "model": "Qwen2.5-VL-7B" }
-  POST /analyze_video       -> multipart: file (video). Returns { "video_notes": "..." }
+  POST /analyze_video       -> multipart: file (video). Returns { "video_notes": "...", "metadata" }
   POST /evaluate_video      -> multipart: file (video), rubric (JSON). Returns { "sections", "overallComments", "transcript" } (same as SpeechGradebook Model)
+                               plus "metadata": { "video": frame plan (frames, resolution, visual tokens, why), "generate_seconds" }
   POST /extract_rubric      -> multipart: file (image/PDF). Returns rubric JSON
 
 Usage:
@@ -13,14 +14,41 @@ Usage:
   python qwen_serve.py [--port 8001] [--model Qwen/Qwen2.5-VL-7B-Instruct]
 
 To avoid ~/.cache permission issues, uses ./cache in the llm_training dir by default.
+
+Inference runs on a dedicated thread pool behind a GPU semaphore (QWEN_GPU_CONCURRENCY, default 1), so /health,
+uploads and storage-URL downloads keep being served while a video is generating.
+
+Videos are pre-sampled by ffmpeg (video_frames.py) into a fixed budget of downscaled frames that feed the
+processor, instead of decoding the full-resolution stream in-process; QWEN_FRAME_SAMPLER=off restores the old path.
+
+Cold starts are timed: container start -> model loaded -> first evaluation answered. Each milestone is logged as
+[COLD_START] and /health reports them under "cold_start" (hosts that restore from a memory snapshot call
+mark_container_start() after the restore so the clock starts there).
+
+evaluate_video and extract_rubric decode under a JSON schema (json_grammar.py; evaluate_video's is built from the
+rubric), so their output is always parseable JSON with nothing before or after it; QWEN_CONSTRAINED_JSON=0 goes back
+to free generation. /health "decoding" compares tokens generated and parse failures between the two. Either way
+generation stops when the top-level object closes (QWEN_EARLY_STOP=0 to measure instead); each response's
+metadata.generation.early_stop reports the tokens and GPU seconds that saved.
+
+evaluate_video puts its prompt before the video, so requests with the same rubric share every token up to the video;
+the model's keys/values for that prefix are computed once and reused (prefix_cache.py; QWEN_PREFIX_CACHE=0 to turn
+off, QWEN_PREFIX_CACHE_MB bounds it). metadata.generation.prefix and /health "prefix_cache" report time to first
+token with and without reuse.
 """
 
 import argparse
+import asyncio
+import hashlib
 import json
 import os
-import re
 import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import urlparse
 
 # Use local cache inside project (avoids ~/.cache permission issues)
 _script_dir = Path(__file__).resolve().parent
@@ -33,6 +61,16 @@ if "HF_HOME" not in os.environ and "HF_HUB_CACHE" not in os.environ:
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 
+try:
+    from llm_training import json_extract, json_grammar, prefix_cache, video_frames
+    from llm_training.result_cache import DiskLRUCache, canonical_json, sha256_file
+except ImportError:
+    import json_extract
+    import json_grammar
+    import prefix_cache
+    import video_frames
+    from result_cache import DiskLRUCache, canonical_json, sha256_file
+
 app = FastAPI(title="SpeechGradebook Qwen2.5-VL Service")
 
 _allowed = os.environ.get("ALLOWED_ORIGINS", "").strip()
@@ -49,12 +87,616 @@ app.add_middleware(
 )
 
 model = None
+_model_name = None
 processor = None
 DEVICE = "cuda"
 
+# ----- Inference off the event loop: blocking generate() runs on its own threads, gated by a GPU semaphore -----
+QWEN_GPU_CONCURRENCY = max(1, int(os.environ.get("QWEN_GPU_CONCURRENCY", "1")))
+_gpu_executor = ThreadPoolExecutor(max_workers=QWEN_GPU_CONCURRENCY, thread_name_prefix="qwen-gpu")
+_gpu_semaphore = asyncio.Semaphore(QWEN_GPU_CONCURRENCY)
+_gpu_stats_lock = threading.Lock()
+_gpu_stats = {"active": 0, "waiting": 0, "completed": 0, "errors": 0, "gpu_seconds": 0.0, "max_wait_seconds": 0.0}
+
+
+def _free_gpu_memory():
+    """Release cached CUDA blocks and Python garbage between requests to prevent OOM on the next one."""
+    import gc
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+        torch.cuda.synchronize()
+    gc.collect()
+
+
+def _generate_blocking(conversation: list, max_new_tokens: int, route: str, vision_key: str = None,
+                       vision_report: dict = None, json_schema: dict = None, stop_at_json_end: bool = False,
+                       generation_report: dict = None, reuse_prefix: bool = False, **template_kwargs) -> str:
+    """
+    Tokenize the conversation, run model.generate and decode the new tokens. Runs on a _gpu_executor thread.
+    vision_key names the video's encoded visual tokens in the vision cache; vision_report receives hit/seconds.
+    json_schema constrains the output to that schema (see json_grammar); stop_at_json_end ends generation when the
+    first JSON object closes. reuse_prefix starts from the cached keys/values of the text before the video.
+    generation_report receives the token count, the early-stop savings and the prefix reuse / time to first token.
+    """
+    import torch
+    _vision_call.key, _vision_call.report = vision_key, vision_report
+    try:
+        _free_gpu_memory()
+        inputs = processor.apply_chat_template(
+            conversation,
+            add_generation_prompt=True,
+            tokenize=True,
+            return_dict=True,
+            return_tensors="pt",
+            **template_kwargs,
+        )
+        inputs = {k: v.to(model.device) if hasattr(v, "to") else v for k, v in inputs.items()}
+
+        # Clear cache again after moving inputs to GPU
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+        from transformers import LogitsProcessorList
+        timer = prefix_cache.FirstTokenTimer() if reuse_prefix else None
+        prefix = _prefix_past(inputs["input_ids"]) if reuse_prefix else None
+        constraint = None
+        gen_kwargs = {}
+        if prefix is not None:
+            gen_kwargs["past_key_values"] = prefix[0]
+        if json_schema is not None:
+            constraint = json_grammar.JSONLogitsProcessor(_grammar(json_schema), processor.tokenizer)
+        processors = [p for p in (timer, constraint) if p is not None]
+        if processors:
+            gen_kwargs["logits_processor"] = LogitsProcessorList(processors)
+        stop = None
+        if stop_at_json_end:
+            from transformers import StoppingCriteriaList
+            stop = json_grammar.JSONObjectEnd(processor.tokenizer, enabled=_early_stop())
+            gen_kwargs["stopping_criteria"] = StoppingCriteriaList([stop])
+
+        with torch.no_grad():
+            out = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False, **gen_kwargs)
+
+        gen_ids = [o[len(i) :] for i, o in zip(inputs["input_ids"], out)]
+        early = _early_stop_ledger.record(stop, 0, len(gen_ids[0]), max_new_tokens) if stop is not None else None
+        reuse = None
+        if timer is not None:
+            mode = prefix[1] if prefix is not None else "off"
+            _prefix_cache.record_ttft(mode, timer.seconds)
+            ttft = round(timer.seconds, 3) if timer.seconds is not None else None
+            reuse = {"mode": mode, "tokens": prefix[2] if prefix is not None else 0, "ttft_seconds": ttft}
+        if generation_report is not None:
+            generation_report.update(
+                tokens=len(gen_ids[0]),
+                max_new_tokens=max_new_tokens,
+                constrained=constraint is not None,
+                complete=constraint.complete if constraint is not None else None,
+                early_stop=early,
+                prefix=reuse,
+            )
+        text = processor.batch_decode(gen_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True)
+        return (text[0] or "").strip()
+    finally:
+        _vision_call.key = _vision_call.report = None
+        # Memory cleanup to prevent OOM on subsequent requests
+        try:
+            _free_gpu_memory()
+        except Exception as cleanup_error:
+            print(f"[{route}] Memory cleanup warning: {cleanup_error!s}", flush=True)
+
+
+async def _generate(conversation: list, max_new_tokens: int, route: str, **kwargs) -> str:
+    """Wait for a GPU slot, then run _generate_blocking on the inference thread pool without blocking the loop."""
+    queued = time.time()
+    with _gpu_stats_lock:
+        _gpu_stats["waiting"] += 1
+    async with _gpu_semaphore:
+        started = time.time()
+        with _gpu_stats_lock:
+            _gpu_stats["waiting"] -= 1
+            _gpu_stats["active"] += 1
+            _gpu_stats["max_wait_seconds"] = round(max(_gpu_stats["max_wait_seconds"], started - queued), 2)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                _gpu_executor,
+                lambda: _generate_blocking(conversation, max_new_tokens, route, **kwargs),
+            )
+        except Exception:
+            with _gpu_stats_lock:
+                _gpu_stats["errors"] += 1
+            raise
+        finally:
+            elapsed = time.time() - started
+            with _gpu_stats_lock:
+                _gpu_stats["active"] -= 1
+                _gpu_stats["completed"] += 1
+                _gpu_stats["gpu_seconds"] = round(_gpu_stats["gpu_seconds"] + elapsed, 2)
+            print(f"[{route}] GPU {elapsed:.1f}s (waited {started - queued:.1f}s for a slot)", flush=True)
+
+
+def _gpu_snapshot() -> dict:
+    with _gpu_stats_lock:
+        return {"concurrency": QWEN_GPU_CONCURRENCY, **_gpu_stats}
+
+
+# ----- Constrained JSON decoding: evaluate_video / extract_rubric can only generate JSON their schema accepts -----
+# The schema comes from the rubric (section keys, subcategory names and points, timeline_markers); a logits processor
+# masks tokens that would leave it, so there are no fences or prose to strip and generation ends when the object
+# closes. QWEN_CONSTRAINED_JSON=0 turns it off (free generation + the repair parsers, as before). Tokens generated
+# and parse failures are counted per route and mode so the two can be compared in /health "decoding".
+_grammars = OrderedDict()  # schema JSON -> json_grammar.Grammar (holds the per-state token masks); LRU
+_grammars_lock = threading.Lock()
+_decode_stats_lock = threading.Lock()
+_decode_stats = {}  # route -> "constrained"/"free" -> counters
+# QWEN_EARLY_STOP=0 lets structured generations run on past the closing brace (to EOS / max_new_tokens) and only
+# measures how many tokens that costs; on (default), they stop there and the saving is credited per request.
+_early_stop_ledger = json_grammar.EarlyStopLedger()
+
+
+def _constrained_json() -> bool:
+    return os.environ.get("QWEN_CONSTRAINED_JSON", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _early_stop() -> bool:
+    return os.environ.get("QWEN_EARLY_STOP", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _grammar(schema: dict) -> "json_grammar.Grammar":
+    """Compiled grammar for schema, shared across requests so a class's batch reuses its token masks."""
+    key = json.dumps(schema, ensure_ascii=False)
+    with _grammars_lock:
+        grammar = _grammars.get(key)
+        if grammar is not None:
+            _grammars.move_to_end(key)
+            return grammar
+    grammar = json_grammar.Grammar(schema)
+    with _grammars_lock:
+        _grammars[key] = grammar
+        while len(_grammars) > 16:
+            _grammars.popitem(last=False)
+    return grammar
+
+
+def _record_decode(route: str, generation: dict, valid_json: bool, parsed: bool):
+    """Count one structured generation: its tokens, whether it was strict JSON, whether anything usable came out."""
+    mode = "constrained" if generation.get("constrained") else "free"
+    with _decode_stats_lock:
+        stats = _decode_stats.setdefault(route, {}).setdefault(
+            mode, {"requests": 0, "tokens": 0, "hit_max_tokens": 0, "invalid_json": 0, "parse_failures": 0}
+        )
+        stats["requests"] += 1
+        stats["tokens"] += generation.get("tokens") or 0
+        stats["hit_max_tokens"] += int(bool(generation.get("tokens")) and generation.get("tokens") == generation.get("max_new_tokens"))
+        stats["invalid_json"] += int(not valid_json)
+        stats["parse_failures"] += int(not parsed)
+
+
+def _decode_snapshot() -> dict:
+    with _decode_stats_lock:
+        out = {}
+        for route, modes in _decode_stats.items():
+            out[route] = {}
+            for mode, s in modes.items():
+                n = s["requests"] or 1
+                out[route][mode] = {
+                    **s,
+                    "avg_tokens": round(s["tokens"] / n, 1),
+                    "parse_failure_rate": round(s["parse_failures"] / n, 3),
+                }
+        return {
+            "enabled": _constrained_json(),
+            "grammars": len(_grammars),
+            **out,
+            "early_stop": {"enabled": _early_stop(), **_early_stop_ledger.snapshot()},
+        }
+
+
+def _is_json(text: str) -> bool:
+    try:
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
+
+
+# ----- Prompt-prefix KV cache: a class's evaluations prefill the shared rubric prompt once -----
+# evaluate_video's prompt (rubric, point values, behaviors, excerpts) comes before the video, so every token up to
+# the video is the same for a rubric; those keys/values are kept (prefix_cache.PrefixCache, on the GPU) and
+# generate() continues from a copy. Needs transformers 5: 4.x drops the video pixels from a generate() whose cache
+# isn't empty. QWEN_PREFIX_CACHE=0 turns it off; QWEN_PREFIX_CACHE_MB bounds it (default 512).
+_prefix_cache = prefix_cache.PrefixCache(max_mb=float(os.environ.get("QWEN_PREFIX_CACHE_MB", "512")))
+
+
+def _prefix_reuse_supported() -> bool:
+    import transformers
+    return int(transformers.__version__.split(".")[0]) >= 5
+
+
+def _prefix_reuse() -> bool:
+    if os.environ.get("QWEN_PREFIX_CACHE", "1").strip().lower() in ("0", "false", "no", "off"):
+        return False
+    return _prefix_reuse_supported()
+
+
+def _prefix_past(input_ids):
+    """(copy of the cached keys/values, "reused"/"prefilled", tokens) for the text before the video, or None."""
+    if not _prefix_reuse() or input_ids.shape[0] != 1:
+        return None
+    ids = input_ids[0].tolist()
+    start = getattr(model.config, "vision_start_token_id", None)
+    n = ids.index(start) if start in ids else 0
+    if n < _prefix_cache.min_tokens:
+        return None
+    past, mode = _prefix_cache.get(prefix_cache.key_for(ids[:n], _model_name), lambda: prefix_cache.prefill(model, ids[:n]))
+    # rope_deltas left by the last generate() (or the prefill) would shift the video's positions; None recomputes them
+    for owner in (model, getattr(model, "model", None)):
+        if owner is not None and hasattr(owner, "rope_deltas"):
+            owner.rope_deltas = None
+    return prefix_cache.fork(past), mode, n
+
+
+def _prefix_snapshot() -> dict:
+    return {"enabled": _prefix_reuse(), "supported": _prefix_reuse_supported(), **_prefix_cache.snapshot()}
+
+
+# ----- Vision-embedding cache: analyze_video then evaluate_video on the same file runs the vision tower once -----
+# The visual encoder's output for a video is kept (on the CPU) under a key of video hash + frame plan + model; a
+# later generate() for the same key gets it back instead of re-encoding, so only the language decoder runs.
+# Works by wrapping the vision tower's forward, which every transformers version calls with (pixels, grid_thw).
+# QWEN_VISION_CACHE=0 disables it; QWEN_VISION_CACHE_MB bounds its host memory (default 1024).
+_vision_cache = OrderedDict()  # key -> (grid_thw, output on CPU, bytes, encode seconds); least recently used first
+_vision_cache_lock = threading.Lock()
+_vision_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0, "encode_seconds": 0.0, "gpu_seconds_saved": 0.0}
+_vision_call = threading.local()  # .key / .report for the generate() running on this thread
+
+
+def _vision_key(sampling: dict, model_name: str = None):
+    """Cache key for a video's visual tokens, or None when the video hash is unknown."""
+    if not sampling.get("video_sha256") or os.environ.get("QWEN_VISION_CACHE", "1").strip().lower() in ("0", "false", "no"):
+        return None
+    plan = {k: sampling.get(k) for k in ("sampler", "frames", "frame_size", "fps", "mode")}
+    return DiskLRUCache.make_key(sampling["video_sha256"], json.dumps(plan, sort_keys=True), model_name or _model_name)
+
+
+def _map_tensors(value, fn):
+    """Apply fn to a tensor, or to every tensor field of a ModelOutput / tuple (newer transformers return those)."""
+    if hasattr(value, "detach"):
+        return fn(value)
+    if isinstance(value, dict):
+        return type(value)(**{k: _map_tensors(v, fn) for k, v in value.items()})
+    if isinstance(value, (tuple, list)):
+        return type(value)(_map_tensors(v, fn) for v in value)
+    return value
+
+
+def _output_bytes(value) -> int:
+    total = []
+    _map_tensors(value, lambda t: total.append(t.numel() * t.element_size()) or t)
+    return sum(total)
+
+
+def _install_vision_cache(vlm):
+    """Wrap vlm's vision tower so calls made under a _vision_call.key are served from / stored in _vision_cache."""
+    visual = getattr(vlm, "visual", None) or getattr(getattr(vlm, "model", None), "visual", None)
+    if visual is None or getattr(visual, "_speechgradebook_cached", False):
+        return
+    import torch
+    encode = visual.forward
+
+    def forward(hidden_states, *args, grid_thw=None, **kwargs):
+        key = getattr(_vision_call, "key", None)
+        report = getattr(_vision_call, "report", None)
+        if key is None:
+            return encode(hidden_states, *args, grid_thw=grid_thw, **kwargs)
+        grid = grid_thw.tolist() if grid_thw is not None else None
+        with _vision_cache_lock:
+            entry = _vision_cache.get(key)
+            if entry is not None and entry[0] == grid:
+                _vision_cache.move_to_end(key)
+                _vision_stats["hits"] += 1
+                _vision_stats["gpu_seconds_saved"] = round(_vision_stats["gpu_seconds_saved"] + entry[3], 2)
+        if entry is not None and entry[0] == grid:
+            if report is not None:
+                report.update(hit=True, encode_seconds=0.0, gpu_seconds_saved=round(entry[3], 2))
+            # Fresh objects: callers (get_video_features) reassign fields on the output they get back
+            return _map_tensors(entry[1], lambda t: t.to(hidden_states.device, non_blocking=True))
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        started = time.time()
+        output = encode(hidden_states, *args, grid_thw=grid_thw, **kwargs)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        seconds = time.time() - started
+        stored = _map_tensors(output, lambda t: t.detach().to("cpu"))
+        size = _output_bytes(stored)
+        limit = int(os.environ.get("QWEN_VISION_CACHE_MB", "1024")) * 1024 * 1024
+        with _vision_cache_lock:
+            _vision_stats["misses"] += 1
+            _vision_stats["encode_seconds"] = round(_vision_stats["encode_seconds"] + seconds, 2)
+            if size <= limit:
+                old = _vision_cache.pop(key, None)
+                if old is not None:
+                    _vision_stats["bytes"] -= old[2]
+                _vision_cache[key] = (grid, stored, size, seconds)
+                _vision_stats["bytes"] += size
+                while _vision_stats["bytes"] > limit:
+                    _, evicted = _vision_cache.popitem(last=False)
+                    _vision_stats["bytes"] -= evicted[2]
+                    _vision_stats["evictions"] += 1
+        if report is not None:
+            report.update(hit=False, encode_seconds=round(seconds, 2), gpu_seconds_saved=0.0)
+        return output
+
+    visual.forward = forward
+    visual._speechgradebook_cached = True
+
+
+def _vision_snapshot() -> dict:
+    with _vision_cache_lock:
+        return {"entries": len(_vision_cache), **_vision_stats}
+
+
+# ----- Frame sampling: ffmpeg extracts a budget of downscaled frames instead of in-process full-res decode -----
+# QWEN_FRAME_SAMPLER=ffmpeg (default, when ffmpeg is on PATH) or off (hand the video path to the processor at
+# fps=0.15 as before). Frames are chosen by QWEN_FRAME_MODE=uniform|scene and cached by video hash + plan under
+# QWEN_FRAME_CACHE_DIR (QWEN_FRAME_CACHE_MB).
+# QWEN_FRAME_BUDGET=auto (default) plans frames and resolution per video from its duration and free CUDA memory,
+# aiming at QWEN_VISUAL_TOKEN_TARGET visual tokens (default 6144) and at most what fits after QWEN_VRAM_RESERVE_MB
+# (default 6144) at QWEN_VRAM_KB_PER_TOKEN (default 384); QWEN_FRAME_MAX_SIDE caps the resolution (default 896).
+# A number instead of auto is a fixed frame count at QWEN_FRAME_MAX_SIDE (default 640). The plan is returned
+# in each response's "metadata".
+LEGACY_VIDEO_FPS = 0.15
+_frame_sampler = None
+_frame_stats = {"sampled": 0, "in_process": 0, "fallbacks": 0}
+
+
+def _sampler():
+    """The process-wide FrameSampler, or None when disabled or ffmpeg is missing."""
+    global _frame_sampler
+    if os.environ.get("QWEN_FRAME_SAMPLER", "ffmpeg").strip().lower() != "ffmpeg":
+        return None
+    if _frame_sampler is None:
+        if not video_frames.ffmpeg_available():
+            return None
+        _frame_sampler = video_frames.FrameSampler(
+            os.environ.get("QWEN_FRAME_CACHE_DIR") or str(Path(tempfile.gettempdir()) / "qwen_frames"),
+            max_bytes=int(os.environ.get("QWEN_FRAME_CACHE_MB", "2048")) * 1024 * 1024,
+        )
+    return _frame_sampler
+
+
+def _free_vram_bytes():
+    """Free CUDA memory on the model's device, counting blocks PyTorch has cached but not allocated; None on CPU."""
+    try:
+        import torch
+        if not torch.cuda.is_available():
+            return None
+        free, _total = torch.cuda.mem_get_info()
+        return free + torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+    except Exception:
+        return None
+
+
+def _frame_plan(info: dict) -> dict:
+    budget = os.environ.get("QWEN_FRAME_BUDGET", "auto").strip().lower()
+    if budget != "auto":
+        frames = int(budget)
+        max_side = int(os.environ.get("QWEN_FRAME_MAX_SIDE", "640"))
+        return {"frames": frames, "max_side": max_side, "limited_by": "fixed", "duration": round(info["duration"], 1)}
+    return video_frames.plan_frame_budget(
+        info["duration"],
+        info["width"],
+        info["height"],
+        free_vram_bytes=_free_vram_bytes(),
+        target_tokens=int(os.environ.get("QWEN_VISUAL_TOKEN_TARGET", "6144")),
+        bytes_per_token=int(os.environ.get("QWEN_VRAM_KB_PER_TOKEN", "384")) * 1024,
+        reserve_bytes=int(os.environ.get("QWEN_VRAM_RESERVE_MB", "6144")) * 1024 * 1024,
+        max_side=int(os.environ.get("QWEN_FRAME_MAX_SIDE", "896")),
+    )
+
+
+def _sample_blocking(sampler, path: str):
+    info = video_frames.probe(path)
+    plan = _frame_plan(info)
+    video = sampler.sample(
+        path,
+        frames=plan["frames"],
+        max_side=plan["max_side"],
+        mode=os.environ.get("QWEN_FRAME_MODE", "uniform").strip().lower(),
+        info=info,
+    )
+    return video, video.images(), plan
+
+
+async def _video_input(path: str, route: str):
+    """
+    (content block, apply_chat_template kwargs, sampling metadata) for the video at path: pre-sampled frames when
+    the ffmpeg sampler is available, else the path itself for in-process decoding at LEGACY_VIDEO_FPS.
+    """
+    sampler = _sampler()
+    if sampler is not None:
+        try:
+            video, images, plan = await asyncio.to_thread(_sample_blocking, sampler, path)
+            _frame_stats["sampled"] += 1
+            meta = {**plan, "mode": video.meta.get("mode"), "extract_seconds": video.meta.get("extract_seconds")}
+            width, height = images[0].size
+            meta.update(
+                sampler="ffmpeg",
+                video_sha256=video.meta.get("video_sha256"),
+                frames=len(images),
+                fps=video.fps,
+                frame_size=[width, height],
+                visual_tokens=video_frames.visual_tokens(len(images), width, height),
+                cache_hit=video.cache_hit,
+            )
+            return {"type": "video", "video": images}, {"fps": video.fps}, meta
+        except Exception as e:
+            _frame_stats["fallbacks"] += 1
+            print(f"[{route}] ffmpeg frame sampling failed, decoding in-process: {e!s}", flush=True)
+    _frame_stats["in_process"] += 1
+    try:
+        with open(path, "rb") as f:
+            digest = await asyncio.to_thread(sha256_file, f)
+    except OSError:
+        digest = None
+    meta = {"sampler": "in-process", "fps": LEGACY_VIDEO_FPS, "video_sha256": digest}
+    return {"type": "video", "path": path}, {"fps": LEGACY_VIDEO_FPS}, meta
+
+
+def _response_metadata(sampling: dict, generate_started: float, vision: dict = None, generation: dict = None) -> dict:
+    """Frame plan + timings returned with each video response, to line up quality with latency and GPU cost."""
+    return {
+        "video": sampling,
+        "generate_seconds": round(time.time() - generate_started, 2),
+        "vision_cache": vision or None,
+        "generation": generation or None,
+    }
+
+
+def _frame_snapshot() -> dict:
+    sampler = _frame_sampler
+    return {**_frame_stats, "ffmpeg": sampler.snapshot() if sampler is not None else None}
+
+
+# ----- storage_url downloads: streamed to a temp file in chunks, size-capped, resumed with Range after a dropped connection -----
+QWEN_MAX_DOWNLOAD_MB = int(os.environ.get("QWEN_MAX_DOWNLOAD_MB", "500"))
+QWEN_DOWNLOAD_RETRIES = int(os.environ.get("QWEN_DOWNLOAD_RETRIES", "3"))
+_download_client = None
+_download_stats = {"downloads": 0, "failures": 0, "resumes": 0, "bytes": 0, "seconds": 0.0, "recent": deque(maxlen=20)}
+
+
+class DownloadTooLarge(Exception):
+    pass
+
+
+def _http():
+    """Shared AsyncClient for storage downloads (keep-alive to Supabase across evaluations)."""
+    global _download_client
+    if _download_client is None:
+        import httpx
+        _download_client = httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=10.0), follow_redirects=True)
+    return _download_client
+
+
+async def _download_to_tempfile(url: str, max_bytes: int | None = None) -> str:
+    """
+    Stream url to a temp file and return its path. Aborts with DownloadTooLarge past max_bytes
+    (default QWEN_MAX_DOWNLOAD_MB). If the connection drops mid-body the download resumes from the
+    last written byte with a Range request (up to QWEN_DOWNLOAD_RETRIES times); a server that ignores
+    Range just restarts the file.
+    """
+    import httpx
+
+    max_bytes = max_bytes if max_bytes is not None else QWEN_MAX_DOWNLOAD_MB * 1024 * 1024
+    suffix = Path(urlparse(url).path).suffix or ".mp4"
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    started = time.time()
+    written = 0
+    resumes = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                headers = {"Range": f"bytes={written}-"} if written else {}
+                try:
+                    async with _http().stream("GET", url, headers=headers) as resp:
+                        if written and resp.status_code == 416:
+                            # Connection dropped after the last byte had already arrived
+                            break
+                        if written and resp.status_code == 200:
+                            # Range not honoured: start over
+                            out.seek(0)
+                            out.truncate()
+                            written = 0
+                        elif resp.status_code not in (200, 206):
+                            raise HTTPException(status_code=400, detail=f"Failed to fetch video from storage URL: {resp.status_code}")
+                        length = resp.headers.get("content-length")
+                        if length and length.isdigit() and written + int(length) > max_bytes:
+                            raise DownloadTooLarge(f"video is {(written + int(length)) / 1e6:.0f} MB")
+                        # Chunks as they arrive from the network, so a dropped connection loses nothing already received
+                        async for chunk in resp.aiter_bytes():
+                            written += len(chunk)
+                            if written > max_bytes:
+                                raise DownloadTooLarge(f"video exceeds {max_bytes / 1e6:.0f} MB")
+                            out.write(chunk)
+                    break
+                except (httpx.ReadError, httpx.ReadTimeout, httpx.RemoteProtocolError) as e:
+                    if resumes >= QWEN_DOWNLOAD_RETRIES:
+                        raise
+                    resumes += 1
+                    print(f"[download] connection dropped after {written / 1e6:.1f} MB ({e!s}); resuming", flush=True)
+    except BaseException:
+        _download_stats["failures"] += 1
+        Path(path).unlink(missing_ok=True)
+        raise
+    elapsed = max(time.time() - started, 1e-6)
+    mb = written / (1024 * 1024)
+    _download_stats["downloads"] += 1
+    _download_stats["resumes"] += resumes
+    _download_stats["bytes"] += written
+    _download_stats["seconds"] += elapsed
+    _download_stats["recent"].append({"mb": round(mb, 2), "seconds": round(elapsed, 2), "mb_per_s": round(mb / elapsed, 2), "resumes": resumes})
+    print(f"[download] {mb:.1f} MB in {elapsed:.1f}s ({mb / elapsed:.1f} MB/s, {resumes} resume(s))", flush=True)
+    return path
+
+
+def _download_snapshot() -> dict:
+    s = _download_stats
+    return {
+        "downloads": s["downloads"],
+        "failures": s["failures"],
+        "resumes": s["resumes"],
+        "mb": round(s["bytes"] / (1024 * 1024), 1),
+        "avg_mb_per_s": round(s["bytes"] / (1024 * 1024) / s["seconds"], 2) if s["seconds"] else None,
+        "max_mb": QWEN_MAX_DOWNLOAD_MB,
+        "recent": list(s["recent"]),
+    }
+
+
+# Cold-start milestones for this container, in seconds since container_started
+_cold_start = {
+    "container_started": time.time(),
+    "restored_from_snapshot": False,
+    "model_load_seconds": None,
+    "model_ready_seconds": None,
+    "first_evaluation_seconds": None,
+}
+
+
+def mark_container_start(restored_from_snapshot: bool = False):
+    """Restart the cold-start clock (call after a memory-snapshot restore; import time is then not part of it)."""
+    _cold_start.update(
+        container_started=time.time(),
+        restored_from_snapshot=restored_from_snapshot,
+        model_ready_seconds=None,
+        first_evaluation_seconds=None,
+    )
+    if model is not None:
+        _cold_start["model_ready_seconds"] = 0.0  # weights came back with the snapshot
+
+
+def _note_first_evaluation():
+    if _cold_start["first_evaluation_seconds"] is not None:
+        return
+    elapsed = time.time() - _cold_start["container_started"]
+    _cold_start["first_evaluation_seconds"] = round(elapsed, 1)
+    print(
+        f"[COLD_START] Time to first evaluation: {elapsed:.1f}s after container start "
+        f"(model ready at {_cold_start['model_ready_seconds']}s, snapshot restore: {_cold_start['restored_from_snapshot']})",
+        flush=True,
+    )
+
+
+def _cold_start_snapshot() -> dict:
+    c = dict(_cold_start)
+    c["uptime_seconds"] = round(time.time() - c.pop("container_started"), 1)
+    return c
+
 
 def _load_model(model_name: str, load_in_8bit: bool = False, load_in_4bit: bool = False):
-    global model, processor
+    global model, processor, _model_name
+    load_started = time.time()
     import torch
     import os
     from transformers import Qwen2_5_VLForConditionalGeneration, Qwen2_5_VLProcessor  # requires transformers>=4.50
@@ -100,6 +742,12 @@ def _load_model(model_name: str, load_in_8bit: bool = False, load_in_4bit: bool
         if device == "cpu":
             model = model.to(device)
     model.eval()
+    _model_name = model_name
+    _install_vision_cache(model)
+    json_grammar.vocab_for(processor.tokenizer)  # decode the vocabulary now rather than on the first evaluation
+    _cold_start["model_load_seconds"] = round(time.time() - load_started, 1)
+    _cold_start["model_ready_seconds"] = round(time.time() - _cold_start["container_started"], 1)
+    print(f"[COLD_START] Model loaded in {_cold_start['model_load_seconds']}s; ready {_cold_start['model_ready_seconds']}s after container start", flush=True)
     return model_name
 
 
@@ -135,6 +783,14 @@ def health():
     return {
         "status": "ok" if is_ready else "model_not_loaded",
         "model": "Qwen2.5-VL-7B" if is_ready else None,
+        "gpu": _gpu_snapshot(),
+        "downloads": _download_snapshot(),
+        "cold_start": _cold_start_snapshot(),
+        "frames": _frame_snapshot(),
+        "vision_cache": _vision_snapshot(),
+        "decoding": _decode_snapshot(),
+        "rubrics": _rubric_cache_snapshot(),
+        "prefix_cache": _prefix_snapshot(),
     }
 
 
@@ -171,20 +827,12 @@ async def analyze_video(file: UploadFile = File(...)):
         tmp_path = tmp.name
 
     try:
-        import torch
-        import gc
-        
-        # Clear memory before processing to free up space from previous requests
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            torch.cuda.synchronize()
-        gc.collect()
-
+        video_block, video_kwargs, sampling = await _video_input(tmp_path, "analyze_video")
         conversation = [
             {
                 "role": "user",
                 "content": [
-                    {"type": "video", "path": tmp_path},
+                    video_block,
                     {
                         "type": "text",
                         "text": (
@@ -198,42 +846,15 @@ async def analyze_video(file: UploadFile = File(...)):
             }
         ]
 
-        # Reduced fps from 0.25 to 0.15 to use fewer video frames and save memory
-        inputs = processor.apply_chat_template(
-            conversation,
-            fps=0.15,  # Reduced from 0.25 to save memory (fewer frames processed)
-            add_generation_prompt=True,
-            tokenize=True,
-            return_dict=True,
-            return_tensors="pt",
+        # Frame budget from the ffmpeg sampler, or fps 0.15 (reduced from 0.25) when decoding in-process
+        started = time.time()
+        vision = {}
+        video_notes = await _generate(
+            conversation, 512, "analyze_video", vision_key=_vision_key(sampling), vision_report=vision, **video_kwargs
         )
-        inputs = {k: v.to(model.device) if hasattr(v, "to") else v for k, v in inputs.items()}
-
-        # Clear cache again after moving inputs to GPU
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
 
-        with torch.no_grad():
-            out = model.generate(**inputs, max_new_tokens=512, do_sample=False)
-
-        gen_ids = [o[len(i) :] for i, o in zip(inputs["input_ids"], out)]
-        text = processor.batch_decode(gen_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True)
-        video_notes = (text[0] or "").strip()
-
-        return {"video_notes": video_notes}
+        return {"video_notes": video_notes, "metadata": _response_metadata(sampling, started, vision)}
     finally:
-        # Memory cleanup to prevent OOM on subsequent requests
-        try:
-            import gc
-            import torch
-            # Clear PyTorch cache
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-                torch.cuda.synchronize()
-            # Force garbage collection
-            gc.collect()
-        except Exception as cleanup_error:
-            print(f"[analyze_video] Memory cleanup warning: {cleanup_error!s}", flush=True)
         # Clean up temp file
         try:
             os.unlink(tmp_path)
@@ -310,11 +931,90 @@ def _get_textbook_chunks_block(rubric: dict) -> str:
         return ""
 
 
+# ----- Compiled rubrics: what a rubric contributes to the prompt, schema and score normalization, built once -----
+# Every video in a class batch comes with the same rubric. Its point distribution, section keys, name -> maxPoints
+# lookups, prompt text (all of EVALUATE_VIDEO_PROMPT except the textbook excerpts, which are retrieved per request)
+# and output schema are computed on first use and kept in an LRU keyed by the hash of the canonical rubric JSON, so
+# key order and whitespace don't matter. Entries are shared across requests and must not be mutated.
+QWEN_RUBRIC_CACHE_SIZE = int(os.environ.get("QWEN_RUBRIC_CACHE_SIZE", "64"))
+_compiled_rubrics = OrderedDict()  # sha256 of canonical rubric JSON -> _CompiledRubric; least recently used first
+_compiled_rubrics_lock = threading.Lock()
+_rubric_cache_stats = {"hits": 0, "misses": 0, "compile_seconds": 0.0}
+_TEXTBOOK_SLOT = "\x00textbook_block\x00"
+
+
+class _CompiledRubric:
+    """Everything derived from one rubric (see above)."""
+
+    def __init__(self, rubric: dict):
+        self.distribution = _point_distribution(rubric)
+        self.section_names = _section_names(rubric)
+        self.section_keys = ", ".join(self.section_names)
+        # category -> {lowercased subcategory name: maxPoints}, for matching the model's subcategories
+        self.sub_max = {
+            name: {s.get("name", "").strip().lower(): s.get("maxPoints") for s in info.get("subcategories", []) if s.get("name")}
+            for name, info in self.distribution.items()
+        }
+        self.structure = _format_rubric_structure(rubric, self.distribution)
+        self.point_block = _format_point_block(rubric, self.distribution)
+        prompt = EVALUATE_VIDEO_PROMPT.format(
+            rubric_structure=self.structure,
+            point_block=self.point_block,
+            example_videos_block=_format_example_videos_block(rubric),
+            behavior_block=_format_behavior_references_block(BEHAVIOR_REFERENCES),
+            textbook_block=_TEXTBOOK_SLOT,
+            section_keys=self.section_keys,
+        )
+        self.prompt_head, _, self.prompt_tail = prompt.partition(_TEXTBOOK_SLOT)
+        self._schema = None
+
+    @property
+    def schema(self) -> dict:
+        """Output schema for constrained decoding (built on first use; free generation never needs it)."""
+        if self._schema is None:
+            self._schema = _build_evaluation_schema(self.distribution, self.section_names)
+        return self._schema
+
+
+def _compiled_rubric(rubric: dict) -> _CompiledRubric:
+    """The cached compiled form of rubric, compiling it on a miss."""
+    key = hashlib.sha256(canonical_json(rubric if isinstance(rubric, dict) else None).encode("utf-8")).hexdigest()
+    with _compiled_rubrics_lock:
+        compiled = _compiled_rubrics.get(key)
+        if compiled is not None:
+            _compiled_rubrics.move_to_end(key)
+            _rubric_cache_stats["hits"] += 1
+            return compiled
+    started = time.perf_counter()
+    compiled = _CompiledRubric(rubric if isinstance(rubric, dict) else None)
+    with _compiled_rubrics_lock:
+        _rubric_cache_stats["misses"] += 1
+        _rubric_cache_stats["compile_seconds"] += time.perf_counter() - started
+        _compiled_rubrics[key] = compiled
+        while len(_compiled_rubrics) > max(1, QWEN_RUBRIC_CACHE_SIZE):
+            _compiled_rubrics.popitem(last=False)
+    return compiled
+
+
+def _rubric_cache_snapshot() -> dict:
+    with _compiled_rubrics_lock:
+        return {
+            "size": len(_compiled_rubrics),
+            "capacity": QWEN_RUBRIC_CACHE_SIZE,
+            "hits": _rubric_cache_stats["hits"],
+            "misses": _rubric_cache_stats["misses"],
+            "compile_ms": round(_rubric_cache_stats["compile_seconds"] * 1000, 1),
+        }
+
+
 def _rubric_to_eval_prompt(rubric: dict) -> str:
     """Build the rubric description for the evaluation prompt (with point values and subcategory descriptions)."""
+    return _compiled_rubric(rubric).structure
+
+
+def _format_rubric_structure(rubric: dict, dist: dict) -> str:
     if not rubric or not isinstance(rubric.get("categories"), list):
         return "Categories: Content, Delivery. Subcategories: score each as appropriate."
-    dist = _rubric_point_distribution(rubric)
     lines = []
     for cat in rubric["categories"]:
         name = cat.get("name", "Category") if isinstance(cat, dict) else str(cat)
@@ -358,7 +1058,10 @@ def _rubric_to_eval_prompt(rubric: dict) -> str:
 
 def _rubric_point_block(rubric: dict) -> str:
     """Build explicit point-values block for prompt so model uses correct math."""
-    dist = _rubric_point_distribution(rubric)
+    return _compiled_rubric(rubric).point_block
+
+
+def _format_point_block(rubric: dict, dist: dict) -> str:
     if not dist:
         return ""
     total = rubric.get("totalPoints") or 50
@@ -374,6 +1077,10 @@ def _rubric_point_block(rubric: dict) -> str:
 
 def _rubric_point_distribution(rubric: dict) -> dict:
     """Return correct maxScore per category and maxPoints per subcategory from rubric. Used to enforce correct math."""
+    return _compiled_rubric(rubric).distribution
+
+
+def _point_distribution(rubric: dict) -> dict:
     if not rubric or not isinstance(rubric.get("categories"), list):
         return {}
     total = rubric.get("totalPoints") or 50
@@ -410,16 +1117,92 @@ def _rubric_point_distribution(rubric: dict) -> dict:
     return out
 
 
-def _rubric_section_keys(rubric: dict) -> str:
-    """Exact category names to use as keys in 'sections' (so the model matches the frontend)."""
+def _rubric_section_names(rubric: dict) -> list:
+    """Category names in rubric order (Content, Delivery when the rubric has none)."""
+    return _compiled_rubric(rubric).section_names
+
+
+def _section_names(rubric: dict) -> list:
     if not rubric or not isinstance(rubric.get("categories"), list):
-        return "Content, Delivery"
+        return ["Content", "Delivery"]
     names = []
     for cat in rubric["categories"]:
         name = cat.get("name", "") if isinstance(cat, dict) else str(cat)
         if name:
             names.append(name)
-    return ", ".join(names) if names else "Content, Delivery"
+    return names or ["Content", "Delivery"]
+
+
+def _rubric_section_keys(rubric: dict) -> str:
+    """Exact category names to use as keys in 'sections' (so the model matches the frontend)."""
+    return _compiled_rubric(rubric).section_keys
+
+
+def _evaluation_json_schema(rubric: dict) -> dict:
+    """JSON schema of EVALUATE_VIDEO_PROMPT's output for this rubric: every category, its subcategories by name, markers."""
+    return _compiled_rubric(rubric).schema
+
+
+def _build_evaluation_schema(dist: dict, section_names: list) -> dict:
+    names = list(dict.fromkeys(section_names))
+    free_sub = {
+        "type": "object",
+        "properties": {
+            "name": {"type": "string", "maxLength": 120},
+            "points": {"type": "number", "minimum": 0},
+            "maxPoints": {"type": "number", "minimum": 0},
+            "feedback": {"type": "string", "maxLength": 300},
+        },
+    }
+    sections = {}
+    for name in names:
+        info = dist.get(name)
+        if info:
+            subcategories = {
+                "type": "array",
+                "prefixItems": [
+                    {
+                        "type": "object",
+                        "properties": {
+                            "name": {"const": s["name"]},
+                            "points": {"type": "number", "minimum": 0},
+                            "maxPoints": {"const": s["maxPoints"]},
+                            "feedback": {"type": "string", "maxLength": 300},
+                        },
+                    }
+                    for s in info.get("subcategories", [])
+                ],
+            }
+            max_score = {"const": info["maxScore"]}
+        else:
+            subcategories = {"type": "array", "items": free_sub, "maxItems": 12}
+            max_score = {"type": "number", "minimum": 0}
+        sections[name] = {
+            "type": "object",
+            "properties": {
+                "score": {"type": "number", "minimum": 0},
+                "maxScore": max_score,
+                "feedback": {"type": "string", "maxLength": 400},
+                "subcategories": subcategories,
+            },
+        }
+    marker = {
+        "type": "object",
+        "properties": {
+            "seconds": {"type": "number", "minimum": 0},
+            "label": {"type": "string", "maxLength": 80},
+            "observation": {"type": "string", "maxLength": 240},
+            "severity": {"enum": ["positive", "minor", "moderate", "major"]},
+            "category": {"enum": list(dict.fromkeys(names + ["Content", "Delivery"]))},
+        },
+    }
+    return {
+        "type": "object",
+        "properties": {
+            "sections": {"type": "object", "properties": sections},
+            "timeline_markers": {"type": "array", "items": marker, "maxItems": 40},
+        },
+    }
 
 
 def _placeholder_sections_from_rubric(rubric: dict) -> dict:
@@ -436,7 +1219,8 @@ def _placeholder_sections_from_rubric(rubric: dict) -> dict:
 
 def _normalize_sections_to_rubric(sections: dict, rubric: dict) -> dict:
     """Enforce rubric point distribution: override maxScore/maxPoints and scale model scores proportionally."""
-    dist = _rubric_point_distribution(rubric)
+    compiled = _compiled_rubric(rubric)
+    dist = compiled.distribution
     if not dist or not sections:
         return sections
     out = {}
@@ -449,7 +1233,7 @@ def _normalize_sections_to_rubric(sections: dict, rubric: dict) -> dict:
             out[cat_name] = sec
             continue
         rubric_max = info.get("maxScore")
-        rubric_subs = {s.get("name", "").strip().lower(): s.get("maxPoints") for s in info.get("subcategories", []) if s.get("name")}
+        rubric_subs = compiled.sub_max[cat_name]
         model_max = sec.get("maxScore")
         model_score = sec.get("score", 0) or 0
         # Scale category score if model used wrong max
@@ -580,7 +1364,7 @@ def _scrape_scores_from_raw(raw: str, rubric: dict, placeholder_sections: dict)
     return out
 
 
-EVALUATE_VIDEO_PROMPT = """Watch and listen to this speech video. Evaluate it using the rubric below.
+EVALUATE_VIDEO_PROMPT = """Watch and listen to the speech video that follows these instructions. Evaluate it using the rubric below.
 
 How to assess:
 - **Content and verbal delivery**: Use the speech (what is said and how it is said)—main ideas, organization, purpose statement, evidence, vocal delivery, pacing, vocalized pauses, clarity. Score content and verbal-delivery categories from the speaker's words and voice.
@@ -613,130 +1397,49 @@ Example 2 (structure only—use YOUR rubric's category names):
 Output only the JSON object. Do not wrap in markdown. Use the exact category and subcategory names from the rubric above."""
 
 
-def _strip_markdown_json(text: str) -> str:
-    """Remove markdown code fence so we can parse JSON inside ```json ... ``` or ``` ... (handles truncated output with no closing fence)."""
-    s = text.strip()
-    # Strip opening fence (```json or ```, case-insensitive)
-    m = re.match(r"^```(?:json)?\s*\n?", s, re.IGNORECASE)
-    if m:
-        s = s[m.end() :].lstrip()
-    # Strip closing fence if present (truncated output may not have it)
-    if s.endswith("```"):
-        s = s[:-3].rstrip()
-    return s
-
-
-def _extract_sections_from_raw(raw: str) -> dict | None:
-    """Try to find and parse a 'sections' object when it appears as a key in raw text (e.g. model output sections in a different block)."""
-    idx = raw.find('"sections"')
-    if idx == -1:
-        idx = raw.find("'sections'")
-    if idx == -1:
-        return None
-    # Find the next ':' then skip whitespace and '{'
-    after_key = raw[idx:].find(":")
-    if after_key == -1:
-        return None
-    start = idx + after_key + 1
-    while start < len(raw) and raw[start] in " \t\n\r":
-        start += 1
-    if start >= len(raw) or raw[start] != "{":
-        return None
-    depth = 0
-    end = -1
-    for i in range(start, len(raw)):
-        if raw[i] == "{":
-            depth += 1
-        elif raw[i] == "}":
-            depth -= 1
-            if depth == 0:
-                end = i + 1
-                break
-    if end == -1:
-        # Truncated: strip trailing comma, close braces, and parse
-        fragment = raw[start:].rstrip()
-        while fragment.endswith(","):
-            fragment = fragment[:-1].rstrip()
-        if depth > 0:
-            try:
-                closed = fragment + ("}" * depth)
-                return json.loads(closed)
-            except json.JSONDecodeError:
-                pass
-        return None
-    try:
-        return json.loads(raw[start:end])
-    except json.JSONDecodeError:
-        return None
-
-
 def _extract_json_from_response(text: str) -> dict | None:
-    """Parse one or more JSON objects from model output and merge. Handles ```json fences and truncated output."""
-    text = _strip_markdown_json(text)
+    """Merge the keys we use from every JSON object in model output (fenced, prose-wrapped or truncated; see json_extract)."""
+    found = json_extract.extract(text, keys=("sections",))
     merged: dict = {}
-    pos = 0
-    while True:
-        start = text.find("{", pos)
-        if start == -1:
-            break
-        depth = 0
-        end = -1
-        for i in range(start, len(text)):
-            if text[i] == "{":
-                depth += 1
-            elif text[i] == "}":
-                depth -= 1
-                if depth == 0:
-                    end = i + 1
-                    break
-        if end == -1:
-            # Truncated JSON: strip trailing comma, close braces, and parse
-            fragment = text[start:].rstrip()
-            while fragment.endswith(","):
-                fragment = fragment[:-1].rstrip()
-            if depth > 0:
-                try:
-                    closed = fragment + ("}" * depth)
-                    obj = json.loads(closed)
-                    if isinstance(obj, dict):
-                        if obj.get("sections"):
-                            merged["sections"] = obj["sections"]
-                        if obj.get("timeline_markers") is not None:
-                            merged["timeline_markers"] = obj["timeline_markers"]
-                        if obj.get("overallComments") or obj.get("overall_comments"):
-                            merged["overallComments"] = obj.get("overallComments") or obj.get("overall_comments")
-                        if obj.get("transcript") is not None:
-                            merged["transcript"] = obj["transcript"]
-                except json.JSONDecodeError:
-                    pass
-            break
-        try:
-            obj = json.loads(text[start:end])
-            if isinstance(obj, dict):
-                if obj.get("sections"):
-                    merged["sections"] = obj["sections"]
-                if obj.get("timeline_markers") is not None:
-                    merged["timeline_markers"] = obj["timeline_markers"]
-                if obj.get("overallComments") or obj.get("overall_comments"):
-                    merged["overallComments"] = obj.get("overallComments") or obj.get("overall_comments")
-                if obj.get("transcript") is not None:
-                    merged["transcript"] = obj["transcript"]
-        except json.JSONDecodeError:
-            pass
-        pos = end
-    # If we have markers but no sections, try to find "sections" elsewhere in raw text
-    if merged.get("timeline_markers") is not None and not merged.get("sections"):
-        sections = _extract_sections_from_raw(text)
-        if sections:
-            merged["sections"] = sections
-    # If still no sections but raw has a truncated "sections" object, try extracting it
-    if not merged.get("sections"):
-        sections = _extract_sections_from_raw(text)
-        if sections:
-            merged["sections"] = sections
+    for obj in found.objects:
+        if obj.get("sections"):
+            merged["sections"] = obj["sections"]
+        if obj.get("timeline_markers") is not None:
+            merged["timeline_markers"] = obj["timeline_markers"]
+        if obj.get("overallComments") or obj.get("overall_comments"):
+            merged["overallComments"] = obj.get("overallComments") or obj.get("overall_comments")
+        if obj.get("transcript") is not None:
+            merged["transcript"] = obj["transcript"]
+    # "sections" nested somewhere else, or inside an object that isn't valid JSON as a whole
+    sections = found.values.get("sections")
+    if not merged.get("sections") and isinstance(sections, dict) and sections:
+        merged["sections"] = sections
     return merged if merged else None
 
 
+def _format_example_videos_block(rubric: dict) -> str:
+    example_videos = (rubric or {}).get("exampleVideos") or (rubric or {}).get("example_videos") or []
+    if not example_videos or not isinstance(example_videos, list):
+        return ""
+    lines = ["Reference example videos (instructor-provided URLs for context):"]
+    for ev in example_videos:
+        if isinstance(ev, dict) and ev.get("url"):
+            label = ev.get("label", "").strip()
+            lines.append(f"- {ev['url']}" + (f" ({label})" if label else ""))
+    return "\n".join(lines)
+
+
+def _build_evaluate_prompt(rubric_obj: dict) -> str:
+    """EVALUATE_VIDEO_PROMPT filled in for this rubric (structure, points, example videos, behaviors, textbook excerpts)."""
+    compiled = _compiled_rubric(rubric_obj)
+    try:
+        textbook_block = _get_textbook_chunks_block(rubric_obj)
+    except Exception as e:
+        print(f"[evaluate_video] textbook RAG skipped: {e!s}", flush=True)
+        textbook_block = ""
+    return compiled.prompt_head + textbook_block + compiled.prompt_tail
+
+
 @app.post("/evaluate_video")
 async def evaluate_video(
     file: UploadFile = File(None),
@@ -773,24 +1476,11 @@ async def evaluate_video(
 
     # Support both file upload and storage URL
     tmp_path = None
+    download = None
     if storage_url:
-        # Fetch video from storage URL
+        # Fetch video from storage URL in the background while the prompt is built
         print(f"[evaluate_video] Using storage URL: {storage_url}", flush=True)
-        try:
-            import httpx
-            async with httpx.AsyncClient(timeout=300.0) as client:
-                video_response = await client.get(storage_url)
-                if video_response.status_code != 200:
-                    raise HTTPException(status_code=400, detail=f"Failed to fetch video from storage URL: {video_response.status_code}")
-                
-                # Save to temp file
-                suffix = Path(storage_url).suffix or ".mp4"
-                with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-                    tmp.write(video_response.content)
-                    tmp_path = tmp.name
-        except Exception as e:
-            print(f"[evaluate_video] Failed to fetch from storage URL: {e!s}", flush=True)
-            raise HTTPException(status_code=400, detail=f"Failed to fetch video from storage URL: {str(e)}")
+        download = asyncio.create_task(_download_to_tempfile(storage_url))
     elif file:
         # Traditional file upload
         content_type = file.content_type or ""
@@ -807,86 +1497,62 @@ async def evaluate_video(
         raise HTTPException(status_code=400, detail="Either 'file' or 'storage_url' must be provided")
 
     try:
-        rubric_obj = json.loads(rubric)
-    except json.JSONDecodeError as e:
-        print(f"[evaluate_video] 400: invalid rubric JSON: {e!s}, rubric_len={len(rubric)}, rubric_preview={rubric[:200]!r}", flush=True)
-        raise HTTPException(status_code=400, detail=f"Invalid rubric JSON: {e}")
-
-    rubric_structure = _rubric_to_eval_prompt(rubric_obj)
-    behavior_block = _format_behavior_references_block(BEHAVIOR_REFERENCES)
-    if not behavior_block:
-        behavior_block = ""
-    section_keys = _rubric_section_keys(rubric_obj)
-    point_block = _rubric_point_block(rubric_obj)
-    example_videos = rubric_obj.get("exampleVideos") or rubric_obj.get("example_videos") or []
-    if example_videos and isinstance(example_videos, list):
-        lines = ["Reference example videos (instructor-provided URLs for context):"]
-        for ev in example_videos:
-            if isinstance(ev, dict) and ev.get("url"):
-                label = ev.get("label", "").strip()
-                lines.append(f"- {ev['url']}" + (f" ({label})" if label else ""))
-        example_videos_block = "\n".join(lines)
-    else:
-        example_videos_block = ""
-    try:
-        textbook_block = _get_textbook_chunks_block(rubric_obj)
-    except Exception as e:
-        print(f"[evaluate_video] textbook RAG skipped: {e!s}", flush=True)
-        textbook_block = ""
-    prompt_text = EVALUATE_VIDEO_PROMPT.format(
-        rubric_structure=rubric_structure,
-        point_block=point_block,
-        example_videos_block=example_videos_block,
-        behavior_block=behavior_block,
-        textbook_block=textbook_block,
-        section_keys=section_keys,
-    )
+        try:
+            rubric_obj = json.loads(rubric)
+        except json.JSONDecodeError as e:
+            print(f"[evaluate_video] 400: invalid rubric JSON: {e!s}, rubric_len={len(rubric)}, rubric_preview={rubric[:200]!r}", flush=True)
+            raise HTTPException(status_code=400, detail=f"Invalid rubric JSON: {e}")
 
-    try:
-        import torch
-        import gc
-        
-        # Clear memory before processing to free up space from previous requests
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            torch.cuda.synchronize()
-        gc.collect()
+        # Off the loop (textbook RAG does blocking DB calls) so the storage download keeps streaming meanwhile
+        prompt_text = await asyncio.to_thread(_build_evaluate_prompt, rubric_obj)
+
+        if download is not None:
+            try:
+                tmp_path = await download
+            except DownloadTooLarge as e:
+                raise HTTPException(status_code=413, detail=f"Video too large: {e} (limit {QWEN_MAX_DOWNLOAD_MB} MB)")
+            except HTTPException:
+                raise
+            except Exception as e:
+                print(f"[evaluate_video] Failed to fetch from storage URL: {e!s}", flush=True)
+                raise HTTPException(status_code=400, detail=f"Failed to fetch video from storage URL: {str(e)}")
+    except BaseException:
+        if download is not None:
+            if not download.done():
+                download.cancel()
+            elif not download.cancelled() and download.exception() is None:
+                Path(download.result()).unlink(missing_ok=True)
+        if tmp_path:
+            Path(tmp_path).unlink(missing_ok=True)
+        raise
 
+    try:
+        video_block, video_kwargs, sampling = await _video_input(tmp_path, "evaluate_video")
+        # Prompt first: everything before the video is shared by the rubric's other evaluations (prefix cache)
         conversation = [
             {
                 "role": "user",
                 "content": [
-                    {"type": "video", "path": tmp_path},
                     {"type": "text", "text": prompt_text},
+                    video_block,
                 ],
             }
         ]
 
-        # Reduced fps from 0.25 to 0.15 to use fewer video frames and save memory
-        inputs = processor.apply_chat_template(
-            conversation,
-            fps=0.15,  # Reduced from 0.25 to save memory (fewer frames processed)
-            add_generation_prompt=True,
-            tokenize=True,
-            return_dict=True,
-            return_tensors="pt",
+        # Sampled frame budget (or fps 0.15 in-process); max_new_tokens 3072 (from 4096) saves memory
+        started = time.time()
+        vision = {}
+        generation = {}
+        schema = _evaluation_json_schema(rubric_obj) if _constrained_json() else None
+        raw = await _generate(
+            conversation, 3072, "evaluate_video", vision_key=_vision_key(sampling), vision_report=vision,
+            json_schema=schema, stop_at_json_end=True, generation_report=generation, reuse_prefix=True, **video_kwargs
         )
-        inputs = {k: v.to(model.device) if hasattr(v, "to") else v for k, v in inputs.items()}
-
-        # Clear cache again after moving inputs to GPU
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-
-        with torch.no_grad():
-            # Reduced max_new_tokens from 4096 to 3072 to save memory
-            out = model.generate(**inputs, max_new_tokens=3072, do_sample=False)
-
-        gen_ids = [o[len(i):] for i, o in zip(inputs["input_ids"], out)]
-        text = processor.batch_decode(gen_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True)
-        raw = (text[0] or "").strip()
+        metadata = _response_metadata(sampling, started, vision, generation)
 
         parsed = _extract_json_from_response(raw)
         sections = parsed.get("sections") if parsed else None
+        _record_decode("evaluate_video", generation, _is_json(raw), bool(sections))
         print(f"[evaluate_video] raw_len={len(raw)} parsed_keys={list(parsed.keys()) if parsed else None} has_sections={bool(sections)} section_keys={list(sections.keys()) if isinstance(sections, dict) else None}", flush=True)
         if parsed is None:
             return {
@@ -894,6 +1560,7 @@ async def evaluate_video(
                 "overallComments": "Qwen could not return valid JSON. Raw output: " + raw[:500],
                 "transcript": "",
                 "timeline_markers": [],
+                "metadata": metadata,
             }
 
         # New format: {"sections": {...}, "timeline_markers": [...], "overallComments": "..." }
@@ -955,28 +1622,18 @@ async def evaluate_video(
         if sections and rubric_obj:
             sections = _normalize_sections_to_rubric(sections, rubric_obj)
 
+        _note_first_evaluation()
         return {
             "sections": sections,
             "overallComments": overall_comments,
             "transcript": parsed.get("transcript") or "",
             "timeline_markers": timeline_markers,
+            "metadata": metadata,
         }
     except Exception as e:
         print(f"[evaluate_video] 500: {e!s}", flush=True)
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        # Memory cleanup to prevent OOM on subsequent requests
-        try:
-            import gc
-            import torch
-            # Clear PyTorch cache
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-                torch.cuda.synchronize()
-            # Force garbage collection
-            gc.collect()
-        except Exception as cleanup_error:
-            print(f"[evaluate_video] Memory cleanup warning: {cleanup_error!s}", flush=True)
         # Clean up temp file
         try:
             os.unlink(tmp_path)
@@ -1018,6 +1675,44 @@ IMPORTANT: Keep each description to a SHORT phrase (max 40 chars). Use abbreviat
 Return ONLY the JSON object, nothing else."""
 
 
+RUBRIC_EXTRACT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "speechType": {"type": "string", "maxLength": 80},
+        "totalPoints": {"type": "number", "minimum": 0},
+        "categories": {
+            "type": "array",
+            "maxItems": 20,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "maxLength": 120},
+                    "subcategories": {
+                        "type": "array",
+                        "maxItems": 20,
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "name": {"type": "string", "maxLength": 120},
+                                "points": {"type": "number", "minimum": 0},
+                                "description": {"type": "string", "maxLength": 80},
+                            },
+                        },
+                    },
+                },
+            },
+        },
+        "gradeScale": {
+            "type": "object",
+            "additionalProperties": {
+                "type": "object",
+                "properties": {"min": {"type": "number", "minimum": 0}, "label": {"type": "string", "maxLength": 60}},
+            },
+        },
+    },
+}
+
+
 @app.post("/extract_rubric")
 async def extract_rubric(file: UploadFile = File(...)):
     """Extract rubric structure from image or PDF."""
@@ -1054,15 +1749,6 @@ async def extract_rubric(file: UploadFile = File(...)):
             img_path = tmp.name
 
     try:
-        import torch
-        import gc
-        
-        # Clear memory before processing to free up space from previous requests
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            torch.cuda.synchronize()
-        gc.collect()
-
         conversation = [
             {
                 "role": "user",
@@ -1073,67 +1759,22 @@ async def extract_rubric(file: UploadFile = File(...)):
             }
         ]
 
-        inputs = processor.apply_chat_template(
-            conversation,
-            add_generation_prompt=True,
-            tokenize=True,
-            return_dict=True,
-            return_tensors="pt",
+        # Reduced max_new_tokens from 4096 to 3072 to save memory
+        generation = {}
+        schema = RUBRIC_EXTRACT_SCHEMA if _constrained_json() else None
+        raw = await _generate(
+            conversation, 3072, "extract_rubric", json_schema=schema, stop_at_json_end=True, generation_report=generation
         )
-        inputs = {k: v.to(model.device) if hasattr(v, "to") else v for k, v in inputs.items()}
+        valid_json = _is_json(raw)
 
-        # Clear cache again after moving inputs to GPU
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-
-        with torch.no_grad():
-            # Reduced max_new_tokens from 4096 to 3072 to save memory
-            out = model.generate(**inputs, max_new_tokens=3072, do_sample=False)
-
-        gen_ids = [o[len(i) :] for i, o in zip(inputs["input_ids"], out)]
-        text = processor.batch_decode(gen_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True)
-        raw = (text[0] or "").strip()
-
-        # Parse JSON (handle markdown fences and truncation)
-        import re
-        if "```" in raw:
-            m = re.search(r"```(?:json)?\s*([\s\S]*?)```", raw)
-            if m:
-                raw = m.group(1).strip()
-        start = raw.find("{")
-        if start >= 0:
-            raw = raw[start:]
-        raw = raw.rstrip().rstrip(",")
-        rubric = None
-        for _ in range(20):
-            try:
-                rubric = json.loads(raw)
-                break
-            except json.JSONDecodeError:
-                if raw.count("[") > raw.count("]"):
-                    raw += "]"
-                elif raw.count("{") > raw.count("}"):
-                    raw += "}"
-                else:
-                    raise
+        # First JSON object in the output (fences and prose skipped, a truncated one repaired)
+        rubric = next(iter(json_extract.extract(raw).objects), None)
         if rubric is None:
-            rubric = json.loads(raw)
+            _record_decode("extract_rubric", generation, False, False)
+            raise HTTPException(status_code=500, detail="Failed to parse rubric JSON: no JSON object in the model output")
+        _record_decode("extract_rubric", generation, valid_json, True)
         return rubric
-    except json.JSONDecodeError as e:
-        raise HTTPException(status_code=500, detail=f"Failed to parse rubric JSON: {e}")
     finally:
-        # Memory cleanup to prevent OOM on subsequent requests
-        try:
-            import gc
-            import torch
-            # Clear PyTorch cache
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-                torch.cuda.synchronize()
-            # Force garbage collection
-            gc.collect()
-        except Exception as cleanup_error:
-            print(f"[extract_rubric] Memory cleanup warning: {cleanup_error!s}", flush=True)
         # Clean up temp file
         try:
             if img_path and os.path.exists(img_path):
@@ -0,0 +1,169 @@
+"""
+On-disk LRU cache for evaluation results, keyed by content hash.
+
+Usage:
+  cache = DiskLRUCache("/tmp/qwen_results", max_bytes=256 * 1024 * 1024, max_entries=5000)
+  key = DiskLRUCache.make_key(sha256_file(video), canonical_json(rubric), "qwen-v1")
+  body = cache.get(key)
+  if body is None:
+      body = run_evaluation(...)
+      cache.put(key, body)
+
+One file per entry; recency is the file mtime (touched on every hit), so the cache survives restarts and
+several processes can share one directory. Once either limit is exceeded the least recently used entries
+are deleted. Stdlib only, so app.py can import it without the training dependencies.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+_SUFFIX = ".cache"
+
+
+def sha256_file(fileobj, chunk_bytes: int = 1024 * 1024) -> str:
+    """Hex SHA-256 of a seekable file's whole contents; the file position is restored afterwards."""
+    offset = fileobj.tell()
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    try:
+        while True:
+            chunk = fileobj.read(chunk_bytes)
+            if not chunk:
+                break
+            digest.update(chunk)
+    finally:
+        fileobj.seek(offset)
+    return digest.hexdigest()
+
+
+def canonical_json(value) -> str:
+    """Stable text for a JSON value (or JSON string): sorted keys, no whitespace. Non-JSON strings are returned stripped."""
+    if isinstance(value, (str, bytes)):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return value.decode("utf-8", errors="replace").strip() if isinstance(value, bytes) else value.strip()
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+class DiskLRUCache:
+    """Bytes-valued LRU cache in a directory, bounded by total size and (optionally) entry count."""
+
+    def __init__(self, directory, max_bytes: int, max_entries: int = 0):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # key -> size, least recently used first
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        entries = []
+        for path in self.directory.glob(f"*{_SUFFIX}"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, path.name[: -len(_SUFFIX)], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._bytes += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Hash any number of key parts (video digest, canonical rubric, model/prompt version...) into one key."""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode("utf-8"))
+            digest.update(b"\x1f")
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}{_SUFFIX}"
+
+    def get(self, key: str):
+        """Cached bytes for key, or None. A hit marks the entry most recently used."""
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self._bytes -= size
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key not in self._index:
+                # Written by another process sharing the directory
+                self._index[key] = len(data)
+                self._bytes += len(data)
+            self._index.move_to_end(key)
+        return data
+
+    def put(self, key: str, value: bytes):
+        """Store value under key (atomic rename, so readers never see a partial entry) and evict if over budget."""
+        if self.max_bytes and len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(value)
+        os.replace(tmp, path)
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old is not None:
+                self._bytes -= old
+            self._index[key] = len(value)
+            self._bytes += len(value)
+            self._evict()
+
+    def _evict(self):
+        while self._index and (
+            (self.max_bytes and self._bytes > self.max_bytes)
+            or (self.max_entries and len(self._index) > self.max_entries)
+        ):
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._index):
+                try:
+                    self._path(key).unlink()
+                except OSError:
+                    pass
+            self._index.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "directory": str(self.directory),
+            }
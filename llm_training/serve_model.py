@@ -7,14 +7,30 @@ Endpoints:
   POST /evaluate            -> body: { "transcript": "...", "rubric_name": "...", "rubric": { ... }, "video_notes": "..." (optional) }
                               response: { "sections": { ... }, "overallComments": "..." }
   POST /evaluate_with_file  -> multipart: file, rubric (JSON string), video_notes (optional). Requires whisper.
+                              WHISPER_MODEL picks the model size (default base); it is loaded once per process.
   POST /llm-export          -> body: JSON array (export from dashboard). Saves to exported.json and runs run_training.sh (ISAAC). Optional header X-LLM-Export-Secret.
 
+Concurrent /evaluate requests are micro-batched: EVAL_BATCH_WINDOW_MS (default 15) and EVAL_BATCH_MAX (default 8;
+1 disables batching) control how long the scheduler waits and how many prompts share one generate().
+
+Each prompt's generation stops as soon as its JSON object closes (json_grammar.JSONObjectEnd); EVAL_EARLY_STOP=0
+lets it run on and only measures the tokens spent after the close. Responses carry metadata.generation (tokens,
+tokens and GPU seconds saved) and /health "early_stop" the totals.
+
+Everything in a prompt before "Transcript:" (system prompt, rubric, reference examples, textbook excerpts) is the
+same for every evaluation against a rubric; its keys/values are computed once and reused (prefix_cache.py), and
+batches are formed per rubric so all rows share it. EVAL_PREFIX_CACHE=0 turns it off, EVAL_PREFIX_CACHE_MB bounds
+it (default 512). metadata.generation.prefix and /health "prefix_cache" report time to first token with and
+without reuse.
+
 Usage:
   pip install -r requirements-train.txt fastapi uvicorn
   python serve_model.py --model_path ./mistral7b-speech-lora [--port 8000] [--load_in_8bit]
+  python serve_model.py --model_path ./mistral7b-speech-lora --benchmark 32   # evaluations/sec/GPU and TTFT, batched vs not
 """
 
 import argparse
+import asyncio
 import base64
 import json
 import os
@@ -22,7 +38,10 @@ import shutil
 import stat
 import subprocess
 import tempfile
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future
 from pathlib import Path
 
 # Load .env from repo root so RENDER_LLM_EXPORT_SECRET is set when this module handles /api/llm-export
@@ -58,7 +77,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel
 from peft import PeftModel
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, LogitsProcessorList, StoppingCriteriaList
+
+try:
+    from llm_training import json_extract, json_grammar, prefix_cache
+except ImportError:
+    import json_extract
+    import json_grammar
+    import prefix_cache
 
 # Rate limiting
 from slowapi import Limiter, _rate_limit_exceeded_handler
@@ -100,6 +126,20 @@ try:
 except ImportError:
     pass
 
+# Whisper registry: one model per size per process, loaded on first use (or by warm_whisper() at startup).
+# Whisper's decoder installs kv-cache hooks on the shared model, so transcriptions on one model are serialized.
+WHISPER_MODEL_SIZE = os.environ.get("WHISPER_MODEL", "base").strip() or "base"
+_whisper_models = {}
+_whisper_registry_lock = threading.Lock()
+_whisper_stats = {
+    "load_seconds": {},
+    "transcriptions": 0,
+    "errors": 0,
+    "transcribe_seconds_total": 0.0,
+    "transcribe_seconds_max": 0.0,
+    "recent": deque(maxlen=20),
+}
+
 
 class EvaluateRequest(BaseModel):
     transcript: str
@@ -112,6 +152,7 @@ class EvaluateResponse(BaseModel):
     sections: dict
     overallComments: str = ""
     transcript: str = ""  # Set when using /evaluate_with_file
+    metadata: dict | None = None  # generation: tokens, early-stop savings
 
 
 def load_model_and_tokenizer(model_path: str, base_model: str, load_in_8bit: bool):
@@ -123,6 +164,9 @@ def load_model_and_tokenizer(model_path: str, base_model: str, load_in_8bit: boo
     tokenizer = AutoTokenizer.from_pretrained(str(path), trust_remote_code=True)
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
+    # Batched generate() needs prompts right-aligned so every row's new tokens start at the same column
+    tokenizer.padding_side = "left"
+    json_grammar.vocab_for(tokenizer)  # token texts for the early-stop scanner, decoded once here
 
     model_kwargs = {"torch_dtype": torch.bfloat16 if DEVICE == "cuda" else torch.float32}
     if load_in_8bit:
@@ -135,6 +179,68 @@ def load_model_and_tokenizer(model_path: str, base_model: str, load_in_8bit: boo
     model.eval()
 
 
+def get_whisper_model(size: str | None = None):
+    """Return (model, transcribe_lock) for size (default WHISPER_MODEL); the model is loaded once per process."""
+    size = size or WHISPER_MODEL_SIZE
+    entry = _whisper_models.get(size)
+    if entry is None:
+        with _whisper_registry_lock:
+            entry = _whisper_models.get(size)
+            if entry is None:
+                t0 = time.time()
+                entry = (whisper.load_model(size, device=DEVICE), threading.Lock())
+                load_seconds = time.time() - t0
+                _whisper_stats["load_seconds"][size] = round(load_seconds, 2)
+                _whisper_models[size] = entry
+                print(f"[WHISPER] Loaded '{size}' model on {DEVICE} in {load_seconds:.1f}s")
+    return entry
+
+
+def warm_whisper():
+    """Load the configured Whisper model ahead of the first request. No-op without openai-whisper."""
+    if not WHISPER_AVAILABLE:
+        return
+    try:
+        get_whisper_model()
+    except Exception as e:
+        print(f"[WHISPER] Warm-up failed (will retry on first request): {e}")
+
+
+def transcribe(path: str) -> str:
+    """Transcribe an audio/video file with the shared Whisper model and record its latency."""
+    whisper_model, lock = get_whisper_model()
+    t0 = time.time()
+    try:
+        with lock:
+            result = whisper_model.transcribe(path, fp16=(DEVICE == "cuda"))
+    except Exception:
+        _whisper_stats["errors"] += 1
+        raise
+    elapsed = time.time() - t0
+    _whisper_stats["transcriptions"] += 1
+    _whisper_stats["transcribe_seconds_total"] += elapsed
+    _whisper_stats["transcribe_seconds_max"] = max(_whisper_stats["transcribe_seconds_max"], elapsed)
+    _whisper_stats["recent"].append(round(elapsed, 2))
+    print(f"[WHISPER] Transcribed {Path(path).name} in {elapsed:.1f}s")
+    return (result.get("text") or "").strip()
+
+
+def whisper_stats() -> dict:
+    """Whisper load-time and transcription-latency metrics (served in /health and the Render app's /diagnostics)."""
+    count = _whisper_stats["transcriptions"]
+    return {
+        "available": WHISPER_AVAILABLE,
+        "model_size": WHISPER_MODEL_SIZE,
+        "loaded": sorted(_whisper_models),
+        "load_seconds": dict(_whisper_stats["load_seconds"]),
+        "transcriptions": count,
+        "errors": _whisper_stats["errors"],
+        "transcribe_seconds_avg": round(_whisper_stats["transcribe_seconds_total"] / count, 2) if count else None,
+        "transcribe_seconds_max": round(_whisper_stats["transcribe_seconds_max"], 2),
+        "recent_transcribe_seconds": list(_whisper_stats["recent"]),
+    }
+
+
 def _format_rubric_structure(rubric: dict) -> str | None:
     """Format rubric categories and subcategories for the prompt so the model knows exactly what to output."""
     if not rubric:
@@ -242,10 +348,18 @@ def _format_reference_examples_block(examples: list) -> str:
     return "\n".join(lines)
 
 
+TRANSCRIPT_HEADER = "Transcript:\n"
+
+
 def build_messages(
     transcript: str, rubric_name: str, rubric: dict, video_notes: str = ""
 ) -> list:
-    """Same prompt shape as in training (system + user). Include full rubric structure, video_notes, and optional reference examples."""
+    """
+    Same prompt shape as in training (system + user). Include full rubric structure, video_notes, and optional reference
+    examples. The per-rubric parts (reference examples, textbook excerpts) go before the transcript, so a class's
+    prompts share everything up to TRANSCRIPT_HEADER (see _generate_batch); training rows have neither block, so
+    their layout (export_to_jsonl.js) is unchanged.
+    """
     system = (
         "You are a speech evaluator. You must assess both (1) the transcript (verbal content: e.g. purpose statement, organization, evidence) "
         "and (2) the video notes (visual delivery: e.g. eye contact, posture, swaying, gestures). "
@@ -261,15 +375,15 @@ def build_messages(
     structure_text = _format_rubric_structure(rubric)
     if structure_text:
         user += "Categories and subcategories to score:\n" + structure_text + "\n\n"
-    user += f"Transcript:\n{transcript}"
-    if video_notes and video_notes.strip():
-        user += f"\n\nVideo notes (visual delivery):\n{video_notes.strip()}"
     ref_block = _format_reference_examples_block(REFERENCE_EXAMPLES)
     if ref_block:
-        user += "\n\n" + ref_block
+        user += ref_block + "\n\n"
     textbook_block = _get_textbook_chunks_block(rubric)
     if textbook_block:
-        user += "\n\n" + textbook_block
+        user += textbook_block + "\n\n"
+    user += f"{TRANSCRIPT_HEADER}{transcript}"
+    if video_notes and video_notes.strip():
+        user += f"\n\nVideo notes (visual delivery):\n{video_notes.strip()}"
     return [
         {"role": "system", "content": system},
         {"role": "user", "content": user},
@@ -277,39 +391,78 @@ def build_messages(
 
 
 def extract_json_from_response(text: str) -> dict | None:
-    text = text.strip()
-    start = text.rfind("{")
-    if start == -1:
-        return None
-    depth = 0
-    end = -1
-    for i in range(start, len(text)):
-        if text[i] == "{":
-            depth += 1
-        elif text[i] == "}":
-            depth -= 1
-            if depth == 0:
-                end = i + 1
-                break
-    if end == -1:
-        return None
-    try:
-        return json.loads(text[start:end])
-    except json.JSONDecodeError:
-        return None
+    """The model's answer: the last top-level JSON object in its output (fenced or truncated is fine; see json_extract)."""
+    return json_extract.last_object(text)
 
 
-def run_inference(
-    transcript: str, rubric_name: str, rubric: dict, video_notes: str = "", max_new_tokens: int = 1024
-) -> dict:
+def _build_prompt(transcript: str, rubric_name: str, rubric: dict, video_notes: str = "") -> str:
     messages = build_messages(transcript, rubric_name, rubric, video_notes)
-    prompt = tokenizer.apply_chat_template(
+    return tokenizer.apply_chat_template(
         messages,
         tokenize=False,
         add_generation_prompt=True,
     )
-    inputs = tokenizer(prompt, return_tensors="pt", truncation=True, max_length=2048)
-    inputs = {k: v.to(DEVICE) for k, v in inputs.items()}
+
+
+def _shared_prefix(prompt: str) -> str:
+    """The part of a built prompt every evaluation against the same rubric has in common ("" if there's none)."""
+    end = prompt.find(TRANSCRIPT_HEADER)
+    return prompt[: end + len(TRANSCRIPT_HEADER)] if end >= 0 else ""
+
+
+# ----- Prompt-prefix KV cache: the shared part of a batch's prompts is prefilled once per rubric -----
+PREFIX_CACHE = prefix_cache.PrefixCache(max_mb=float(os.environ.get("EVAL_PREFIX_CACHE_MB", "512")))
+
+
+def _prefix_reuse_enabled() -> bool:
+    return os.environ.get("EVAL_PREFIX_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _prefix_inputs(prompts: list[str]):
+    """
+    (inputs padded after the shared prefix, "reused"/"prefilled", prefix tokens, past_key_values) when every prompt
+    starts with the same long enough prefix; None otherwise (left padding and a full prefill, as before).
+    """
+    prefix = _shared_prefix(prompts[0])
+    if not prefix or any(not p.startswith(prefix) for p in prompts):
+        return None
+    rows = [tokenizer(p)["input_ids"] for p in prompts]
+    if max(len(r) for r in rows) > 2048:
+        return None  # the plain path truncates; keep its behaviour for oversized prompts
+    prefix_ids = tokenizer(prefix)["input_ids"]
+    n = min(prefix_cache.common_length(prefix_ids, r) for r in rows)
+    n = min(n, min(len(r) for r in rows) - 1)  # leave at least one token for generate() to prefill
+    if n < PREFIX_CACHE.min_tokens:
+        return None
+    past, mode = PREFIX_CACHE.get(prefix_cache.key_for(rows[0][:n]), lambda: prefix_cache.prefill(model, rows[0][:n]))
+    inputs = prefix_cache.pad_after_prefix(rows, n, tokenizer.pad_token_id, device=DEVICE)
+    return inputs, mode, n, prefix_cache.fork(past, len(prompts))
+
+
+# ----- Early stop: each row's generation ends when its JSON object closes (EVAL_EARLY_STOP=0 only measures) -----
+EARLY_STOP = json_grammar.EarlyStopLedger()
+
+
+def _early_stop_enabled() -> bool:
+    return os.environ.get("EVAL_EARLY_STOP", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _generate_batch(prompts: list[str], max_new_tokens: int, reports: list | None = None) -> list[str]:
+    """
+    One generate() over left-padded prompts (padded after their shared prefix when its cached keys/values are reused);
+    returns each prompt's decoded continuation. reports (one dict or None per prompt) receive that row's token count,
+    early-stop savings and prefix reuse / time to first token.
+    """
+    timer = prefix_cache.FirstTokenTimer()
+    reuse = _prefix_inputs(prompts) if _prefix_reuse_enabled() else None
+    extra = {}
+    if reuse is not None:
+        inputs, mode, shared, extra["past_key_values"] = reuse
+    else:
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True, truncation=True, max_length=2048)
+        inputs = {k: v.to(DEVICE) for k, v in inputs.items()}
+        mode, shared = "off", 0
+    stop = json_grammar.JSONObjectEnd(tokenizer, enabled=_early_stop_enabled())
 
     with torch.no_grad():
         out = model.generate(
@@ -317,17 +470,205 @@ def run_inference(
             max_new_tokens=max_new_tokens,
             do_sample=False,
             pad_token_id=tokenizer.pad_token_id,
+            stopping_criteria=StoppingCriteriaList([stop]),
+            logits_processor=LogitsProcessorList([timer]),
+            **extra,
         )
-    gen = tokenizer.decode(out[0][inputs["input_ids"].shape[1] :], skip_special_tokens=True)
+    PREFIX_CACHE.record_ttft(mode, timer.seconds)
+    ttft = round(timer.seconds, 3) if timer.seconds is not None else None
+    prompt_len = inputs["input_ids"].shape[1]
+    for row, o in enumerate(out):
+        new = o[prompt_len:].tolist()
+        closed_at = stop.closed_at(row)
+        if stop.enabled and closed_at is not None:
+            tokens = closed_at
+        elif tokenizer.eos_token_id in new:
+            tokens = new.index(tokenizer.eos_token_id) + 1
+        else:
+            tokens = len(new)
+        early = EARLY_STOP.record(stop, row, tokens, max_new_tokens, batch_size=len(prompts))
+        if reports is not None and reports[row] is not None:
+            reports[row].update(
+                tokens=tokens,
+                max_new_tokens=max_new_tokens,
+                early_stop=early,
+                prefix={"mode": mode, "tokens": shared, "ttft_seconds": ttft},
+            )
+    return [tokenizer.decode(o[prompt_len:], skip_special_tokens=True) for o in out]
+
+
+# ----- Micro-batching: concurrent /evaluate requests are collected for EVAL_BATCH_WINDOW_MS and share one generate() -----
+class _PendingPrompt:
+    __slots__ = ("prompt", "max_new_tokens", "report", "group", "future", "queued_at")
+
+    def __init__(self, prompt: str, max_new_tokens: int, report: dict | None = None):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.report = report
+        # Prompts batch together only if they generate the same length and (with prefix reuse) share a rubric prefix
+        self.group = (max_new_tokens, _shared_prefix(prompt) if _prefix_reuse_enabled() else None)
+        self.future = Future()
+        self.queued_at = time.time()
+
+
+class InferenceBatcher:
+    """
+    Batching scheduler for run_inference. Callers block in submit() while a single worker thread waits up to
+    window_ms after the first prompt arrives (or until max_batch are waiting), runs one left-padded generate()
+    for the batch and hands each caller its own decoded text. Prompts asking for a different max_new_tokens, or
+    (with prefix reuse) built from a different rubric, go in separate batches.
+    """
+
+    def __init__(self, window_ms: float, max_batch: int):
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._cv = threading.Condition()
+        self._pending = deque()
+        self._thread = None
+        self.stats = {"batches": 0, "requests": 0, "batch_sizes": {}, "generate_seconds": 0.0, "max_queue_wait_seconds": 0.0}
+
+    def submit(self, prompt: str, max_new_tokens: int, report: dict | None = None) -> str:
+        item = _PendingPrompt(prompt, max_new_tokens, report)
+        with self._cv:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="eval-batcher", daemon=True)
+                self._thread.start()
+            self._pending.append(item)
+            self._cv.notify_all()
+        return item.future.result()
+
+    def _take_batch(self) -> list:
+        with self._cv:
+            while not self._pending:
+                self._cv.wait()
+            head = self._pending[0]
+            deadline = head.queued_at + self.window
+            # Only prompts that can share the head's batch count towards filling it
+            while sum(1 for p in self._pending if p.group == head.group) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cv.wait(remaining)
+            batch = [p for p in self._pending if p.group == head.group][: self.max_batch]
+            for p in batch:
+                self._pending.remove(p)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            started = time.time()
+            try:
+                texts = _generate_batch([p.prompt for p in batch], batch[0].max_new_tokens, [p.report for p in batch])
+            except Exception as e:
+                for p in batch:
+                    p.future.set_exception(e)
+                continue
+            elapsed = time.time() - started
+            for p, text in zip(batch, texts):
+                p.future.set_result(text)
+            size = len(batch)
+            self.stats["batches"] += 1
+            self.stats["requests"] += size
+            self.stats["batch_sizes"][size] = self.stats["batch_sizes"].get(size, 0) + 1
+            self.stats["generate_seconds"] += elapsed
+            self.stats["max_queue_wait_seconds"] = max(self.stats["max_queue_wait_seconds"], started - batch[0].queued_at)
+
+    def snapshot(self) -> dict:
+        s = self.stats
+        return {
+            "window_ms": round(self.window * 1000, 1),
+            "max_batch": self.max_batch,
+            "batches": s["batches"],
+            "requests": s["requests"],
+            "avg_batch_size": round(s["requests"] / s["batches"], 2) if s["batches"] else None,
+            "batch_sizes": dict(sorted(s["batch_sizes"].items())),
+            "evaluations_per_gpu_second": round(s["requests"] / s["generate_seconds"], 3) if s["generate_seconds"] else None,
+            "max_queue_wait_seconds": round(s["max_queue_wait_seconds"], 3),
+        }
+
+
+BATCHER = InferenceBatcher(
+    window_ms=float(os.environ.get("EVAL_BATCH_WINDOW_MS", "15")),
+    max_batch=int(os.environ.get("EVAL_BATCH_MAX", "8")),
+)
+
+
+def run_inference(
+    transcript: str, rubric_name: str, rubric: dict, video_notes: str = "", max_new_tokens: int = 1024
+) -> dict:
+    prompt = _build_prompt(transcript, rubric_name, rubric, video_notes)
+    generation = {}
+    if BATCHER.max_batch > 1:
+        gen = BATCHER.submit(prompt, max_new_tokens, generation)
+    else:
+        gen = _generate_batch([prompt], max_new_tokens, [generation])[0]
+    metadata = {"generation": generation or None}
     sections = extract_json_from_response(gen)
     if sections is None:
-        return {"sections": {}, "overallComments": "Model output could not be parsed as JSON."}
-    return {"sections": sections, "overallComments": ""}
+        return {"sections": {}, "overallComments": "Model output could not be parsed as JSON.", "metadata": metadata}
+    return {"sections": sections, "overallComments": "", "metadata": metadata}
+
+
+def benchmark(n_requests: int = 32, transcript: str = "", rubric: dict | None = None, max_new_tokens: int = 256) -> dict:
+    """
+    Throughput of run_inference for n_requests concurrent evaluations, first one at a time (batch size 1), then
+    through the micro-batcher, then micro-batched without prefix reuse. Returns evaluations per second per GPU and
+    the average time to first token for each.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    global BATCHER
+    rubric = rubric or {"name": "Benchmark", "categories": [{"name": "Content", "subcategories": ["Organization"]}]}
+    transcript = transcript or "Good morning. Today I will explain why clear communication matters at work. " * 20
+    gpus = max(1, torch.cuda.device_count()) if DEVICE == "cuda" else 1
+    results = {}
+    configured = BATCHER
+    prefix_setting = os.environ.get("EVAL_PREFIX_CACHE")
+    passes = (
+        ("batch_size_1", 1, "1"),
+        ("micro_batched", configured.max_batch, "1"),
+        ("micro_batched_without_prefix_reuse", configured.max_batch, "0"),
+    )
+    try:
+        for label, max_batch, reuse in passes:
+            os.environ["EVAL_PREFIX_CACHE"] = reuse
+            BATCHER = InferenceBatcher(configured.window * 1000, max_batch)
+            started = time.time()
+            with ThreadPoolExecutor(max_workers=n_requests) as pool:
+                outputs = list(pool.map(lambda _: run_inference(transcript, rubric["name"], rubric, max_new_tokens=max_new_tokens), range(n_requests)))
+            elapsed = time.time() - started
+            ttfts = [
+                ((o["metadata"]["generation"] or {}).get("prefix") or {}).get("ttft_seconds") for o in outputs
+            ]
+            ttfts = [t for t in ttfts if t is not None]
+            results[label] = {
+                "seconds": round(elapsed, 2),
+                "evaluations_per_second_per_gpu": round(n_requests / elapsed / gpus, 3),
+                "avg_ttft_ms": round(sum(ttfts) / len(ttfts) * 1000, 1) if ttfts else None,
+                "batching": BATCHER.snapshot(),
+            }
+    finally:
+        BATCHER = configured
+        if prefix_setting is None:
+            os.environ.pop("EVAL_PREFIX_CACHE", None)
+        else:
+            os.environ["EVAL_PREFIX_CACHE"] = prefix_setting
+    results["speedup"] = round(results["batch_size_1"]["seconds"] / results["micro_batched"]["seconds"], 2)
+    results["prefix_cache"] = PREFIX_CACHE.snapshot()
+    return results
 
 
 @app.get("/health")
 def health():
-    return {"status": "ok", "model_loaded": model is not None}
+    return {
+        "status": "ok",
+        "model_loaded": model is not None,
+        "whisper": whisper_stats(),
+        "batching": BATCHER.snapshot(),
+        "early_stop": {"enabled": _early_stop_enabled(), **EARLY_STOP.snapshot()},
+        "prefix_cache": {"enabled": _prefix_reuse_enabled(), **PREFIX_CACHE.snapshot()},
+    }
 
 
 class SuggestDescriptionsRequest(BaseModel):
@@ -410,14 +751,17 @@ async def evaluate_with_file(
         tmp.write(contents)
         tmp_path = tmp.name
     try:
-        whisper_model = whisper.load_model("base")
-        result = whisper_model.transcribe(tmp_path, fp16=(DEVICE == "cuda"))
-        transcript = (result.get("text") or "").strip()
+        # Off the event loop: transcription takes seconds and would stall every other request
+        transcript = await asyncio.to_thread(transcribe, tmp_path)
     finally:
         Path(tmp_path).unlink(missing_ok=True)
     if not transcript:
         raise HTTPException(status_code=400, detail="Transcription returned empty. Check file format (audio/video).")
-    eval_result = run_inference(transcript, rubric_name, rubric_obj, video_notes=(video_notes or "").strip())
+    # Also off the loop: run_inference blocks for the batch window and generate(), and other uploads must be able
+    # to arrive meanwhile to share the batch
+    eval_result = await asyncio.to_thread(
+        run_inference, transcript, rubric_name, rubric_obj, video_notes=(video_notes or "").strip()
+    )
     return EvaluateResponse(**eval_result, transcript=transcript)
 
 
@@ -963,8 +1307,14 @@ def main():
     p.add_argument("--base_model", default="mistralai/Mistral-7B-Instruct-v0.2")
     p.add_argument("--port", type=int, default=8000)
     p.add_argument("--load_in_8bit", action="store_true")
+    p.add_argument("--benchmark", type=int, default=0, metavar="N", help="Run N concurrent evaluations with and without micro-batching, print throughput and exit")
     args = p.parse_args()
 
+    if args.benchmark:
+        load_model_and_tokenizer(args.model_path, args.base_model, args.load_in_8bit)
+        print(json.dumps(benchmark(args.benchmark), indent=2))
+        return
+
     # #region agent log
     _dbg("main() started", {"model_path": str(args.model_path), "port": args.port}, "H1")
     path = Path(args.model_path)
@@ -990,6 +1340,7 @@ def main():
     else:
         print("Model path not found:", path.resolve())
         print("Server will start but /evaluate and /evaluate_with_file will return 503 until you train and pass a valid --model_path.")
+    warm_whisper()
     print("Starting server on port", args.port)
     # #region agent log
     _dbg("about to uvicorn.run", {"port": args.port}, "H3")
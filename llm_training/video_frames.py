@@ -0,0 +1,304 @@
+"""
+ffmpeg frame sampler for Qwen2.5-VL: a fixed budget of downscaled frames (+ optional 16 kHz mono audio) per video.
+
+Usage:
+  sampler = FrameSampler("/tmp/qwen_frames", max_bytes=2 * 1024**3)
+  video = sampler.sample("talk.mp4", frames=32, max_side=640, mode="scene")
+  video.images()      # list of PIL images, oldest first -> {"type": "video", "video": video.images()}
+  video.fps           # effective sampling rate, pass as fps= so temporal positions match real time
+  video.audio_path    # 16 kHz mono WAV when audio=True
+
+Instead of letting PyAV/torchvision decode every full-resolution frame in the server process and then keeping
+~0.15 fps of them, ffmpeg decodes in a subprocess, scales to max_side and writes JPEGs, so the Python process
+never holds a 1080p frame. Modes:
+  uniform - frames evenly spaced over the duration (one at the middle of each slot)
+  scene   - frames at scene changes (ffmpeg's scene score > scene_threshold), thinned or topped up with uniform
+            frames to exactly the budget; slide changes and speaker movement get a frame, static stretches don't
+
+Results are cached by video content hash + sampling plan in a DiskLRUCache (frames as one zip of JPEGs, audio as
+its own entry), so analyze_video followed by evaluate_video on the same upload decodes once. Stdlib + ffmpeg on
+PATH; PIL is only needed for images().
+"""
+
+import io
+import json
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    from llm_training.result_cache import DiskLRUCache, sha256_file
+except ImportError:
+    from result_cache import DiskLRUCache, sha256_file
+
+SAMPLER_VERSION = "frames-v1"  # bump when the extraction commands change, to invalidate cached frames
+_PTS_TIME = re.compile(r"pts_time:\s*([0-9.]+)")
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+
+def probe(path: str) -> dict:
+    """Duration (s), width, height and frame rate of the first video stream via ffprobe."""
+    r = subprocess.run(
+        [
+            "ffprobe", "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "format=duration:stream=width,height,avg_frame_rate",
+            "-of", "json", path,
+        ],
+        capture_output=True, text=True, timeout=60,
+    )
+    if r.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {(r.stderr or '')[-300:]}")
+    info = json.loads(r.stdout or "{}")
+    stream = (info.get("streams") or [{}])[0]
+    num, _, den = (stream.get("avg_frame_rate") or "0/1").partition("/")
+    return {
+        "duration": float((info.get("format") or {}).get("duration") or 0.0),
+        "width": int(stream.get("width") or 0),
+        "height": int(stream.get("height") or 0),
+        "fps": float(num) / float(den) if float(den or 0) else 0.0,
+    }
+
+
+def uniform_timestamps(duration: float, frames: int) -> list:
+    """frames timestamps, one at the middle of each equal slot of [0, duration)."""
+    if duration <= 0 or frames <= 0:
+        return [0.0]
+    step = duration / frames
+    return [round((i + 0.5) * step, 3) for i in range(frames)]
+
+
+def fill_to_budget(scene_times: list, duration: float, frames: int) -> list:
+    """
+    Exactly `frames` sorted timestamps: scene changes first (evenly thinned if there are too many), topped up with
+    the uniform slot midpoints furthest from any chosen frame.
+    """
+    scene_times = sorted(set(round(t, 3) for t in scene_times if 0 <= t <= max(duration, 0)))
+    if len(scene_times) >= frames:
+        step = len(scene_times) / frames
+        return [scene_times[int(i * step)] for i in range(frames)]
+    chosen = list(scene_times)
+    spare = uniform_timestamps(duration, frames)
+    while len(chosen) < frames and spare:
+        best = max(spare, key=lambda t: min((abs(t - c) for c in chosen), default=duration))
+        spare.remove(best)
+        chosen.append(best)
+    return sorted(chosen)
+
+
+def parse_showinfo(stderr: str) -> list:
+    """Timestamps of the frames ffmpeg's showinfo filter reported (one 'pts_time:' per selected frame)."""
+    return [float(m.group(1)) for line in stderr.splitlines() if "Parsed_showinfo" in line for m in _PTS_TIME.finditer(line)]
+
+
+# ----- Adaptive budget: frames and resolution from duration and free VRAM, aimed at a visual-token target -----
+# Qwen2.5-VL turns each 28x28 pixel block of a frame pair into one visual token (14px patches, 2x2 merge,
+# temporal patch of 2 frames), so visual tokens = ceil(frames / 2) * (h / 28) * (w / 28). Those tokens drive
+# vision-tower activations and the KV cache, i.e. what runs out of memory on long videos.
+_TOKEN_PX = 28
+
+
+def visual_tokens(frames: int, width: int, height: int) -> int:
+    return ((frames + 1) // 2) * max(1, round(width / _TOKEN_PX)) * max(1, round(height / _TOKEN_PX))
+
+
+def _frame_size(max_side: int, source_width: int, source_height: int) -> tuple:
+    """(w, h) of a frame scaled to fit max_side x max_side (never upscaled), as the ffmpeg scale filter does."""
+    w, h = source_width or 16, source_height or 9
+    scale = min(1.0, max_side / max(w, h))
+    return max(2, int(w * scale) // 2 * 2), max(2, int(h * scale) // 2 * 2)
+
+
+def plan_frame_budget(duration: float, source_width: int, source_height: int, free_vram_bytes: int = None,
+                      target_tokens: int = 6144, bytes_per_token: int = 384 * 1024, reserve_bytes: int = 6 * 1024 ** 3,
+                      frames_per_minute: float = 12, min_frames: int = 8, max_frames: int = 64,
+                      min_side: int = 224, max_side: int = 896) -> dict:
+    """
+    Pick frames and max_side so the video costs at most target_tokens visual tokens, lowered further to what
+    free_vram_bytes can hold after reserve_bytes (prompt, generation, allocator slack) at bytes_per_token.
+    Longer videos get more frames (frames_per_minute, within [min_frames, max_frames]) at a lower resolution;
+    when even min_side would overshoot, frames are dropped instead. Returns the plan with the numbers behind it.
+    """
+    limit = "target"
+    tokens = target_tokens
+    if free_vram_bytes is not None:
+        vram_tokens = max(0, free_vram_bytes - reserve_bytes) // bytes_per_token
+        if vram_tokens < tokens:
+            tokens, limit = vram_tokens, "vram"
+    frames = int(min(max_frames, max(min_frames, round(duration / 60 * frames_per_minute))))
+    long_side = max(source_width or 0, source_height or 0) or max_side
+    side = min(max_side, long_side)
+    # Largest side (multiple of 28, >= min_side) whose frames fit the token budget
+    while side > min_side and visual_tokens(frames, *_frame_size(side, source_width, source_height)) > tokens:
+        side -= _TOKEN_PX
+    side = max(min(min_side, long_side), side)
+    # Still over budget at the smallest side: fewer frames (pairs, since frames are encoded two at a time)
+    while frames > 2 and visual_tokens(frames, *_frame_size(side, source_width, source_height)) > tokens:
+        frames -= 2
+    width, height = _frame_size(side, source_width, source_height)
+    return {
+        "frames": frames,
+        "max_side": side,
+        "fps": round(frames / duration, 4) if duration else None,
+        "frame_size": [width, height],
+        "visual_tokens": visual_tokens(frames, width, height),
+        "token_budget": int(tokens),
+        "limited_by": limit,
+        "duration": round(duration, 1),
+        "free_vram_mb": round(free_vram_bytes / 1024 ** 2) if free_vram_bytes is not None else None,
+    }
+
+
+def _scale_filter(max_side: int) -> str:
+    # Fit inside max_side x max_side, keep aspect, even dimensions (some encoders and the processor want them)
+    return f"scale='min({max_side},iw)':'min({max_side},ih)':force_original_aspect_ratio=decrease:force_divisible_by=2"
+
+
+class SampledVideo:
+    """Frames (JPEG bytes, in time order) and their timestamps for one video + plan; see FrameSampler.sample."""
+
+    def __init__(self, frames: list, timestamps: list, meta: dict, audio_path: str = None, cache_hit: bool = False):
+        self.frames = frames
+        self.timestamps = timestamps
+        self.meta = meta
+        self.audio_path = audio_path
+        self.cache_hit = cache_hit
+
+    @property
+    def fps(self) -> float:
+        """Average sampling rate over the video (frames / duration)."""
+        duration = self.meta.get("duration") or 0
+        return round(len(self.frames) / duration, 4) if duration else 1.0
+
+    def images(self) -> list:
+        from PIL import Image
+        return [Image.open(io.BytesIO(jpeg)).convert("RGB") for jpeg in self.frames]
+
+    def to_zip(self) -> bytes:
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zf:  # JPEGs don't deflate
+            zf.writestr("meta.json", json.dumps({**self.meta, "timestamps": self.timestamps}))
+            for i, jpeg in enumerate(self.frames):
+                zf.writestr(f"frame_{i:04d}.jpg", jpeg)
+        return buf.getvalue()
+
+    @classmethod
+    def from_zip(cls, data: bytes, audio_path: str = None) -> "SampledVideo":
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            meta = json.loads(zf.read("meta.json"))
+            names = sorted(n for n in zf.namelist() if n.startswith("frame_"))
+            frames = [zf.read(n) for n in names]
+        return cls(frames, meta.pop("timestamps", []), meta, audio_path=audio_path, cache_hit=True)
+
+
+class FrameSampler:
+    """Extract and cache frame budgets with ffmpeg; thread-safe, cache shared across processes via the directory."""
+
+    def __init__(self, directory, max_bytes: int, max_entries: int = 0, timeout: float = 600, workers: int = 4):
+        self.cache = DiskLRUCache(directory, max_bytes=max_bytes, max_entries=max_entries)
+        self.timeout = timeout
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self.stats = {"extractions": 0, "cache_hits": 0, "failures": 0, "extract_seconds": 0.0, "frames": 0}
+
+    def _run(self, cmd: list) -> subprocess.CompletedProcess:
+        r = subprocess.run(cmd, capture_output=True, text=True, timeout=self.timeout)
+        if r.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed ({' '.join(cmd[:3])}...): {(r.stderr or '')[-500:]}")
+        return r
+
+    def _extract_at(self, path: str, timestamps: list, max_side: int, out_dir: Path) -> list:
+        """
+        [(timestamp, JPEG bytes)], one per timestamp that has a frame. Input-side -ss seeks to the nearest keyframe, so each ffmpeg decodes one GOP rather
+        than the whole stream; a few run in parallel.
+        """
+        def grab(i, t):
+            out = out_dir / f"t_{i:04d}.jpg"
+            self._run([
+                "ffmpeg", "-nostdin", "-v", "error", "-ss", f"{t:.3f}", "-i", path,
+                "-frames:v", "1", "-vf", _scale_filter(max_side), "-q:v", "3", "-y", str(out),
+            ])
+            return out.read_bytes() if out.exists() else None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            frames = list(pool.map(grab, range(len(timestamps)), timestamps))
+        return [(t, f) for t, f in zip(timestamps, frames) if f]
+
+    def _scene_times(self, path: str, threshold: float) -> list:
+        """Timestamps where ffmpeg's scene score exceeds threshold (decoded at low resolution to keep it cheap)."""
+        r = self._run([
+            "ffmpeg", "-nostdin", "-v", "info", "-i", path, "-an",
+            "-vf", f"scale=160:-2,select='gt(scene,{threshold})',showinfo", "-f", "null", "-",
+        ])
+        return parse_showinfo(r.stderr)
+
+    def _extract_audio(self, path: str, out: Path):
+        self._run(["ffmpeg", "-nostdin", "-v", "error", "-i", path, "-vn", "-ac", "1", "-ar", "16000", "-c:a", "pcm_s16le", "-y", str(out)])
+
+    def sample(self, path: str, frames: int = 32, max_side: int = 640, mode: str = "uniform",
+               scene_threshold: float = 0.3, audio: bool = False, video_hash: str = None, info: dict = None) -> SampledVideo:
+        """
+        Frames for path under this plan, from cache when the same bytes were sampled the same way before.
+        info is probe(path) when the caller already has it (e.g. from planning the budget).
+        """
+        if video_hash is None:
+            with open(path, "rb") as f:
+                video_hash = sha256_file(f)
+        plan = {"frames": frames, "max_side": max_side, "mode": mode, "scene_threshold": scene_threshold if mode == "scene" else None}
+        key = DiskLRUCache.make_key(video_hash, json.dumps(plan, sort_keys=True), SAMPLER_VERSION)
+        audio_key = DiskLRUCache.make_key(video_hash, "audio-16k-mono", SAMPLER_VERSION)
+        audio_path = self._audio(path, audio_key) if audio else None
+        cached = self.cache.get(key)
+        if cached is not None:
+            with self._lock:
+                self.stats["cache_hits"] += 1
+            return SampledVideo.from_zip(cached, audio_path=audio_path)
+
+        started = time.time()
+        try:
+            info = info or probe(path)
+            if mode == "scene":
+                timestamps = fill_to_budget(self._scene_times(path, scene_threshold), info["duration"], frames)
+            else:
+                timestamps = uniform_timestamps(info["duration"], frames)
+            with tempfile.TemporaryDirectory(prefix="qwen_frames_") as tmp:
+                extracted = self._extract_at(path, timestamps, max_side, Path(tmp))
+        except Exception:
+            with self._lock:
+                self.stats["failures"] += 1
+            raise
+        if not extracted:
+            raise RuntimeError("ffmpeg produced no frames")
+        elapsed = time.time() - started
+        meta = {**plan, "duration": info["duration"], "source_width": info["width"], "source_height": info["height"],
+                "extract_seconds": round(elapsed, 2), "video_sha256": video_hash}
+        video = SampledVideo([f for _, f in extracted], [t for t, _ in extracted], meta, audio_path=audio_path)
+        self.cache.put(key, video.to_zip())
+        with self._lock:
+            self.stats["extractions"] += 1
+            self.stats["frames"] += len(extracted)
+            self.stats["extract_seconds"] = round(self.stats["extract_seconds"] + elapsed, 2)
+        return video
+
+    def _audio(self, path: str, key: str) -> str:
+        """Path of the cached 16 kHz mono WAV for this video (extracted on first use)."""
+        if self.cache.get(key) is None:
+            with tempfile.TemporaryDirectory(prefix="qwen_audio_") as tmp:
+                out = Path(tmp) / "audio.wav"
+                self._extract_audio(path, out)
+                self.cache.put(key, out.read_bytes())
+        return str(self.cache._path(key))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["cache"] = self.cache.stats()
+        return stats
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Compare the two ways qwen_serve can turn a speech video into model input.
+
+  in-process  - what the processor does with {"type": "video", "path": ...} at fps=0.15: decode the full-resolution
+                stream in the server process (transformers' load_video: PyAV / torchvision / decord)
+  ffmpeg      - llm_training/video_frames.FrameSampler: a fixed budget of downscaled frames, cold and from cache
+
+For each path it reports wall time, peak RSS of the process doing the decode (each run is a fresh subprocess, so
+numbers don't bleed into each other), the frames and resolution handed to the processor, the bytes of pixels held,
+and the visual tokens Qwen2.5-VL would see (one token per 28x28 patch, two frames per temporal patch) - the driver
+of GPU memory during generate().
+
+Usage:
+    python scripts/benchmark_frames.py talk_1080p.mp4 [more.mp4 ...] [--frames 32] [--max-side 640] [--mode scene]
+
+Needs ffmpeg/ffprobe on PATH, and PyAV or torchvision for the in-process path (--skip-in-process to omit it).
+"""
+
+import argparse
+import multiprocessing
+import queue as queue_module
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def _in_process(path, fps, queue):
+    from transformers.video_utils import load_video
+    t0 = time.perf_counter()
+    video, _metadata = load_video(path, fps=fps)
+    elapsed = time.perf_counter() - t0
+    frames, height, width = len(video), video.shape[1], video.shape[2]
+    queue.put({"seconds": elapsed, "peak_rss_mb": _peak_rss_mb(), "frames": frames, "width": width,
+               "height": height, "pixel_bytes": int(video.nbytes)})
+
+
+def _ffmpeg(path, cache_dir, frames, max_side, mode, queue):
+    from llm_training.video_frames import FrameSampler
+    sampler = FrameSampler(cache_dir, max_bytes=4 * 1024 ** 3)
+    t0 = time.perf_counter()
+    video = sampler.sample(path, frames=frames, max_side=max_side, mode=mode)
+    images = video.images()
+    elapsed = time.perf_counter() - t0
+    width, height = images[0].size
+    queue.put({"seconds": elapsed, "peak_rss_mb": _peak_rss_mb(), "frames": len(images), "width": width,
+               "height": height, "pixel_bytes": sum(len(im.tobytes()) for im in images), "cache_hit": video.cache_hit})
+
+
+def run_isolated(target, *args):
+    """Run target in a fresh process (spawn) and return the dict it reports, or {"error": ...}."""
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=target, args=(*args, queue))
+    proc.start()
+    proc.join()
+    try:
+        return queue.get(timeout=5)
+    except queue_module.Empty:
+        return {"error": f"exit code {proc.exitcode}"}
+
+
+def report(label, r):
+    if "error" in r:
+        print(f"  {label:<22}failed: {r['error']}")
+        return
+    from llm_training.video_frames import visual_tokens
+    tokens = visual_tokens(r["frames"], r["width"], r["height"])
+    print(
+        f"  {label:<22}{r['seconds']:>8.2f}s {r['peak_rss_mb']:>9,.0f} MB {r['frames']:>6} x {r['width']}x{r['height']:<6}"
+        f"{r['pixel_bytes'] / 1e6:>9,.1f} MB {tokens:>9,} tokens"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("videos", nargs="+")
+    parser.add_argument("--frames", type=int, default=32)
+    parser.add_argument("--max-side", type=int, default=640)
+    parser.add_argument("--mode", choices=["uniform", "scene"], default="uniform")
+    parser.add_argument("--fps", type=float, default=0.15, help="In-process sampling rate (qwen_serve's legacy value)")
+    parser.add_argument("--skip-in-process", action="store_true")
+    args = parser.parse_args()
+
+    from llm_training.video_frames import ffmpeg_available, probe
+    if not ffmpeg_available():
+        sys.exit("ffmpeg/ffprobe not found on PATH")
+
+    print(f"  {'path':<22}{'time':>9} {'peak RSS':>12} {'frames x size':>20}{'pixels':>12} {'visual':>16}")
+    for path in args.videos:
+        info = probe(path)
+        print(f"{path}: {info['duration']:.0f}s, {info['width']}x{info['height']} @ {info['fps']:.1f} fps")
+        if not args.skip_in_process:
+            report(f"in-process @{args.fps}fps", run_isolated(_in_process, path, args.fps))
+        with tempfile.TemporaryDirectory(prefix="bench_frames_") as cache_dir:
+            report(f"ffmpeg {args.mode} (cold)", run_isolated(_ffmpeg, path, cache_dir, args.frames, args.max_side, args.mode))
+            report(f"ffmpeg {args.mode} (cached)", run_isolated(_ffmpeg, path, cache_dir, args.frames, args.max_side, args.mode))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: the shared single-pass JSON extractor (llm_training/json_extract.py) against the parsers it replaced.
+
+  legacy qwen   - qwen_serve's _strip_markdown_json + _extract_json_from_response + _extract_sections_from_raw
+                  (a brace scan from every "{", braces in strings counted, json.loads on each fragment)
+  legacy last   - serve_model / eval_model extract_json_from_response (the block after the last "{")
+  json_extract  - extract(text, keys=("sections",)) / last_object(text)
+
+The corpus is built from real model-shaped outputs - the assistant turns in llm_training/example_train.jsonl and a
+Qwen evaluation in EVALUATE_VIDEO_PROMPT's format, with feedback that contains braces and escaped quotes - in the
+shapes models actually return them: bare, ```json fenced, wrapped in prose, pretty-printed, with trailing commas,
+truncated at several points (as at max_new_tokens), and long (hundreds of timeline markers). Captured outputs can
+be added with --corpus (JSONL with a "text" field per line, e.g. raw outputs copied from the [evaluate_video] logs).
+
+For each parser and shape it reports microseconds per call and how many outputs yielded sections.
+
+Usage:
+    python scripts/benchmark_json_extract.py [--corpus outputs.jsonl] [--repeat 200]
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from llm_training import json_extract
+
+
+# ----- The replaced implementations, verbatim apart from names -----
+def _legacy_strip_markdown_json(text):
+    s = text.strip()
+    m = re.match(r"^```(?:json)?\s*\n?", s, re.IGNORECASE)
+    if m:
+        s = s[m.end():].lstrip()
+    if s.endswith("```"):
+        s = s[:-3].rstrip()
+    return s
+
+
+def _legacy_sections_from_raw(raw):
+    idx = raw.find('"sections"')
+    if idx == -1:
+        idx = raw.find("'sections'")
+    if idx == -1:
+        return None
+    after_key = raw[idx:].find(":")
+    if after_key == -1:
+        return None
+    start = idx + after_key + 1
+    while start < len(raw) and raw[start] in " \t\n\r":
+        start += 1
+    if start >= len(raw) or raw[start] != "{":
+        return None
+    depth = 0
+    end = -1
+    for i in range(start, len(raw)):
+        if raw[i] == "{":
+            depth += 1
+        elif raw[i] == "}":
+            depth -= 1
+            if depth == 0:
+                end = i + 1
+                break
+    if end == -1:
+        fragment = raw[start:].rstrip()
+        while fragment.endswith(","):
+            fragment = fragment[:-1].rstrip()
+        if depth > 0:
+            try:
+                return json.loads(fragment + ("}" * depth))
+            except json.JSONDecodeError:
+                pass
+        return None
+    try:
+        return json.loads(raw[start:end])
+    except json.JSONDecodeError:
+        return None
+
+
+def _legacy_merge(merged, obj):
+    if isinstance(obj, dict):
+        if obj.get("sections"):
+            merged["sections"] = obj["sections"]
+        if obj.get("timeline_markers") is not None:
+            merged["timeline_markers"] = obj["timeline_markers"]
+
+
+def legacy_qwen(text):
+    text = _legacy_strip_markdown_json(text)
+    merged = {}
+    pos = 0
+    while True:
+        start = text.find("{", pos)
+        if start == -1:
+            break
+        depth = 0
+        end = -1
+        for i in range(start, len(text)):
+            if text[i] == "{":
+                depth += 1
+            elif text[i] == "}":
+                depth -= 1
+                if depth == 0:
+                    end = i + 1
+                    break
+        if end == -1:
+            fragment = text[start:].rstrip()
+            while fragment.endswith(","):
+                fragment = fragment[:-1].rstrip()
+            if depth > 0:
+                try:
+                    _legacy_merge(merged, json.loads(fragment + ("}" * depth)))
+                except json.JSONDecodeError:
+                    pass
+            break
+        try:
+            _legacy_merge(merged, json.loads(text[start:end]))
+        except json.JSONDecodeError:
+            pass
+        pos = end
+    if not merged.get("sections"):
+        sections = _legacy_sections_from_raw(text)
+        if sections:
+            merged["sections"] = sections
+    return merged or None
+
+
+def legacy_last(text):
+    text = text.strip()
+    start = text.rfind("{")
+    if start == -1:
+        return None
+    depth = 0
+    end = -1
+    for i in range(start, len(text)):
+        if text[i] == "{":
+            depth += 1
+        elif text[i] == "}":
+            depth -= 1
+            if depth == 0:
+                end = i + 1
+                break
+    if end == -1:
+        return None
+    try:
+        return json.loads(text[start:end])
+    except json.JSONDecodeError:
+        return None
+
+
+def new_qwen(text):
+    found = json_extract.extract(text, keys=("sections",))
+    merged = {}
+    for obj in found.objects:
+        _legacy_merge(merged, obj)
+    if not merged.get("sections") and isinstance(found.values.get("sections"), dict):
+        merged["sections"] = found.values["sections"]
+    return merged or None
+
+
+# ----- Corpus -----
+def _qwen_evaluation(markers: int) -> dict:
+    return {
+        "sections": {
+            "Content": {
+                "score": 35, "maxScore": 40,
+                "feedback": 'Clear purpose ("today I will {explain}") and strong evidence; the \\"so what\\" came late.',
+                "subcategories": [
+                    {"name": "Organization", "points": 12, "maxPoints": 15, "feedback": "Previewed {three} points."},
+                    {"name": "Evidence", "points": 13, "maxPoints": 15, "feedback": "Cited two sources."},
+                ],
+            },
+            "Delivery": {
+                "score": 26, "maxScore": 30,
+                "feedback": "Good eye contact; hands in pockets at 1:23 } and some swaying.",
+                "subcategories": [
+                    {"name": "Eye contact", "points": 14, "maxPoints": 15, "feedback": "Mostly on camera."},
+                    {"name": "Gestures", "points": 12, "maxPoints": 15, "feedback": 'Used "air quotes" {twice}.'},
+                ],
+            },
+        },
+        "timeline_markers": [
+            {"seconds": 5 * i, "label": "Vocalized pause", "observation": f'Said "um" {{#{i}}}', "severity": "minor",
+             "category": "Delivery"}
+            for i in range(markers)
+        ],
+    }
+
+
+def _shapes(name: str, obj: dict) -> list:
+    compact = json.dumps(obj)
+    pretty = json.dumps(obj, indent=2)
+    trailing = re.sub(r"(\d)(\s*[}\]])", r"\1,\2", compact, count=3)
+    out = [
+        (f"{name}/bare", compact),
+        (f"{name}/fenced", f"```json\n{pretty}\n```"),
+        (f"{name}/prose", f"Here is my evaluation of the speech.\n\n{pretty}\n\nOverall this was a solid talk."),
+        (f"{name}/trailing-comma", trailing),
+    ]
+    for pct in (25, 50, 75, 95):
+        out.append((f"{name}/truncated-{pct}%", "```json\n" + pretty[: len(pretty) * pct // 100]))
+    return out
+
+
+def build_corpus(extra: str = None) -> list:
+    corpus = []
+    train = project_root / "llm_training" / "example_train.jsonl"
+    if train.exists():
+        for line in train.read_text().splitlines():
+            if not line.strip():
+                continue
+            for m in json.loads(line).get("messages", []):
+                if m.get("role") == "assistant":
+                    try:
+                        corpus += _shapes("mistral", {"sections": json.loads(m["content"])})
+                    except json.JSONDecodeError:
+                        corpus.append(("mistral/raw", m["content"]))
+    corpus += _shapes("qwen", _qwen_evaluation(8))
+    corpus += [(label.replace("qwen", "qwen-long"), text) for label, text in _shapes("qwen", _qwen_evaluation(400))]
+    if extra:
+        for line in Path(extra).read_text().splitlines():
+            if line.strip():
+                record = json.loads(line)
+                corpus.append(("captured", record["text"] if isinstance(record, dict) else str(record)))
+    return corpus
+
+
+def bench(fn, text, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(text)
+    return (time.perf_counter() - started) / repeat * 1e6, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", help="JSONL of captured model outputs ({\"text\": ...} per line)")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    parsers = [
+        ("legacy qwen", legacy_qwen, lambda r: bool(r and r.get("sections"))),
+        ("json_extract", new_qwen, lambda r: bool(r and r.get("sections"))),
+        ("legacy last", legacy_last, lambda r: bool(r)),
+        ("last_object", json_extract.last_object, lambda r: bool(r)),
+    ]
+    corpus = build_corpus(args.corpus)
+    print(f"{'shape':<28}{'chars':>8}" + "".join(f"{name:>22}" for name, _, _ in parsers))
+    totals = {name: [0.0, 0] for name, _, _ in parsers}
+    for label, text in corpus:
+        cells = []
+        for name, fn, ok in parsers:
+            micros, result = bench(fn, text, args.repeat)
+            totals[name][0] += micros
+            totals[name][1] += ok(result)
+            cells.append(f"{micros:>12,.1f} us {'ok' if ok(result) else '--':>4}")
+        print(f"{label:<28}{len(text):>8}" + "".join(f"{c:>22}" for c in cells))
+    print(f"{'total':<28}{'':>8}" + "".join(
+        f"{totals[name][0]:>12,.0f} us {totals[name][1]:>2}/{len(corpus):<2}" for name, _, _ in parsers
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Measure bytes on the wire for the HTML pages app.py serves, and requests/sec for SPA deep links.
+
+For each page this compares the old behaviour (full uncompressed body on every navigation, no-store) with a
+first visit using gzip or brotli and with a repeat visit that revalidates its ETag and gets a 304.
+
+--deep-links N resolves N crawler-style deep links (/courses/123/...) through the catch-all twice: once with
+the per-request exists()/is_file() checks and disk read it used to do, once through the in-memory file index,
+then times the same links end to end through the app.
+
+Usage:
+    python scripts/benchmark_static.py [--pages index.html landing.html] [--visits 10] [--deep-links 2000]
+
+Runs the app in-process (fastapi TestClient); no server or network needed.
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+
+def wire_bytes(client, path, accept_encoding, etag=None):
+    """(status, body bytes as sent, ETag) for one GET; stream=True keeps httpx from decompressing."""
+    headers = {"Accept-Encoding": accept_encoding}
+    if etag:
+        headers["If-None-Match"] = etag
+    with client.stream("GET", path, headers=headers) as response:
+        sent = sum(len(chunk) for chunk in response.iter_raw())
+        return response.status_code, sent, response.headers.get("etag")
+
+
+def deep_link_benchmark(client, app, n):
+    links = [f"/courses/{i}/students/{i % 37}" for i in range(n)]
+
+    def stat_and_read(link):
+        path = app._this_dir / link.lstrip("/")
+        if path.exists() and path.is_file():
+            return path.read_bytes()
+        return (app._this_dir / "index.html").read_bytes()
+
+    def index_lookup(link):
+        path = app._static_index_map().get(link.lstrip("/"))
+        return app._static_file(path if path is not None else app._this_dir / "index.html").variants["identity"]
+
+    for label, resolve in (("stat + read (before)", stat_and_read), ("in-memory index", index_lookup)):
+        t0 = time.perf_counter()
+        for link in links:
+            resolve(link)
+        elapsed = time.perf_counter() - t0
+        print(f"  resolve, {label:<22}{n / elapsed:>12,.0f} lookups/s")
+
+    t0 = time.perf_counter()
+    for link in links:
+        wire_bytes(client, link, "br, gzip")
+    elapsed = time.perf_counter() - t0
+    stats = app._static_snapshot()["index"]
+    print(f"  end to end, {'TestClient':<18}{n / elapsed:>12,.0f} requests/s (index hits={stats['hits']}, misses={stats['misses']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", nargs="+", default=["index.html", "landing.html", "help.html"])
+    parser.add_argument("--visits", type=int, default=10, help="Navigations per page (first one is a cold visit)")
+    parser.add_argument("--deep-links", type=int, default=0, help="Also benchmark this many SPA deep links")
+    args = parser.parse_args()
+
+    from fastapi.testclient import TestClient
+    import app
+
+    app._warm_static_files()
+    client = TestClient(app.app)
+    print(f"{'page':<20}{'identity':>12}{'gzip':>12}{'br':>12}{'304':>8}   {args.visits} visits: before -> after")
+    total_before = total_after = 0
+    for page in args.pages:
+        _, identity, _ = wire_bytes(client, f"/{page}", "identity")
+        _, gz, _ = wire_bytes(client, f"/{page}", "gzip")
+        _, br, etag = wire_bytes(client, f"/{page}", "br, gzip")
+        status, revalidated, _ = wire_bytes(client, f"/{page}", "br, gzip", etag)
+        assert status == 304, f"/{page} revalidation returned {status}"
+        before = identity * args.visits
+        after = br + revalidated * (args.visits - 1)
+        total_before += before
+        total_after += after
+        print(f"{page:<20}{identity:>12,}{gz:>12,}{br:>12,}{revalidated:>8,}   {before:,} -> {after:,} bytes")
+    saved = total_before - total_after
+    print(f"Total: {total_before:,} -> {total_after:,} bytes ({saved:,} saved, {100 * saved / max(total_before, 1):.1f}%)")
+    if args.deep_links:
+        print(f"Deep links ({args.deep_links:,}):")
+        deep_link_benchmark(client, app, args.deep_links)
+
+
+if __name__ == "__main__":
+    main()
@@ -94,3 +94,46 @@ def mock_env_vars(monkeypatch):
     monkeypatch.setenv("SUPABASE_ANON_KEY", "test-anon-key")
     monkeypatch.setenv("ALLOWED_ORIGINS", "http://localhost:3000")
     monkeypatch.setenv("RENDER_LLM_EXPORT_SECRET", "test-secret-123")
+
+
+# Sent as X-Diagnostics-Secret by tests that read /diagnostics
+DIAGNOSTICS_SECRET = "test-diagnostics-secret"
+
+
+@pytest.fixture(autouse=True)
+def isolated_qwen_state(tmp_path, monkeypatch):
+    """Keep the /qwen-api job store, result cache and cost spill file out of the repo and start every test with empty ones."""
+    monkeypatch.setenv("QWEN_JOBS_DIR", str(tmp_path / "qwen_jobs"))
+    monkeypatch.setenv("QWEN_RESULT_CACHE_DIR", str(tmp_path / "qwen_cache"))
+    monkeypatch.setenv("COST_SPILL_FILE", str(tmp_path / "cost_spill.jsonl"))
+    monkeypatch.setenv("DIAGNOSTICS_SECRET", DIAGNOSTICS_SECRET)
+    # Full-quality brotli of index.html takes seconds; tests only need the variants to exist
+    monkeypatch.setenv("STATIC_BROTLI_QUALITY", "5")
+    app_module = sys.modules.get("app")
+    if app_module is not None:
+        monkeypatch.setattr(app_module, "_qwen_jobs", None)
+        monkeypatch.setattr(app_module, "_qwen_result_cache", None)
+        monkeypatch.setattr(app_module, "_cost_writer", None)
+        monkeypatch.setattr(app_module, "_qwen_circuits", {})
+        monkeypatch.setattr(app_module, "_qwen_backend_pool", (None, []))
+        monkeypatch.setattr(app_module, "_qwen_warmups", {})
+
+
+@pytest.fixture
+def mock_qwen(monkeypatch):
+    """
+    Returns install(handler, url=..., storage=None): points QWEN_API_URL at url (None leaves it, e.g. for
+    QWEN_BACKENDS) and sends every Qwen upstream request to handler via httpx.MockTransport. Storage HEADs from the
+    result cache go to storage instead (default: a bare 200), so nothing reaches the network.
+    """
+    import httpx
+    import app
+
+    def install(handler, url="http://qwen.test", storage=None):
+        if url is not None:
+            monkeypatch.setenv("QWEN_API_URL", url)
+        storage = storage or (lambda req: httpx.Response(200))
+        monkeypatch.setattr(app, "_qwen_http_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        monkeypatch.setattr(app, "_storage_http_client", httpx.AsyncClient(transport=httpx.MockTransport(storage)))
+
+    return install
@@ -144,3 +144,310 @@ class TestCORS:
         )
         # Should not return 403
         assert response.status_code != 403
+
+
+class TestWhisperRegistry:
+    """Tests for the process-wide Whisper model registry."""
+
+    @pytest.fixture
+    def fake_whisper(self, monkeypatch):
+        """Replace openai-whisper with a loader that counts model loads."""
+        import types
+        from llm_training import serve_model
+        loads = []
+
+        class FakeModel:
+            def transcribe(self, path, fp16=False):
+                return {"text": " hello class "}
+
+        def load_model(size, device=None):
+            loads.append(size)
+            return FakeModel()
+
+        monkeypatch.setattr(serve_model, "whisper", types.SimpleNamespace(load_model=load_model), raising=False)
+        monkeypatch.setattr(serve_model, "WHISPER_AVAILABLE", True)
+        monkeypatch.setattr(serve_model, "_whisper_models", {})
+        return loads
+
+    def test_model_loaded_once_across_threads(self, fake_whisper):
+        """Concurrent first requests should share a single load."""
+        from concurrent.futures import ThreadPoolExecutor
+        from llm_training import serve_model
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            models = list(pool.map(lambda _: serve_model.get_whisper_model()[0], range(16)))
+        assert fake_whisper == [serve_model.WHISPER_MODEL_SIZE]
+        assert all(m is models[0] for m in models)
+
+    def test_transcribe_records_latency(self, fake_whisper, tmp_path):
+        """transcribe() should return stripped text and update the metrics."""
+        from llm_training import serve_model
+
+        before = serve_model.whisper_stats()["transcriptions"]
+        assert serve_model.transcribe(str(tmp_path / "talk.webm")) == "hello class"
+        stats = serve_model.whisper_stats()
+        assert stats["transcriptions"] == before + 1
+        assert serve_model.WHISPER_MODEL_SIZE in stats["load_seconds"]
+
+    def test_file_evaluation_runs_off_the_event_loop(self, fake_whisper, monkeypatch):
+        """/evaluate_with_file should wait for run_inference in a worker thread, not block the event loop."""
+        import asyncio
+        from llm_training import serve_model
+        calls = []
+
+        def fake_run_inference(transcript, rubric_name, rubric, video_notes="", max_new_tokens=1024):
+            try:
+                asyncio.get_running_loop()
+                calls.append("event loop")
+            except RuntimeError:
+                calls.append("worker thread")
+            return {"sections": {}}
+
+        monkeypatch.setattr(serve_model, "model", object())
+        monkeypatch.setattr(serve_model, "tokenizer", object())
+        monkeypatch.setattr(serve_model, "run_inference", fake_run_inference)
+        client = TestClient(serve_model.app)
+
+        response = client.post(
+            "/evaluate_with_file",
+            files={"file": ("talk.webm", b"\x00" * 16, "video/webm")},
+            data={"rubric": '{"name": "Informative"}'},
+        )
+        assert response.status_code == 200
+        assert response.json()["transcript"] == "hello class"
+        assert calls == ["worker thread"]
+
+    def test_health_reports_whisper(self):
+        """Health should include the Whisper metrics."""
+        from llm_training.serve_model import app
+        client = TestClient(app)
+
+        whisper = client.get("/health").json()["whisper"]
+        assert "transcribe_seconds_avg" in whisper
+
+
+class TestInferenceBatcher:
+    """Tests for micro-batching concurrent /evaluate prompts."""
+
+    @staticmethod
+    def _hold_until_queued(monkeypatch, batcher, n):
+        """Keep the batcher's worker from cutting its first batch until n prompts are queued (no timing involved)."""
+        import threading
+        take_batch = batcher._take_batch
+        released = threading.Event()
+
+        def gated():
+            if not released.is_set():
+                with batcher._cv:
+                    assert batcher._cv.wait_for(lambda: len(batcher._pending) >= n, timeout=10)
+                released.set()
+            return take_batch()
+
+        monkeypatch.setattr(batcher, "_take_batch", gated)
+
+    def test_concurrent_prompts_share_a_generate_call(self, monkeypatch):
+        """Prompts arriving within the window should run as one batch, each caller getting its own text."""
+        from concurrent.futures import ThreadPoolExecutor
+        from llm_training import serve_model
+        batches = []
+
+        def fake_generate(prompts, max_new_tokens, reports=None):
+            batches.append(list(prompts))
+            return [f"out:{p}" for p in prompts]
+
+        monkeypatch.setattr(serve_model, "_generate_batch", fake_generate)
+        batcher = serve_model.InferenceBatcher(window_ms=0, max_batch=4)
+        self._hold_until_queued(monkeypatch, batcher, 4)
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda i: batcher.submit(f"p{i}", 64), range(4)))
+        assert results == ["out:p0", "out:p1", "out:p2", "out:p3"]
+        assert len(batches) == 1
+        assert batcher.snapshot()["avg_batch_size"] == 4
+
+    def test_different_max_new_tokens_not_mixed(self, monkeypatch):
+        """A batch should only contain prompts with the same generation length."""
+        from concurrent.futures import ThreadPoolExecutor
+        from llm_training import serve_model
+        seen = []
+
+        def fake_generate(prompts, max_new_tokens, reports=None):
+            seen.append((max_new_tokens, len(prompts)))
+            return ["" for _ in prompts]
+
+        monkeypatch.setattr(serve_model, "_generate_batch", fake_generate)
+        batcher = serve_model.InferenceBatcher(window_ms=0, max_batch=8)
+        self._hold_until_queued(monkeypatch, batcher, 4)
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(lambda i: batcher.submit("p", 64 if i % 2 else 128), range(4)))
+        assert sorted(seen) == [(64, 2), (128, 2)]
+
+    def test_different_rubrics_not_mixed(self, monkeypatch):
+        """With prefix reuse on, a batch only holds prompts that share the text before the transcript."""
+        from concurrent.futures import ThreadPoolExecutor
+        from llm_training import serve_model
+        seen = []
+
+        def fake_generate(prompts, max_new_tokens, reports=None):
+            seen.append(sorted(p[0] for p in prompts))
+            return ["" for _ in prompts]
+
+        monkeypatch.setattr(serve_model, "_generate_batch", fake_generate)
+        batcher = serve_model.InferenceBatcher(window_ms=0, max_batch=8)
+        self._hold_until_queued(monkeypatch, batcher, 4)
+        prompts = [f"{rubric} rubric\n{serve_model.TRANSCRIPT_HEADER}speech {i}" for i, rubric in enumerate("ABAB")]
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(lambda p: batcher.submit(p, 64), prompts))
+        assert sorted(seen) == [["A", "A"], ["B", "B"]]
+
+    def test_other_groups_do_not_cut_the_window_short(self, monkeypatch):
+        """A full batch's worth of prompts from another group shouldn't send the head's batch off half-empty."""
+        from concurrent.futures import ThreadPoolExecutor
+        from llm_training import serve_model
+        seen = []
+
+        def fake_generate(prompts, max_new_tokens, reports=None):
+            seen.append((max_new_tokens, len(prompts)))
+            return ["" for _ in prompts]
+
+        def queued(n):
+            with batcher._cv:
+                assert batcher._cv.wait_for(lambda: len(batcher._pending) >= n, timeout=10)
+
+        monkeypatch.setattr(serve_model, "_generate_batch", fake_generate)
+        batcher = serve_model.InferenceBatcher(window_ms=10000, max_batch=2)
+        self._hold_until_queued(monkeypatch, batcher, 3)
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(batcher.submit, "p", 64)]
+            queued(1)
+            futures += [pool.submit(batcher.submit, "p", 128) for _ in range(2)]
+            queued(3)
+            futures.append(pool.submit(batcher.submit, "p", 64))
+            for future in futures:
+                future.result(timeout=10)
+        assert seen == [(64, 2), (128, 2)]
+
+    def test_rubric_parts_come_before_the_transcript(self, monkeypatch):
+        """Reference and textbook blocks precede the transcript, so two speeches share the whole rubric prefix."""
+        from llm_training import serve_model
+        monkeypatch.setattr(serve_model, "_get_textbook_chunks_block", lambda rubric: "Textbook excerpts: [1] Eye contact.")
+        rubric = {"categories": [{"name": "Delivery", "subcategories": ["Eye Contact"]}]}
+        first = serve_model.build_messages("Hello class.", "Informative", rubric, "Looked down.")[1]["content"]
+        second = serve_model.build_messages("Good morning.", "Informative", rubric)[1]["content"]
+        assert first.index("Eye Contact") < first.index("Textbook") < first.index("Transcript:") < first.index("Video notes")
+        prefix = serve_model._shared_prefix(first)
+        assert prefix.endswith(serve_model.TRANSCRIPT_HEADER) and second.startswith(prefix)
+
+    def test_batch_reuses_the_rubric_prefix(self, monkeypatch):
+        """Second batch for a rubric starts from the cached prefix; outputs equal those without reuse."""
+        import torch
+        from transformers import MistralConfig, MistralForCausalLM
+        from llm_training import prefix_cache, serve_model
+
+        class Tokenizer:
+            """One token per character (ids 2..127); 0 pads, 1 is EOS."""
+            pad_token_id, eos_token_id, all_special_ids = 0, 1, [0, 1]
+
+            def __len__(self):
+                return 128
+
+            def __call__(self, text, return_tensors=None, padding=False, **kwargs):
+                rows = [[2 + ord(c) % 126 for c in t] for t in ([text] if isinstance(text, str) else text)]
+                if return_tensors is None:
+                    return {"input_ids": rows[0]}
+                width = max(len(r) for r in rows)
+                return {
+                    "input_ids": torch.tensor([[0] * (width - len(r)) + r for r in rows]),
+                    "attention_mask": torch.tensor([[0] * (width - len(r)) + [1] * len(r) for r in rows]),
+                }
+
+            def batch_decode(self, ids, **kwargs):
+                return [self.decode(row) for row in ids]
+
+            def decode(self, ids, skip_special_tokens=False):
+                return "".join(chr(i + 30) for i in ids if i > 1)
+
+        torch.manual_seed(0)
+        config = MistralConfig(vocab_size=128, hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                               num_attention_heads=4, num_key_value_heads=2, pad_token_id=0, eos_token_id=1)
+        monkeypatch.setattr(serve_model, "tokenizer", Tokenizer())
+        monkeypatch.setattr(serve_model, "model", MistralForCausalLM(config).eval())
+        monkeypatch.setattr(serve_model, "DEVICE", "cpu")
+        monkeypatch.setattr(serve_model, "PREFIX_CACHE", prefix_cache.PrefixCache(max_mb=64))
+        rubric_text = "System: score the speech against the rubric. Content: organization, evidence. " * 2
+        prompts = [f"{rubric_text}{serve_model.TRANSCRIPT_HEADER}{speech}" for speech in ("Hi all.", "Good morning, class.")]
+
+        monkeypatch.setenv("EVAL_PREFIX_CACHE", "0")
+        plain = serve_model._generate_batch(prompts, 5)
+        monkeypatch.setenv("EVAL_PREFIX_CACHE", "1")
+        for mode in ("prefilled", "reused"):
+            reports = [{}, {}]
+            assert serve_model._generate_batch(prompts, 5, reports) == plain
+            assert [r["prefix"]["mode"] for r in reports] == [mode, mode]
+            assert reports[0]["prefix"]["tokens"] == len(rubric_text) + len(serve_model.TRANSCRIPT_HEADER)
+        assert set(serve_model.PREFIX_CACHE.snapshot()["ttft"]) == {"off", "prefilled", "reused"}
+
+    def test_errors_reach_every_caller(self, monkeypatch):
+        """If the batched generate fails, each waiting request should see the exception."""
+        from llm_training import serve_model
+
+        def boom(prompts, max_new_tokens, reports=None):
+            raise RuntimeError("CUDA out of memory")
+
+        monkeypatch.setattr(serve_model, "_generate_batch", boom)
+        batcher = serve_model.InferenceBatcher(window_ms=1, max_batch=2)
+        with pytest.raises(RuntimeError):
+            batcher.submit("p", 64)
+
+    def test_generation_stops_when_json_closes(self, monkeypatch):
+        """A model that keeps talking after its JSON is cut off at the closing brace, and the saving is reported."""
+        import torch
+        from llm_training import serve_model
+        vocab = ["<pad>", "<eos>", '{"Content": 8', "}", " Hope", " this", " helps"]
+
+        class Tokenizer:
+            eos_token_id, pad_token_id, all_special_ids = 1, 0, [0, 1]
+
+            def __len__(self):
+                return len(vocab)
+
+            def __call__(self, prompts, **kwargs):
+                return {"input_ids": torch.full((len(prompts), 3), 6)}
+
+            def batch_decode(self, ids, **kwargs):
+                return ["".join(vocab[i] for i in row) for row in ids]
+
+            def decode(self, ids, skip_special_tokens=False):
+                return "".join(vocab[i] for i in ids if not (skip_special_tokens and i < 2))
+
+        class Model:
+            def generate(self, input_ids, max_new_tokens, stopping_criteria, **kwargs):
+                script = [2, 3, 4, 5, 6] * 10
+                done = torch.zeros(input_ids.shape[0], dtype=torch.bool)
+                for step in range(max_new_tokens):
+                    nxt = torch.where(done, torch.tensor(0), torch.tensor(script[step]))
+                    input_ids = torch.cat([input_ids, nxt[:, None]], dim=1)
+                    done |= stopping_criteria(input_ids, None)
+                    if done.all():
+                        break
+                return input_ids
+
+        monkeypatch.setattr(serve_model, "tokenizer", Tokenizer())
+        monkeypatch.setattr(serve_model, "model", Model())
+        monkeypatch.setattr(serve_model, "DEVICE", "cpu")
+        monkeypatch.setattr(serve_model, "BATCHER", serve_model.InferenceBatcher(window_ms=1, max_batch=1))
+        monkeypatch.setattr(serve_model, "_build_prompt", lambda *a, **k: "prompt")
+        monkeypatch.setattr(serve_model, "EARLY_STOP", serve_model.json_grammar.EarlyStopLedger())
+
+        result = serve_model.run_inference("t", "r", {}, max_new_tokens=40)
+        generation = result["metadata"]["generation"]
+        assert result["sections"] == {"Content": 8}
+        assert generation["tokens"] == 2
+        assert generation["early_stop"]["stopped"] and generation["early_stop"]["tokens_saved"] == 38
+
+        monkeypatch.setenv("EVAL_EARLY_STOP", "0")
+        watched = serve_model.run_inference("t", "r", {}, max_new_tokens=40)["metadata"]["generation"]
+        assert watched["tokens"] == 40 and watched["early_stop"]["tokens_after_close"] == 38
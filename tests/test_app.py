@@ -0,0 +1,1116 @@
+"""
+Tests for the main Render app (app.py): Qwen proxy plumbing and diagnostics.
+
+Run with: pytest tests/test_app.py -v
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+import os
+import sys
+
+# Add parent to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.conftest import DIAGNOSTICS_SECRET
+
+DIAGNOSTICS_HEADERS = {"X-Diagnostics-Secret": DIAGNOSTICS_SECRET}
+
+
+class TestQwenPool:
+    """Tests for the shared /qwen-api upstream client."""
+
+    def test_client_is_reused(self):
+        """Every upstream call should go through one pooled client."""
+        import app
+        assert app._qwen_http() is app._qwen_http()
+
+    def test_route_timeouts_from_env(self, monkeypatch):
+        """QWEN_TIMEOUT_<ROUTE> should override the default route timeout."""
+        import app
+        assert app._qwen_timeout("evaluate_video").read == 600.0
+        monkeypatch.setenv("QWEN_TIMEOUT_EVALUATE_VIDEO", "900")
+        assert app._qwen_timeout("evaluate_video").read == 900.0
+
+    def test_diagnostics_reports_pool(self):
+        """Diagnostics endpoint should expose pool utilization."""
+        import app
+        client = TestClient(app.app)
+
+        response = client.get("/diagnostics", headers=DIAGNOSTICS_HEADERS)
+        assert response.status_code == 200
+        pool = response.json()["qwen_pool"]
+        assert "in_flight" in pool
+        assert "connections" in pool
+
+    def test_diagnostics_pool_falls_back_to_in_flight(self, monkeypatch, mock_qwen):
+        """When the transport has no readable pool, connections are estimated from the requests in flight."""
+        import httpx
+        import app
+        mock_qwen(lambda request: httpx.Response(200))
+        monkeypatch.setitem(app._qwen_pool_stats, "in_flight", 2)
+        connections = app._qwen_pool_snapshot()["connections"]
+        assert connections == {"open": None, "idle": None, "active": 2, "estimated": True}
+
+    def test_diagnostics_requires_secret(self, monkeypatch):
+        """Without the X-Diagnostics-Secret header (or with DIAGNOSTICS_SECRET unset) the stats stay private."""
+        import app
+        client = TestClient(app.app)
+        assert client.get("/diagnostics").status_code == 401
+        assert client.get("/diagnostics", headers={"X-Diagnostics-Secret": "wrong"}).status_code == 401
+        monkeypatch.delenv("DIAGNOSTICS_SECRET")
+        assert client.get("/diagnostics", headers=DIAGNOSTICS_HEADERS).status_code == 503
+
+    def test_diagnostics_does_not_create_job_store(self):
+        """Reading the job stats shouldn't open (and create) the SQLite store."""
+        import app
+        client = TestClient(app.app)
+        assert client.get("/diagnostics", headers=DIAGNOSTICS_HEADERS).json()["jobs"]["by_status"] == {}
+        assert app._qwen_jobs is None
+
+
+class TestStreamingUploads:
+    """Tests for streaming video uploads through the /qwen-api proxy."""
+
+    @pytest.fixture
+    def upstream(self, mock_qwen):
+        """Point the proxy at a mock Qwen service that records what it received."""
+        import httpx
+        received = {}
+
+        def handler(req):
+            received["body"] = req.content
+            received["content_type"] = req.headers.get("content-type", "")
+            return httpx.Response(200, json={"video_notes": "ok"})
+
+        mock_qwen(handler)
+        return received
+
+    def test_file_is_forwarded_intact(self, upstream):
+        """A multi-MB upload should arrive upstream byte-for-byte as a multipart body."""
+        import app
+        client = TestClient(app.app)
+        payload = bytes(range(256)) * 8192  # 2 MB, larger than Starlette's in-memory spool
+
+        response = client.post("/qwen-api/analyze_video", files={"file": ("talk.mp4", payload, "video/mp4")})
+        assert response.status_code == 200
+        assert upstream["content_type"].startswith("multipart/form-data")
+        assert payload in upstream["body"]
+
+    def test_upload_peak_rss_reported(self, upstream):
+        """Each streamed upload should be recorded with its peak RSS in diagnostics."""
+        import app
+        client = TestClient(app.app)
+
+        client.post("/qwen-api/analyze_video", files={"file": ("talk.mp4", b"x" * 1024, "video/mp4")})
+        uploads = client.get("/diagnostics", headers=DIAGNOSTICS_HEADERS).json()["uploads"]
+        assert uploads["in_flight"] == 0
+        assert uploads["recent"][-1]["route"] == "analyze_video"
+        assert "peak_rss_mb" in uploads["recent"][-1]
+
+
+class TestJobQueue:
+    """Tests for the asynchronous /qwen-api/jobs evaluation queue."""
+
+    @pytest.fixture
+    def upstream(self, mock_qwen):
+        """Mock Qwen service that returns a fixed evaluation."""
+        import httpx
+        calls = []
+
+        def handler(req):
+            calls.append(req)
+            return httpx.Response(200, json={"sections": {"Content": {"score": 35}}})
+
+        mock_qwen(handler)
+        return calls
+
+    @staticmethod
+    def _wait_for(client, job_id, timeout=5.0):
+        import time
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = client.get(f"/qwen-api/jobs/{job_id}").json()
+            if job["status"] in ("succeeded", "failed"):
+                return job
+            time.sleep(0.05)
+        raise AssertionError(f"job {job_id} did not finish")
+
+    def test_submit_returns_job_id_and_result_is_pollable(self, upstream):
+        """Submit should answer 202 immediately; polling should eventually return the upstream evaluation."""
+        import app
+        with TestClient(app.app) as client:
+            response = client.post(
+                "/qwen-api/jobs/evaluate_video",
+                data={"rubric": "{}"},
+                files={"file": ("talk.mp4", b"x" * 4096, "video/mp4")},
+            )
+            assert response.status_code == 202
+            job_id = response.json()["id"]
+            assert response.headers["location"] == f"/qwen-api/jobs/{job_id}"
+
+            job = self._wait_for(client, job_id)
+        assert job["status"] == "succeeded"
+        assert job["result"] == {"sections": {"Content": {"score": 35}}}
+        assert b"x" * 4096 in upstream[0].content
+
+    def test_events_stream_ends_with_finished_job(self, upstream, monkeypatch):
+        """The SSE endpoint should emit data messages and close once the job is done."""
+        import json
+        import app
+        monkeypatch.setenv("QWEN_JOB_POLL_SECONDS", "0.05")
+        with TestClient(app.app) as client:
+            job_id = client.post(
+                "/qwen-api/jobs/evaluate_video", data={"rubric": "{}", "storage_url": "https://storage.test/v.mp4"}
+            ).json()["id"]
+            response = client.get(f"/qwen-api/jobs/{job_id}/events")
+        assert response.headers["content-type"].startswith("text/event-stream")
+        messages = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+        assert messages[-1]["status"] == "succeeded"
+        assert b"storage_url" in upstream[0].content
+
+    def test_upstream_error_marks_job_failed(self, mock_qwen):
+        """A non-200 from Qwen should leave the job failed with the upstream detail."""
+        import httpx
+        import app
+        mock_qwen(lambda req: httpx.Response(500, json={"detail": "CUDA out of memory"}))
+        with TestClient(app.app) as client:
+            job_id = client.post("/qwen-api/jobs/evaluate_video", data={"rubric": "{}", "storage_url": "https://s/v.mp4"}).json()["id"]
+            job = self._wait_for(client, job_id)
+        assert job["status"] == "failed"
+        assert job["status_code"] == 500
+        assert "out of memory" in job["error"].lower()
+
+    def test_running_jobs_are_requeued_after_restart(self):
+        """Jobs a dead process left running should go back to the queue on startup."""
+        import app
+        store = app._qwen_job_store()
+        store.create(id="stale", rubric="{}", storage_url="https://s/v.mp4")
+        assert store.claim("stale")
+        assert store.recover() == ["stale"]
+        assert store.get("stale")["status"] == "queued"
+
+    @pytest.fixture
+    def quota(self, monkeypatch):
+        """Sign every request in as user-1 and let check_user_quota return quota[...]; the workers are held back."""
+        import queue
+        import app
+        state = {"has_quota": True, "quota_type": "individual", "remaining_quota": 2}
+
+        async def fake_check(user_id):
+            return dict(state)
+
+        monkeypatch.setattr(app, "_get_user_info_from_token", lambda request: ("user-1", None))
+        monkeypatch.setattr(app, "_check_user_quota", fake_check)
+        monkeypatch.setattr(app, "_quota_cache", {})
+        monkeypatch.setattr(app, "_quota_cache_alias", {})
+        monkeypatch.setattr(app, "_start_qwen_job_workers", lambda: None)
+        monkeypatch.setattr(app, "_qwen_job_queue", queue.Queue())
+        return state
+
+    def test_queued_jobs_reserve_quota(self, upstream, quota):
+        """With 2 evaluations left, a third queued job is refused until one of the first two finishes."""
+        import app
+        client = TestClient(app.app)
+
+        def submit():
+            return client.post("/qwen-api/jobs/evaluate_video", data={"rubric": "{}", "storage_url": "https://s/v.mp4"})
+
+        first, second, third = submit(), submit(), submit()
+        assert (first.status_code, second.status_code, third.status_code) == (202, 202, 402)
+        assert "reserved by 2 queued" in third.json()["detail"]
+        assert app._qwen_job_store().reserved("user_id", "user-1") == 2
+
+        app._finish_qwen_job(first.json()["id"], 200, "{}")
+        assert submit().status_code == 202
+
+    def test_quota_checked_again_before_running(self, upstream, quota):
+        """A job whose quota was spent while it waited fails with 402 without reaching Qwen."""
+        import asyncio
+        import app
+        client = TestClient(app.app)
+        job_id = client.post("/qwen-api/jobs/evaluate_video", data={"rubric": "{}", "storage_url": "https://s/v.mp4"}).json()["id"]
+
+        quota.update(has_quota=False, remaining_quota=0)
+        app._quota_cache.clear()
+        asyncio.run(app._run_qwen_job(job_id))
+        job = app._qwen_job_store().get(job_id)
+        assert job["status"] == "failed" and job["status_code"] == 402
+        assert "Quota exhausted" in job["error"]
+        assert upstream == []
+
+    def test_old_finished_jobs_purged_periodically(self, monkeypatch):
+        """The janitor keeps purging jobs past QWEN_JOB_RETENTION_HOURS while the process runs, not just at startup."""
+        import asyncio
+        import time
+        import app
+        monkeypatch.setenv("QWEN_JOB_RETENTION_HOURS", "1")
+        monkeypatch.setenv("QWEN_JOB_PURGE_SECONDS", "1")
+        store = app._qwen_job_store()
+
+        def finished(job_id, hours_ago):
+            store.create(id=job_id, rubric="{}", storage_url="https://s/v.mp4")
+            store.update(job_id, status="succeeded", finished_at=time.time() - hours_ago * 3600)
+
+        async def scenario():
+            finished("old", 2)
+            finished("recent", 0)
+            janitor = asyncio.create_task(app._qwen_job_janitor())
+            await asyncio.sleep(0.2)
+            first = (store.get("old"), store.get("recent"))
+            finished("later", 2)  # goes stale long after startup
+            await asyncio.sleep(1.2)
+            janitor.cancel()
+            return first
+
+        old, recent = asyncio.run(scenario())
+        assert old is None and recent is not None
+        assert store.get("later") is None
+        assert app._qwen_job_stats["purged"] >= 2
+
+    def test_unknown_job_is_404(self):
+        """Polling an unknown id should be a 404, not an error."""
+        import app
+        client = TestClient(app.app)
+        assert client.get("/qwen-api/jobs/does-not-exist").status_code == 404
+
+
+class TestResultCache:
+    """Tests for serving repeat /qwen-api/evaluate_video requests from the result cache."""
+
+    @pytest.fixture
+    def upstream(self, mock_qwen):
+        """Mock Qwen service that counts evaluations."""
+        import httpx
+        calls = []
+
+        def handler(req):
+            calls.append(req)
+            return httpx.Response(200, json={"sections": {"Content": {"score": 35}}, "overallComments": ""})
+
+        mock_qwen(handler)
+        return calls
+
+    def _evaluate(self, client, video, rubric):
+        return client.post("/qwen-api/evaluate_video", data={"rubric": rubric}, files={"file": ("talk.mp4", video, "video/mp4")})
+
+    def test_same_video_and_rubric_hits_cache(self, upstream):
+        """A rerun with identical bytes and an equivalent rubric should not reach Qwen."""
+        import app
+        client = TestClient(app.app)
+
+        first = self._evaluate(client, b"v" * 2048, '{"name": "R", "totalPoints": 100}')
+        second = self._evaluate(client, b"v" * 2048, '{"totalPoints": 100, "name": "R"}')
+        assert first.headers["x-qwen-cache"] == "miss"
+        assert second.headers["x-qwen-cache"] == "hit"
+        assert second.json() == first.json()
+        assert len(upstream) == 1
+        stats = client.get("/diagnostics", headers=DIAGNOSTICS_HEADERS).json()["result_cache"]
+        assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    def test_different_video_misses(self, upstream):
+        """Changing the video bytes must produce a fresh evaluation."""
+        import app
+        client = TestClient(app.app)
+
+        self._evaluate(client, b"a" * 2048, "{}")
+        self._evaluate(client, b"b" * 2048, "{}")
+        assert len(upstream) == 2
+
+    def test_hit_logged_as_zero_gpu_seconds(self, upstream, monkeypatch):
+        """Cost tracking should record cache hits with no GPU time or cost."""
+        import app
+        logged = []
+
+        async def fake_log(**kwargs):
+            logged.append(kwargs)
+
+        monkeypatch.setattr(app, "_log_cost_to_database", fake_log)
+        client = TestClient(app.app)
+        self._evaluate(client, b"v" * 2048, "{}")
+        self._evaluate(client, b"v" * 2048, "{}")
+        assert logged[0]["gpu_seconds"] > 0
+        assert logged[1]["cache_hit"] is True
+        assert "gpu_seconds" not in logged[1]
+
+    @staticmethod
+    def _mock_storage_and_qwen(mock_qwen, headers: dict, qwen_status=None):
+        """Mock storage (HEADs answered with headers) and Qwen transports; returns the evaluations per host."""
+        import httpx
+        evaluations = []
+
+        def handler(req):
+            assert req.method != "HEAD", "storage HEADs must not go through the Qwen pool"
+            evaluations.append(req.url.host)
+            status = (qwen_status or {}).get(req.url.host, 200)
+            return httpx.Response(status, json={"sections": {"Content": {"score": 35}}, "host": req.url.host})
+
+        mock_qwen(handler, storage=lambda req: httpx.Response(200, headers=headers))
+        return evaluations
+
+    def test_storage_url_keyed_on_object_version(self, mock_qwen):
+        """A video re-uploaded to the same storage path (new ETag) is evaluated again; the same object is a hit."""
+        import app
+        headers = {"ETag": '"v1"', "Last-Modified": "Sat, 17 Oct 2026 10:00:00 GMT", "Content-Length": "2048"}
+        evaluations = self._mock_storage_and_qwen(mock_qwen, headers)
+        client = TestClient(app.app)
+        data = {"rubric": "{}", "storage_url": "https://storage.test/object/public/evaluation-media/u1/talk.mp4"}
+
+        assert client.post("/qwen-api/evaluate_video", data=data).headers["x-qwen-cache"] == "miss"
+        assert client.post("/qwen-api/evaluate_video", data=data).headers["x-qwen-cache"] == "hit"
+        headers["ETag"] = '"v2"'  # upsert to the same path
+        assert client.post("/qwen-api/evaluate_video", data=data).headers["x-qwen-cache"] == "miss"
+        assert len(evaluations) == 2
+
+    def test_storage_url_without_version_not_cached(self, mock_qwen):
+        """With no ETag or Last-Modified the object can't be told apart from a replacement, so nothing is cached."""
+        import app
+        evaluations = self._mock_storage_and_qwen(mock_qwen, {})
+        client = TestClient(app.app)
+        data = {"rubric": "{}", "storage_url": "https://storage.test/v.mp4"}
+
+        for _ in range(2):
+            assert "x-qwen-cache" not in client.post("/qwen-api/evaluate_video", data=data).headers
+        assert len(evaluations) == 2
+
+    def test_result_stored_under_the_model_that_answered(self, monkeypatch, mock_qwen):
+        """A failover answer is keyed on that backend's model; only backends serving the same model reuse it."""
+        import json
+        import app
+        status = {"big.test": 503}
+        evaluations = self._mock_storage_and_qwen(mock_qwen, {}, qwen_status=status)
+
+        def configure(*backends):
+            monkeypatch.setenv("QWEN_BACKENDS", json.dumps([{"url": f"http://{host}", "model": model} for host, model in backends]))
+
+        client = TestClient(app.app)
+        configure(("big.test", "qwen-7b"), ("small.test", "qwen-3b"))
+        assert self._evaluate(client, b"v" * 2048, "{}").json()["host"] == "small.test"
+        assert self._evaluate(client, b"v" * 2048, "{}").headers["x-qwen-cache"] == "hit"
+
+        status["big.test"] = 200
+        configure(("big.test", "qwen-7b"))  # the 3b result must not be served as the 7b model's
+        assert self._evaluate(client, b"v" * 2048, "{}").headers["x-qwen-cache"] == "miss"
+        configure(("other.test", "qwen-3b"))  # another backend with the 3b model does reuse it
+        assert self._evaluate(client, b"v" * 2048, "{}").headers["x-qwen-cache"] == "hit"
+        assert evaluations == ["big.test", "small.test", "big.test"]
+
+
+class TestSupabaseClient:
+    """Tests for the shared service-role Supabase client and its latency metrics."""
+
+    def test_client_is_shared(self, monkeypatch):
+        """Repeated lookups should return one client until the credentials change."""
+        import app
+        monkeypatch.setenv("SUPABASE_URL", "https://test.supabase.co")
+        monkeypatch.setenv("SUPABASE_SERVICE_ROLE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZSJ9.c2ln")
+        monkeypatch.setattr(app, "_supabase_client", None)
+
+        client = app._supabase_admin()
+        assert client is not None
+        assert app._supabase_admin() is client
+
+    def test_missing_config_returns_none(self, monkeypatch):
+        """Without a service-role key there is no client (callers bypass quota/cost tracking)."""
+        import app
+        monkeypatch.delenv("SUPABASE_SERVICE_ROLE_KEY", raising=False)
+        assert app._supabase_admin() is None
+
+    def test_rpc_latency_recorded(self, monkeypatch):
+        """check_user_quota should go through the shared client and land in the latency histogram."""
+        import asyncio
+        import types
+        import app
+        calls = []
+
+        class FakeClient:
+            def rpc(self, name, params):
+                calls.append((name, params))
+                return types.SimpleNamespace(execute=lambda: types.SimpleNamespace(data=[{"has_quota": True, "remaining_quota": 7}]))
+
+        monkeypatch.setenv("SUPABASE_URL", "https://test.supabase.co")
+        monkeypatch.setenv("SUPABASE_SERVICE_ROLE_KEY", "key")
+        monkeypatch.setattr(app, "_supabase_admin", lambda: FakeClient())
+        monkeypatch.setattr(app, "_supabase_latency", {})
+
+        result = asyncio.run(app._check_user_quota("user-1"))
+        assert result["remaining_quota"] == 7
+        assert calls == [("check_user_quota", {"p_user_id": "user-1"})]
+        stats = app._supabase_latency_snapshot()["rpc:check_user_quota"]
+        assert stats["count"] == 1
+        assert sum(stats["histogram_ms"].values()) == 1
+
+
+class TestQuotaCache:
+    """Tests for the short-TTL quota cache in front of check_user_quota."""
+
+    @pytest.fixture
+    def rpc(self, monkeypatch):
+        """Replace the Supabase RPCs with counters; quota[...] is what check_user_quota returns."""
+        import app
+        state = {"checks": 0, "increments": [], "quota": {"has_quota": True, "quota_type": "individual", "remaining_quota": 10}}
+
+        async def fake_check(user_id):
+            state["checks"] += 1
+            return dict(state["quota"])
+
+        async def fake_increment(user_id, evaluation_id=None, cost=0, provider="runpod"):
+            state["increments"].append((user_id, cost))
+
+        monkeypatch.setattr(app, "_check_user_quota", fake_check)
+        monkeypatch.setattr(app, "_increment_usage", fake_increment)
+        monkeypatch.setattr(app, "_quota_cache", {})
+        monkeypatch.setattr(app, "_quota_cache_alias", {})
+        monkeypatch.setattr(app, "_quota_cache_stats", dict.fromkeys(app._quota_cache_stats, 0))
+        return state
+
+    def test_repeat_checks_served_from_cache(self, rpc):
+        """Within the TTL only the first check should reach Supabase."""
+        import asyncio
+        import app
+
+        async def run():
+            return [await app._cached_user_quota("user-1") for _ in range(3)]
+
+        results = asyncio.run(run())
+        assert rpc["checks"] == 1
+        assert all(r["remaining_quota"] == 10 for r in results)
+        assert app._quota_cache_snapshot()["hits"] == 2
+
+    def test_near_boundary_uses_authoritative_rpc(self, rpc):
+        """With only a few evaluations left every check should go to Supabase."""
+        import asyncio
+        import app
+        rpc["quota"]["remaining_quota"] = 2
+
+        async def run():
+            await app._cached_user_quota("user-1")
+            await app._cached_user_quota("user-1")
+
+        asyncio.run(run())
+        assert rpc["checks"] == 2
+        assert app._quota_cache_snapshot()["boundary_checks"] == 1
+
+    def test_usage_decrements_cache_and_reconciles_in_background(self, rpc):
+        """A successful evaluation should lower the cached count at once and then sync with Supabase."""
+        import asyncio
+        import app
+
+        async def run():
+            await app._cached_user_quota("user-1")
+            await app._record_usage("user-1", None, 0.5, "modal")
+            decremented = app._quota_cache["user:user-1"]["info"]["remaining_quota"]
+            await asyncio.gather(*app._quota_background)
+            return decremented
+
+        assert asyncio.run(run()) == 9
+        assert rpc["increments"] == [("user-1", 0.5)]
+        assert rpc["checks"] == 2
+        assert app._quota_cache["user:user-1"]["info"]["remaining_quota"] == 10
+
+    def test_bypass_results_are_not_cached(self, rpc):
+        """A Supabase outage (bypass) should not be remembered for the TTL."""
+        import asyncio
+        import app
+        rpc["quota"] = {"has_quota": True, "bypass": True}
+
+        async def run():
+            await app._cached_user_quota("user-1")
+            await app._cached_user_quota("user-1")
+
+        asyncio.run(run())
+        assert rpc["checks"] == 2
+        assert app._quota_cache == {}
+
+    def test_department_quota_shared_per_institution(self, rpc):
+        """Department users of one institution should share a single cached pool."""
+        import asyncio
+        import app
+        rpc["quota"]["quota_type"] = "department"
+
+        async def run():
+            await app._cached_user_quota("user-1", "inst-1")
+            await app._cached_user_quota("user-2", "inst-1")
+
+        asyncio.run(run())
+        assert list(app._quota_cache) == ["institution:inst-1"]
+        assert app._quota_cache_alias == {"user-1": "institution:inst-1", "user-2": "institution:inst-1"}
+
+
+class TestCostWriter:
+    """Tests for the batched background cost_tracking writer."""
+
+    class Rejected(Exception):
+        """What postgrest raises when Postgres refuses a row (check_violation)."""
+        code = "23514"
+
+    class FakeSupabase:
+        """
+        Records inserts and profile lookups; set fail=True to simulate Supabase being unreachable, bad_cost to have
+        Postgres reject any insert containing a row with that estimated_cost.
+        """
+
+        def __init__(self):
+            self.inserts = []
+            self.lookups = []
+            self.fail = False
+            self.bad_cost = None
+
+        def table(self, name):
+            import types
+            fake = self
+
+            def insert(rows, returning=None):
+                def execute():
+                    if fake.fail:
+                        raise ConnectionError("supabase unreachable")
+                    if any(r["estimated_cost"] == fake.bad_cost for r in rows):
+                        raise TestCostWriter.Rejected("new row violates check constraint")
+                    fake.inserts.append([dict(r) for r in rows])
+                return types.SimpleNamespace(execute=execute)
+
+            def select(columns):
+                def in_(column, ids):
+                    fake.lookups.append(list(ids))
+                    rows = [{"id": i, "institution_id": "inst-" + i} for i in ids]
+                    return types.SimpleNamespace(execute=lambda: types.SimpleNamespace(data=rows))
+                return types.SimpleNamespace(in_=in_)
+
+            return types.SimpleNamespace(insert=insert, select=select)
+
+    @pytest.fixture
+    def supabase(self, monkeypatch):
+        import app
+        fake = self.FakeSupabase()
+        monkeypatch.setattr(app, "_supabase_admin", lambda: fake)
+        monkeypatch.setattr(app, "_institution_ids", {})
+        return fake
+
+    @staticmethod
+    def _row(user_id="u1", cost=0.1):
+        return {"instructor_id": user_id, "institution_id": None, "estimated_cost": cost}
+
+    def test_rows_are_batched_into_one_insert(self, supabase, tmp_path):
+        """Rows queued together should reach Supabase as a single multi-row insert."""
+        import app
+        writer = app._CostWriter(tmp_path / "spill.jsonl", flush_seconds=60, batch_size=50)
+        for _ in range(3):
+            writer.enqueue(self._row())
+        writer.close()
+        assert [len(batch) for batch in supabase.inserts] == [3]
+        assert writer.stats["written"] == 3
+
+    def test_institution_lookup_is_cached(self, supabase, tmp_path):
+        """One user_profiles query per unknown user; later batches reuse the cached institution_id."""
+        import app
+        writer = app._CostWriter(tmp_path / "spill.jsonl", flush_seconds=60, batch_size=2)
+        for _ in range(4):
+            writer.enqueue(self._row("u1"))
+        writer.close()
+        assert supabase.lookups == [["u1"]]
+        assert all(r["institution_id"] == "inst-u1" for batch in supabase.inserts for r in batch)
+        assert app._cached_institution("u1") == "inst-u1"
+
+    def test_unreachable_supabase_spills_and_replays(self, supabase, tmp_path):
+        """Failed inserts go to the spill file and are written once Supabase is back."""
+        import app
+        spill = tmp_path / "spill.jsonl"
+        supabase.fail = True
+        writer = app._CostWriter(spill, flush_seconds=60, batch_size=50)
+        writer.enqueue(self._row(cost=1.0))
+        writer.enqueue(self._row(cost=2.0))
+        writer.close()
+        assert len(spill.read_text().splitlines()) == 2
+
+        supabase.fail = False
+        writer = app._CostWriter(spill, flush_seconds=60, batch_size=50)
+        writer.enqueue(self._row(cost=3.0))
+        writer.close()
+        costs = sorted(r["estimated_cost"] for batch in supabase.inserts for r in batch)
+        assert costs == [1.0, 2.0, 3.0]
+        assert writer.stats["replayed"] == 2
+        assert not spill.exists()
+
+    def test_rejected_row_is_dead_lettered(self, supabase, tmp_path):
+        """A row Postgres refuses doesn't sink its batch: the others are written, it goes to the .rejected file."""
+        import json
+        import app
+        spill = tmp_path / "spill.jsonl"
+        supabase.bad_cost = -1.0
+        writer = app._CostWriter(spill, flush_seconds=60, batch_size=50)
+        for cost in (1.0, -1.0, 2.0):
+            writer.enqueue(self._row(cost=cost))
+        writer.close()
+        assert sorted(r["estimated_cost"] for batch in supabase.inserts for r in batch) == [1.0, 2.0]
+        rejected = [json.loads(line) for line in writer.rejected_path.read_text().splitlines()]
+        assert [r["row"]["estimated_cost"] for r in rejected] == [-1.0]
+        assert "check constraint" in rejected[0]["error"]
+        assert writer.stats["written"] == 2 and writer.stats["rejected"] == 1
+        assert not spill.exists()
+
+    def test_replay_skips_bad_spill_lines_and_rows(self, supabase, tmp_path):
+        """A truncated line and a rejected row are dead-lettered; the rest replays and the spill is drained."""
+        import json
+        import app
+        spill = tmp_path / "spill.jsonl"
+        lines = [json.dumps(self._row(cost=c)) for c in (1.0, -1.0, 2.0)]
+        spill.write_text("\n".join(lines) + "\n" + lines[0][:10] + "\n")
+        supabase.bad_cost = -1.0
+        writer = app._CostWriter(spill, flush_seconds=60, batch_size=50)
+        writer.enqueue(self._row(cost=3.0))
+        writer.close()
+        assert sorted(r["estimated_cost"] for batch in supabase.inserts for r in batch) == [1.0, 2.0, 3.0]
+        assert writer.stats["replayed"] == 2 and writer.stats["rejected"] == 2
+        assert not spill.exists() and not spill.with_name(spill.name + ".replaying").exists()
+
+        writer = app._CostWriter(spill, flush_seconds=60, batch_size=50)
+        writer.enqueue(self._row(cost=4.0))
+        writer.close()
+        assert writer.stats["replayed"] == 0  # nothing left to retry
+
+    def test_write_waits_for_the_replay_backoff(self, supabase, tmp_path):
+        """After a failed insert, later successful batches don't retry the spill until the backoff has passed."""
+        import app
+        spill = tmp_path / "spill.jsonl"
+        supabase.fail = True
+        writer = app._CostWriter(spill, flush_seconds=60, batch_size=50)
+        writer.enqueue(self._row(cost=1.0))
+        writer.close()
+        supabase.fail = False
+
+        writer._write([self._row(cost=2.0)])
+        assert spill.exists() and writer.stats["replayed"] == 0
+        writer._retry_spill_at = 0.0
+        writer._write([self._row(cost=3.0)])
+        assert not spill.exists() and writer.stats["replayed"] == 1
+
+    def test_log_cost_only_enqueues(self, supabase, monkeypatch):
+        """The request path should hand the row to the writer with its own timestamp."""
+        import asyncio
+        import app
+        monkeypatch.setenv("SUPABASE_URL", "https://test.supabase.co")
+        monkeypatch.setenv("SUPABASE_SERVICE_ROLE_KEY", "key")
+        monkeypatch.setenv("COST_FLUSH_SECONDS", "60")
+        asyncio.run(app._log_cost_to_database(user_id="u1", gpu_seconds=4.0, estimated_cost=0.005, provider="modal"))
+        writer = app._cost_writer
+        assert writer.stats["enqueued"] == 1
+        assert supabase.inserts == []
+        writer.close()
+        row = supabase.inserts[0][0]
+        assert row["gpu_seconds"] == 4.0 and row["institution_id"] == "inst-u1"
+        assert "created_at" in row
+
+
+class TestStaticPages:
+    """Tests for precompressed, ETag-revalidated HTML pages and hashed asset URLs."""
+
+    @staticmethod
+    def _raw(client, path, **headers):
+        """(response, bytes as sent): stream so httpx doesn't transparently decompress."""
+        with client.stream("GET", path, headers=headers) as response:
+            return response, b"".join(response.iter_raw())
+
+    def test_gzip_variant_served_when_accepted(self):
+        """index.html should go out compressed and decompress to the original page."""
+        import gzip
+        import app
+        client = TestClient(app.app)
+
+        response, body = self._raw(client, "/index.html", **{"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert "accept-encoding" in response.headers["vary"].lower()
+        assert len(body) < (app._this_dir / "index.html").stat().st_size / 3
+        assert gzip.decompress(body).startswith(b"<!DOCTYPE html>")
+
+    def test_identity_when_encoding_refused(self):
+        """q=0 or no Accept-Encoding must get the uncompressed body."""
+        import app
+        client = TestClient(app.app)
+
+        response, _ = self._raw(client, "/landing.html", **{"Accept-Encoding": "gzip;q=0"})
+        assert "content-encoding" not in response.headers
+
+    def test_revalidation_returns_304(self):
+        """A repeat visit with the ETag (from any encoding) should get an empty 304."""
+        import app
+        client = TestClient(app.app)
+
+        first = client.get("/dashboard", headers={"Accept-Encoding": "gzip"})
+        assert first.headers["cache-control"] == "no-cache"
+        assert first.headers["last-modified"]
+        again = client.get("/dashboard", headers={"Accept-Encoding": "identity", "If-None-Match": first.headers["etag"]})
+        assert again.status_code == 304
+        assert again.content == b""
+
+    def test_hashed_asset_urls_are_immutable(self):
+        """HTML references assets by content hash, and those URLs are cacheable for a year."""
+        import re
+        import app
+        client = TestClient(app.app)
+
+        html = client.get("/index.html").text
+        hashed = re.search(r"assets/(speechgradebook-logo-light\.[0-9a-f]{10}\.png)", html).group(1)
+        asset = client.get(f"/assets/{hashed}")
+        assert asset.status_code == 200
+        assert "immutable" in asset.headers["cache-control"]
+        assert asset.content == (app._this_dir / "assets" / "speechgradebook-logo-light.png").read_bytes()
+        assert client.get("/assets/speechgradebook-logo-light.png").headers["cache-control"] == "no-cache"
+
+    def test_changed_file_is_rebuilt_on_refresh(self, tmp_path, monkeypatch):
+        """Editing a file on disk should produce a new ETag once the index is refreshed (SIGHUP or mtime poll)."""
+        import os
+        import app
+        monkeypatch.setattr(app, "_static_files", {})
+        page = tmp_path / "page.html"
+        page.write_text("<html>one</html>")
+        first = app._static_file(page)
+        page.write_text("<html>two</html>")
+        os.utime(page, (first.mtime + 5, first.mtime + 5))
+        assert app._static_file(page) is first
+        app._refresh_static_index("test")
+        assert app._static_file(page).etag != first.etag
+
+
+class TestSpaCatchAll:
+    """Tests for the in-memory file index behind the /{full_path} catch-all."""
+
+    def test_deep_link_serves_index_without_stat(self, monkeypatch):
+        """Deep links resolve from the index and memory, never from the filesystem."""
+        import pathlib
+        import app
+        client = TestClient(app.app)
+        client.get("/index.html")
+
+        def no_stat(self, *args, **kwargs):
+            raise AssertionError(f"stat({self})")
+
+        monkeypatch.setattr(pathlib.Path, "stat", no_stat)
+        monkeypatch.setattr(pathlib.Path, "exists", no_stat)
+        monkeypatch.setattr(pathlib.Path, "is_file", no_stat)
+        response = client.get("/courses/123/students")
+        assert response.status_code == 200
+        assert response.text.startswith("<!DOCTYPE html>")
+
+    def test_indexed_files_count_as_hits(self):
+        """Real pages are index hits, SPA routes are misses that fall back to index.html."""
+        import app
+        client = TestClient(app.app)
+        before = dict(app._static_index_stats)
+
+        assert client.get("/privacy.html").status_code == 200
+        assert client.get("/courses/1").status_code == 200
+        assert app._static_index_stats["hits"] == before["hits"] + 1
+        assert app._static_index_stats["misses"] == before["misses"] + 1
+
+    @pytest.mark.parametrize("path", ["/app.py", "/.env.example", "/requirements.txt", "/llm_training/qwen_serve.py"])
+    def test_source_files_are_not_served(self, path):
+        """Only whitelisted files are servable; source and env files on disk are 404."""
+        import app
+        client = TestClient(app.app)
+        assert client.get(path).status_code == 404
+
+
+class TestConfigJs:
+    """Tests for the generated /config.js and its inlining into index.html."""
+
+    def test_config_js_revalidates(self, monkeypatch):
+        """config.js should carry an ETag and answer 304 instead of being regenerated with no-store."""
+        import app
+        monkeypatch.setenv("SUPABASE_URL", "https://test.supabase.co")
+        client = TestClient(app.app)
+
+        first = client.get("/config.js")
+        assert "window.SUPABASE_URL = 'https://test.supabase.co';" in first.text
+        assert first.headers["cache-control"] == "no-cache"
+        assert client.get("/config.js", headers={"If-None-Match": first.headers["etag"]}).status_code == 304
+
+    def test_config_built_once(self, monkeypatch):
+        """The script is only rebuilt when one of its environment values changes."""
+        import app
+        monkeypatch.setenv("SUPABASE_URL", "https://a.supabase.co")
+        first = app._config_js()
+        assert app._config_js() is first
+        monkeypatch.setenv("SUPABASE_URL", "https://b.supabase.co")
+        assert app._config_js().etag != first.etag
+
+    def test_config_inlined_into_index(self, monkeypatch):
+        """index.html should embed the config instead of a render-blocking <script src="config.js">."""
+        import app
+        monkeypatch.setenv("SUPABASE_URL", "https://inline.supabase.co")
+        html = TestClient(app.app).get("/index.html").text
+        assert '<script src="config.js"></script>' not in html
+        assert "window.SUPABASE_URL = 'https://inline.supabase.co';" in html
+
+    def test_inlining_can_be_disabled(self, monkeypatch):
+        """STATIC_INLINE_CONFIG=0 keeps the external script tag."""
+        import app
+        monkeypatch.setenv("STATIC_INLINE_CONFIG", "0")
+        monkeypatch.setattr(app, "_static_files", {})
+        html = TestClient(app.app).get("/index.html").text
+        assert '<script src="config.js"></script>' in html
+
+
+class TestQwenCircuit:
+    """Tests for the circuit breaker in front of QWEN_API_URL."""
+
+    @pytest.fixture
+    def upstream(self, monkeypatch, mock_qwen):
+        """Mock Qwen service; set state["status"] to choose the reply, or "down" to refuse connections."""
+        import httpx
+        state = {"status": "down", "calls": 0}
+
+        def handler(req):
+            state["calls"] += 1
+            if state["status"] == "down":
+                raise httpx.ConnectError("connection refused", request=req)
+            return httpx.Response(state["status"], json={"status": "ok"})
+
+        monkeypatch.setenv("QWEN_CIRCUIT_FAILURES", "3")
+        mock_qwen(handler)
+        return state
+
+    def test_opens_after_consecutive_failures_and_fails_fast(self, upstream):
+        """After N connect errors further requests get 503 + Retry-After without reaching the backend."""
+        import app
+        client = TestClient(app.app)
+
+        for _ in range(3):
+            client.post("/qwen-api/analyze_video", files={"file": ("talk.mp4", b"x", "video/mp4")})
+        assert upstream["calls"] == 3
+
+        response = client.post("/qwen-api/analyze_video", files={"file": ("talk.mp4", b"x", "video/mp4")})
+        assert response.status_code == 503
+        assert int(response.headers["retry-after"]) > 0
+        assert upstream["calls"] == 3
+        circuit = client.get("/diagnostics", headers=DIAGNOSTICS_HEADERS).json()["qwen_circuit"]["runpod-1"]
+        assert circuit["state"] == "open"
+        assert circuit["transitions"] == {"closed->open": 1}
+
+    def test_half_open_allows_one_trial_then_closes(self, upstream, monkeypatch):
+        """Once the open period is over a single request goes through; success closes the circuit."""
+        import asyncio
+        import app
+
+        async def run():
+            for _ in range(3):
+                try:
+                    await app._qwen_send("GET", "health", "http://qwen.test/health")
+                except Exception:
+                    pass
+            circuit = app._qwen_circuit("http://qwen.test")
+            circuit.open_until = 0  # open period elapsed
+            upstream["status"] = 200
+            assert circuit.acquire() is True
+            with pytest.raises(app._QwenCircuitOpen):
+                await app._qwen_send("GET", "health", "http://qwen.test/health")  # trial slot already taken
+            circuit.release(True, True)
+            return circuit
+
+        circuit = asyncio.run(run())
+        assert circuit.state == "closed"
+        assert circuit.transitions == {"closed->open": 1, "open->half_open": 1, "half_open->closed": 1}
+
+    def test_failed_trial_reopens_with_backoff(self, upstream, monkeypatch):
+        """A failing half-open probe re-opens the circuit for twice as long."""
+        import asyncio
+        import time
+        import app
+        monkeypatch.setenv("QWEN_CIRCUIT_OPEN_SECONDS", "10")
+
+        async def run():
+            for _ in range(3):
+                try:
+                    await app._qwen_send("GET", "health", "http://qwen.test/health")
+                except Exception:
+                    pass
+            circuit = app._qwen_circuit("http://qwen.test")
+            circuit.open_until = 0
+            upstream["status"] = 503
+            await app._qwen_send("GET", "health", "http://qwen.test/health")
+            return circuit
+
+        circuit = asyncio.run(run())
+        assert circuit.state == "open"
+        assert 15 < circuit.open_until - time.time() <= 20
+
+    def test_client_errors_do_not_count(self, upstream):
+        """A 500 or 4xx means the backend is up; only connect errors, timeouts and 502-504 trip the circuit."""
+        import asyncio
+        import app
+        upstream["status"] = 500
+
+        async def run():
+            for _ in range(5):
+                await app._qwen_send("GET", "health", "http://qwen.test/health")
+
+        asyncio.run(run())
+        assert app._qwen_circuit("http://qwen.test").state == "closed"
+
+
+class TestQwenBackends:
+    """Tests for routing /qwen-api requests across several Qwen backends."""
+
+    @pytest.fixture
+    def backends(self, monkeypatch, mock_qwen):
+        """Three mock backends; set status[host] to the reply code or "down" to refuse connections."""
+        import asyncio
+        import json
+        import httpx
+        status = {"runpod.test": 200, "modal.test": 200, "isaac.test": 200}
+        calls = []
+
+        async def handler(req):
+            calls.append(req.url.host)
+            await asyncio.sleep(0.01)  # keep the request in flight so concurrent ones see it
+            if status[req.url.host] == "down":
+                raise httpx.ConnectError("connection refused", request=req)
+            return httpx.Response(status[req.url.host], json={"status": "ok", "host": req.url.host})
+
+        monkeypatch.setenv("QWEN_BACKENDS", json.dumps([
+            {"name": "runpod", "url": "http://runpod.test", "cost_per_second": 0.0002, "max_concurrency": 1},
+            {"name": "modal", "url": "http://modal.test", "provider": "modal", "cost_per_second": 0.001},
+            {"name": "isaac", "url": "http://isaac.test/", "provider": "isaac", "cost_per_second": 0.0, "weight": 2},
+        ]))
+        mock_qwen(handler, url=None)
+        return status, calls
+
+    def test_backends_parsed_from_env(self, backends):
+        """QWEN_BACKENDS replaces QWEN_API_URL; trailing slashes are dropped and providers default from the URL."""
+        import app
+        pool = app._qwen_backends()
+        assert [b.url for b in pool] == ["http://runpod.test", "http://modal.test", "http://isaac.test"]
+        assert [b.provider for b in pool] == ["runpod", "modal", "isaac"]
+        assert app._qwen_base() == "http://runpod.test"
+
+    def test_least_outstanding_spreads_by_weight(self, backends):
+        """Concurrent requests go to the backend with the fewest in-flight requests per unit of weight."""
+        import asyncio
+        import app
+        _, calls = backends
+
+        async def run():
+            return await asyncio.gather(*(app._qwen_route("GET", "health") for _ in range(4)))
+
+        results = asyncio.run(run())
+        assert all(r.status_code == 200 for _, r in results)
+        assert sorted(b.name for b, _ in results) == ["isaac", "isaac", "modal", "runpod"]
+
+    def test_cheapest_available(self, backends, monkeypatch):
+        """cheapest routing prefers the lowest cost_per_second backend whose circuit is closed."""
+        import asyncio
+        import app
+        monkeypatch.setenv("QWEN_ROUTING", "cheapest")
+        status, _ = backends
+        backend, _ = asyncio.run(app._qwen_route("GET", "health"))
+        assert backend.name == "isaac"
+        status["isaac.test"] = "down"
+        monkeypatch.setenv("QWEN_CIRCUIT_FAILURES", "1")
+        backend, _ = asyncio.run(app._qwen_route("GET", "health"))  # fails over, opens isaac's circuit
+        assert backend.name == "runpod"
+        backend, _ = asyncio.run(app._qwen_route("GET", "health"))
+        assert backend.name == "runpod"
+
+    def test_failover_on_503_and_connect_error(self, backends):
+        """A 503 or an unreachable backend is retried on the next one; counters record the failover."""
+        import asyncio
+        import app
+        status, calls = backends
+        status["isaac.test"] = 503
+        status["runpod.test"] = "down"
+        backend, response = asyncio.run(app._qwen_route("GET", "health"))
+        assert backend.name == "modal" and response.status_code == 200
+        assert sorted(calls) == ["isaac.test", "modal.test", "runpod.test"]
+        stats = app._qwen_backends_snapshot()["backends"]
+        assert stats["isaac"]["errors"] == 1 and stats["isaac"]["failovers"] == 1
+        assert stats["runpod"]["error_rate"] == 1.0
+        assert stats["modal"]["errors"] == 0
+
+    def test_all_backends_failing_returns_last_response(self, backends):
+        """When every backend answers 503 the caller sees the last 503 instead of an exception."""
+        import asyncio
+        import app
+        status, calls = backends
+        for host in status:
+            status[host] = 503
+        _, response = asyncio.run(app._qwen_route("GET", "health"))
+        assert response.status_code == 503
+        assert len(calls) == 3
+
+    def test_max_concurrency_queues_then_rejects(self, backends, monkeypatch):
+        """With every backend at max_concurrency a request waits, then gets 503 + Retry-After."""
+        import asyncio
+        import json
+        import app
+        monkeypatch.setenv("QWEN_BACKENDS", json.dumps([{"url": "http://runpod.test", "max_concurrency": 1}]))
+        monkeypatch.setenv("QWEN_BACKEND_QUEUE_SECONDS", "0.2")
+        backend = app._qwen_backends()[0]
+        backend.in_flight = 1
+        with pytest.raises(app._QwenCircuitOpen) as exc:
+            asyncio.run(app._qwen_route("GET", "health"))
+        assert exc.value.circuit is None
+        assert app._qwen_circuit_response(exc.value).status_code == 503
+
+    def test_spend_and_latency_in_diagnostics(self, backends, monkeypatch):
+        """Each backend's requests, latency and spend (at its cost_per_second) show up under /diagnostics."""
+        import app
+        monkeypatch.setenv("QWEN_ROUTING", "cheapest")
+        client = TestClient(app.app)
+        response = client.post("/qwen-api/analyze_video", files={"file": ("talk.mp4", b"x", "video/mp4")})
+        assert response.json()["host"] == "isaac.test"
+        diagnostics = client.get("/diagnostics", headers=DIAGNOSTICS_HEADERS)
+        stats = diagnostics.json()["qwen_backends"]
+        assert stats["routing"] == "cheapest"
+        isaac = stats["backends"]["isaac"]
+        assert isaac["requests"] == 1 and isaac["avg_latency_seconds"] is not None
+        assert isaac["estimated_spend_usd"] == 0.0
+        assert stats["backends"]["modal"]["requests"] == 0
+        assert "://" not in diagnostics.text
+
+
+class TestQwenWarm:
+    """Tests for the /qwen-api/warm pre-warm hook."""
+
+    @pytest.fixture
+    def upstream(self, monkeypatch, mock_qwen):
+        """Mock Qwen service that reports model_not_loaded for the first state["loading"] health checks."""
+        import httpx
+        state = {"loading": 2, "calls": 0}
+
+        def handler(req):
+            state["calls"] += 1
+            if state["calls"] <= state["loading"]:
+                return httpx.Response(200, json={"status": "model_not_loaded"})
+            return httpx.Response(200, json={"status": "ok"})
+
+        monkeypatch.setenv("QWEN_WARM_POLL_SECONDS", "0.01")
+        mock_qwen(handler, url="https://me--qwen.modal.run")
+        return state
+
+    def test_cold_start_is_polled_until_ready(self, upstream):
+        """The warm-up keeps polling /health while the model loads and records a cold start."""
+        import asyncio
+        import app
+
+        asyncio.run(app._warm_qwen_backend(app._qwen_backends()[0], "evaluate_page"))
+        assert upstream["calls"] == 3
+        recent = app._qwen_warm_snapshot()["recent"][-1]
+        assert recent["ready"] and recent["cold_start"] and recent["reason"] == "evaluate_page"
+
+    def test_warm_endpoint_is_debounced(self, upstream):
+        """A second call within QWEN_WARM_INTERVAL_SECONDS does not send another warm-up."""
+        import app
+        upstream["loading"] = 0
+        with TestClient(app.app) as client:
+            first = client.post("/qwen-api/warm?reason=bulk_upload")
+            second = client.post("/qwen-api/warm?reason=bulk_upload")
+        assert first.status_code == 202 and first.json()["warming"] == ["modal-1"]
+        assert second.json() == {"warming": [], "skipped": ["modal-1"]}
+
+    def test_disabled(self, upstream, monkeypatch):
+        """QWEN_WARM=0 makes the hook a no-op."""
+        import app
+        monkeypatch.setenv("QWEN_WARM", "0")
+        with TestClient(app.app) as client:
+            response = client.post("/qwen-api/warm")
+        assert response.json()["warming"] == []
+        assert upstream["calls"] == 0
@@ -0,0 +1,74 @@
+"""
+Tests for llm_training/json_extract.py (tolerant single-pass JSON extraction from model output).
+
+Run with: pytest tests/test_json_extract.py -v
+"""
+
+import json
+import os
+import sys
+import time
+
+# Add parent to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_training.json_extract import extract, last_object
+
+EVALUATION = {
+    "sections": {
+        "Content": {"score": 35, "maxScore": 40, "feedback": 'Said "{first}" then [second].', "subcategories": []},
+        "Delivery": {"score": 28, "maxScore": 30, "feedback": "Back\\slash } and a quote \"", "subcategories": []},
+    },
+    "timeline_markers": [{"seconds": 15, "label": "Purpose", "severity": "positive"}],
+}
+
+
+class TestExtract:
+    """Tests for finding and repairing JSON objects."""
+
+    def test_fenced_and_prose_wrapped(self):
+        """Fences and text around the object are skipped; braces and quotes inside strings don't confuse it."""
+        text = "Here is the evaluation:\n```json\n" + json.dumps(EVALUATION, indent=2) + "\n```\nLet me know!"
+        assert extract(text).objects == [EVALUATION]
+
+    def test_truncated_output_keeps_what_was_written(self):
+        """Cut mid-string: the string is closed; cut mid-number or mid-key: back to the last complete value."""
+        full = json.dumps(EVALUATION)
+        cut_in_string = full[: full.index("then [second]")]
+        assert last_object(cut_in_string)["sections"]["Content"]["feedback"] == 'Said "{first}" '
+        cut_in_number = full[: full.index('28') + 1]
+        assert last_object(cut_in_number)["sections"]["Delivery"] == {}
+        cut_in_key = full[: full.index('"maxScore": 40') + 5]
+        assert last_object(cut_in_key)["sections"]["Content"] == {"score": 35}
+        assert last_object('{"a": "x\\') == {"a": "x"} and last_object('{"a": "\\u00') == {"a": ""}
+
+    def test_trailing_commas_and_several_objects(self):
+        """Dangling commas are dropped; every top-level object is returned in order."""
+        text = '{"timeline_markers": [{"seconds": 3},],} then {"sections": {"A": {"score": 2,},},}'
+        assert extract(text).objects == [{"timeline_markers": [{"seconds": 3}]}, {"sections": {"A": {"score": 2}}}]
+        assert last_object(text) == {"sections": {"A": {"score": 2}}}
+
+    def test_watched_key_survives_a_broken_object(self):
+        """A "sections" value is recovered even when its enclosing object isn't valid JSON or is nested."""
+        broken = '{"timeline_markers": [oops], "sections": {"A": {"score": 7}}}'
+        found = extract(broken, keys=("sections",))
+        assert found.objects == [] and found.values["sections"] == {"A": {"score": 7}}
+        nested = extract('{"result": {"sections": {"A": 1}}, "x": 2', keys=("sections",))
+        assert nested.values["sections"] == {"A": 1}
+
+    def test_stray_brace_in_prose(self):
+        """An unclosed "{" in the preamble doesn't swallow the real object."""
+        assert last_object('Scores { see below [\n{"Content": 8}') == {"Content": 8}
+        assert last_object("no json here") is None
+
+    def test_linear_time(self):
+        """Twenty times more truncated text takes nowhere near 400 times longer (the old scan was quadratic)."""
+        def timed(n):
+            text = '{"timeline_markers": [' + '{"seconds": 1, "label": "{x}"}, ' * n  # never closed
+            started = time.perf_counter()
+            assert len(last_object(text)["timeline_markers"]) == n
+            return time.perf_counter() - started
+
+        timed(100)
+        small, large = timed(1000), timed(20000)
+        assert large < small * 100
@@ -0,0 +1,200 @@
+"""
+Tests for llm_training/json_grammar.py (schema-constrained JSON decoding).
+
+Run with: pytest tests/test_json_grammar.py -v
+"""
+
+import json
+import os
+import sys
+
+# Add parent to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_training.json_grammar import Grammar, JSONLogitsProcessor
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sections": {
+            "type": "object",
+            "properties": {
+                "Content": {
+                    "type": "object",
+                    "properties": {
+                        "score": {"type": "number", "minimum": 0},
+                        "maxScore": {"const": 40},
+                        "subcategories": {
+                            "type": "array",
+                            "prefixItems": [
+                                {"type": "object", "properties": {"name": {"const": "Org"}, "points": {"type": "number"}}}
+                            ],
+                        },
+                    },
+                },
+            },
+        },
+        "timeline_markers": {
+            "type": "array",
+            "maxItems": 2,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "label": {"type": "string", "maxLength": 12},
+                    "severity": {"enum": ["minor", "major"]},
+                },
+            },
+        },
+        "grades": {"type": "object", "additionalProperties": {"type": "integer"}},
+    },
+}
+
+VALID = (
+    '{"sections":{"Content":{"score":35.5,"maxScore":40,"subcategories":[{"name":"Org","points":12}]}},'
+    '"timeline_markers":[{"label":"say \\"um\\" \\u00e9","severity":"major"}],"grades":{"A":90,"B":80}}'
+)
+
+
+class TestGrammar:
+    """Tests for the character-level automaton."""
+
+    def test_accepts_a_schema_document(self):
+        """A compact document in schema order is accepted (escapes included) and is real JSON."""
+        grammar = Grammar(SCHEMA)
+        assert grammar.accepts(VALID)
+        assert json.loads(VALID)["timeline_markers"][0]["label"] == 'say "um" é'
+
+    def test_rejects_what_the_repair_parsers_used_to_clean_up(self):
+        """Fences, trailing text, truncation, out-of-order keys and off-schema values never get through."""
+        grammar = Grammar(SCHEMA)
+        assert grammar.advance(grammar.initial, "```json") is None
+        assert grammar.advance(grammar.initial, "Sure! {") is None
+        assert not grammar.accepts(VALID + "\nHope this helps")
+        assert not grammar.accepts(VALID[:-1])
+        assert grammar.advance(grammar.initial, '{"timeline_markers"') is None
+        assert not grammar.accepts(VALID.replace('"major"', '"severe"'))
+        assert not grammar.accepts(VALID.replace('"Org"', '"Organization"'))
+        assert not grammar.accepts(VALID.replace("35.5", "-3"))
+        assert not grammar.accepts(VALID.replace('"maxScore":40', '"maxScore":10'))
+
+    def test_limits(self):
+        """maxLength caps strings and maxItems caps arrays; an empty free-form object is fine."""
+        grammar = Grammar(SCHEMA)
+        assert not grammar.accepts(VALID.replace("say", "say this word"))
+        marker = '{"label":"x","severity":"minor"}'
+        two = VALID.replace(VALID[VALID.index('[{"label"'):VALID.index('],"grades"') + 1], f"[{marker},{marker}]")
+        three = two.replace(f"[{marker},{marker}]", f"[{marker},{marker},{marker}]")
+        assert grammar.accepts(two) and not grammar.accepts(three)
+        assert grammar.accepts(VALID.replace('{"A":90,"B":80}', "{}"))
+
+
+class FakeTokenizer:
+    """A tiny vocabulary with the tokens a model would be tempted by: fences, prose, whitespace."""
+
+    def __init__(self, pieces):
+        self.vocab = list(pieces) + ["<eos>"]
+        self.eos_token_id = len(self.vocab) - 1
+        self.all_special_ids = [self.eos_token_id]
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def batch_decode(self, ids, **kwargs):
+        return ["".join(self.vocab[i] for i in row) for row in ids]
+
+
+class TestLogitsProcessor:
+    """Tests for masking generate() scores with the grammar."""
+
+    def _greedy(self, processor, tokenizer, preference, steps=200):
+        """Greedy decoding where the 'model' always prefers tokens earlier in preference."""
+        import torch
+        rank = {t: i for i, t in enumerate(preference)}
+        base = torch.tensor([[-float(rank.get(t, len(rank))) for t in tokenizer.vocab] + [5.0]])  # + one padded id
+        ids = torch.zeros((1, 2), dtype=torch.long)
+        for _ in range(steps):
+            scores = processor(ids, base.clone())
+            nxt = int(torch.argmax(scores[0]))
+            ids = torch.cat([ids, torch.tensor([[nxt]])], dim=1)
+            if nxt == tokenizer.eos_token_id:
+                break
+        return tokenizer.batch_decode([ids[0, 2:].tolist()])[0]
+
+    def test_greedy_output_is_schema_json_then_eos(self):
+        """Even a model that wants fences and prose produces exactly one valid document and then EOS."""
+        pieces = ["```json", "Sure", "\n", " ", "{", "}", "[", "]", ",", ":", '"', '":', '{"', '"}', '"]', "}}",
+                  "sections", "Content", "score", "maxScore", "subcategories", "name", "Org", "points",
+                  "timeline_markers", "label", "severity", "minor", "major", "grades", "A", "3", "4", "0", ".",
+                  "good", " eye contact", "\\", "�"]
+        tokenizer = FakeTokenizer(pieces)
+        processor = JSONLogitsProcessor(Grammar(SCHEMA), tokenizer)
+        preference = ["```json", "Sure", "\n", " eye contact", '"}', "4", "}}", "]", "<eos>"]
+        text = self._greedy(processor, tokenizer, preference)
+        assert text.endswith("<eos>")
+        document = text[: -len("<eos>")]
+        assert Grammar(SCHEMA).accepts(document)
+        assert json.loads(document)["sections"]["Content"]["maxScore"] == 40
+        assert processor.complete and processor.desynced == 0
+
+    def test_allowed_sets_are_cached_on_the_grammar(self):
+        """A second generation with the same grammar reuses the per-state token sets."""
+        pieces = ["{", "}", "[", "]", ",", ":", '"', "sections", "Content", "score", "maxScore", "subcategories",
+                  "name", "Org", "points", "timeline_markers", "label", "severity", "minor", "grades", "1", "4", "0"]
+        tokenizer = FakeTokenizer(pieces)
+        grammar = Grammar(SCHEMA)
+        first = self._greedy(JSONLogitsProcessor(grammar, tokenizer), tokenizer, ["1", "<eos>"])
+        cached = len(grammar._allowed)
+        second = self._greedy(JSONLogitsProcessor(grammar, tokenizer), tokenizer, ["1", "<eos>"])
+        assert first == second and len(grammar._allowed) == cached
+
+
+class TestEarlyStop:
+    """Tests for stopping generation when the top-level JSON object closes."""
+
+    def test_scanner_ignores_braces_in_strings_and_prose(self):
+        """Quoted and escaped braces don't count, and nothing before the first '{' does either."""
+        from llm_training.json_grammar import ObjectScanner
+        scanner = ObjectScanner()
+        chunks = ['Sure: "{" ```json\n', '{"feedback": "use \\"{\\" and }', ' sparingly"', ', "n": {"a": 1}', "}", " extra"]
+        closed = [scanner.feed(chunk, i) for i, chunk in enumerate(chunks)]
+        assert closed == [False, False, False, False, True, False]
+        assert scanner.closed_at == 4
+
+    def test_stops_each_row_at_its_close(self):
+        """Per-row stop flags; with enabled=False the criterion only watches."""
+        import torch
+        from llm_training.json_grammar import JSONObjectEnd
+        tokenizer = FakeTokenizer(["{", "}", '"', "a", " "])
+        rows = [[0, 3, 1], [0, 0, 1]]  # "{a}" closes at step 3; "{{}" never closes
+        for enabled in (True, False):
+            stop = JSONObjectEnd(tokenizer, enabled=enabled)
+            flags = []
+            for step in range(1, 4):
+                ids = torch.tensor([[9] + r[:step] for r in rows])
+                flags.append(stop(ids, None).tolist())
+            assert flags[-1] == [enabled, False]
+            assert stop.closed_at(0) == 3 and stop.closed_at(1) is None
+
+    def test_ledger_credits_observed_tail(self):
+        """Before any observation the unused budget is the bound; after, the observed tail length is credited."""
+        from llm_training.json_grammar import EarlyStopLedger
+
+        class Criterion:
+            seconds_per_step = 0.05
+
+            def __init__(self, enabled, closed):
+                self.enabled, self._closed = enabled, closed
+
+            def closed_at(self, row):
+                return self._closed
+
+        ledger = EarlyStopLedger()
+        first = ledger.record(Criterion(True, 400), 0, 400, 1024)
+        assert first["estimate"] == "upper_bound" and first["tokens_saved"] == 624
+        watched = ledger.record(Criterion(False, 400), 0, 700, 1024)
+        assert watched["tokens_after_close"] == 300 and not watched["stopped"]
+        later = ledger.record(Criterion(True, 500), 0, 500, 1024, batch_size=2)
+        assert later["estimate"] == "observed" and later["tokens_saved"] == 300
+        assert later["gpu_seconds_saved"] == 7.5
+        snap = ledger.snapshot()
+        assert snap["stopped"] == 2 and snap["tokens_saved"] == 924 and snap["avg_tokens_after_close"] == 300.0
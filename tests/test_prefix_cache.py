@@ -0,0 +1,76 @@
+"""
+Tests for llm_training/prefix_cache.py (reusing a shared prompt prefix's keys/values across generations).
+
+Run with: pytest tests/test_prefix_cache.py -v
+"""
+
+import os
+import sys
+
+# Add parent to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_training import prefix_cache
+
+
+def _tiny_model():
+    """A randomly initialised two-layer Mistral: small enough for CPU, same cache and padding code paths."""
+    import torch
+    from transformers import MistralConfig, MistralForCausalLM
+    torch.manual_seed(0)
+    config = MistralConfig(vocab_size=200, hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                           num_attention_heads=4, num_key_value_heads=2, pad_token_id=0, bos_token_id=1, eos_token_id=199)
+    return MistralForCausalLM(config).eval()
+
+
+class TestPrefixReuse:
+    """Tests for generating from a cached prefix."""
+
+    def test_batch_from_cached_prefix_matches_full_prefill(self):
+        """Rows padded after a reused prefix produce the same scores as each prompt prefilled on its own."""
+        import torch
+        model = _tiny_model()
+        prefix = list(range(2, 82))
+        rows = [prefix + [90, 91, 92], prefix + [100 + i for i in range(9)]]
+
+        def generate(**kwargs):
+            with torch.no_grad():
+                return model.generate(max_new_tokens=6, do_sample=False, pad_token_id=0, output_scores=True,
+                                      return_dict_in_generate=True, **kwargs)
+
+        alone = [generate(input_ids=torch.tensor([r])) for r in rows]
+        cache = prefix_cache.PrefixCache(max_mb=64)
+        for expected_mode in ("prefilled", "reused"):
+            timer = prefix_cache.FirstTokenTimer()
+            past, mode = cache.get(prefix_cache.key_for(prefix, "tiny"), lambda: prefix_cache.prefill(model, prefix))
+            inputs = prefix_cache.pad_after_prefix(rows, len(prefix), pad_id=0)
+            batched = generate(**inputs, past_key_values=prefix_cache.fork(past, len(rows)),
+                               logits_processor=[timer])
+            cache.record_ttft(mode, timer.seconds)
+            assert mode == expected_mode
+            for row, single in enumerate(alone):
+                assert batched.sequences[row, -6:].tolist() == single.sequences[0, -6:].tolist()
+                assert max((a[0] - b[row]).abs().max().item() for a, b in zip(single.scores, batched.scores)) < 1e-4
+        snap = cache.snapshot()
+        assert snap["hits"] == 1 and snap["misses"] == 1 and snap["tokens_reused"] == len(prefix)
+        assert set(snap["ttft"]) == {"prefilled", "reused"}
+
+    def test_lru_bounded_by_bytes(self):
+        """Past max_mb the least recently used prefix is evicted; one that can never fit is used but not kept."""
+        model = _tiny_model()
+        one = prefix_cache.cache_bytes(prefix_cache.prefill(model, list(range(2, 66))))
+        cache = prefix_cache.PrefixCache(max_mb=2.5 * one / 1024 / 1024)
+        for start in (2, 3, 2, 4):
+            ids = list(range(start, start + 64))
+            cache.get(prefix_cache.key_for(ids), lambda: prefix_cache.prefill(model, ids))
+        assert cache.get(prefix_cache.key_for(list(range(2, 66))), lambda: None)[1] == "reused"
+        assert cache.snapshot()["evictions"] == 1 and cache.snapshot()["entries"] == 2
+        long_ids = list(range(2, 190))
+        assert cache.get("long", lambda: prefix_cache.prefill(model, long_ids))[1] == "prefilled"
+        assert cache.snapshot()["entries"] == 2 and cache.snapshot()["bytes"] <= 2.5 * one
+
+    def test_common_length(self):
+        """The shared prefix stops where a separately tokenized prefix stops matching."""
+        assert prefix_cache.common_length([1, 2, 3, 4], [1, 2, 3, 9, 9]) == 3
+        assert prefix_cache.common_length([1, 2], [1, 2, 3]) == 2
+        assert prefix_cache.key_for([1, 2], "a") != prefix_cache.key_for([1, 2], "b")
@@ -0,0 +1,91 @@
+"""
+Tests for the Modal deployment (llm_training/qwen_modal.py): the container-start hooks, run locally without a GPU.
+
+Run with: pytest tests/test_qwen_modal.py -v
+"""
+
+import importlib
+import os
+import sys
+
+import pytest
+
+# Add parent to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("modal")
+
+
+def _container_module(monkeypatch, deploy_env: dict):
+    """Import qwen_modal as `modal deploy` would with deploy_env, then again with only the image's env (the container)."""
+    from llm_training import qwen_modal
+    for key in ("QWEN_MODAL_GPU_SNAPSHOT", "QWEN_MODAL_MIN_CONTAINERS"):
+        monkeypatch.delenv(key, raising=False)
+    for key, value in deploy_env.items():
+        monkeypatch.setenv(key, value)
+    baked = dict(importlib.reload(qwen_modal)._DEPLOY_ENV)
+    for key in deploy_env:
+        monkeypatch.delenv(key)
+    for key, value in baked.items():
+        monkeypatch.setenv(key, value)
+    return importlib.reload(qwen_modal)
+
+
+def _hook(module, name):
+    """The undecorated @modal.enter method."""
+    return module.QwenService._get_user_cls().__dict__[name]._get_raw_f()
+
+
+@pytest.fixture
+def fake_load(monkeypatch):
+    """Make qwen_serve._load_model put a small torch module in place of Qwen; returns the list of loads."""
+    import torch
+    from llm_training import qwen_serve
+    loads = []
+
+    def load(name, load_in_4bit=False):
+        loads.append(name)
+        qwen_serve.model = torch.nn.Linear(1, 1)
+
+    monkeypatch.setattr(qwen_serve, "_load_model", load)
+    monkeypatch.setattr(qwen_serve, "model", None)
+    return loads
+
+
+class TestSnapshotHooks:
+    """Tests for what the memory-snapshot hooks load and how the start is labelled."""
+
+    def test_gpu_snapshot_deploy_loads_the_model_before_the_snapshot(self, monkeypatch, fake_load):
+        """QWEN_MODAL_GPU_SNAPSHOT=1 at deploy time reaches the container, so the snap=True hook loads the model."""
+        from llm_training import qwen_serve
+        module = _container_module(monkeypatch, {"QWEN_MODAL_GPU_SNAPSHOT": "1", "QWEN_MODAL_MIN_CONTAINERS": "1"})
+        assert module._GPU_SNAPSHOT and module._MIN_CONTAINERS == 1
+
+        service = module.QwenService._get_user_cls()()
+        _hook(module, "import_libraries")(service)
+        assert qwen_serve.model is not None and fake_load == [module.MODEL_NAME]
+
+    def test_cpu_snapshot_deploy_loads_the_model_after_restore(self, monkeypatch, fake_load):
+        """Without the flag only imports are snapshotted; the model loads in the snap=False hook."""
+        from llm_training import qwen_serve
+        module = _container_module(monkeypatch, {})
+        service = module.QwenService._get_user_cls()()
+        _hook(module, "import_libraries")(service)
+        assert qwen_serve.model is None
+        _hook(module, "load_model")(service)
+        assert fake_load == [module.MODEL_NAME]
+
+    def test_restore_detected_from_the_task_id(self, monkeypatch, fake_load):
+        """The first boot (same task as the snapshot) isn't reported as restored; a later task restoring it is."""
+        from llm_training import qwen_serve
+        module = _container_module(monkeypatch, {})
+        monkeypatch.setenv("MODAL_TASK_ID", "ta-first")
+        service = module.QwenService._get_user_cls()()
+        _hook(module, "import_libraries")(service)
+
+        _hook(module, "load_model")(service)
+        assert qwen_serve._cold_start_snapshot()["restored_from_snapshot"] is False
+
+        monkeypatch.setenv("MODAL_TASK_ID", "ta-restored")
+        _hook(module, "load_model")(service)
+        assert qwen_serve._cold_start_snapshot()["restored_from_snapshot"] is True
@@ -0,0 +1,356 @@
+"""
+Tests for the Qwen2.5-VL service (llm_training/qwen_serve.py) that don't need the model or a GPU.
+
+Run with: pytest tests/test_qwen_serve.py -v
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+# Add parent to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestGpuExecutor:
+    """Tests for running generate() off the event loop behind the GPU semaphore."""
+
+    def test_event_loop_stays_responsive_during_generation(self, monkeypatch):
+        """While a (blocking) generation runs, other coroutines should keep getting scheduled."""
+        from llm_training import qwen_serve
+
+        monkeypatch.setattr(qwen_serve, "_generate_blocking", lambda *a, **k: time.sleep(0.3) or "notes")
+
+        async def scenario():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            task = asyncio.create_task(ticker())
+            text = await qwen_serve._generate([], 16, "test")
+            task.cancel()
+            return text, ticks
+
+        text, ticks = asyncio.run(scenario())
+        assert text == "notes"
+        assert ticks >= 10
+
+    def test_semaphore_serializes_generations(self, monkeypatch):
+        """With QWEN_GPU_CONCURRENCY=1, two requests should never be on the GPU at once."""
+        from llm_training import qwen_serve
+        active = []
+        peak = []
+
+        def fake_generate(*args, **kwargs):
+            active.append(1)
+            peak.append(len(active))
+            time.sleep(0.05)
+            active.pop()
+            return ""
+
+        monkeypatch.setattr(qwen_serve, "_generate_blocking", fake_generate)
+        monkeypatch.setattr(qwen_serve, "_gpu_semaphore", asyncio.Semaphore(1))
+
+        async def scenario():
+            await asyncio.gather(*(qwen_serve._generate([], 16, "test") for _ in range(3)))
+
+        asyncio.run(scenario())
+        assert max(peak) == 1
+        assert qwen_serve._gpu_snapshot()["active"] == 0
+
+
+class TestStorageDownload:
+    """Tests for streaming storage_url videos to disk."""
+
+    @staticmethod
+    def _client(handler):
+        import httpx
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    def test_streams_to_temp_file(self, monkeypatch):
+        """The whole body should land in a temp file with the URL's extension (query string ignored)."""
+        import httpx
+        from llm_training import qwen_serve
+        body = bytes(range(256)) * 4096
+        monkeypatch.setattr(qwen_serve, "_download_client", self._client(lambda req: httpx.Response(200, content=body)))
+
+        path = asyncio.run(qwen_serve._download_to_tempfile("https://storage.test/v/talk.webm?token=abc"))
+        try:
+            assert path.endswith(".webm")
+            with open(path, "rb") as f:
+                assert f.read() == body
+        finally:
+            os.unlink(path)
+        assert qwen_serve._download_snapshot()["recent"][-1]["mb"] == 1.0
+
+    def test_rejects_oversized_video(self, monkeypatch):
+        """A Content-Length over the cap should abort before any body is read."""
+        import httpx
+        import pytest
+        from llm_training import qwen_serve
+        monkeypatch.setattr(qwen_serve, "_download_client", self._client(lambda req: httpx.Response(200, content=b"x" * 2048)))
+
+        with pytest.raises(qwen_serve.DownloadTooLarge):
+            asyncio.run(qwen_serve._download_to_tempfile("https://storage.test/talk.mp4", max_bytes=1024))
+
+    def test_resumes_with_range_after_dropped_connection(self, monkeypatch):
+        """After a mid-body disconnect, the next request should ask for the remaining bytes only."""
+        import httpx
+        from llm_training import qwen_serve
+        body = b"0123456789" * 1000
+        ranges = []
+
+        class DroppingStream(httpx.AsyncByteStream):
+            async def __aiter__(self):
+                yield body[:4000]
+                raise httpx.ReadError("connection reset")
+
+        def handler(req):
+            ranges.append(req.headers.get("range"))
+            if "range" in req.headers:
+                start = int(req.headers["range"].split("=")[1].rstrip("-"))
+                return httpx.Response(206, content=body[start:])
+            return httpx.Response(200, stream=DroppingStream())
+
+        monkeypatch.setattr(qwen_serve, "_download_client", self._client(handler))
+        path = asyncio.run(qwen_serve._download_to_tempfile("https://storage.test/talk.mp4"))
+        try:
+            with open(path, "rb") as f:
+                assert f.read() == body
+        finally:
+            os.unlink(path)
+        assert ranges == [None, "bytes=4000-"]
+
+
+class TestVideoInput:
+    """Tests for choosing between ffmpeg-sampled frames and in-process decoding."""
+
+    def test_sampler_off_keeps_legacy_path(self, monkeypatch):
+        """QWEN_FRAME_SAMPLER=off hands the path to the processor at fps=0.15."""
+        from llm_training import qwen_serve
+        monkeypatch.setenv("QWEN_FRAME_SAMPLER", "off")
+        block, kwargs, meta = asyncio.run(qwen_serve._video_input("/tmp/talk.mp4", "test"))
+        assert block == {"type": "video", "path": "/tmp/talk.mp4"}
+        assert kwargs == {"fps": 0.15}
+        assert meta["sampler"] == "in-process"
+
+    def test_sampler_failure_falls_back(self, monkeypatch):
+        """If ffmpeg fails on a file the request still goes through in-process."""
+        from llm_training import qwen_serve
+
+        class BrokenSampler:
+            def sample(self, *args, **kwargs):
+                raise RuntimeError("ffmpeg failed")
+
+        monkeypatch.setattr(qwen_serve, "_sampler", lambda: BrokenSampler())
+        block, kwargs, meta = asyncio.run(qwen_serve._video_input("/tmp/talk.mp4", "test"))
+        assert block["path"] == "/tmp/talk.mp4" and meta["sampler"] == "in-process"
+        assert qwen_serve._frame_stats["fallbacks"] >= 1
+
+    def test_fixed_budget_overrides_planner(self, monkeypatch):
+        """QWEN_FRAME_BUDGET=<n> skips the adaptive planner; auto plans from duration and VRAM."""
+        from llm_training import qwen_serve
+        info = {"duration": 600.0, "width": 1920, "height": 1080}
+        monkeypatch.setenv("QWEN_FRAME_BUDGET", "16")
+        assert qwen_serve._frame_plan(info) == {"frames": 16, "max_side": 640, "limited_by": "fixed", "duration": 600.0}
+        monkeypatch.setenv("QWEN_FRAME_BUDGET", "auto")
+        monkeypatch.setattr(qwen_serve, "_free_vram_bytes", lambda: 7 * 1024 ** 3)
+        plan = qwen_serve._frame_plan(info)
+        assert plan["limited_by"] == "vram" and plan["visual_tokens"] <= plan["token_budget"]
+
+
+class TestVisionCache:
+    """Tests for reusing encoded visual tokens between analyze_video and evaluate_video."""
+
+    def _model(self):
+        import torch
+
+        class Visual(torch.nn.Module):
+            calls = 0
+
+            def forward(self, hidden_states, grid_thw=None):
+                Visual.calls += 1
+                return hidden_states * 2
+
+        class VLM(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.visual = Visual()
+
+        return VLM(), Visual
+
+    def test_second_call_with_same_key_skips_the_encoder(self, monkeypatch):
+        """Same key and grid: the cached output is returned and the saved encode time is reported."""
+        import torch
+        from collections import OrderedDict
+        from llm_training import qwen_serve
+        monkeypatch.setattr(qwen_serve, "_vision_cache", OrderedDict())
+        vlm, Visual = self._model()
+        qwen_serve._install_vision_cache(vlm)
+        pixels, grid = torch.ones(4, 3), torch.tensor([[2, 2, 2]])
+
+        reports = []
+        for _ in range(2):
+            report = {}
+            qwen_serve._vision_call.key, qwen_serve._vision_call.report = "video-a", report
+            out = vlm.visual(pixels, grid_thw=grid)
+            reports.append(report)
+        qwen_serve._vision_call.key = qwen_serve._vision_call.report = None
+
+        assert Visual.calls == 1
+        assert torch.equal(out, pixels * 2)
+        assert reports[0]["hit"] is False and reports[1]["hit"] is True
+        assert reports[1]["gpu_seconds_saved"] == reports[0]["encode_seconds"]
+
+    def test_no_key_or_different_grid_encodes(self, monkeypatch):
+        """Calls outside a keyed generate (e.g. rubric images) and a changed frame grid always run the encoder."""
+        import torch
+        from collections import OrderedDict
+        from llm_training import qwen_serve
+        monkeypatch.setattr(qwen_serve, "_vision_cache", OrderedDict())
+        vlm, Visual = self._model()
+        qwen_serve._install_vision_cache(vlm)
+        vlm.visual(torch.ones(2), grid_thw=torch.tensor([[1, 1, 2]]))
+        qwen_serve._vision_call.key = "video-b"
+        vlm.visual(torch.ones(2), grid_thw=torch.tensor([[1, 1, 2]]))
+        vlm.visual(torch.ones(2), grid_thw=torch.tensor([[2, 1, 1]]))
+        qwen_serve._vision_call.key = None
+        assert Visual.calls == 3
+
+    def test_key_depends_on_plan(self):
+        """A different frame plan for the same video is a different cache entry; unknown hashes aren't cached."""
+        from llm_training import qwen_serve
+        base = {"sampler": "ffmpeg", "video_sha256": "abc", "frames": 24, "frame_size": [840, 472], "fps": 0.2}
+        assert qwen_serve._vision_key(base, "qwen") == qwen_serve._vision_key(dict(base), "qwen")
+        assert qwen_serve._vision_key(base, "qwen") != qwen_serve._vision_key({**base, "frames": 16}, "qwen")
+        assert qwen_serve._vision_key({**base, "video_sha256": None}, "qwen") is None
+
+
+class TestConstrainedDecoding:
+    """Tests for the rubric-derived output schema and the decoding counters."""
+
+    def test_evaluation_schema_follows_the_rubric(self, sample_rubric):
+        """Sections are the rubric's categories with its points fixed; a filled-in placeholder is accepted."""
+        from llm_training import qwen_serve
+        from llm_training.json_grammar import Grammar
+        schema = qwen_serve._evaluation_json_schema(sample_rubric)
+        assert list(schema["properties"]["sections"]["properties"]) == ["Content", "Delivery"]
+        sections = {
+            name: {
+                "score": 10,
+                "maxScore": sec["maxScore"],
+                "feedback": "Clear.",
+                "subcategories": [{**sub, "feedback": "Ok."} for sub in sec["subcategories"]],
+            }
+            for name, sec in qwen_serve._placeholder_sections_from_rubric(sample_rubric).items()
+        }
+        marker = {"seconds": 12.5, "label": "Eye contact", "observation": "Looked up", "severity": "positive", "category": "Delivery"}
+        document = json.dumps({"sections": sections, "timeline_markers": [marker]}, separators=(",", ":"))
+        grammar = Grammar(schema)
+        assert grammar.accepts(document)
+        assert not grammar.accepts(document.replace('"maxScore":50.0', '"maxScore":10'))
+        assert not grammar.accepts("```json\n" + document)
+
+    def test_decode_stats_compare_modes(self, monkeypatch):
+        """Constrained and free generations are counted separately with average tokens and parse-failure rate."""
+        from llm_training import qwen_serve
+        monkeypatch.setattr(qwen_serve, "_decode_stats", {})
+        qwen_serve._record_decode("evaluate_video", {"tokens": 3072, "max_new_tokens": 3072, "constrained": False}, False, False)
+        qwen_serve._record_decode("evaluate_video", {"tokens": 1000, "max_new_tokens": 3072, "constrained": False}, False, True)
+        qwen_serve._record_decode("evaluate_video", {"tokens": 900, "max_new_tokens": 3072, "constrained": True}, True, True)
+        snap = qwen_serve._decode_snapshot()["evaluate_video"]
+        assert snap["free"]["avg_tokens"] == 2036.0 and snap["free"]["parse_failure_rate"] == 0.5
+        assert snap["free"]["hit_max_tokens"] == 1 and snap["free"]["invalid_json"] == 2
+        assert snap["constrained"] == {**snap["constrained"], "requests": 1, "avg_tokens": 900.0, "parse_failure_rate": 0.0}
+
+
+class TestCompiledRubric:
+    """Tests for the per-rubric cache of point distribution, prompt fragments and schema."""
+
+    def test_batch_with_one_rubric_compiles_it_once(self, sample_rubric, monkeypatch):
+        """Key order doesn't change the key; every derived value comes from the one compiled entry."""
+        from collections import OrderedDict
+        from llm_training import qwen_serve
+        monkeypatch.setattr(qwen_serve, "_compiled_rubrics", OrderedDict())
+        monkeypatch.setattr(qwen_serve, "_rubric_cache_stats", {"hits": 0, "misses": 0, "compile_seconds": 0.0})
+        monkeypatch.setenv("DISABLE_TEXTBOOK_RAG", "1")
+        reordered = dict(reversed(list(json.loads(json.dumps(sample_rubric)).items())))
+        for rubric in (sample_rubric, reordered, sample_rubric):
+            prompt = qwen_serve._build_evaluate_prompt(rubric)
+            qwen_serve._evaluation_json_schema(rubric)
+            qwen_serve._normalize_sections_to_rubric({"Content": {"score": 5, "maxScore": 10}}, rubric)
+        snap = qwen_serve._rubric_cache_snapshot()
+        assert snap["size"] == 1 and snap["misses"] == 1 and snap["hits"] == 8
+        assert qwen_serve._rubric_point_block(sample_rubric) in prompt and "{textbook_block}" not in prompt
+        assert "\x00" not in prompt and "Content, Delivery" in prompt
+
+    def test_lru_bound(self, monkeypatch):
+        """The least recently used rubric is evicted past QWEN_RUBRIC_CACHE_SIZE."""
+        from collections import OrderedDict
+        from llm_training import qwen_serve
+        monkeypatch.setattr(qwen_serve, "_compiled_rubrics", OrderedDict())
+        monkeypatch.setattr(qwen_serve, "QWEN_RUBRIC_CACHE_SIZE", 2)
+        rubrics = [{"categories": [{"name": f"C{i}", "subcategories": ["A"]}]} for i in range(3)]
+        first = qwen_serve._compiled_rubric(rubrics[0])
+        qwen_serve._compiled_rubric(rubrics[1])
+        qwen_serve._compiled_rubric(rubrics[0])
+        qwen_serve._compiled_rubric(rubrics[2])
+        assert qwen_serve._compiled_rubric(rubrics[0]) is first
+        assert qwen_serve._rubric_section_names(rubrics[1]) == ["C1"] and len(qwen_serve._compiled_rubrics) == 2
+
+
+class TestPrefixCache:
+    """Tests for reusing the rubric prompt's keys/values ahead of the video."""
+
+    def test_video_after_reused_prefix_matches_full_prefill(self, monkeypatch):
+        """Same scores as a cold generate, even when an earlier generate left its rope deltas behind."""
+        import pytest
+        import torch
+        from llm_training import prefix_cache, qwen_serve
+        if not qwen_serve._prefix_reuse_supported():
+            pytest.skip("prefix reuse with video needs transformers 5")
+        from transformers import Qwen2_5_VLConfig, Qwen2_5_VLForConditionalGeneration
+        torch.manual_seed(0)
+        config = Qwen2_5_VLConfig(
+            text_config=dict(vocab_size=300, hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                             num_attention_heads=4, num_key_value_heads=2,
+                             rope_scaling={"type": "mrope", "mrope_section": [2, 3, 3]}),
+            vision_config=dict(depth=1, hidden_size=32, intermediate_size=64, num_heads=2, out_hidden_size=64,
+                               fullatt_block_indexes=[0]),
+            image_token_id=290, video_token_id=291, vision_start_token_id=292, vision_end_token_id=293,
+        )
+        vlm = Qwen2_5_VLForConditionalGeneration(config).eval()
+        monkeypatch.setattr(qwen_serve, "model", vlm)
+        monkeypatch.setattr(qwen_serve, "_prefix_cache", prefix_cache.PrefixCache(max_mb=64))
+
+        def inputs(prompt, tail):
+            grid = torch.tensor([[2, 4, 4]])
+            ids = torch.tensor([prompt + [292] + [291] * 8 + [293] + tail])
+            return dict(input_ids=ids, attention_mask=torch.ones_like(ids), mm_token_type_ids=(ids == 291).long() * 2,
+                        pixel_values_videos=torch.randn(32, 3 * 2 * 14 * 14), video_grid_thw=grid)
+
+        def generate(batch, **kwargs):
+            with torch.no_grad():
+                return vlm.generate(**batch, max_new_tokens=4, do_sample=False, output_scores=True,
+                                    return_dict_in_generate=True, **kwargs)
+
+        prompt = list(range(1, 81))
+        request = inputs(prompt, [7, 8])
+        vlm.model.rope_deltas = None
+        cold = generate(request)
+        modes = []
+        for _ in range(2):
+            generate(inputs(list(range(5, 40)), [9]))  # another request leaves different rope deltas
+            past, mode, tokens = qwen_serve._prefix_past(request["input_ids"])
+            warm = generate(request, past_key_values=past)
+            modes.append(mode)
+            assert tokens == len(prompt) and warm.sequences[0, -4:].tolist() == cold.sequences[0, -4:].tolist()
+            assert max((a - b).abs().max().item() for a, b in zip(cold.scores, warm.scores)) < 1e-4
+        assert modes == ["prefilled", "reused"]
+        assert qwen_serve._prefix_past(inputs([1, 2, 3], [4])["input_ids"]) is None  # too short to bother
@@ -0,0 +1,69 @@
+"""
+Tests for llm_training/result_cache.py (on-disk LRU cache for evaluation results).
+
+Run with: pytest tests/test_result_cache.py -v
+"""
+
+import io
+import os
+import sys
+
+# Add parent to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_training.result_cache import DiskLRUCache, canonical_json, sha256_file
+
+
+class TestKeys:
+    """Tests for cache key helpers."""
+
+    def test_canonical_json_ignores_key_order_and_whitespace(self):
+        """Equivalent rubrics should produce the same canonical text."""
+        assert canonical_json('{"b": 1, "a": [1, 2]}') == canonical_json('{ "a":[1,2],\n "b":1 }')
+
+    def test_sha256_file_restores_position(self):
+        """Hashing an upload must not move the file position httpx will read from."""
+        f = io.BytesIO(b"video bytes")
+        f.seek(3)
+        digest = sha256_file(f)
+        assert f.tell() == 3
+        assert digest == sha256_file(io.BytesIO(b"video bytes"))
+
+
+class TestDiskLRUCache:
+    """Tests for DiskLRUCache storage and eviction."""
+
+    def test_hit_and_miss_counters(self, tmp_path):
+        """get() should count misses, then hits once the value is stored."""
+        cache = DiskLRUCache(tmp_path, max_bytes=1024)
+        assert cache.get("k") is None
+        cache.put("k", b"result")
+        assert cache.get("k") == b"result"
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+    def test_evicts_least_recently_used_over_size(self, tmp_path):
+        """Once over max_bytes, the entry touched longest ago should go first."""
+        cache = DiskLRUCache(tmp_path, max_bytes=20)
+        cache.put("a", b"x" * 8)
+        cache.put("b", b"x" * 8)
+        cache.get("a")
+        cache.put("c", b"x" * 8)
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.stats()["evictions"] == 1
+
+    def test_evicts_over_entry_limit(self, tmp_path):
+        """max_entries should cap the number of stored results."""
+        cache = DiskLRUCache(tmp_path, max_bytes=0, max_entries=2)
+        for key in ("a", "b", "c"):
+            cache.put(key, b"1")
+        assert cache.stats()["entries"] == 2
+        assert cache.get("a") is None
+
+    def test_survives_restart(self, tmp_path):
+        """A new cache over the same directory should see existing entries."""
+        DiskLRUCache(tmp_path, max_bytes=1024).put("k", b"result")
+        reopened = DiskLRUCache(tmp_path, max_bytes=1024)
+        assert reopened.stats()["entries"] == 1
+        assert reopened.get("k") == b"result"
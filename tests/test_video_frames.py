@@ -0,0 +1,129 @@
+"""
+Tests for llm_training/video_frames.py (ffmpeg frame sampling). Plan/timestamp logic runs everywhere; extraction
+tests need ffmpeg on PATH and are skipped without it.
+
+Run with: pytest tests/test_video_frames.py -v
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Add parent to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_training import video_frames
+from llm_training.video_frames import FrameSampler, SampledVideo, fill_to_budget, parse_showinfo, uniform_timestamps
+
+needs_ffmpeg = pytest.mark.skipif(not video_frames.ffmpeg_available(), reason="ffmpeg/ffprobe not installed")
+
+
+class TestPlan:
+    """Tests for choosing frame timestamps."""
+
+    def test_uniform_timestamps_are_slot_midpoints(self):
+        """A 2-minute video with a budget of 4 gets one frame in the middle of each 30s slot."""
+        assert uniform_timestamps(120, 4) == [15.0, 45.0, 75.0, 105.0]
+
+    def test_scene_changes_thinned_to_budget(self):
+        """More scene changes than the budget are thinned evenly, never exceeding it."""
+        times = fill_to_budget([float(t) for t in range(100)], 100, 10)
+        assert len(times) == 10
+        assert times == sorted(times) and times[0] == 0.0 and times[-1] >= 90
+
+    def test_few_scene_changes_topped_up_uniformly(self):
+        """A mostly static talk with two slide changes still gets the full budget, spread over the gaps."""
+        times = fill_to_budget([10.0, 11.0], 120, 6)
+        assert len(times) == 6
+        assert 10.0 in times and 11.0 in times
+        assert max(times) > 90  # the end of the talk is covered
+
+    def test_parse_showinfo(self):
+        """Only showinfo lines contribute timestamps."""
+        stderr = (
+            "[Parsed_showinfo_2 @ 0x1] n:   0 pts:  12800 pts_time:12.8 duration:512\n"
+            "frame=  2 fps=0.0 q=-0.0 size=N/A time=00:00:12.80\n"
+            "[Parsed_showinfo_2 @ 0x1] n:   1 pts:  64000 pts_time:64 duration:512\n"
+        )
+        assert parse_showinfo(stderr) == [12.8, 64.0]
+
+    def test_zip_round_trip(self):
+        """Cached frames come back in order with their timestamps and metadata."""
+        video = SampledVideo([b"a", b"b"], [1.0, 2.0], {"duration": 4.0, "mode": "uniform"})
+        restored = SampledVideo.from_zip(video.to_zip())
+        assert restored.frames == [b"a", b"b"]
+        assert restored.timestamps == [1.0, 2.0]
+        assert restored.cache_hit and restored.fps == 0.5
+
+
+@needs_ffmpeg
+class TestExtraction:
+    """Tests that run ffmpeg on a generated clip."""
+
+    @pytest.fixture
+    def clip(self, tmp_path):
+        path = tmp_path / "talk.mp4"
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=duration=6:size=1280x720:rate=25",
+             "-f", "lavfi", "-i", "sine=frequency=440:duration=6", "-shortest", "-pix_fmt", "yuv420p", str(path)],
+            check=True,
+        )
+        return str(path)
+
+    def test_budget_resolution_audio_and_cache(self, clip, tmp_path):
+        """Frames are downscaled to max_side, audio is 16 kHz mono, and a second call is a cache hit."""
+        sampler = FrameSampler(tmp_path / "cache", max_bytes=64 * 1024 * 1024)
+        video = sampler.sample(clip, frames=4, max_side=320, audio=True)
+        assert len(video.frames) == 4 and not video.cache_hit
+        width, height = video.images()[0].size
+        assert max(width, height) <= 320
+        import wave
+        with wave.open(video.audio_path) as wav:
+            assert wav.getframerate() == 16000 and wav.getnchannels() == 1
+        again = sampler.sample(clip, frames=4, max_side=320)
+        assert again.cache_hit and again.frames == video.frames
+        assert sampler.snapshot()["extractions"] == 1
+
+    def test_scene_mode_fills_budget(self, clip, tmp_path):
+        """A clip with no cuts still yields exactly the frame budget in scene mode."""
+        sampler = FrameSampler(tmp_path / "cache", max_bytes=64 * 1024 * 1024)
+        video = sampler.sample(clip, frames=5, max_side=256, mode="scene")
+        assert len(video.frames) == 5
+
+
+class TestFrameBudget:
+    """Tests for the adaptive frame budget planner."""
+
+    def test_long_video_trades_resolution_for_frames(self):
+        """A 20-minute talk gets more frames than a 2-minute one, at a lower resolution, within the same token target."""
+        from llm_training.video_frames import plan_frame_budget
+        short = plan_frame_budget(120, 1920, 1080)
+        long = plan_frame_budget(1200, 1920, 1080)
+        assert long["frames"] > short["frames"]
+        assert long["max_side"] < short["max_side"]
+        assert short["visual_tokens"] <= 6144 and long["visual_tokens"] <= 6144
+        assert short["limited_by"] == "target"
+
+    def test_low_free_vram_lowers_the_budget(self):
+        """With little free VRAM the token budget shrinks to what fits after the reserve."""
+        from llm_training.video_frames import plan_frame_budget
+        plan = plan_frame_budget(600, 1920, 1080, free_vram_bytes=7 * 1024 ** 3)
+        assert plan["limited_by"] == "vram"
+        assert plan["visual_tokens"] <= plan["token_budget"] == (1024 ** 3) // (384 * 1024)
+        assert plan["free_vram_mb"] == 7 * 1024
+
+    def test_drops_frames_when_min_resolution_does_not_fit(self):
+        """Past the minimum resolution the planner removes frame pairs instead of going below it."""
+        from llm_training.video_frames import plan_frame_budget, visual_tokens
+        plan = plan_frame_budget(1200, 1920, 1080, target_tokens=500)
+        assert plan["max_side"] == 224
+        assert plan["frames"] < 64 and plan["frames"] % 2 == 0
+        assert plan["visual_tokens"] == visual_tokens(plan["frames"], *plan["frame_size"]) <= 500
+
+    def test_small_source_is_not_upscaled(self):
+        """A webcam-sized recording keeps its own size."""
+        from llm_training.video_frames import plan_frame_budget
+        plan = plan_frame_budget(60, 320, 240)
+        assert plan["frame_size"] == [320, 240]